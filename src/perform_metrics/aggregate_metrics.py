@@ -9,25 +9,33 @@ metrics of ON vs OFF for plate reader or aggregated flow cytometry data (one mea
 import argparse
 import json
 import os
-import platform
 import shutil
+import time
 from collections import OrderedDict
 from datetime import datetime
 
-import matplotlib
 import numpy as np
 import pandas as pd
 
-if platform.system() == "Darwin":
-    matplotlib.use("TkAgg")
-import matplotlib.pyplot as plt
-import seaborn as sns
-
 from perform_metrics.group_metrics import metrics_info
-from perform_metrics.config_parsing import parse_intended_output
-
-
-def compute_metrics(data_df, group_cols, observed_output, intended_output, function):
+from perform_metrics.group_arrays import make_group_arrays, make_group_arrays_dict, get_on_off, get_segment_lengths, \
+    get_segment_counts, get_group_labels, get_name_array, get_key_columns, take_segments, ON, OFF
+from perform_metrics.grouped_quantiles import grouped_nanpercentile
+from perform_metrics.bootstrap import bootstrap_metric
+from perform_metrics.config_parsing import parse_intended_output, check_metric_params, get_compact_config, get_metrics
+from perform_metrics.compact import get_key_categoricals, get_small_int_array
+from perform_metrics.data_loading import read_data, get_csv_parser
+from perform_metrics.table_writer import write_table, get_table_file_name
+from perform_metrics.transitions import make_transition_arrays_from_config
+from perform_metrics.windows import make_window_arrays_from_config, compute_window_metrics, WINDOW_FUNCTIONS
+from perform_metrics.ranking import get_ranking_config, top_k_indices, save_ranking
+from perform_metrics.diagnostics import save_diagnostics, get_diagnostics_config, get_heavy_groups, \
+    time_grouped_metric, make_group_costs, profile_group_costs, profile_group_costs_dict
+from perform_metrics.plot_summaries import compute_box_stats, draw_figure, save_plot_summaries
+
+
+def compute_metrics(data_df, group_cols, observed_output, intended_output, function, function_params=None,
+                    group_arrays=None, grouped_function=None, compact=False, timings=None, metric_columns=None):
     """
     function to compute all the different intervals for analyzing fold change
 
@@ -36,109 +44,391 @@ def compute_metrics(data_df, group_cols, observed_output, intended_output, funct
     :param observed_output: column name associated with the observed output
     :param data_df: pandas.DataFrame of the data
     :param group_cols: list of columns to group by
+    :param function_params: optional dictionary of keyword arguments for the function (e.g. {'percents': [50]})
+    :param group_arrays: optional GroupArrays for this grouping (made from data_df if not given)
+    :param grouped_function: optional function computing the metric for all groups at once (see metrics_info),
+        used instead of calling function for each group
+    :param compact: build the table with small column types (see make_records_df), only with a grouped function
+    :param timings: optional dictionary with 'heavy' (positions of groups), the metric is then timed as it is computed
+        and 'seconds' (for all groups) and 'heavy_seconds' (numpy.ndarray of the seconds of each heavy group) are added
+        to it (see diagnostics.time_grouped_metric)
+    :param metric_columns: optional columns of the grouped function already computed for these groups (e.g. for every
+        channel in one call, see variants.compute_channel_columns), the table is then made from them
     :return: pandas.DataFrame
     """
 
-    # group by the exp and ts ids
+    if metric_columns is not None:
+        return make_records_df(group_arrays, metric_columns, compact)
+    if function_params is None:
+        function_params = dict()
+    if group_arrays is None:
+        group_arrays = make_group_arrays(data_df, group_cols, observed_output, intended_output)
+
+    if grouped_function is not None:
+        if timings is not None:
+            metric_columns, timings['seconds'], timings['heavy_seconds'] = time_grouped_metric(
+                group_arrays, grouped_function, function_params, timings['heavy'])
+        else:
+            metric_columns = grouped_function(group_arrays.values, group_arrays.offsets, **function_params)
+        return make_records_df(group_arrays, metric_columns, compact)
+
+    # groups are already in sorted order
+    heavy = dict() if timings is None else {int(group): rank for rank, group in enumerate(timings['heavy'])}
+    heavy_seconds = np.zeros(len(heavy))
+    start_time = time.perf_counter()
     records = list()
-    grouped_df = data_df.groupby(group_cols)
-    for name, group in grouped_df:
-        # compute max of OFF and min of ON
-        off = group[(group[intended_output['col']] == intended_output['off'])][
-            observed_output].astype(
-            'float')
-        on = group[(group[intended_output['col']] == intended_output['on'])][
-            observed_output].astype(
-            'float')  # .to_list()
-        # TODO: just use len of above? was planning to do other metrics, but just think count is okay
-        off_count = off.count()
-        on_count = on.count()
+    for i, name in enumerate(group_arrays.names):
+        group_start_time = time.perf_counter()
+        on, off = get_on_off(group_arrays, i)
+        off_count = np.count_nonzero(~np.isnan(off))
+        on_count = np.count_nonzero(~np.isnan(on))
 
         # identifier part of record
-        name_list = [name] if isinstance(name, str) else name
-        record = OrderedDict(zip(group_cols, name_list))
+        record = OrderedDict(zip(group_cols, group_arrays.keys[i]))
         record['group_name'] = name
         record['off_count'] = off_count
         record['on_count'] = on_count
 
         # metric part of records
-        metric_records = function(on, off)
+        metric_records = function(on, off, **function_params)
 
         # merge identifier records and metric records
         # makes a new dict (from entries, not ref to shared record) and *hopefully* preserve the order.
         rec_merge = [OrderedDict(**record, **met_rec) for met_rec in metric_records]
         records.extend(rec_merge)
+        if i in heavy:
+            heavy_seconds[heavy[i]] = time.perf_counter() - group_start_time
 
+    if timings is not None:
+        timings['seconds'] = time.perf_counter() - start_time
+        timings['heavy_seconds'] = heavy_seconds
     records_df = pd.DataFrame(records)
-    records_df.sort_values(by=group_cols,
-                           inplace=True)
 
     return records_df
 
 
-def save_df(results_df, comments, out_path):
+def make_records_df(group_arrays, metric_columns, compact=False):
+    """
+    build the results dataframe column-wise from a grouped metric, same columns as the records made per group
+
+    :param group_arrays: GroupArrays the metric was computed on
+    :param metric_columns: OrderedDict of column name to numpy.ndarray of shape (ngroups, nparams), the first column
+        is the metric parameter (e.g. percentile)
+    :param compact: group columns and group_name as categoricals, counts and integer parameters as small integers
+        (see compact.py)
+    :return: pandas.DataFrame
+    """
+
+    nparams = next(iter(metric_columns.values())).shape[1]
+    counts = get_segment_counts(group_arrays)
+
+    columns = OrderedDict()
+    if compact:
+        columns.update(get_key_categoricals(group_arrays, np.repeat(np.arange(len(group_arrays.names)), nparams)))
+        counts = get_small_int_array(counts)
+    else:
+        for col, col_values in get_key_columns(group_arrays).items():
+            columns[col] = np.repeat(col_values, nparams)
+        columns['group_name'] = np.repeat(get_name_array(group_arrays), nparams)
+    columns['off_count'] = np.repeat(counts[:, OFF], nparams)
+    columns['on_count'] = np.repeat(counts[:, ON], nparams)
+    for i, (col, col_values) in enumerate(metric_columns.items()):
+        columns[col] = get_small_int_array(np.ravel(col_values)) if compact and i == 0 else np.ravel(col_values)
+
+    return pd.DataFrame(columns)
+
+
+def add_bootstrap_ci(results_df, group_arrays, metric_dict, function_params, bootstrap_config, verbose=True):
+    """
+    add bootstrap confidence interval columns (diff_ci_low, diff_ci_high, ratio_ci_low, ratio_ci_high) to a results
+    dataframe. only metrics with a grouped function can be bootstrapped.
+
+    :param results_df: results dataframe from compute_metrics, rows ordered by group then metric parameter
+    :param group_arrays: GroupArrays the results were computed on
+    :param metric_dict: entry of metrics_info for the metric
+    :param function_params: optional dictionary of keyword arguments for the metric function
+    :param bootstrap_config: dictionary of bootstrap settings (see bootstrap.DEFAULT_BOOTSTRAP)
+    :param verbose: print what is bootstrapped (or skipped)
+    :return: results dataframe with the CI columns
+    """
+
+    if metric_dict.get('grouped_function') is None:
+        if verbose:
+                print("no grouped function for metric {0:s}, skipping bootstrap".format(metric_dict['metric']))
+        return results_df
+
+    if verbose:
+        print("bootstrapping {0:s} for {1:d} groups".format(metric_dict['metric'], len(group_arrays.names)))
+    ci_columns = bootstrap_metric(group_arrays, metric_dict['grouped_function'], function_params, bootstrap_config)
+    for col, col_values in ci_columns.items():
+        results_df[col] = np.ravel(col_values)
+
+    return results_df
+
+
+def save_df(results_df, comments, out_path, compression=None):
     """
     Function to save the results dataframe to file
 
     :param results_df: results dataframe
     :param comments: any comments the user wishes to be added to the output file
     :param out_path: path to save output to
+    :param compression: None, 'gzip' or 'zstd'
     """
-    print("saving to: " + out_path)
-    with open(out_path, 'w') as out_file:
-        # out_file.write(doc_info)
-        out_file.write(comments)
-        out_file.write("# \n")
-        results_df.to_csv(out_file, sep='\t', header=True, index=False)
+    write_table([results_df], comments, out_path, compression)
 
 
-def run_functions(data_df, config_json, output_dir):
+def compute_all_metrics(data_df, config_json, group_arrays_dict=None, group_costs_dict=None, metric_columns_dict=None,
+                        verbose=True):
     """
     measure fold and absolute change between percentiles and/or mean +/- standard deviation,
-    for each experiment, strain - this combines all time series, replicates, and time points
+    for each experiment, strain - this combines all time series, replicates, and time points.
+    if the config has a "transitions" entry, the transitions of each time series are also used as a grouping, and
+    with a "windows" entry the rolling time windows of each time series are a 'windows' grouping (see windows.py).
+    the metrics are those of "metrics" in the config, by default the ones that are not opt in (see
+    config_parsing.get_metrics)
 
-    :param output_dir: directory to save output to
-    :param config_json: configuration file
     :param data_df: pandas.DataFrame with the data in it
-    :return:
-            full_results_df_dict: dictionary with all the results from the analysis
-            files: list of file names which contain the output
+    :param config_json: configuration file
+    :param group_arrays_dict: optional dictionary of GroupArrays for each grouping (made from data_df if not given),
+        extra groupings (e.g. pooled events) are also run
+    :param group_costs_dict: optional dictionary to add the diagnostics.GroupCosts of each grouping of the config to
+        (if the config has "diagnostics"), the metrics are then timed while they are computed
+    :param metric_columns_dict: optional dictionary of (metric, grouping) to a dictionary with the 'columns' of the
+        grouped function already computed (and their 'seconds' and 'heavy_seconds' if they were timed), see
+        variants.compute_channel_columns
+    :param verbose: print the progress of the bootstrap (see add_bootstrap_ci)
+    :return: full_results_df_dict: list with a dictionary of the results for each metric
     """
 
     observed_output = config_json['observed_output']
     intended_output = config_json['intended_output']
     group_cols_dict = config_json['group_cols_dict']
+    metric_params = config_json.get('metric_params', dict())
+    check_metric_params(metric_params, metrics_info)
+    run_metrics = get_metrics(config_json, metrics_info)
+    bootstrap_config = config_json.get('bootstrap')
+    compact = get_compact_config(config_json) is not None
+    if group_arrays_dict is None:
+        group_arrays_dict = make_group_arrays_dict(data_df, config_json)
+
+    # the transitions of each time series are one more grouping
+    if 'transitions' in config_json.keys() and 'transitions' not in group_arrays_dict:
+        group_arrays_dict = dict(group_arrays_dict)
+        group_arrays_dict['transitions'] = make_transition_arrays_from_config(data_df, config_json)
+
+    # the heaviest groups of the config groupings are timed on their own (see diagnostics.py)
+    diagnostics_config = get_diagnostics_config(config_json) if group_costs_dict is not None else None
+    heavy_dict = dict()
+    seconds_dict = dict()
+    if diagnostics_config is not None and not diagnostics_config['profile']:
+        heavy_dict = {key: get_heavy_groups(group_arrays_dict[key], diagnostics_config['top'])
+                      for key in group_cols_dict.keys()}
+        seconds_dict = {key: OrderedDict() for key in group_cols_dict.keys()}
+
+    # groupings that are not in the config (transitions, pooled events) are run after the config groupings
+    groupings = OrderedDict(group_cols_dict)
+    groupings.update((key, group_arrays.group_cols) for key, group_arrays in group_arrays_dict.items()
+                     if key not in group_cols_dict)
+
+    # the rolling windows are computed incrementally from their own arrays, after every other grouping, for the
+    # metrics that have a window function
+    window_results = None
+    if 'windows' in config_json.keys():
+        window_arrays = make_window_arrays_from_config(data_df, config_json)
+        window_results = compute_window_metrics(window_arrays, [metric_dict['metric'] for metric_dict in run_metrics
+                                                                if metric_dict['metric'] in WINDOW_FUNCTIONS],
+                                                metric_params, compact)
+        groupings['windows'] = window_arrays.group_cols
+        if bootstrap_config is not None and verbose:
+            print("no bootstrap for windows, skipping")
 
-    files = []
     full_results_df_dict = []
-    for metric_dict in metrics_info:
-        results_df_dict = dict()
-        for key, group_cols in group_cols_dict.items():
+    for metric_dict in run_metrics:
+        results_df_dict = OrderedDict()
+        for key, group_cols in groupings.items():
+            if key not in group_arrays_dict:
+                continue
+            timings = {'heavy': heavy_dict[key]} if key in heavy_dict else None
+            computed = None if metric_columns_dict is None else metric_columns_dict.get((metric_dict['metric'], key))
+            if computed is not None and timings is not None:
+                timings.update(seconds=computed['seconds'], heavy_seconds=computed['heavy_seconds'])
             results_df = compute_metrics(data_df=data_df,
                                          group_cols=group_cols,
                                          observed_output=observed_output,
-                                         intended_output=intended_output, function=metric_dict['function'])
+                                         intended_output=intended_output, function=metric_dict['function'],
+                                         function_params=metric_params.get(metric_dict['metric']),
+                                         group_arrays=group_arrays_dict[key],
+                                         grouped_function=metric_dict.get('grouped_function'), compact=compact,
+                                         timings=timings if computed is None else None,
+                                         metric_columns=None if computed is None else computed['columns'])
+            if timings is not None:
+                seconds_dict[key][metric_dict['metric']] = (timings['seconds'], timings['heavy_seconds'])
+            if bootstrap_config is not None:
+                results_df = add_bootstrap_ci(results_df, group_arrays_dict[key], metric_dict,
+                                              metric_params.get(metric_dict['metric']), bootstrap_config, verbose)
             results_df_dict[key] = results_df
+        if window_results is not None and metric_dict['metric'] in window_results:
+            results_df_dict['windows'] = window_results[metric_dict['metric']]
+        full_results_df_dict.append({'metric': metric_dict['metric'], 'record_df_dict': results_df_dict,
+                                     "plot_metric": metric_dict["plot_metric"], 'group_cols_dict': groupings})
+
+    if diagnostics_config is not None:
+        for key in group_cols_dict.keys():
+            if diagnostics_config['profile']:
+                group_costs_dict[key] = profile_group_costs(group_arrays_dict[key], config_json,
+                                                            diagnostics_config['top'])
+            else:
+                group_costs_dict[key] = make_group_costs(group_arrays_dict[key], heavy_dict[key], seconds_dict[key])
+
+    return full_results_df_dict
+
+
+def concat_results(full_results_list):
+    """
+    concatenate the results of several parts of the data (e.g. partitions), in the given order
+
+    :param full_results_list: list of full_results_df_dict (see compute_all_metrics), one for each part
+    :return: full_results_df_dict
+    """
+
+    full_results_df_dict = list()
+    for i, metric_results in enumerate(full_results_list[0]):
+        results_df_dict = OrderedDict()
+        for key in metric_results['record_df_dict'].keys():
+            results_df_dict[key] = pd.concat([part[i]['record_df_dict'][key] for part in full_results_list],
+                                             ignore_index=True)
+        full_results_df_dict.append(dict(metric_results, record_df_dict=results_df_dict))
+
+    return full_results_df_dict
+
+
+def save_all_metrics(full_results_df_dict, config_json, output_dir, writer=None):
+    """
+    save a table for each metric and grouping
+
+    :param full_results_df_dict: results from compute_all_metrics
+    :param config_json: configuration file
+    :param output_dir: directory to save output to
+    :param writer: optional pipeline.OutputWriter to write the tables on background threads
+    :return: files: list of file names which contain the output
+    """
+
+    compression = config_json.get('output_compression')
+    bootstrap_config = config_json.get('bootstrap')
+    metric_dicts = {metric_dict['metric']: metric_dict for metric_dict in metrics_info}
+
+    files = []
+    for metric_results in full_results_df_dict:
+        metric_dict = metric_dicts[metric_results['metric']]
+        for key, results_df in metric_results['record_df_dict'].items():
+            group_cols = metric_results['group_cols_dict'][key]
             comment = metric_dict['comments'] + "{0:s}".format(', '.join(group_cols))
-            file_name = metric_dict['file_name'] + "_{0:s}.tsv".format(key)
+            if bootstrap_config is not None:
+                comment += "\n# bootstrap CIs: {0}".format(json.dumps(bootstrap_config, sort_keys=True))
+            file_name = get_table_file_name(metric_dict['file_name'] + "_{0:s}.tsv".format(key), compression)
             out_path = os.path.join(output_dir, file_name)
-            save_df(results_df, comment, out_path)
+            if writer is None:
+                save_df(results_df, comment, out_path, compression)
+            else:
+                writer.write(file_name, save_df, results_df, comment, out_path, compression)
             files.append(file_name)
-        full_results_df_dict.append({'metric': metric_dict['metric'], 'record_df_dict': results_df_dict,
-                                     "plot_metric": metric_dict["plot_metric"]})
+
+    return files
+
+
+def run_functions(data_df, config_json, output_dir, group_arrays_dict=None, writer=None, group_costs_dict=None):
+    """
+    compute all the metrics (see compute_all_metrics) and save a table for each metric and grouping
+
+    :param output_dir: directory to save output to
+    :param config_json: configuration file
+    :param data_df: pandas.DataFrame with the data in it
+    :param group_arrays_dict: optional dictionary of GroupArrays for each grouping (made from data_df if not given),
+        extra groupings (e.g. pooled events) are also run
+    :param writer: optional pipeline.OutputWriter to write the tables on background threads
+    :param group_costs_dict: optional dictionary to add the costs of each grouping to (see compute_all_metrics)
+    :return:
+            full_results_df_dict: dictionary with all the results from the analysis
+            files: list of file names which contain the output
+    """
+
+    full_results_df_dict = compute_all_metrics(data_df, config_json, group_arrays_dict, group_costs_dict)
+    files = save_all_metrics(full_results_df_dict, config_json, output_dir, writer)
 
     return full_results_df_dict, files
 
 
-def plot_on_vs_off(data_df, config_json, file_name, output_dir):
+def make_box_data(group_arrays):
     """
-    for each group_cols combination listed in the config, stacked boxplots comparing the distribution
-    of on values vs. the distribution of off values is displayed
+    box statistics of every group with both on and off values, with the ratio of their on and off medians (the order
+    of the groups in the on vs. off figure). the box data of parts of the groups can be joined (see concat_box_data),
+    so the figure of partitioned data is made without keeping the values of every partition
+
+    :param group_arrays: GroupArrays
+    :return: OrderedDict with 'ngroups' (number of groups), 'labels' (of the groups with both states, in group order),
+        'ratios', 'stats', 'fliers' and 'flier_offsets' (see plot_summaries.compute_box_stats)
+    """
+
+    ngroups = len(group_arrays.names)
+    labels = np.array(get_group_labels(group_arrays), dtype=object)
+
+    # only plot groups that have both on and off values
+    seg_lengths = get_segment_lengths(group_arrays)
+    has_both = (seg_lengths > 0).all(axis=1)
+    plot_groups = np.flatnonzero(has_both)
+
+    medians = grouped_nanpercentile(group_arrays.values, group_arrays.offsets, [50]).reshape(ngroups, 2)
+    ratios = medians[plot_groups, ON] / (medians[plot_groups, OFF] + 1.0e-20)
+    stats, fliers, flier_offsets = compute_box_stats(group_arrays, plot_groups)
+    plot_labels = np.array([str(label) for label in labels[plot_groups]], dtype=str)
+
+    return OrderedDict([('ngroups', ngroups), ('labels', plot_labels), ('ratios', ratios), ('stats', stats),
+                        ('fliers', fliers), ('flier_offsets', flier_offsets)])
+
+
+def concat_box_data(box_data_list):
+    """
+    join the box data of several parts of the groups (e.g. partitions), as if it was made from all the groups
+
+    :param box_data_list: list of box data (see make_box_data), in group order
+    :return: OrderedDict
+    """
+
+    flier_starts = np.cumsum([0] + [len(box_data['fliers']) for box_data in box_data_list])
+    flier_offsets = [box_data['flier_offsets'][1:] + flier_starts[i] for i, box_data in enumerate(box_data_list)]
+
+    return OrderedDict([
+        ('ngroups', sum(box_data['ngroups'] for box_data in box_data_list)),
+        ('labels', np.concatenate([box_data['labels'] for box_data in box_data_list])),
+        ('ratios', np.concatenate([box_data['ratios'] for box_data in box_data_list])),
+        ('stats', np.concatenate([box_data['stats'] for box_data in box_data_list])),
+        ('fliers', np.concatenate([box_data['fliers'] for box_data in box_data_list])),
+        ('flier_offsets', np.concatenate([np.zeros(1, dtype=np.int64)] + flier_offsets))])
+
+
+def make_box_data_dict(group_arrays_dict, config_json):
+    """
+    box data of each group_cols combination listed in the config
+
+    :param group_arrays_dict: dictionary of GroupArrays for each grouping
+    :param config_json: configuration file
+    :return: OrderedDict of grouping to box data (see make_box_data)
+    """
+
+    return OrderedDict((key, make_box_data(group_arrays_dict[key])) for key in config_json['group_cols_dict'].keys())
+
+
+def make_on_vs_off_summaries(config_json, file_name, group_arrays_dict=None, box_data_dict=None):
+    """
+    box statistics of the on vs. off figure of each group_cols combination listed in the config (see plot_on_vs_off),
+    without drawing anything
 
-    :param data_df: dataframe containing the data
     :param config_json: configuration file
     :param file_name: experiment reference (or data file name) to put in the title of the plot
-    :param output_dir: directory to save output to
+    :param group_arrays_dict: dictionary of GroupArrays for each grouping
+    :param box_data_dict: optional box data of each grouping instead of the GroupArrays (see make_box_data_dict)
+    :return: OrderedDict of figure name to summary (see plot_summaries.draw_figure)
     """
 
     observed_output = config_json['observed_output']
@@ -149,56 +439,74 @@ def plot_on_vs_off(data_df, config_json, file_name, output_dir):
     out_on = intended_output['on']
     out_off = intended_output['off']
     out_str = '{0:s} on: {1}, off: {2}'.format(out_col, out_on, out_off)
+    ranking_config = get_ranking_config(config_json)
+    limit_plots = ranking_config is not None and ranking_config['limit_plots']
+    if box_data_dict is None:
+        box_data_dict = make_box_data_dict(group_arrays_dict, config_json)
 
+    summaries = OrderedDict()
     for key, group_cols in group_cols_dict.items():
         grp = '_'.join(group_cols)
-        grouped_df = data_df.groupby(group_cols)
-        df = []
-        ratio = []
-        nm_for_order = []
-        for name, group in grouped_df:
-            off = group[(group[intended_output['col']] == intended_output['off'])][observed_output]
-            on = group[(group[intended_output['col']] == intended_output['on'])][observed_output]
-            if len(off) > 0 and len(on) > 0:
-                ratio.append(on.median() / (off.median() + 1.0e-20))
-                n = ', '.join(name) if isinstance(name, (list, tuple)) else name
-                nm_for_order.append(n)
-                for i in off:
-                    df.append([n, 'off', i])
-                for j in on:
-                    df.append([n, 'on', j])
-        tmp_arr = np.array(ratio)
-        order = np.argsort(-tmp_arr)
-
-        data = pd.DataFrame(df, columns=[grp, intended_output['col'], observed_output])
-
-        grp_order = [nm_for_order[i] for i in order]
-
-        data = data.astype({observed_output: float})
-        if len(data) > 0:
-            fig_height = 3 + 0.1 * grouped_df.ngroups
-            plt.figure(figsize=(12, fig_height))
-            sns_plot = sns.boxplot(x=observed_output, y=grp,
-                                   hue=intended_output['col'], order=grp_order,
-                                   data=data)
-            sns_plot.set_title("On Vs. Off Boxplot \n {} \n groupby: {} \n {}".format(file_name, key, out_str))
-            plt.tight_layout()
-            img_name = "on_vs_off_" + key
-            out_path = os.path.join(output_dir, img_name)
-            fig = sns_plot.get_figure()
-            fig.savefig(out_path)
-            plt.close()
-
-
-def plot_histogram_of_fold_changes(results_df_dict, config_json, file_name, output_dir):
+        box_data = box_data_dict[key]
+        tmp_arr = box_data['ratios']
+        if limit_plots:
+            # partial selection of the best and worst groups instead of sorting all of them
+            top = top_k_indices(tmp_arr, ranking_config['k'], largest=True)
+            bottom = top_k_indices(tmp_arr, ranking_config['k'], largest=False)[::-1]
+            order = np.concatenate([top, bottom[~np.isin(bottom, top)]])
+            fig_groups = len(order)
+        else:
+            order = np.argsort(-tmp_arr)
+            fig_groups = box_data['ngroups']
+
+        if len(order) > 0:
+            # the boxes are drawn from their statistics, which are kept to draw the figure again (see replot)
+            segments = (order[:, np.newaxis] * 2 + np.arange(2)).ravel()
+            flier_offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+            np.cumsum(np.diff(box_data['flier_offsets'])[segments], out=flier_offsets[1:])
+            summaries["on_vs_off_" + key] = OrderedDict([
+                ('kind', 'on_vs_off'), ('labels', box_data['labels'][order]), ('stats', box_data['stats'][order]),
+                ('fliers', box_data['fliers'][take_segments(box_data['flier_offsets'], segments)]),
+                ('flier_offsets', flier_offsets),
+                ('title', "On Vs. Off Boxplot \n {} \n groupby: {} \n {}".format(file_name, key, out_str)),
+                ('xlabel', observed_output), ('ylabel', grp), ('legend_title', out_col), ('fig_groups', int(fig_groups))])
+
+    return summaries
+
+
+def plot_on_vs_off(data_df, config_json, file_name, output_dir, group_arrays_dict=None, summaries=None,
+                   box_data_dict=None):
     """
-    For each group_cols combination listed in the config, a histogram is produced tabulating
-    the number of groups that have certain ratios of on/off
+    for each group_cols combination listed in the config, stacked boxplots comparing the distribution
+    of on values vs. the distribution of off values is displayed.
+    with "ranking": {"limit_plots": true} in the config, only the top and bottom k groups by median ratio are plotted
 
-    :param results_df_dict: dictionary with all the results from the analysis
+    :param data_df: dataframe containing the data
     :param config_json: configuration file
     :param file_name: experiment reference (or data file name) to put in the title of the plot
     :param output_dir: directory to save output to
+    :param group_arrays_dict: optional dictionary of GroupArrays for each grouping (made from data_df if not given)
+    :param summaries: optional OrderedDict to add the box statistics of each figure to (see plot_summaries.py)
+    :param box_data_dict: optional box data of each grouping instead of the GroupArrays (see make_box_data_dict)
+    """
+
+    if group_arrays_dict is None and box_data_dict is None:
+        group_arrays_dict = make_group_arrays_dict(data_df, config_json)
+
+    for img_name, summary in make_on_vs_off_summaries(config_json, file_name, group_arrays_dict,
+                                                      box_data_dict).items():
+        draw_figure(img_name, summary, output_dir, summaries)
+
+
+def make_fold_change_summaries(results_df_dict, config_json, file_name):
+    """
+    ratios of the fold change histogram of each metric and grouping (see plot_histogram_of_fold_changes), without
+    drawing anything
+
+    :param results_df_dict: dictionary with all the results from the analysis
+    :param config_json: configuration file
+    :param file_name: experiment reference (or data file name) to put in the title of the plot
+    :return: OrderedDict of figure name to summary (see plot_summaries.draw_figure)
     """
 
     intended_output = config_json['intended_output']
@@ -207,6 +515,7 @@ def plot_histogram_of_fold_changes(results_df_dict, config_json, file_name, outp
     out_off = intended_output['off']
     out_str = '{0:s} on: {1}, off: {2}'.format(out_col, out_on, out_off)
 
+    summaries = OrderedDict()
     for metric_dict in results_df_dict:
         results_dict = metric_dict['record_df_dict']
         metric, metric_val = metric_dict["plot_metric"]
@@ -214,43 +523,73 @@ def plot_histogram_of_fold_changes(results_df_dict, config_json, file_name, outp
         for key in results_dict.keys():
             assert metric in results_dict[key].columns, '{} is not a column in this dataframe'
             ratio_val = results_dict[key][results_dict[key][metric] == metric_val]['ratio']
-            bins = list(range(0, 15, 1))
+            summaries["fold_change_histogram_" + metric_dict['metric'] + '_' + key] = OrderedDict([
+                ('kind', 'fold_change_histogram'), ('ratios', ratio_val.to_numpy(dtype=np.float64)),
+                ('title', "Group counts per metric histogram \n {} \n groupby: {} \n {} \n {} = {}".format(
+                    file_name, key, out_str, metric, metric_val))])
 
-            hist = sns.distplot(ratio_val, kde=False, bins=bins,
-                                hist_kws={"rwidth": 0.75})
-            hist.set_title(
-                "Group counts per metric histogram \n {} \n groupby: {} \n {} \n {} = {}".format(file_name, key,
-                                                                                                 out_str, metric,
-                                                                                                 metric_val))
-            hist.set(xlabel='ratio on/off', ylabel='Counts')
-            plt.tight_layout()
+    return summaries
 
-            fig = hist.get_figure()
 
-            img_name = "fold_change_histogram_" + metric_dict['metric'] + '_' + key
-            out_path = os.path.join(output_dir, img_name)
+def plot_histogram_of_fold_changes(results_df_dict, config_json, file_name, output_dir, summaries=None):
+    """
+    For each group_cols combination listed in the config, a histogram is produced tabulating
+    the number of groups that have certain ratios of on/off
+
+    :param results_df_dict: dictionary with all the results from the analysis
+    :param config_json: configuration file
+    :param file_name: experiment reference (or data file name) to put in the title of the plot
+    :param output_dir: directory to save output to
+    :param summaries: optional OrderedDict to add the ratios of each figure to (see plot_summaries.py)
+    """
 
-            fig.savefig(out_path)
-            plt.close()
+    for img_name, summary in make_fold_change_summaries(results_df_dict, config_json, file_name).items():
+        draw_figure(img_name, summary, output_dir, summaries)
 
 
-def run_analysis(data_df, config_json, output_dir, input_file_name):
+def run_analysis(data_df, config_json, output_dir, input_file_name, group_arrays_dict=None,
+                 full_results_df_dict=None, writer=None, group_costs_dict=None, box_data_dict=None):
     """
     Function to run all the analysis and produce all the plots - this is called by run_analysis.py
 
-    :param data_df: dataframe with the data
+    :param data_df: dataframe with the data (can be None if group_arrays_dict and full_results_df_dict are given)
     :param config_json: configuration file
     :param output_dir: directory to save output to
     :param input_file_name:  experiment reference (or input data file name) to put in the title of the plots
+    :param group_arrays_dict: optional dictionary of GroupArrays for each grouping (made from data_df if not given)
+    :param full_results_df_dict: optional results already computed (e.g. for each partition, see
+        partitioned_data.py), they are only saved and plotted
+    :param writer: optional pipeline.OutputWriter, the tables are then written on background threads while the plots
+        are made
+    :param group_costs_dict: optional diagnostics.GroupCosts of each grouping, with full_results_df_dict (the costs
+        are recorded while the metrics are computed otherwise)
+    :param box_data_dict: optional box data of each grouping for the on vs. off figure (see make_box_data_dict), with
+        full_results_df_dict and group_costs_dict no GroupArrays are needed then
     :return: files: file names for the output
     """
 
+    if group_arrays_dict is None and box_data_dict is None:
+        group_arrays_dict = make_group_arrays_dict(data_df, config_json)
+
     print('making tables')
-    results_df_dict, files = run_functions(data_df, config_json, output_dir)
+    if full_results_df_dict is None:
+        group_costs_dict = OrderedDict()
+        results_df_dict, files = run_functions(data_df, config_json, output_dir, group_arrays_dict, writer,
+                                               group_costs_dict)
+    else:
+        results_df_dict = full_results_df_dict
+        files = save_all_metrics(full_results_df_dict, config_json, output_dir, writer)
+        if group_costs_dict is None:
+            # the costs were not recorded with the results, time the metrics again
+            group_costs_dict = profile_group_costs_dict(group_arrays_dict, config_json)
+    files.extend(save_ranking(results_df_dict, config_json, output_dir, writer))
+    files.extend(save_diagnostics(group_costs_dict, config_json, output_dir, writer))
 
     print('making plots')
-    plot_on_vs_off(data_df, config_json, input_file_name, output_dir)
-    plot_histogram_of_fold_changes(results_df_dict, config_json, input_file_name, output_dir)
+    summaries = OrderedDict()
+    plot_on_vs_off(data_df, config_json, input_file_name, output_dir, group_arrays_dict, summaries, box_data_dict)
+    plot_histogram_of_fold_changes(results_df_dict, config_json, input_file_name, output_dir, summaries)
+    save_plot_summaries(summaries, output_dir)
 
     return files
 
@@ -306,7 +645,7 @@ if __name__ == '__main__':
     with open(config_file) as json_file:
         config_json = json.load(json_file)
 
-    data_df_loc = pd.read_csv(data_path, dtype=object)
+    data_df_loc = read_data(data_path, csv_parser=get_csv_parser(config_json))
 
     config_json_loc = parse_intended_output(config_json_loc, data_df_loc, output_dir_loc, config_file_loc)
 
@@ -0,0 +1,126 @@
+"""
+in-process analysis of data already in memory, without the side effects of the command line runner:
+
+    results = analyze(data_df, config_json)
+    results.aggregate[0]['record_df_dict']['exp_str']   # percentile metric grouped by experiment and strain
+
+analyze does not change the data or the config, does not write or draw anything, does not print the progress the
+runner prints (verbose=False) and does not change module state (the "quantile_kernel" of the config is not set, see
+grouped_quantiles.set_default_kernel), so it can be called from several threads at once. the figures are returned as
+their summaries (see plot_summaries.py), save_results writes the tables and draws the figures of a result the same way
+run_analysis.py does. the runner itself still writes the per sample tables a block at a time while they are computed,
+so memory does not grow with the size of the output (analyze keeps every table in memory).
+
+:license: see LICENSE for more details
+"""
+
+from collections import OrderedDict, namedtuple
+
+import pandas as pd
+
+from perform_metrics.config_parsing import resolve_config
+from perform_metrics.compact import make_compact_data
+from perform_metrics.group_arrays import make_group_arrays_dict
+from perform_metrics.sample_metrics import make_sample_chunks_dict, save_per_sample
+from perform_metrics.aggregate_metrics import compute_all_metrics, save_all_metrics, make_on_vs_off_summaries, \
+    make_fold_change_summaries
+from perform_metrics.ranking import get_ranking_config, make_ranking, save_ranking
+from perform_metrics.plot_summaries import draw_figure, save_plot_summaries
+from perform_metrics.variants import is_variant_run, compute_variants
+
+# config: the config with the intended output and contrasts resolved for the data (see config_parsing.resolve_config)
+# per_sample: OrderedDict of per sample table name (see sample_metrics.get_per_sample_tables) to pandas.DataFrame
+# aggregate: list with a dictionary of the results of each metric (see aggregate_metrics.compute_all_metrics)
+# ranking: pandas.DataFrame of the ranked groups (see ranking.make_ranking), or None without "ranking" in the config
+# figures: OrderedDict of figure name to summary (see plot_summaries.draw_figure)
+AnalysisResults = namedtuple('AnalysisResults', ['config', 'per_sample', 'aggregate', 'ranking', 'figures'])
+
+
+def prepare_data(data_df, config_json):
+    """
+    select the rows of the config's "subset_by" and make the data compact (if the config has "compact")
+
+    :param data_df: pandas.DataFrame as read (and merged)
+    :param config_json: configuration
+    :return: pandas.DataFrame
+    """
+
+    if "subset_by" in config_json.keys():
+        for col, val in config_json["subset_by"].items():
+            data_df = data_df[data_df[col] == val]
+
+    return make_compact_data(data_df, config_json)
+
+
+def concat_chunks(chunks):
+    """
+    join the chunks of a per sample table
+
+    :param chunks: iterable of pandas.DataFrame
+    :return: pandas.DataFrame (empty if there are no chunks)
+    """
+
+    chunks = list(chunks)
+    if len(chunks) == 0:
+        return pd.DataFrame()
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def analyze(data_df, config_json, input_file_name='data'):
+    """
+    compute the per sample and aggregate metrics (and the ranking and figure summaries) of data in memory
+
+    :param data_df: pandas.DataFrame of the data (read and merged, see data_loading.read_data), it is not changed
+    :param config_json: configuration, it is not changed. "events" is not supported, the events are summarized while
+        they are read (see event_summaries.read_events)
+    :param input_file_name: experiment reference (or data file name) to put in the title of the figures
+    :return: AnalysisResults
+    """
+
+    if 'events' in config_json.keys():
+        raise ValueError('events are summarized while they are read, analyze the summaries without "events"')
+
+    data_df = prepare_data(data_df, config_json)
+    config_json = resolve_config(config_json, data_df)
+
+    if is_variant_run(config_json):
+        sample_chunks_dict, full_results_df_dict, figures = compute_variants(data_df, config_json, input_file_name,
+                                                                             verbose=False)
+    else:
+        group_arrays_dict = make_group_arrays_dict(data_df, config_json)
+        sample_chunks_dict = make_sample_chunks_dict(data_df, config_json, group_arrays_dict)
+        full_results_df_dict = compute_all_metrics(data_df, config_json, group_arrays_dict, verbose=False)
+        figures = make_on_vs_off_summaries(config_json, input_file_name, group_arrays_dict)
+        figures.update(make_fold_change_summaries(full_results_df_dict, config_json, input_file_name))
+
+    per_sample = OrderedDict((table_key, concat_chunks(chunks)) for table_key, chunks in sample_chunks_dict.items())
+    ranking_config = get_ranking_config(config_json)
+    ranking_df = make_ranking(full_results_df_dict, ranking_config) if ranking_config is not None else None
+
+    return AnalysisResults(config=config_json, per_sample=per_sample, aggregate=full_results_df_dict,
+                           ranking=ranking_df, figures=figures)
+
+
+def save_results(results, output_dir, writer=None):
+    """
+    write the tables and draw the figures of an analysis, with the same file names as run_analysis.py (the tables of
+    several variants are always written with the variant columns)
+
+    :param results: AnalysisResults from analyze
+    :param output_dir: directory to save output to
+    :param writer: optional pipeline.OutputWriter to write the tables on background threads
+    :return: files: list of table file names
+    """
+
+    config_json = results.config
+    files = save_per_sample(OrderedDict((table_key, [table_df]) for table_key, table_df in results.per_sample.items()),
+                            config_json, output_dir, writer)
+    files.extend(save_all_metrics(results.aggregate, config_json, output_dir, writer))
+    files.extend(save_ranking(results.aggregate, config_json, output_dir, writer))
+
+    for img_name, summary in results.figures.items():
+        draw_figure(img_name, summary, output_dir)
+    save_plot_summaries(results.figures, output_dir)
+
+    return files
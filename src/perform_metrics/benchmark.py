@@ -0,0 +1,332 @@
+"""
+benchmarks for the performance critical parts of the package
+
+    python benchmark.py quantiles --ngroups 10000 --mean_size 30
+    python benchmark.py memory --nrows 2000000
+    python benchmark.py calibrate --nrows 200000 --out coefficients.json
+
+:license: see LICENSE for more details
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.grouped_quantiles import grouped_nanpercentile, KERNELS
+from perform_metrics.compact import make_compact_data
+from perform_metrics.group_arrays import make_group_arrays_dict
+from perform_metrics.aggregate_metrics import compute_all_metrics, compute_metrics, save_all_metrics, plot_on_vs_off
+from perform_metrics.sample_metrics import iter_sample_chunks, save_per_sample
+from perform_metrics.group_metrics import metrics_info
+from perform_metrics.planner import DEFAULT_COEFFICIENTS
+
+GROUP_SIZE_DISTRIBUTIONS = ['constant', 'poisson', 'skewed']
+MEMORY_MODES = OrderedDict([('standard', False), ('compact', True), ('compact_float32', {'float32': True})])
+MEMORY_CONFIG = {
+    'observed_output': 'observed_fluor',
+    'intended_output': {'col': 'intended_output', 'off': '0', 'on': '1'},
+    'group_cols_dict': {
+        'exp_str': ['experiment_id', 'strain'],
+        'exp_str_ts': ['experiment_id', 'strain', 'output_id'],
+        'exp_str_ts_rep': ['experiment_id', 'strain', 'output_id', 'replicate'],
+    },
+    'sample_id': 'sample_id',
+}
+
+
+def make_group_sizes(distribution, ngroups, mean_size, rng):
+    """
+    make a list of group sizes
+
+    :param distribution: 'constant' (all groups the same size), 'poisson', or 'skewed' (lognormal, a few very large
+        groups and many small ones)
+    :param ngroups: number of groups
+    :param mean_size: (approximate) mean group size
+    :param rng: numpy random Generator
+    :return: numpy.ndarray of group sizes
+    """
+
+    if distribution == 'constant':
+        sizes = np.full(ngroups, mean_size)
+    elif distribution == 'poisson':
+        sizes = rng.poisson(mean_size, ngroups)
+    elif distribution == 'skewed':
+        sigma = 1.5
+        sizes = rng.lognormal(np.log(mean_size) - sigma ** 2 / 2, sigma, ngroups).astype(np.int64)
+    else:
+        raise ValueError('unknown distribution: {}'.format(distribution))
+
+    return sizes
+
+
+def make_offset_data(sizes, rng, nan_fraction=0.01):
+    """
+    make random offset indexed values for the given segment sizes
+
+    :param sizes: size of each segment
+    :param rng: numpy random Generator
+    :param nan_fraction: fraction of the values to set to nan
+    :return: values, offsets
+    """
+
+    offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+    np.cumsum(sizes, out=offsets[1:])
+    values = rng.lognormal(5, 1, offsets[-1])
+    values[rng.random(offsets[-1]) < nan_fraction] = np.nan
+
+    return values, offsets
+
+
+def time_function(function, repeats):
+    """
+    best wall clock time of several calls
+
+    :param function: function with no arguments
+    :param repeats: number of calls
+    :return: seconds
+    """
+
+    times = list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    return min(times)
+
+
+def benchmark_grouped_quantiles(ngroups, mean_size, repeats=3, seed=0, include_loop=True):
+    """
+    compare the grouped quantile kernels (and a python loop over np.nanpercentile) across group size distributions
+
+    :param ngroups: number of segments
+    :param mean_size: mean segment size
+    :param repeats: number of timed calls for each kernel
+    :param seed: random seed
+    :param include_loop: also time a python loop calling np.nanpercentile for each segment
+    :return: pandas.DataFrame with one row per (distribution, kernel)
+    """
+
+    rng = np.random.default_rng(seed)
+    percents = [100, 75, 50, 25, 0]
+    records = list()
+
+    for distribution in GROUP_SIZE_DISTRIBUTIONS:
+        sizes = make_group_sizes(distribution, ngroups, mean_size, rng)
+        values, offsets = make_offset_data(sizes, rng)
+
+        functions = OrderedDict()
+        for kernel in KERNELS:
+            functions[kernel] = lambda k=kernel: grouped_nanpercentile(values, offsets, percents, kernel=k)
+        if include_loop:
+            functions['loop'] = lambda: [np.nanpercentile(values[offsets[i]:offsets[i + 1]], percents)
+                                         for i in range(ngroups) if offsets[i + 1] > offsets[i]]
+
+        for kernel, function in functions.items():
+            # the first call compiles the numba kernel
+            function()
+            record = OrderedDict()
+            record['distribution'] = distribution
+            record['ngroups'] = ngroups
+            record['nvalues'] = offsets[-1]
+            record['max_size'] = sizes.max()
+            record['kernel'] = kernel
+            record['seconds'] = time_function(function, repeats)
+            records.append(record)
+
+    return pd.DataFrame(records)
+
+
+def make_string_data(nrows, nstrains, rng):
+    """
+    make a data set like the example data (one row per sample), with every column as strings the way it is read from
+    a csv
+
+    :param nrows: number of rows
+    :param nstrains: number of strains
+    :param rng: numpy random Generator
+    :return: pandas.DataFrame
+    """
+
+    def choose(prefix, n):
+        labels = np.array([prefix + str(i) for i in range(n)], dtype=object)
+        return labels[rng.integers(0, n, nrows)]
+
+    data = OrderedDict()
+    data['experiment_id'] = choose('exp', 10)
+    data['strain'] = choose('strain', nstrains)
+    data['output_id'] = choose('ts', 4)
+    data['replicate'] = choose('', 4)
+    data['time'] = choose('', 8)
+    data['intended_output'] = choose('', 2)
+    data['observed_fluor'] = np.array([repr(float(val)) for val in rng.lognormal(5, 1, nrows)], dtype=object)
+    data['sample_id'] = np.array([str(i) for i in range(nrows)], dtype=object)
+
+    return pd.DataFrame(data, dtype=object)
+
+
+def get_memory_mb(data):
+    """
+    memory used by dataframes (including the python objects they point to) or numpy arrays, in MB
+
+    :param data: list of pandas.DataFrame or numpy.ndarray
+    :return: float
+    """
+
+    nbytes = 0
+    for item in data:
+        if isinstance(item, pd.DataFrame):
+            nbytes += item.memory_usage(deep=True).sum()
+        else:
+            nbytes += item.nbytes
+    return nbytes / 1e6
+
+
+def benchmark_compact_memory(nrows, nstrains=1000, seed=0):
+    """
+    compare the memory used by the data, group arrays and result tables with and without compact mode (see compact.py),
+    and the peak memory allocated (traced with tracemalloc) while they are made from the csv strings
+
+    :param nrows: number of rows of data
+    :param nstrains: number of strains
+    :param seed: random seed
+    :return: pandas.DataFrame with one row per mode
+    """
+
+    data_df = make_string_data(nrows, nstrains, np.random.default_rng(seed))
+    input_mb = get_memory_mb([data_df])
+
+    records = list()
+    for mode, compact in MEMORY_MODES.items():
+        config_json = dict(MEMORY_CONFIG, compact=compact)
+
+        start = time.perf_counter()
+        tracemalloc.start()
+        compact_df = make_compact_data(data_df, config_json)
+        group_arrays_dict = make_group_arrays_dict(compact_df, config_json)
+        full_results = compute_all_metrics(compact_df, config_json, group_arrays_dict)
+        sample_chunks = [chunk for key, group_cols in config_json['group_cols_dict'].items()
+                         for chunk in iter_sample_chunks(compact_df, config_json, group_cols, group_arrays_dict[key])]
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        record = OrderedDict()
+        record['mode'] = mode
+        record['nrows'] = nrows
+        record['input_mb'] = input_mb
+        record['data_mb'] = get_memory_mb([compact_df]) if compact_df is not data_df else input_mb
+        record['group_arrays_mb'] = get_memory_mb([array for group_arrays in group_arrays_dict.values()
+                                                   for array in [group_arrays.values, group_arrays.offsets,
+                                                                 group_arrays.row_index]])
+        record['aggregate_mb'] = get_memory_mb([results_df for metric_results in full_results
+                                                for results_df in metric_results['record_df_dict'].values()])
+        record['per_sample_mb'] = get_memory_mb(sample_chunks)
+        record['peak_mb'] = peak / 1e6
+        record['seconds'] = time.perf_counter() - start
+        records.append(record)
+
+    return pd.DataFrame(records)
+
+
+def calibrate_planner(nrows, nstrains=1000, seed=0):
+    """
+    measure the coefficients the dry run planner uses to estimate the time and memory of a run (see
+    planner.DEFAULT_COEFFICIENTS) on a generated data set
+
+    :param nrows: number of rows of data
+    :param nstrains: number of strains
+    :param seed: random seed
+    :return: dictionary of coefficients
+    """
+
+    rng = np.random.default_rng(seed)
+    data_df = make_string_data(nrows, nstrains, rng)
+    config_json = dict(MEMORY_CONFIG, pipeline={'threads': 0})
+    coefficients = dict(DEFAULT_COEFFICIENTS)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_path = os.path.join(tmp_dir, 'data.csv')
+        data_df.to_csv(data_path, index=False)
+        seconds = time_function(lambda: pd.read_csv(data_path, dtype=object), 1)
+        coefficients['read_seconds_per_cell'] = seconds / (nrows * len(data_df.columns))
+
+        ngroupings = len(config_json['group_cols_dict'])
+        seconds = time_function(lambda: make_group_arrays_dict(data_df, config_json), 1)
+        coefficients['group_seconds_per_row'] = seconds / (nrows * ngroupings)
+        group_arrays_dict = make_group_arrays_dict(data_df, config_json)
+
+        # time = per value * values + per group * groups, fitted over the groupings (which have different numbers of
+        # groups and the same number of values)
+        sizes = list()
+        times = list()
+        for key, group_arrays in group_arrays_dict.items():
+            for metric_dict in metrics_info:
+                sizes.append([len(group_arrays.values), len(group_arrays.names)])
+                times.append(time_function(lambda: compute_metrics(
+                    data_df, group_arrays.group_cols, config_json['observed_output'], config_json['intended_output'],
+                    metric_dict['function'], group_arrays=group_arrays,
+                    grouped_function=metric_dict['grouped_function']), 1))
+        per_value, per_group = np.linalg.lstsq(np.array(sizes, dtype=np.float64), np.array(times), rcond=None)[0]
+        coefficients['aggregate_seconds_per_value'] = max(per_value, 0.0)
+        coefficients['aggregate_seconds_per_group'] = max(per_group, 0.0)
+
+        chunks_dict = {key: iter_sample_chunks(data_df, config_json, group_cols, group_arrays_dict[key])
+                       for key, group_cols in config_json['group_cols_dict'].items()}
+        seconds = time_function(lambda: save_per_sample(chunks_dict, config_json, tmp_dir), 1)
+        coefficients['per_sample_seconds_per_row'] = seconds / sum(len(group_arrays.values)
+                                                                   for group_arrays in group_arrays_dict.values())
+
+        # plot time = per figure + per group * groups, from plots of 5 and 50 groups
+        plot_times = list()
+        for ngroups in [5, 50]:
+            plot_df = data_df[data_df['strain'].isin(['strain' + str(i) for i in range(ngroups)])]
+            plot_config = dict(config_json, group_cols_dict={'str': ['strain']})
+            plot_times.append(time_function(lambda: plot_on_vs_off(plot_df, plot_config, 'calibrate', tmp_dir), 1))
+        coefficients['plot_seconds_per_group'] = max((plot_times[1] - plot_times[0]) / 45, 0.0)
+        coefficients['plot_seconds_per_figure'] = max(plot_times[0] - 5 * coefficients['plot_seconds_per_group'], 0.0)
+
+        full_results = compute_all_metrics(data_df, config_json, group_arrays_dict)
+        results_dfs = [results_df for metric_results in full_results
+                       for results_df in metric_results['record_df_dict'].values()]
+        ncells = sum(results_df.size for results_df in results_dfs)
+        seconds = time_function(lambda: save_all_metrics(full_results, config_json, tmp_dir), 1)
+        coefficients['write_seconds_per_cell'] = seconds / ncells
+        coefficients['table_bytes_per_cell'] = get_memory_mb(results_dfs) * 1e6 / ncells
+
+    return coefficients
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("benchmark", choices=['quantiles', 'memory', 'calibrate'], help="which benchmark to run")
+    parser.add_argument("--ngroups", type=int, default=10000, help="number of groups")
+    parser.add_argument("--mean_size", type=int, default=30, help="mean number of values per group")
+    parser.add_argument("--repeats", type=int, default=3, help="number of timed runs (the best is reported)")
+    parser.add_argument("--no_loop", action="store_true", help="skip the (slow) python loop baseline")
+    parser.add_argument("--nrows", type=int, default=2000000, help="number of rows of data (memory and calibrate)")
+    parser.add_argument("--nstrains", type=int, default=1000, help="number of strains (memory and calibrate)")
+    parser.add_argument("--out", help="json file to save the calibrated coefficients to (calibrate)")
+
+    args = parser.parse_args()
+
+    if args.benchmark == 'quantiles':
+        results_df = benchmark_grouped_quantiles(args.ngroups, args.mean_size, args.repeats,
+                                                 include_loop=not args.no_loop)
+        print(results_df.to_string(index=False))
+    elif args.benchmark == 'memory':
+        results_df = benchmark_compact_memory(args.nrows, args.nstrains)
+        print(results_df.to_string(index=False, float_format='{0:.1f}'.format))
+    elif args.benchmark == 'calibrate':
+        coefficients_loc = calibrate_planner(args.nrows, args.nstrains)
+        print(json.dumps(coefficients_loc, indent=2))
+        if args.out is not None:
+            with open(args.out, 'w') as json_file:
+                json.dump(coefficients_loc, json_file, indent=2)
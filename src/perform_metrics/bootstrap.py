@@ -0,0 +1,153 @@
+"""
+bootstrap confidence intervals for the aggregate metrics.
+
+the ON and OFF values of every group are resampled (with replacement) as index arrays, and the grouped metric
+function is computed for all resamples of all groups in one call, by treating each (resample, group, state) as a
+segment of one offset indexed array. large groupings are split into blocks of groups, which can run in a process pool.
+
+:license: see LICENSE for more details
+"""
+
+import multiprocessing
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from perform_metrics.group_arrays import drop_nan, iter_group_blocks
+
+# metric columns that get a confidence interval
+CI_COLUMNS = ['diff', 'ratio']
+
+# default bootstrap config
+DEFAULT_BOOTSTRAP = {
+    'n_resamples': 1000,
+    'seed': 0,
+    'ci': 95,
+    'n_jobs': 1,
+    # about this many resampled values are held in memory at once (per job)
+    'max_values': 10000000,
+}
+
+
+def resample_offsets(offsets, n_resamples, rng):
+    """
+    draw resamples of every segment, as indices into the values
+
+    :param offsets: segment offsets (no nan in the values)
+    :param n_resamples: number of resamples
+    :param rng: numpy random Generator
+    :return: resample_index: numpy.ndarray of shape (n_resamples, nvalues),
+             resample_offsets: segment offsets of resample_index.ravel() (segment b * nsegments + s)
+    """
+
+    nvalues = offsets[-1]
+    seg_lengths = np.diff(offsets)
+    seg_starts = np.repeat(offsets[:-1], seg_lengths)
+    seg_sizes = np.repeat(seg_lengths, seg_lengths)
+
+    # each value of a segment is replaced by a random value of the same segment
+    resample_index = seg_starts + (rng.random((n_resamples, nvalues)) * seg_sizes).astype(np.int64)
+
+    resample_offsets = (offsets[:-1] + nvalues * np.arange(n_resamples)[:, np.newaxis]).ravel()
+    resample_offsets = np.append(resample_offsets, n_resamples * nvalues)
+
+    return resample_index, resample_offsets
+
+
+def bootstrap_block(values, offsets, grouped_function, function_params, n_resamples, ci, max_values, seed):
+    """
+    confidence intervals for one block of groups
+
+    :param values: offset indexed ON/OFF values of the block
+    :param offsets: segment offsets of the block
+    :param grouped_function: grouped metric function (see metrics_info)
+    :param function_params: dictionary of keyword arguments for the grouped function
+    :param n_resamples: number of resamples
+    :param ci: confidence level in percent (e.g. 95)
+    :param max_values: about how many resampled values to hold in memory at once
+    :param seed: numpy SeedSequence for this block
+    :return: OrderedDict of '{col}_ci_low', '{col}_ci_high' to numpy.ndarray of shape (ngroups, nparams)
+    """
+
+    values, offsets = drop_nan(values, offsets)
+    ngroups = (len(offsets) - 1) // 2
+    rng = np.random.default_rng(seed)
+
+    # resamples done together, so at most about max_values resampled values are in memory
+    chunk_resamples = int(np.clip(max_values // max(offsets[-1], 1), 1, n_resamples))
+
+    boot_columns = {col: list() for col in CI_COLUMNS}
+    done = 0
+    while done < n_resamples:
+        n_chunk = min(chunk_resamples, n_resamples - done)
+        resample_index, boot_offsets = resample_offsets(offsets, n_chunk, rng)
+        metric_columns = grouped_function(values[resample_index].ravel(), boot_offsets, **function_params)
+        for col in CI_COLUMNS:
+            # (n_chunk * ngroups, nparams) -> (n_chunk, ngroups, nparams)
+            boot_columns[col].append(metric_columns[col].reshape(n_chunk, ngroups, -1))
+        done += n_chunk
+
+    ci_columns = OrderedDict()
+    with warnings.catch_warnings():
+        # groups with no ON or OFF values are all nan
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        for col in CI_COLUMNS:
+            boot = np.concatenate(boot_columns[col], axis=0)
+            low, high = np.nanpercentile(boot, [(100 - ci) / 2, 100 - (100 - ci) / 2], axis=0)
+            ci_columns[col + '_ci_low'] = low
+            ci_columns[col + '_ci_high'] = high
+
+    return ci_columns
+
+
+def _bootstrap_block_args(args):
+    """
+    unpack the arguments for bootstrap_block, for the process pool
+
+    :param args: tuple of arguments for bootstrap_block
+    :return: result of bootstrap_block
+    """
+
+    return bootstrap_block(*args)
+
+
+def bootstrap_metric(group_arrays, grouped_function, function_params=None, bootstrap_config=None):
+    """
+    bootstrap confidence intervals of the diff and ratio of a metric, for every group and metric parameter.
+    the results only depend on the seed and the config, not on n_jobs.
+
+    :param group_arrays: GroupArrays for the grouping
+    :param grouped_function: grouped metric function (see metrics_info)
+    :param function_params: optional dictionary of keyword arguments for the grouped function
+    :param bootstrap_config: dictionary with n_resamples, seed, ci, n_jobs and max_values (see DEFAULT_BOOTSTRAP)
+    :return: OrderedDict of '{col}_ci_low', '{col}_ci_high' to numpy.ndarray of shape (ngroups, nparams)
+    """
+
+    if function_params is None:
+        function_params = dict()
+    config = dict(DEFAULT_BOOTSTRAP)
+    if bootstrap_config is not None:
+        config.update(bootstrap_config)
+
+    # blocks of groups, so all the resamples of a block fit in max_values
+    block_size = max(config['max_values'] // config['n_resamples'], 1)
+    blocks = list(iter_group_blocks(group_arrays, block_size))
+    seeds = np.random.SeedSequence(config['seed']).spawn(len(blocks))
+    block_args = [(block.values, block.offsets, grouped_function, function_params, config['n_resamples'],
+                   config['ci'], config['max_values'], seed) for block, seed in zip(blocks, seeds)]
+
+    if config['n_jobs'] > 1 and len(blocks) > 1:
+        # spawn, not fork: forking a process that has started threads (e.g. blas or numba) can deadlock
+        with ProcessPoolExecutor(max_workers=config['n_jobs'],
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            block_results = list(executor.map(_bootstrap_block_args, block_args))
+    else:
+        block_results = [_bootstrap_block_args(args) for args in block_args]
+
+    ci_columns = OrderedDict()
+    for col in block_results[0].keys() if block_results else list():
+        ci_columns[col] = np.concatenate([result[col] for result in block_results], axis=0)
+
+    return ci_columns
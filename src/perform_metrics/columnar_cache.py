@@ -0,0 +1,174 @@
+"""
+convert an input data set once into a directory of binary columns (.npy files) that can be memory-mapped.
+
+numeric columns (e.g. the observed output) are stored as float64, every other column is dictionary encoded:
+integer codes plus the sorted list of string values. loading a column cache memory-maps the .npy files, so reruns with
+different configs start without parsing the csv, and several processes reading the same cache share the pages.
+
+    python columnar_cache.py data_path cache_dir --config config.json
+
+:license: see LICENSE for more details
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.group_arrays import to_float_array
+from perform_metrics.config_parsing import get_observed_outputs
+
+MANIFEST_NAME = 'manifest.json'
+CACHE_FORMAT = 'perform_metrics columns'
+CACHE_VERSION = 1
+
+
+def is_column_cache(data_path):
+    """
+    check if a path is a column cache directory made by convert_to_cache
+
+    :param data_path: path to data
+    :return: bool
+    """
+
+    return os.path.isdir(data_path) and os.path.exists(os.path.join(data_path, MANIFEST_NAME))
+
+
+def get_codes_dtype(ncategories):
+    """
+    smallest integer dtype for the codes (the same one pandas uses, so the codes are not copied when loading)
+
+    :param ncategories: number of categories
+    :return: numpy dtype
+    """
+
+    for dtype in [np.int8, np.int16, np.int32]:
+        if ncategories < np.iinfo(dtype).max:
+            return np.dtype(dtype)
+
+    return np.dtype(np.int64)
+
+
+def convert_to_cache(data_df, cache_dir, numeric_cols=None, source=None):
+    """
+    write each column of a dataframe to .npy files and write the manifest
+
+    :param data_df: pandas.DataFrame (as read with dtype=object)
+    :param cache_dir: directory to write the cache to
+    :param numeric_cols: list of columns to store as float64 (e.g. the observed output), the rest are dictionary encoded
+    :param source: path of the original data, saved in the manifest
+    :return: manifest dictionary
+    """
+
+    if numeric_cols is None:
+        numeric_cols = list()
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+
+    columns = list()
+    for i, col in enumerate(data_df.columns):
+        column = {'name': col}
+        if col in numeric_cols:
+            column['kind'] = 'numeric'
+            column['values_file'] = 'col_{0:d}.values.npy'.format(i)
+            np.save(os.path.join(cache_dir, column['values_file']), to_float_array(data_df[col]))
+        else:
+            # sorted categories keep groupby order the same as for the string columns
+            codes, categories = pd.factorize(data_df[col], sort=True)
+            column['kind'] = 'categorical'
+            column['codes_file'] = 'col_{0:d}.codes.npy'.format(i)
+            column['categories_file'] = 'col_{0:d}.categories.npy'.format(i)
+            np.save(os.path.join(cache_dir, column['codes_file']), codes.astype(get_codes_dtype(len(categories))))
+            np.save(os.path.join(cache_dir, column['categories_file']), np.asarray(categories, dtype=str))
+        columns.append(column)
+
+    manifest = {
+        'format': CACHE_FORMAT,
+        'version': CACHE_VERSION,
+        'source': source,
+        'nrows': len(data_df),
+        'columns': columns,
+    }
+
+    with open(os.path.join(cache_dir, MANIFEST_NAME), 'w') as json_file:
+        json.dump(manifest, json_file, indent=2)
+
+    return manifest
+
+
+def load_cache(cache_dir, columns=None, mmap_mode='r'):
+    """
+    load a column cache as a dataframe, numeric columns are float64 and the others are categorical.
+    the arrays are memory-mapped, so only the pages that are used are read.
+
+    :param cache_dir: directory made by convert_to_cache
+    :param columns: optional list of columns to load (default all)
+    :param mmap_mode: mode passed to np.load, None reads the arrays into memory
+    :return: pandas.DataFrame
+    """
+
+    with open(os.path.join(cache_dir, MANIFEST_NAME)) as json_file:
+        manifest = json.load(json_file)
+    assert manifest.get('format') == CACHE_FORMAT, '{} is not a column cache'.format(cache_dir)
+
+    data = dict()
+    names = list()
+    for column in manifest['columns']:
+        if columns is not None and column['name'] not in columns:
+            continue
+        names.append(column['name'])
+        if column['kind'] == 'numeric':
+            data[column['name']] = np.load(os.path.join(cache_dir, column['values_file']), mmap_mode=mmap_mode)
+        else:
+            codes = np.load(os.path.join(cache_dir, column['codes_file']), mmap_mode=mmap_mode)
+            categories = np.load(os.path.join(cache_dir, column['categories_file'])).astype(object)
+            data[column['name']] = pd.Categorical.from_codes(codes, categories=categories)
+
+    return pd.DataFrame(data, columns=names, copy=False)
+
+
+def convert_csv(data_path, cache_dir, config_json=None, merge_files=None):
+    """
+    read a csv (and optional metadata file) and write it as a column cache
+
+    :param data_path: csv file with the data
+    :param cache_dir: directory to write the cache to
+    :param config_json: optional config, the observed outputs are stored as numeric and sample_id is used for merging
+    :param merge_files: optional metadata csv to merge on the sample id
+    :return: manifest dictionary
+    """
+
+    data_df = pd.read_csv(data_path, dtype=object)
+
+    numeric_cols = list()
+    if config_json is not None:
+        numeric_cols.extend(get_observed_outputs(config_json))
+
+    if merge_files is not None:
+        metadata_df = pd.read_csv(merge_files, dtype=object)
+        data_df = pd.merge(data_df, metadata_df, on=config_json['sample_id'])
+
+    return convert_to_cache(data_df, cache_dir, numeric_cols=numeric_cols, source=data_path)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("data_path", help="input csv file with data")
+    parser.add_argument("cache_dir", help="directory to write the column cache to")
+    parser.add_argument("-c", "--config", help="config file, the observed output is stored as numeric")
+    parser.add_argument('-m', "--merge_files", help='if there is a seperate metadata file, specify its location here '
+                                                    '(needs --config for the sample id)')
+
+    args = parser.parse_args()
+
+    config_json_loc = None
+    if args.config is not None:
+        with open(args.config) as json_file:
+            config_json_loc = json.load(json_file)
+
+    manifest_loc = convert_csv(args.data_path, args.cache_dir, config_json_loc, args.merge_files)
+    print("wrote {0:d} rows, {1:d} columns to {2:s}".format(manifest_loc['nrows'], len(manifest_loc['columns']),
+                                                            args.cache_dir))
@@ -0,0 +1,151 @@
+"""
+compact memory mode ("compact" in the config): the data and the result tables are stored with smaller types.
+
+    * data: string columns with repeated values are dictionary encoded (pandas categoricals with sorted categories, so
+      groupby order is the same as for the strings) and the observed output is float64, or float32 with
+      "compact": {"float32": true}. columns of (mostly) unique values, e.g. sample ids, are kept as strings
+    * group arrays: the values are float32 with the float32 setting (see group_arrays.make_group_arrays_dict)
+    * result tables: the group columns and group_name are categoricals (one small integer code per row),
+      the counts and integer metric parameters (e.g. percentile) use the smallest integer type that holds them
+
+the tables written are the same as without compact mode, except for the float32 setting which rounds the observed
+values to float32.
+
+:license: see LICENSE for more details
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.config_parsing import get_compact_config, get_observed_outputs, DEFAULT_COMPACT
+from perform_metrics.group_arrays import to_float_array, get_key_columns, get_name_array
+from perform_metrics.pipeline import prefetch
+
+SMALL_INT_DTYPES = [np.int8, np.int16, np.int32]
+# columns with more distinct values than this fraction of the rows are not dictionary encoded
+MAX_CATEGORY_FRACTION = 0.5
+
+
+def make_compact_data(data_df, config_json):
+    """
+    dictionary encode the string columns of the data (with repeated values) and convert the observed outputs to numbers
+    (does nothing if the config has no "compact" entry)
+
+    :param data_df: pandas.DataFrame (as read with dtype=object, or from a column cache)
+    :param config_json: configuration file
+    :return: pandas.DataFrame
+    """
+
+    compact_config = get_compact_config(config_json)
+    if compact_config is None:
+        return data_df
+
+    dtype = np.float32 if compact_config['float32'] else np.float64
+    observed_outputs = get_observed_outputs(config_json)
+    columns = dict()
+    for col in data_df.columns:
+        series = data_df[col]
+        if col in observed_outputs:
+            columns[col] = to_float_array(series, dtype)
+        elif isinstance(series.dtype, pd.CategoricalDtype) or pd.api.types.is_numeric_dtype(series.dtype):
+            columns[col] = series.array
+        else:
+            # sorted categories keep groupby order the same as for the string columns (see columnar_cache.py)
+            codes, categories = pd.factorize(series, sort=True)
+            if len(categories) > MAX_CATEGORY_FRACTION * len(series):
+                columns[col] = series.array
+            else:
+                columns[col] = pd.Categorical.from_codes(codes, categories=np.asarray(categories, dtype=object))
+
+    return pd.DataFrame(columns, columns=data_df.columns, index=data_df.index, copy=False)
+
+
+def read_compact_csv(data_path, config_json, merge_files=None, chunksize=1000000):
+    """
+    read a csv file a chunk of rows at a time straight into compact columns (see make_compact_data), so the strings of
+    the whole file are never in memory at once. each chunk is merged with the metadata and subset as the whole data
+    would be.
+
+    :param data_path: csv file with the data
+    :param config_json: configuration file (the compact settings are used, or the defaults if there are none)
+    :param merge_files: optional metadata file to merge with
+    :param chunksize: number of rows per chunk
+    :return: pandas.DataFrame
+    """
+
+    compact_config = get_compact_config(config_json) or DEFAULT_COMPACT
+    dtype = np.float32 if compact_config['float32'] else np.float64
+    observed_outputs = get_observed_outputs(config_json)
+    metadata_df = pd.read_csv(merge_files, dtype=object) if merge_files is not None else None
+
+    # each chunk's codes and distinct values, the codes are remapped to the sorted values of all chunks at the end
+    parts = OrderedDict()
+    for chunk in prefetch(pd.read_csv(data_path, dtype=object, chunksize=chunksize)):
+        if metadata_df is not None:
+            chunk = pd.merge(chunk, metadata_df, on=config_json['sample_id'])
+        for col, val in config_json.get('subset_by', dict()).items():
+            chunk = chunk[chunk[col] == val]
+        for col in chunk.columns:
+            if col in observed_outputs:
+                parts.setdefault(col, list()).append(to_float_array(chunk[col], dtype))
+            else:
+                codes, uniques = pd.factorize(chunk[col])
+                parts.setdefault(col, list()).append((codes.astype(np.int32), np.asarray(uniques, dtype=object)))
+
+    columns = dict()
+    for col, col_parts in parts.items():
+        if col in observed_outputs:
+            columns[col] = np.concatenate(col_parts)
+            continue
+        categories = np.unique(np.concatenate([uniques for _, uniques in col_parts]))
+        # position of each chunk value in the sorted values, -1 (missing) stays -1
+        codes = np.concatenate([np.append(np.searchsorted(categories, uniques), -1)[chunk_codes]
+                                for chunk_codes, uniques in col_parts])
+        if len(categories) > MAX_CATEGORY_FRACTION * len(codes):
+            columns[col] = pd.Series(np.where(codes >= 0, categories[np.maximum(codes, 0)], np.nan), dtype=object)
+        else:
+            columns[col] = pd.Categorical.from_codes(get_small_int_array(codes), categories=categories)
+
+    return pd.DataFrame(columns, columns=list(parts.keys()), copy=False)
+
+
+def get_small_int_array(values):
+    """
+    integer values in the smallest integer type that holds them (other values are not changed)
+
+    :param values: numpy.ndarray
+    :return: numpy.ndarray
+    """
+
+    values = np.asarray(values)
+    if values.dtype.kind not in 'iu' or len(values) == 0:
+        return values
+
+    low, high = values.min(), values.max()
+    for dtype in SMALL_INT_DTYPES:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return values.astype(dtype)
+
+    return values
+
+
+def get_key_categoricals(group_arrays, row_group):
+    """
+    group columns and group_name as categoricals, for rows that each belong to a group
+
+    :param group_arrays: GroupArrays
+    :param row_group: group index of each row
+    :return: OrderedDict of column name to pandas.Categorical
+    """
+
+    columns = OrderedDict()
+    for col, col_values in get_key_columns(group_arrays).items():
+        codes, categories = pd.factorize(col_values)
+        columns[col] = pd.Categorical.from_codes(codes[row_group], categories=np.asarray(categories, dtype=object))
+    # group names are unique (tuples are kept as tuples)
+    names = pd.Index(get_name_array(group_arrays), dtype=object, tupleize_cols=False)
+    columns['group_name'] = pd.Categorical.from_codes(row_group, categories=names)
+
+    return columns
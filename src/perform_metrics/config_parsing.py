@@ -7,31 +7,30 @@ code for parsing the config files
 """
 
 import numpy as np
+import pandas as pd
+import inspect
 import json
 import os
+from collections import OrderedDict
+
+DEFAULT_COMPACT = {
+    'float32': False,
+}
 
 
 def parse_intended_output(config_json, data_df, output_dir, config_file):
     """
-    Function to parse the intended output column of the config when a more general value is used, e.g. "max" or "min"
+    Function to parse the intended output column of the config when a more general value is used, e.g. "max" or "min",
+    and save the evaluated config to the output directory
 
     :param config_json: Config file
     :param data_df: Data set associated with the config file
     :param output_dir: Output directory
     :param config_file: Config file name
-    :return: config with the correct values for the intended output
+    :return: config with the correct values for the intended output (the input is updated, see resolve_config to
+        leave it unchanged)
     """
-    output_funct = {"max": np.nanmax, "min": np.nanmin}
-
-    if config_json['intended_output']['on'] in output_funct.keys():
-        tmp_output_on = {float(x): x for x in data_df[config_json['intended_output']['col']]}
-        on_float = output_funct[config_json['intended_output']['on']](list(tmp_output_on.keys()))
-        config_json['intended_output']['on'] = tmp_output_on[on_float]
-
-    if config_json['intended_output']['off'] in output_funct.keys():
-        tmp_output_off = {float(x): x for x in data_df[config_json['intended_output']['col']]}
-        off_float = output_funct[config_json['intended_output']['off']](list(tmp_output_off.keys()))
-        config_json['intended_output']['off'] = tmp_output_off[off_float]
+    config_json.update(resolve_config(config_json, data_df))
 
     confil_file_name, config_file_ext = os.path.splitext(os.path.basename(config_file))
     out_path = os.path.join(output_dir, confil_file_name + '_evaluated.json')
@@ -39,3 +38,172 @@ def parse_intended_output(config_json, data_df, output_dir, config_file):
         json.dump(config_json, outfile, indent=2)
 
     return config_json
+
+
+def resolve_config(config_json, data_df):
+    """
+    Function to resolve the intended output and contrasts of the config for a data set, without changing the input
+    dictionary or writing anything
+
+    :param config_json: Config file
+    :param data_df: Data set associated with the config file
+    :return: config with the correct values for the intended output (a new dictionary)
+    """
+    config_json = dict(config_json)
+    config_json['intended_output'] = resolve_intended_output(config_json['intended_output'], data_df)
+    if 'contrasts' in config_json.keys():
+        config_json['contrasts'] = resolve_contrasts(config_json['contrasts'], config_json['intended_output']['col'],
+                                                     data_df)
+
+    return config_json
+
+
+def resolve_intended_output(intended_output, data_df):
+    """
+    Function to replace "max" or "min" on/off values with the largest or smallest value of the intended output column,
+    without changing the input dictionary
+
+    :param intended_output: intended output entry of the config
+    :param data_df: Data set (only the intended output column is used)
+    :return: new intended output dictionary
+    """
+    output_funct = {"max": np.nanmax, "min": np.nanmin}
+    intended_output = dict(intended_output)
+
+    for state in ['on', 'off']:
+        if intended_output[state] in output_funct.keys():
+            tmp_output = {float(x): x for x in data_df[intended_output['col']]}
+            state_float = output_funct[intended_output[state]](list(tmp_output.keys()))
+            intended_output[state] = tmp_output[state_float]
+
+    return intended_output
+
+
+def get_sorted_levels(values):
+    """
+    Function to sort the intended output levels, by number if they are all numbers
+
+    :param values: iterable of intended output values (strings)
+    :return: sorted list of the distinct values
+    """
+    levels = list(OrderedDict.fromkeys(value for value in values if not pd.isnull(value)))
+    try:
+        return sorted(levels, key=float)
+    except (TypeError, ValueError):
+        return sorted(levels, key=str)
+
+
+def resolve_contrasts(contrasts, intended_col, data_df):
+    """
+    Function to resolve the contrasts entry of the config into a list of {"off": ..., "on": ...} levels of the intended
+    output column. "pairwise" is every pair of levels of the data (the lower level is off), and "max"/"min" levels are
+    resolved as for the intended output
+
+    :param contrasts: "pairwise" or list of {"off": level, "on": level}
+    :param intended_col: intended output column
+    :param data_df: Data set (only the intended output column is used)
+    :return: list of dictionaries (new dictionaries, the input is not changed)
+    """
+    if contrasts == 'pairwise':
+        levels = get_sorted_levels(data_df[intended_col])
+        return [{'off': off, 'on': on} for i, off in enumerate(levels) for on in levels[i + 1:]]
+    if isinstance(contrasts, str) or len(contrasts) == 0:
+        raise ValueError("contrasts: should be \"pairwise\" or a list of {{\"off\": level, \"on\": level}}, not "
+                         "{0}".format(contrasts))
+
+    resolved = list()
+    for contrast in contrasts:
+        intended_output = resolve_intended_output(dict(contrast, col=intended_col), data_df)
+        resolved.append({'off': intended_output['off'], 'on': intended_output['on']})
+
+    return resolved
+
+
+def get_contrast_levels(contrasts):
+    """
+    Function to get every intended output level used by the resolved contrasts, in order of first use
+
+    :param contrasts: list of {"off": level, "on": level} (see resolve_contrasts)
+    :return: list of levels
+    """
+    return list(OrderedDict.fromkeys(level for contrast in contrasts for level in [contrast['off'], contrast['on']]))
+
+
+def check_metric_params(metric_params, metrics_info):
+    """
+    Function to check the metric_params entry of the config, so a typo gives a clear error before any metrics are run
+
+    :param metric_params: dictionary of metric name to dictionary of keyword arguments for the metric function
+    :param metrics_info: list of metric dictionaries (see group_metrics.py)
+    """
+    functions = {metric_dict['metric']: metric_dict['function'] for metric_dict in metrics_info}
+
+    for metric, params in metric_params.items():
+        if metric not in functions:
+            raise ValueError("metric_params: unknown metric '{0}', should be one of {1}".format(
+                metric, list(functions.keys())))
+        allowed = list(inspect.signature(functions[metric]).parameters.keys())[2:]
+        for param in params.keys():
+            if param not in allowed:
+                raise ValueError("metric_params: '{0}' is not a parameter of the '{1}' metric, should be one of "
+                                 "{2}".format(param, metric, allowed))
+
+
+def get_metrics(config_json, metrics_info):
+    """
+    Function to get the aggregate metrics of a run: the metrics named in the "metrics" list of the config, or by
+    default every metric of metrics_info that is not 'opt_in'
+
+    :param config_json: Config file
+    :param metrics_info: list of metric dictionaries (see group_metrics.py)
+    :return: list of metric dictionaries, in the order of metrics_info
+    """
+    metrics = config_json.get('metrics')
+    if metrics is None:
+        return [metric_dict for metric_dict in metrics_info if not metric_dict.get('opt_in', False)]
+
+    names = [metric_dict['metric'] for metric_dict in metrics_info]
+    unknown = [metric for metric in metrics if metric not in names]
+    if len(unknown) > 0:
+        raise ValueError("metrics: unknown metrics {0}, should be in {1}".format(unknown, names))
+
+    return [metric_dict for metric_dict in metrics_info if metric_dict['metric'] in metrics]
+
+
+def get_observed_outputs(config_json):
+    """
+    Function to get the observed output columns of the config, "observed_output" can be a column or a list of columns
+    (channels, see variants.py)
+
+    :param config_json: Config file
+    :return: list of column names
+    """
+    observed_output = config_json['observed_output']
+    if isinstance(observed_output, str):
+        return [observed_output]
+    if len(observed_output) == 0:
+        raise ValueError("observed_output: the list of columns is empty")
+
+    return list(observed_output)
+
+
+def get_compact_config(config_json):
+    """
+    Function to get the compact memory settings of the config, "compact": true uses the defaults
+
+    :param config_json: Config file
+    :return: dictionary of compact settings (see DEFAULT_COMPACT), or None if compact mode is off
+    """
+    compact = config_json.get('compact', False)
+    if compact is False or compact is None:
+        return None
+
+    compact_config = dict(DEFAULT_COMPACT)
+    if isinstance(compact, dict):
+        unknown = set(compact.keys()) - set(DEFAULT_COMPACT.keys())
+        if len(unknown) > 0:
+            raise ValueError("compact: unknown settings {0}, should be in {1}".format(
+                sorted(unknown), list(DEFAULT_COMPACT.keys())))
+        compact_config.update(compact)
+
+    return compact_config
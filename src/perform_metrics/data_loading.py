@@ -0,0 +1,294 @@
+"""
+code for loading the input data sets
+
+the data can be a csv file, a column cache directory made by columnar_cache.py, or many csv files: a directory
+(searched recursively) or a glob pattern. directories named column=value (hive style, e.g.
+data/experiment_id=exp1/plate1.csv) add that column to the rows of the files below them.
+
+csv files can be compressed (.gz, .bz2 or .zst, zstd needs the zstandard package) and are decompressed as they are
+read. with "csv_parser": "pyarrow" in the config they are parsed by pyarrow's multi-threaded csv reader (if pyarrow
+is installed) instead of the single-threaded pandas parser, the columns are still strings. the MB read per second is
+printed and saved in record.json.
+
+:license: see LICENSE for more details
+"""
+
+import glob
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.columnar_cache import is_column_cache, load_cache
+
+try:
+    import pyarrow
+    import pyarrow.csv
+except ImportError:
+    pyarrow = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DATA_EXTENSIONS = ('.csv', '.csv.gz', '.csv.bz2', '.csv.zst')
+GLOB_CHARS = '*?['
+CSV_PARSERS = ['pandas', 'pyarrow']
+# compression of a data file from its extension
+COMPRESSIONS = {'.gz': 'gzip', '.bz2': 'bz2', '.zst': 'zstd'}
+
+
+def is_partitioned(data_path):
+    """
+    check if the data path is a directory of files (not a column cache) or a glob pattern
+
+    :param data_path: path to data
+    :return: bool
+    """
+
+    if any(char in data_path for char in GLOB_CHARS):
+        return True
+
+    return os.path.isdir(data_path) and not is_column_cache(data_path)
+
+
+def get_glob_root(data_path):
+    """
+    the directory a glob pattern starts in
+
+    :param data_path: glob pattern
+    :return: directory
+    """
+
+    prefix = data_path[:min(data_path.index(char) for char in GLOB_CHARS if char in data_path)]
+
+    return os.path.dirname(prefix) or '.'
+
+
+def get_data_name(data_path):
+    """
+    name of a data set from its path, without the extension (for a glob pattern, the directory it is in)
+
+    :param data_path: path to data
+    :return: str
+    """
+
+    if any(char in data_path for char in GLOB_CHARS):
+        data_path = get_glob_root(data_path)
+
+    return os.path.splitext(os.path.basename(os.path.normpath(data_path)))[0]
+
+
+def get_hive_partition(path, root):
+    """
+    partition column values from the column=value directories between root and the file
+
+    :param path: path to a data file
+    :param root: root directory of the data set
+    :return: OrderedDict of column to value
+    """
+
+    partition = OrderedDict()
+    for part in os.path.relpath(os.path.dirname(path), root).split(os.sep):
+        if '=' in part:
+            col, val = part.split('=', 1)
+            partition[col] = val
+
+    return partition
+
+
+def find_partition_files(data_path):
+    """
+    list the data files of a directory or glob pattern, in sorted order, with their hive partition values
+
+    :param data_path: directory or glob pattern
+    :return: list of (file path, OrderedDict of partition column to value)
+    """
+
+    if any(char in data_path for char in GLOB_CHARS):
+        paths = sorted(path for path in glob.glob(data_path, recursive=True) if os.path.isfile(path))
+        root = get_glob_root(data_path)
+    else:
+        paths = sorted(os.path.join(dir_path, file_name) for dir_path, _, file_names in os.walk(data_path)
+                       for file_name in file_names if file_name.endswith(DATA_EXTENSIONS))
+        root = data_path
+    assert len(paths) > 0, 'no data files found in {}'.format(data_path)
+
+    return [(path, get_hive_partition(path, root)) for path in paths]
+
+
+def get_csv_parser(config_json):
+    """
+    csv parser of the config ("csv_parser", default pandas)
+
+    :param config_json: configuration file
+    :return: one of CSV_PARSERS
+    """
+
+    csv_parser = config_json.get('csv_parser', CSV_PARSERS[0])
+    assert csv_parser in CSV_PARSERS, 'csv_parser must be one of {}, not {}'.format(CSV_PARSERS, csv_parser)
+    assert csv_parser != 'pyarrow' or pyarrow is not None, 'the pyarrow package is needed for the pyarrow csv parser'
+
+    return csv_parser
+
+
+def get_compression(path):
+    """
+    compression of a data file from its extension
+
+    :param path: path to the data file
+    :return: 'gzip', 'bz2', 'zstd' or None
+    """
+
+    return COMPRESSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def get_usecols(columns):
+    """
+    usecols argument of pd.read_csv to read only some columns (columns that are not in the file are skipped)
+
+    :param columns: list of column names, or None for all columns
+    :return: None or function
+    """
+
+    if columns is None:
+        return None
+    return lambda col: col in columns
+
+
+def read_pyarrow_csv(path, columns=None):
+    """
+    read a csv file (all columns as strings) with pyarrow's multi-threaded parser
+
+    :param path: path to the csv file (can be compressed)
+    :param columns: optional list of columns to read (default all)
+    :return: pandas.DataFrame, empty values are nan as with pandas
+    """
+
+    header = pyarrow.csv.open_csv(path).schema.names
+    convert_options = pyarrow.csv.ConvertOptions(
+        column_types={col: pyarrow.string() for col in header}, strings_can_be_null=True,
+        include_columns=[col for col in header if columns is None or col in columns])
+    table = pyarrow.csv.read_csv(path, read_options=pyarrow.csv.ReadOptions(use_threads=True),
+                                 convert_options=convert_options)
+    data_df = table.to_pandas().astype(object)
+
+    return data_df.where(data_df.notna(), np.nan)
+
+
+def read_csv_file(path, columns=None, nrows=None, csv_parser='pandas'):
+    """
+    read a csv file (all columns as strings), compressed files are decompressed as they are read
+
+    :param path: path to the csv file
+    :param columns: optional list of columns to read (default all)
+    :param nrows: optional number of rows to read from the start of the file (always read with pandas)
+    :param csv_parser: one of CSV_PARSERS
+    :return: pandas.DataFrame
+    """
+
+    if csv_parser == 'pyarrow' and nrows is None:
+        return read_pyarrow_csv(path, columns)
+
+    assert get_compression(path) != 'zstd' or zstandard is not None, \
+        'the zstandard package is needed to read zstd compressed files'
+    return pd.read_csv(path, dtype=object, usecols=get_usecols(columns), nrows=nrows)
+
+
+def get_read_profile(paths, seconds, csv_parser):
+    """
+    throughput of reading data files
+
+    :param paths: list of paths of the files read
+    :param seconds: seconds to read them
+    :param csv_parser: one of CSV_PARSERS
+    :return: OrderedDict with 'csv_parser', 'files', 'mb' (on disk, compressed), 'seconds' and 'mb_per_s'
+    """
+
+    mb = sum(os.path.getsize(path) for path in paths) / 1e6
+    profile = OrderedDict()
+    profile['csv_parser'] = csv_parser
+    profile['files'] = len(paths)
+    profile['mb'] = mb
+    profile['seconds'] = seconds
+    profile['mb_per_s'] = mb / seconds if seconds > 0 else None
+
+    return profile
+
+
+def read_partition_file(path, partition, columns=None, csv_parser='pandas'):
+    """
+    read one data file (all columns as strings) and add its partition columns
+
+    :param path: path to the data file
+    :param partition: OrderedDict of partition column to value
+    :param columns: optional list of columns to read (default all)
+    :param csv_parser: one of CSV_PARSERS
+    :return: pandas.DataFrame
+    """
+
+    data_df = read_csv_file(path, columns, csv_parser=csv_parser)
+    for col, val in partition.items():
+        if col not in data_df.columns and (columns is None or col in columns):
+            data_df[col] = pd.Series(val, index=data_df.index, dtype=object)
+
+    return data_df
+
+
+def read_partition_files(files, n_jobs=1, columns=None, csv_parser='pandas'):
+    """
+    read data files in parallel threads and concatenate them in order
+
+    :param files: list of (file path, partition) from find_partition_files
+    :param n_jobs: number of threads
+    :param columns: optional list of columns to read (default all)
+    :param csv_parser: one of CSV_PARSERS
+    :return: pandas.DataFrame
+    """
+
+    with ThreadPoolExecutor(max_workers=max(n_jobs, 1)) as executor:
+        data_dfs = list(executor.map(lambda file: read_partition_file(file[0], file[1], columns, csv_parser), files))
+
+    return pd.concat(data_dfs, ignore_index=True)
+
+
+def read_data(data_path, n_jobs=1, columns=None, nrows=None, csv_parser='pandas', profile=None):
+    """
+    read an input data set: a csv file (all columns as strings), a column cache directory made by columnar_cache.py
+    (memory-mapped), or a directory / glob pattern of csv files (read in parallel threads)
+
+    :param data_path: path to the data
+    :param n_jobs: number of threads for reading many files
+    :param columns: optional list of columns to read (default all)
+    :param nrows: optional number of rows to read from the start of a csv file (default all)
+    :param csv_parser: one of CSV_PARSERS (see get_csv_parser)
+    :param profile: optional dictionary to put the read throughput of csv files in (see get_read_profile)
+    :return: pandas.DataFrame
+    """
+
+    if is_column_cache(data_path):
+        print("memory-mapping column cache: " + data_path)
+        return load_cache(data_path, columns)
+
+    start = time.perf_counter()
+    if is_partitioned(data_path):
+        files = find_partition_files(data_path)
+        print("reading {0:d} files: {1:s}".format(len(files), data_path))
+        data_df = read_partition_files(files, n_jobs, columns, csv_parser)
+        paths = [path for path, _ in files]
+    else:
+        data_df = read_csv_file(data_path, columns, nrows, csv_parser)
+        paths = [data_path]
+
+    if nrows is None:
+        read_profile = get_read_profile(paths, time.perf_counter() - start, csv_parser)
+        print("read {0:.1f} MB in {1:.2f} s ({2:.1f} MB/s) with {3:s}".format(
+            read_profile['mb'], read_profile['seconds'], read_profile['mb_per_s'] or 0.0, csv_parser))
+        if profile is not None:
+            profile.update(read_profile)
+
+    return data_df
@@ -0,0 +1,355 @@
+"""
+hot group diagnostics ("diagnostics" in the config): where the time of a run goes when a few groups are much bigger
+than the rest (e.g. a control strain measured in every experiment).
+
+for each grouping three tables are written:
+    * diagnostics_skew.tsv: number of groups and rows, largest, median and mean group size, the skew ratio (largest /
+      median group size), the share of the rows in the heaviest groups and the seconds of each metric for all groups
+    * diagnostics_group_sizes.tsv: histogram of the group sizes in powers of 2 (groups and rows in each bin)
+    * diagnostics_heavy_groups.tsv: the heaviest groups by rows, with the seconds of each metric computed on the group
+      alone and its share of the seconds for all groups
+
+the seconds are measured while the aggregate metrics of the run are computed: the heaviest groups are given to the
+grouped metric function in calls of their own (the groups are independent, so the results are the same as with one
+call) and every call is timed, so the report costs a few more calls and not a second run. the first call of a process
+also compiles the numba kernels (see grouped_quantiles.py). with "profile": true the metrics (and the per sample table)
+are instead timed again after the run, for all groups and for each heavy group alone, without the compilation.
+
+:license: see LICENSE for more details
+"""
+
+import os
+import time
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.group_metrics import metrics_info, grouped_metric_percent
+from perform_metrics.config_parsing import get_metrics
+from perform_metrics.group_arrays import get_segment_lengths, get_segment_counts, get_group_labels, get_on_off, \
+    slice_groups, ON, OFF
+from perform_metrics.ranking import top_k_indices
+from perform_metrics.sample_metrics import compute_grouped_metrics
+from perform_metrics.table_writer import write_table, get_table_file_name
+
+DEFAULT_DIAGNOSTICS = {
+    'top': 20,
+    'profile': False,
+}
+SKEW_FILE_NAME = 'diagnostics_skew.tsv'
+SIZES_FILE_NAME = 'diagnostics_group_sizes.tsv'
+HEAVY_FILE_NAME = 'diagnostics_heavy_groups.tsv'
+PER_SAMPLE_METRIC = 'per_sample'
+
+# sizes: number of rows of each group of a grouping
+# heavy: positions of the heaviest groups (see get_heavy_groups), labels and counts: their labels and (off, on) counts
+# seconds: OrderedDict of metric to (seconds for all groups, numpy.ndarray of the seconds of each heavy group)
+GroupCosts = namedtuple('GroupCosts', ['sizes', 'heavy', 'labels', 'counts', 'seconds'])
+
+
+def get_diagnostics_config(config_json):
+    """
+    diagnostics settings of the config, "diagnostics": true uses the defaults
+
+    :param config_json: configuration file
+    :return: dictionary of diagnostics settings (see DEFAULT_DIAGNOSTICS), or None if there are no diagnostics
+    """
+
+    diagnostics = config_json.get('diagnostics', False)
+    if diagnostics is False or diagnostics is None:
+        return None
+
+    diagnostics_config = dict(DEFAULT_DIAGNOSTICS)
+    if isinstance(diagnostics, dict):
+        unknown = set(diagnostics.keys()) - set(DEFAULT_DIAGNOSTICS.keys())
+        if len(unknown) > 0:
+            raise ValueError('unknown diagnostics settings: {}'.format(sorted(unknown)))
+        diagnostics_config.update(diagnostics)
+
+    return diagnostics_config
+
+
+def get_group_sizes(group_arrays):
+    """
+    number of rows (values, including nan) of each group
+
+    :param group_arrays: GroupArrays
+    :return: numpy.ndarray of int64
+    """
+
+    return get_segment_lengths(group_arrays).sum(axis=1).astype(np.int64)
+
+
+def make_size_histogram(sizes):
+    """
+    histogram of group sizes in powers of 2, bin i has the groups with 2**i to 2**(i+1) - 1 rows
+
+    :param sizes: number of rows of each group
+    :return: pandas.DataFrame with 'min_rows', 'max_rows', 'groups', 'rows' and 'row_share'
+    """
+
+    bins = np.floor(np.log2(np.maximum(sizes, 1))).astype(np.int64)
+    nbins = bins.max() + 1 if len(bins) > 0 else 0
+    groups = np.bincount(bins, minlength=nbins)
+    rows = np.bincount(bins, weights=sizes, minlength=nbins).astype(np.int64)
+    used = np.flatnonzero(groups > 0)
+
+    columns = OrderedDict()
+    columns['min_rows'] = 2 ** used
+    columns['max_rows'] = 2 ** (used + 1) - 1
+    columns['groups'] = groups[used]
+    columns['rows'] = rows[used]
+    columns['row_share'] = rows[used] / max(sizes.sum(), 1)
+
+    return pd.DataFrame(columns)
+
+
+def time_metric(group_arrays, metric_dict, function_params=None):
+    """
+    seconds to compute a metric for all the groups of a GroupArrays
+
+    :param group_arrays: GroupArrays
+    :param metric_dict: entry of metrics_info, or None for the per sample table (without the sample ids)
+    :param function_params: optional dictionary of keyword arguments for the metric function
+    :return: seconds
+    """
+
+    function_params = function_params or dict()
+    start = time.perf_counter()
+    if metric_dict is None:
+        sample_ids = np.empty(len(group_arrays.values), dtype=object)
+        compute_grouped_metrics(group_arrays, grouped_metric_percent, sample_ids)
+    elif metric_dict.get('grouped_function') is not None:
+        metric_dict['grouped_function'](group_arrays.values, group_arrays.offsets, **function_params)
+    else:
+        for i in range(len(group_arrays.names)):
+            on, off = get_on_off(group_arrays, i)
+            metric_dict['function'](on, off, **function_params)
+
+    return time.perf_counter() - start
+
+
+def get_heavy_groups(group_arrays, top):
+    """
+    positions of the groups with the most rows, largest first (ties in group order)
+
+    :param group_arrays: GroupArrays
+    :param top: number of groups
+    :return: numpy.ndarray of int64
+    """
+
+    return top_k_indices(get_group_sizes(group_arrays).astype(np.float64), top)
+
+
+def time_grouped_metric(group_arrays, grouped_function, function_params, heavy):
+    """
+    compute a grouped metric with each heavy group in a call of its own and the other groups in calls between them,
+    and time every call
+
+    :param group_arrays: GroupArrays
+    :param grouped_function: grouped metric function (see metrics_info)
+    :param function_params: dictionary of keyword arguments for the grouped function
+    :param heavy: positions of the groups to time on their own
+    :return: metric_columns (the same as one call for all the groups), seconds for all the groups, numpy.ndarray of
+        the seconds of each heavy group
+    """
+
+    ngroups = len(group_arrays.names)
+    bounds = sorted(set([0, ngroups] + [int(group) for group in heavy] + [int(group) + 1 for group in heavy]))
+    parts = list()
+    seconds = dict()
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        part = slice_groups(group_arrays, start, stop)
+        start_time = time.perf_counter()
+        parts.append(grouped_function(part.values, part.offsets, **function_params))
+        seconds[start] = time.perf_counter() - start_time
+    if len(parts) == 0:
+        parts.append(grouped_function(group_arrays.values, group_arrays.offsets, **function_params))
+
+    metric_columns = OrderedDict((col, np.concatenate([part[col] for part in parts], axis=0))
+                                 for col in parts[0].keys())
+
+    return metric_columns, sum(seconds.values()), np.array([seconds[int(group)] for group in heavy])
+
+
+def make_group_costs(group_arrays, heavy, seconds):
+    """
+    the sizes and seconds of one grouping for the diagnostics tables
+
+    :param group_arrays: GroupArrays of the grouping
+    :param heavy: positions of the heaviest groups (see get_heavy_groups)
+    :param seconds: OrderedDict of metric to (seconds for all groups, numpy.ndarray of the seconds of each heavy group)
+    :return: GroupCosts
+    """
+
+    labels = get_group_labels(group_arrays)
+
+    return GroupCosts(sizes=get_group_sizes(group_arrays), heavy=heavy,
+                      labels=np.array([labels[group] for group in heavy], dtype=object),
+                      counts=get_segment_counts(group_arrays)[heavy], seconds=seconds)
+
+
+def profile_group_costs(group_arrays, config_json, top):
+    """
+    time every metric (and the per sample table) again for all the groups of a grouping and for each heavy group
+    alone ("profile": true in the diagnostics settings), the first call of each is not timed so the numba compilation
+    is not counted
+
+    :param group_arrays: GroupArrays of the grouping
+    :param config_json: configuration file
+    :param top: number of heaviest groups
+    :return: GroupCosts
+    """
+
+    metric_params = config_json.get('metric_params', dict())
+    heavy = get_heavy_groups(group_arrays, top)
+    metrics = [(metric_dict['metric'], metric_dict) for metric_dict in get_metrics(config_json, metrics_info)]
+    metrics.append((PER_SAMPLE_METRIC, None))
+
+    seconds = OrderedDict()
+    for metric, metric_dict in metrics:
+        function_params = metric_params.get(metric) if metric_dict is not None else None
+        # the first call compiles the numba kernels, do not time it
+        if len(heavy) > 0:
+            time_metric(slice_groups(group_arrays, heavy[0], heavy[0] + 1), metric_dict, function_params)
+        total_seconds = time_metric(group_arrays, metric_dict, function_params)
+        seconds[metric] = (total_seconds, np.array([time_metric(slice_groups(group_arrays, group, group + 1),
+                                                                metric_dict, function_params) for group in heavy]))
+
+    return make_group_costs(group_arrays, heavy, seconds)
+
+
+def profile_group_costs_dict(group_arrays_dict, config_json):
+    """
+    time the metrics again for each grouping of the config (see profile_group_costs), e.g. for results computed
+    without recording their costs
+
+    :param group_arrays_dict: dictionary of GroupArrays for each grouping
+    :param config_json: configuration file
+    :return: OrderedDict of grouping name to GroupCosts (empty if the config has no "diagnostics")
+    """
+
+    diagnostics_config = get_diagnostics_config(config_json)
+    if diagnostics_config is None:
+        return OrderedDict()
+
+    return OrderedDict((key, profile_group_costs(group_arrays_dict[key], config_json, diagnostics_config['top']))
+                       for key in config_json['group_cols_dict'].keys())
+
+
+def concat_group_costs(group_costs_list, top):
+    """
+    join the costs of a grouping over several parts of the data (e.g. partitions) that do not share any groups. the
+    heaviest groups of all the parts are among the heaviest of their own part.
+
+    :param group_costs_list: list of GroupCosts, one for each part, in group order
+    :param top: number of heaviest groups
+    :return: GroupCosts
+    """
+
+    group_offsets = np.cumsum([0] + [len(costs.sizes) for costs in group_costs_list])
+    candidates = np.concatenate([costs.heavy + offset for costs, offset in zip(group_costs_list, group_offsets)])
+    order = np.argsort(candidates, kind='stable')
+    sizes = np.concatenate([costs.sizes for costs in group_costs_list])
+    chosen = order[top_k_indices(sizes[candidates[order]].astype(np.float64), top)]
+
+    seconds = OrderedDict()
+    for metric in group_costs_list[0].seconds.keys():
+        heavy_seconds = np.concatenate([costs.seconds[metric][1] for costs in group_costs_list])
+        seconds[metric] = (sum(costs.seconds[metric][0] for costs in group_costs_list), heavy_seconds[chosen])
+
+    return GroupCosts(sizes=sizes, heavy=candidates[chosen],
+                      labels=np.concatenate([costs.labels for costs in group_costs_list])[chosen],
+                      counts=np.concatenate([costs.counts for costs in group_costs_list])[chosen], seconds=seconds)
+
+
+def make_group_diagnostics(key, group_costs):
+    """
+    skew summary, size histogram and heaviest groups of one grouping
+
+    :param key: grouping name (key of group_cols_dict)
+    :param group_costs: GroupCosts of the grouping
+    :return: skew_df, sizes_df, heavy_df (see the module docstring)
+    """
+
+    sizes = group_costs.sizes
+    nrows = max(sizes.sum(), 1)
+    heavy = group_costs.heavy
+
+    skew = OrderedDict()
+    skew['grouping'] = key
+    skew['ngroups'] = len(sizes)
+    skew['nrows'] = int(sizes.sum())
+    skew['max_rows'] = int(sizes.max()) if len(sizes) > 0 else 0
+    skew['median_rows'] = float(np.median(sizes)) if len(sizes) > 0 else 0.0
+    skew['mean_rows'] = float(sizes.mean()) if len(sizes) > 0 else 0.0
+    skew['skew_ratio'] = skew['max_rows'] / skew['median_rows'] if skew['median_rows'] > 0 else np.nan
+    skew['top_row_share'] = sizes[heavy].sum() / nrows
+
+    heavy_records = list()
+    for metric, (total_seconds, heavy_seconds) in group_costs.seconds.items():
+        skew[metric + '_seconds'] = total_seconds
+        for rank, group in enumerate(heavy):
+            record = OrderedDict()
+            record['grouping'] = key
+            record['metric'] = metric
+            record['rank'] = rank + 1
+            record['group_name'] = group_costs.labels[rank]
+            record['rows'] = sizes[group]
+            record['off_count'] = group_costs.counts[rank, OFF]
+            record['on_count'] = group_costs.counts[rank, ON]
+            record['row_share'] = sizes[group] / nrows
+            record['seconds'] = heavy_seconds[rank]
+            record['time_share'] = heavy_seconds[rank] / total_seconds if total_seconds > 0 else np.nan
+            heavy_records.append(record)
+
+    sizes_df = make_size_histogram(sizes)
+    sizes_df.insert(0, 'grouping', key)
+    print("grouping {0:s}: {1:d} groups, largest {2:d} rows, skew ratio {3:.1f}, top {4:d} groups have {5:.0%} of "
+          "the rows".format(key, skew['ngroups'], skew['max_rows'], skew['skew_ratio'], len(heavy),
+                            skew['top_row_share']))
+
+    return pd.DataFrame([skew]), sizes_df, pd.DataFrame(heavy_records)
+
+
+def save_diagnostics(group_costs_dict, config_json, output_dir, writer=None):
+    """
+    write the diagnostics tables (if the config has a "diagnostics" entry)
+
+    :param group_costs_dict: dictionary of GroupCosts for each grouping of the config (see
+        aggregate_metrics.compute_all_metrics)
+    :param config_json: configuration file
+    :param output_dir: directory to save output to
+    :param writer: optional pipeline.OutputWriter to write the tables on a background thread
+    :return: list of file names (empty without diagnostics)
+    """
+
+    diagnostics_config = get_diagnostics_config(config_json)
+    if diagnostics_config is None:
+        return list()
+
+    print("making diagnostics")
+    tables = [list(), list(), list()]
+    for key in config_json['group_cols_dict'].keys():
+        for table, table_df in zip(tables, make_group_diagnostics(key, group_costs_dict[key])):
+            table.append(table_df)
+
+    compression = config_json.get('output_compression')
+    comments = ["# group size skew of each grouping, skew_ratio = max_rows / median_rows, seconds for all groups\n",
+                "# histogram of group sizes (rows) in powers of 2\n",
+                "# heaviest {0:d} groups of each grouping, seconds of each metric for the group alone\n".format(
+                    diagnostics_config['top'])]
+
+    files = list()
+    for file_name, table, comment in zip([SKEW_FILE_NAME, SIZES_FILE_NAME, HEAVY_FILE_NAME], tables, comments):
+        file_name = get_table_file_name(file_name, compression)
+        out_path = os.path.join(output_dir, file_name)
+        table_df = pd.concat(table, ignore_index=True)
+        if writer is None:
+            write_table([table_df], comment, out_path, compression)
+        else:
+            writer.write(file_name, write_table, [table_df], comment, out_path, compression)
+        files.append(file_name)
+
+    return files
@@ -0,0 +1,338 @@
+"""
+event level input (e.g. raw flow cytometry events, many rows per sample): read the data in chunks and summarize the
+observed output of each sample, so the usual one measurement per sample pipelines can run on the summaries.
+
+two methods are available:
+    * exact: when the events of each sample are together in the input (e.g. the data is sorted by sample), each
+      sample is summarized with the grouped kernels as soon as its events end and its values are dropped, so memory
+      only depends on the number of samples and the events of one sample. otherwise (or to pool the events per group)
+      the observed values (float64) and sample index of every event are kept and the samples are summarized at the end.
+    * sketch: each sample gets a histogram with log spaced bins, so memory only depends on the number of samples.
+      quantiles are interpolated within a bin, so they are within a bin width (0.7% for the defaults) of the events
+      on either side of the exact quantile. values below sketch_range[0] (including zero and negative events, which
+      have no log) are counted at the lowest edge and values above sketch_range[1] at the highest edge, so quantiles
+      that fall there are sketch_range[0] or sketch_range[1]. the mean uses the actual values.
+
+:license: see LICENSE for more details
+"""
+
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.group_arrays import to_float_array, take_segments, get_segment_ids
+from perform_metrics.grouped_quantiles import grouped_nanpercentile
+from perform_metrics.pipeline import prefetch
+
+DEFAULT_EVENTS = {
+    'method': 'exact',
+    'quantiles': [50],
+    'summary': 'median',
+    'chunksize': 1000000,
+    'sketch_bins': 2000,
+    'sketch_range': [1, 1e6],
+    'pooled': False,
+}
+METHODS = ['exact', 'sketch']
+
+# sample_ids: sample id of each sample, in the order the samples were first seen
+# values: float64 observed values of every event, sorted by sample (original order kept within a sample)
+# offsets: int64 array of length nsamples + 1, the events of sample i are values[offsets[i]:offsets[i + 1]]
+EventArrays = namedtuple('EventArrays', ['sample_ids', 'values', 'offsets'])
+
+
+class SamplesNotContiguous(ValueError):
+    """
+    the events of a sample are not together in the input, so the exact method can not summarize the samples as the
+    events are read (see read_events, which then reads the events again keeping all of them)
+    """
+
+
+def get_events_config(config_json):
+    """
+    the "events" entry of the config with the defaults filled in
+
+    :param config_json: configuration file
+    :return: dictionary of event settings
+    """
+
+    events_config = dict(DEFAULT_EVENTS)
+    events_config.update(config_json.get('events', dict()))
+    assert events_config['method'] in METHODS, 'events method must be one of {}'.format(METHODS)
+    assert not (events_config['pooled'] and events_config['method'] == 'sketch'), \
+        'pooled event metrics need the exact method'
+
+    return events_config
+
+
+def get_summary_column(summary):
+    """
+    name of the summary column used as the observed output
+
+    :param summary: 'median', 'mean' or a percent
+    :return: column name
+    """
+
+    if summary == 'median':
+        summary = 50
+    if summary == 'mean':
+        return 'event_mean'
+
+    return 'event_p{0:g}'.format(float(summary))
+
+
+def make_sketch_edges(sketch_range, nbins):
+    """
+    log spaced bin edges of the sketch histograms
+
+    :param sketch_range: [low, high] range of the values, values outside (including zero and negative values) go in
+        an underflow/overflow bin
+    :param nbins: number of bins between low and high
+    :return: numpy.ndarray of nbins + 1 edges
+    """
+
+    return np.geomspace(sketch_range[0], sketch_range[1], nbins + 1)
+
+
+def sketch_quantiles(counts, edges, percents):
+    """
+    approximate quantiles of each sample from its sketch histogram
+
+    :param counts: int64 array of shape (nsamples, nbins + 2), the first and last bins are underflow/overflow (their
+        values are at the low and high edges)
+    :param edges: bin edges (nbins + 1)
+    :param percents: list of percents (0 - 100)
+    :return: numpy.ndarray of shape (nsamples, len(percents)), nan for samples without values
+    """
+
+    n = counts.sum(axis=1)
+    cum = np.cumsum(counts, axis=1)
+    log_edges = np.log(edges)
+    # underflow and overflow values are put at the low and high edges
+    lower = np.r_[log_edges[0], log_edges]
+    upper = np.r_[log_edges[0], log_edges[1:], log_edges[-1]]
+
+    out = np.full((len(counts), len(percents)), np.nan)
+    rows = np.arange(len(counts))
+    for j, percent in enumerate(percents):
+        # rank of the quantile, counting each value as the middle of its unit of the cumulative count
+        target = percent / 100 * (n - 1) + 0.5
+        bins = np.minimum((cum < target[:, np.newaxis]).sum(axis=1), counts.shape[1] - 1)
+        before = np.where(bins > 0, cum[rows, np.maximum(bins - 1, 0)], 0)
+        in_bin = counts[rows, bins]
+        frac = np.where(in_bin > 0, (target - before) / np.maximum(in_bin, 1), 0)
+        out[:, j] = np.exp(lower[bins] + frac * (upper[bins] - lower[bins]))
+
+    out[n == 0] = np.nan
+
+    return out
+
+
+def summarize_samples(values, offsets, percents):
+    """
+    number of (not nan) events, sum and quantiles of the events of each sample
+
+    :param values: float64 values of the events, sorted by sample
+    :param offsets: int64 array of length nsamples + 1, the events of sample i are values[offsets[i]:offsets[i + 1]]
+    :param percents: list of percents (0 - 100)
+    :return: counts, sums, quantiles (numpy.ndarray of shape (nsamples, len(percents)))
+    """
+
+    nsamples = len(offsets) - 1
+    valid = ~np.isnan(values)
+    segment_ids = get_segment_ids(offsets)
+    counts = np.bincount(segment_ids[valid], minlength=nsamples)
+    sums = np.bincount(segment_ids[valid], weights=values[valid], minlength=nsamples)
+
+    return counts, sums, grouped_nanpercentile(values, offsets, percents)
+
+
+def summarize_events(chunks, sample_id, observed_output, events_config, keep_events=None):
+    """
+    stream through the event chunks and summarize each sample. the other columns are taken from the first event of
+    each sample (they should be the same for every event of a sample).
+
+    :param chunks: iterable of pandas.DataFrame chunks of the event data
+    :param sample_id: sample id column
+    :param observed_output: column name associated with the observed output
+    :param events_config: dictionary of event settings (see DEFAULT_EVENTS)
+    :param keep_events: exact method: keep the values of every event (EventArrays), by default only if the events are
+        pooled. without them each sample is summarized as soon as its events end, and SamplesNotContiguous is raised
+        if the events of a sample are not together
+    :return: summary_df: one row per sample, the observed output column is the summary, plus event_count,
+                event_mean and event_p{percent} columns
+             events: EventArrays (None for the sketch method or if the events are not kept)
+    """
+
+    method = events_config['method']
+    keep_events = events_config['pooled'] if keep_events is None else keep_events
+    percents = list(events_config['quantiles'])
+    if events_config['summary'] not in ['median', 'mean']:
+        percents.append(float(events_config['summary']))
+    if 50 not in percents:
+        percents.append(50)
+    percents = sorted(set(float(percent) for percent in percents))
+
+    sample_index = dict()
+    first_rows = list()
+    codes_list = list()
+    values_list = list()
+    sums = np.zeros(0)
+    counts = np.zeros((0, events_config['sketch_bins'] + 2), dtype=np.int64)
+    edges = make_sketch_edges(events_config['sketch_range'], events_config['sketch_bins'])
+    # exact method without keeping the events: the events of the last sample seen (it can go on in the next chunk),
+    # and the summaries of the samples before it
+    open_codes = np.zeros(0, dtype=np.int64)
+    open_values = np.zeros(0)
+    summaries = list()
+    done = 0
+
+    for chunk in chunks:
+        # map this chunk's samples to global sample indices, new samples are added in the order they are seen
+        chunk = chunk[chunk[sample_id].notna()]
+        chunk_codes, uniques = pd.factorize(chunk[sample_id])
+        new = [i for i, sample in enumerate(uniques) if sample not in sample_index]
+        if len(new) > 0:
+            # factorize numbers the samples in the order they are first seen
+            first_idx = np.unique(chunk_codes, return_index=True)[1]
+            first_rows.append(chunk.iloc[first_idx[new]])
+            for i in new:
+                sample_index[uniques[i]] = len(sample_index)
+        codes = np.array([sample_index[sample] for sample in uniques], dtype=np.int64)[chunk_codes]
+        values = to_float_array(chunk[observed_output])
+        nsamples = len(sample_index)
+
+        if method == 'exact' and keep_events:
+            codes_list.append(codes)
+            values_list.append(values)
+        elif method == 'exact':
+            codes = np.r_[open_codes, codes]
+            values = np.r_[open_values, values]
+            if len(codes) == 0:
+                continue
+            starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+            # while the events of each sample are together, the runs of samples are the samples in the order they
+            # were first seen, starting with the first one not summarized yet
+            if not np.array_equal(codes[starts], np.arange(done, done + len(starts))):
+                raise SamplesNotContiguous("events: the events of each sample are not together")
+            # every sample but the last one has ended
+            summaries.append(summarize_samples(values[:starts[-1]], starts, percents))
+            done += len(starts) - 1
+            open_codes = codes[starts[-1]:].copy()
+            open_values = values[starts[-1]:].copy()
+        else:
+            valid = ~np.isnan(values)
+            sums = np.r_[sums, np.zeros(nsamples - len(sums))]
+            sums += np.bincount(codes[valid], weights=values[valid], minlength=nsamples)
+            counts = np.r_[counts, np.zeros((nsamples - len(counts), counts.shape[1]), dtype=np.int64)]
+            bins = np.searchsorted(edges, values[valid], side='right')
+            counts += np.bincount(codes[valid] * counts.shape[1] + bins,
+                                  minlength=counts.size).reshape(counts.shape)
+
+    nsamples = len(sample_index)
+    if len(first_rows) > 0:
+        summary_df = pd.concat(first_rows, ignore_index=True)
+    else:
+        summary_df = pd.DataFrame(columns=[sample_id, observed_output])
+
+    columns = OrderedDict()
+    events = None
+    if method == 'exact' and keep_events:
+        codes = np.concatenate(codes_list) if len(codes_list) > 0 else np.zeros(0, dtype=np.int64)
+        values = np.concatenate(values_list) if len(values_list) > 0 else np.zeros(0)
+        order = np.argsort(codes, kind='stable')
+        offsets = np.zeros(nsamples + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=nsamples), out=offsets[1:])
+        events = EventArrays(sample_ids=summary_df[sample_id].to_numpy(), values=values[order], offsets=offsets)
+        columns['event_count'], sums, quantiles = summarize_samples(events.values, events.offsets, percents)
+    elif method == 'exact':
+        # the last sample (if any) ends with the events
+        offsets = np.zeros(min(nsamples, 1) + 1, dtype=np.int64)
+        offsets[1:] = len(open_values)
+        summaries.append(summarize_samples(open_values, offsets, percents))
+        columns['event_count'] = np.concatenate([summary[0] for summary in summaries])
+        sums = np.concatenate([summary[1] for summary in summaries])
+        quantiles = np.concatenate([summary[2] for summary in summaries])
+    else:
+        columns['event_count'] = counts.sum(axis=1)
+        quantiles = sketch_quantiles(counts, edges, percents)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        columns['event_mean'] = sums / columns['event_count']
+    for j, percent in enumerate(percents):
+        columns[get_summary_column(percent)] = quantiles[:, j]
+
+    for col, col_values in columns.items():
+        summary_df[col] = col_values
+    summary_df[observed_output] = summary_df[get_summary_column(events_config['summary'])]
+
+    return summary_df, events
+
+
+def read_events(data_path, config_json):
+    """
+    read an event level csv in chunks (config "events" entry) and summarize each sample
+
+    :param data_path: path to the event data (csv)
+    :param config_json: configuration file
+    :return: summary_df, events (see summarize_events)
+    """
+
+    events_config = get_events_config(config_json)
+    if not isinstance(config_json['observed_output'], str):
+        raise ValueError("events: only one observed output is supported, not {0}".format(config_json['observed_output']))
+    print("summarizing events per sample ({0:s} method): {1:s}".format(events_config['method'], data_path))
+    try:
+        # the next chunk is parsed while the current one is summarized
+        chunks = prefetch(pd.read_csv(data_path, dtype=object, chunksize=int(events_config['chunksize'])))
+        return summarize_events(chunks, config_json['sample_id'], config_json['observed_output'], events_config)
+    except SamplesNotContiguous:
+        print("the events of each sample are not together, reading the events again keeping all of them")
+        chunks = prefetch(pd.read_csv(data_path, dtype=object, chunksize=int(events_config['chunksize'])))
+        return summarize_events(chunks, config_json['sample_id'], config_json['observed_output'], events_config,
+                                keep_events=True)
+
+
+def make_pooled_group_arrays(group_arrays, data_df, sample_id, events):
+    """
+    pool the events of the samples in each (group, state) segment, so the group metrics are computed on all the
+    events instead of on the per sample summaries
+
+    :param group_arrays: GroupArrays of the per sample summaries
+    :param data_df: pandas.DataFrame of the per sample summaries the group arrays were made from
+    :param sample_id: sample id column
+    :param events: EventArrays
+    :return: GroupArrays of the events, row_index is the row of data_df each event's sample is in
+    """
+
+    samples = pd.Index(events.sample_ids).get_indexer(data_df[sample_id].take(group_arrays.row_index))
+    assert (samples >= 0).all(), 'samples without events'
+
+    event_counts = np.diff(events.offsets)[samples]
+    nsegments = len(group_arrays.offsets) - 1
+    segment_ids = np.repeat(np.arange(nsegments), np.diff(group_arrays.offsets))
+    offsets = np.zeros(nsegments + 1, dtype=np.int64)
+    np.cumsum(np.bincount(segment_ids, weights=event_counts, minlength=nsegments).astype(np.int64), out=offsets[1:])
+
+    return group_arrays._replace(values=events.values[take_segments(events.offsets, samples)], offsets=offsets,
+                                 row_index=np.repeat(group_arrays.row_index, event_counts))
+
+
+def make_pooled_group_arrays_dict(group_arrays_dict, data_df, config_json, events):
+    """
+    pooled event GroupArrays for every grouping in the config, keyed by the grouping name + '_events'
+
+    :param group_arrays_dict: dictionary of GroupArrays of the per sample summaries
+    :param data_df: pandas.DataFrame of the per sample summaries
+    :param config_json: configuration file
+    :param events: EventArrays
+    :return: dictionary of group name to GroupArrays
+    """
+
+    pooled_dict = OrderedDict()
+    for key in config_json['group_cols_dict'].keys():
+        pooled_dict[key + '_events'] = make_pooled_group_arrays(group_arrays_dict[key], data_df,
+                                                                config_json['sample_id'], events)
+
+    return pooled_dict
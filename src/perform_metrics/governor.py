@@ -0,0 +1,210 @@
+"""
+memory budget governor (run_analysis.py --max_memory): choose how to run so the estimated peak memory stays under a
+budget, instead of being killed part way through a run.
+
+    * in_memory: the usual run, the whole csv is read as strings
+    * chunked: the csv is read a chunk of rows at a time straight into compact columns (see compact.read_compact_csv,
+      merged and subset a chunk at a time), the result tables are compact, and the per sample tables are made in small
+      blocks with at most one waiting to be written
+    * spill: as chunked, then the data is written to a column cache in the output directory and memory-mapped (see
+      columnar_cache.py), and so are the values and row index of the group arrays (see spill_group_arrays_dict), so
+      their pages can be dropped by the operating system while the metrics are computed. the group keys, offsets and
+      aggregate tables stay in memory, the per sample tables are written in small blocks as in chunked, and the
+      values of each observed output and contrast of a run with several (see variants.py) are made in memory
+
+the peak memory of each strategy is estimated with the dry run planner (see planner.py) on the first rows of the data,
+plus the memory the process already uses (python and the imported packages), and the first strategy under the budget
+is used (spill if none is). the strategy, the estimates and the actual peak memory are saved in record.json.
+
+:license: see LICENSE for more details
+"""
+
+import os
+import shutil
+import sys
+from collections import OrderedDict
+
+import numpy as np
+
+from perform_metrics.columnar_cache import convert_to_cache, load_cache
+from perform_metrics.config_parsing import get_observed_outputs
+from perform_metrics.planner import plan_run, estimate_stages, DEFAULT_COEFFICIENTS
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+STRATEGIES = ['in_memory', 'chunked', 'spill']
+# rows read to estimate the groups of a csv file
+PLAN_ROWS = 100000
+# compact data and tables relative to strings, from python benchmark.py memory --nrows 2000000
+COMPACT_DATA_FACTOR = 0.16
+COMPACT_TABLE_FACTOR = 0.2
+CHUNK_ROWS = 200000
+SMALL_BLOCK_SIZE = 10000
+SPILL_DIR_NAME = 'spill_cache'
+
+
+def get_strategy_config(config_json, strategy):
+    """
+    config for a strategy (a new dictionary, the input is not changed)
+
+    :param config_json: configuration file
+    :param strategy: one of STRATEGIES
+    :return: configuration
+    """
+
+    assert strategy in STRATEGIES, 'strategy must be one of {}, not {}'.format(STRATEGIES, strategy)
+    config_json = dict(config_json)
+    if strategy == 'in_memory':
+        return config_json
+
+    config_json['compact'] = config_json.get('compact') or True
+    config_json['output_block_size'] = min(config_json.get('output_block_size', SMALL_BLOCK_SIZE), SMALL_BLOCK_SIZE)
+    config_json['pipeline'] = dict(config_json.get('pipeline', dict()), max_pending=1)
+    config_json['n_jobs'] = 1
+
+    return config_json
+
+
+def estimate_strategy_peak(plan, config_json, strategy, coefficients=None):
+    """
+    estimated peak memory of the data, group arrays and tables of a run with a strategy
+
+    :param plan: dry run plan of the data (see planner.plan_run)
+    :param config_json: configuration file
+    :param strategy: one of STRATEGIES
+    :param coefficients: optional dictionary of planner coefficients
+    :return: MB
+    """
+
+    strategy_coefficients = dict(DEFAULT_COEFFICIENTS)
+    strategy_coefficients.update(coefficients or dict())
+    data_info = dict(plan['data'])
+
+    if strategy != 'in_memory':
+        # merged a chunk at a time, only one chunk of strings is in memory
+        data_mb = data_info['merge_mb'] if data_info['merge_mb'] is not None else data_info['read_mb']
+        data_info['read_mb'] = data_mb * COMPACT_DATA_FACTOR
+        data_info['read_working_mb'] = data_mb * min(float(CHUNK_ROWS) / max(data_info['nrows'], 1), 1.0)
+        data_info['merge_mb'] = None
+        strategy_coefficients['table_bytes_per_cell'] *= COMPACT_TABLE_FACTOR
+    if strategy == 'spill':
+        # the data and the values of the group arrays are memory-mapped
+        data_info['resident_mb'] = 0.0
+        data_info['value_bytes'] = 0.0
+
+    stages = estimate_stages(data_info, plan['groupings'], get_strategy_config(config_json, strategy),
+                             strategy_coefficients)
+
+    return max(stage['peak_mb'] for stage in stages)
+
+
+def choose_strategy(config_json, data_path, max_memory_mb, merge_files=None, coefficients=None):
+    """
+    the first strategy with an estimated peak memory under the budget
+
+    :param config_json: configuration file
+    :param data_path: path to the data
+    :param max_memory_mb: memory budget in MB
+    :param merge_files: optional metadata file to merge with
+    :param coefficients: optional dictionary of planner coefficients
+    :return: execution record: OrderedDict with 'strategy', 'max_memory_mb' and 'estimated_peak_mb' (for each strategy)
+    """
+
+    base_mb = get_current_memory_mb()
+    plan = plan_run(config_json, data_path, merge_files, PLAN_ROWS, coefficients)
+    estimates = OrderedDict((strategy, base_mb + estimate_strategy_peak(plan, config_json, strategy, coefficients))
+                            for strategy in STRATEGIES)
+
+    under_budget = [strategy for strategy, peak_mb in estimates.items() if peak_mb <= max_memory_mb]
+    if len(under_budget) > 0:
+        strategy = under_budget[0]
+    else:
+        strategy = STRATEGIES[-1]
+        print("warning: estimated peak memory {0:.0f} MB is over the budget of {1:.0f} MB even with {2:s}".format(
+            estimates[strategy], max_memory_mb, strategy))
+    print("memory budget {0:.0f} MB, running {1:s} (estimated peak {2:.0f} MB)".format(max_memory_mb, strategy,
+                                                                                     estimates[strategy]))
+
+    return OrderedDict([('strategy', strategy), ('max_memory_mb', max_memory_mb), ('estimated_peak_mb', estimates)])
+
+
+def spill_data(data_df, config_json, spill_dir):
+    """
+    write the data to a column cache and memory-map it
+
+    :param data_df: pandas.DataFrame
+    :param config_json: configuration file
+    :param spill_dir: directory for the column cache (removed with remove_spill at the end of the run)
+    :return: memory-mapped pandas.DataFrame
+    """
+
+    print("spilling data to: " + spill_dir)
+    convert_to_cache(data_df, spill_dir, numeric_cols=get_observed_outputs(config_json))
+
+    return load_cache(spill_dir)
+
+
+def spill_group_arrays_dict(group_arrays_dict, spill_dir):
+    """
+    write the values and row index of the group arrays (the arrays with one entry per value) to the spill directory
+    and memory-map them, the group keys and offsets are small and stay in memory
+
+    :param group_arrays_dict: dictionary of GroupArrays for each grouping
+    :param spill_dir: directory of the spilled data (see spill_data)
+    :return: dictionary of GroupArrays with memory-mapped (read only) values and row index
+    """
+
+    print("spilling group arrays to: " + spill_dir)
+    os.makedirs(spill_dir, exist_ok=True)
+    spilled = OrderedDict()
+    for i, (key, group_arrays) in enumerate(group_arrays_dict.items()):
+        arrays = dict()
+        for field in ['values', 'row_index']:
+            path = os.path.join(spill_dir, 'group_arrays_{0:d}_{1:s}.npy'.format(i, field))
+            np.save(path, getattr(group_arrays, field))
+            arrays[field] = np.load(path, mmap_mode='r')
+        spilled[key] = group_arrays._replace(**arrays)
+
+    return spilled
+
+
+def remove_spill(spill_dir):
+    """
+    remove a spill directory (if there is one)
+
+    :param spill_dir: directory made by spill_data
+    """
+
+    shutil.rmtree(spill_dir, ignore_errors=True)
+
+
+def get_current_memory_mb():
+    """
+    resident memory of this process now (the peak so far where /proc is not available)
+
+    :return: MB (0 if it is not available)
+    """
+
+    try:
+        with open('/proc/self/statm') as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError, AttributeError):
+        return get_peak_memory_mb() or 0.0
+
+
+def get_peak_memory_mb():
+    """
+    peak resident memory of this process so far
+
+    :return: MB, or None where it is not available (windows)
+    """
+
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return max_rss / 1e6 if sys.platform == 'darwin' else max_rss / 1e3
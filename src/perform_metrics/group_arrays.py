@@ -0,0 +1,354 @@
+"""
+compact representation of the ON/OFF values for a grouping of the data
+
+the observed values are sorted by (group, state) into a single contiguous float64 array (float32 in compact mode), and
+an offsets array gives the start and end of each (group, state) segment, so the values for a group are a pair of array
+slices instead of a DataFrame selection.
+
+:license: see LICENSE for more details
+"""
+
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.config_parsing import get_compact_config, get_observed_outputs
+
+# state index of each segment within a group
+OFF = 0
+ON = 1
+
+# group_cols: list of columns the data was grouped by
+# names: group name for each group (scalar for a single column, tuple otherwise), in sorted order
+# keys: tuple of group column values for each group
+# states: intended output value for each state index
+# values: float64 (or float32) observed values sorted by (group, state), original row order kept within a segment
+# offsets: int64 array of length ngroups * nstates + 1, segment g * nstates + s is values[offsets[i]:offsets[i + 1]]
+# row_index: position in data_df of each value, to look up other columns (e.g. sample id)
+GroupArrays = namedtuple('GroupArrays', ['group_cols', 'names', 'keys', 'states', 'values', 'offsets', 'row_index'])
+
+
+def to_float_array(series, dtype=np.float64):
+    """
+    convert a column to a float numpy array
+
+    :param series: pandas.Series of numeric values (strings and categoricals are okay)
+    :param dtype: np.float64 or np.float32
+    :return: numpy.ndarray of dtype
+    """
+
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # only convert each distinct value once
+        categories = np.asarray(series.cat.categories, dtype=np.float64).astype(dtype)
+        codes = series.cat.codes.to_numpy()
+        return np.where(codes >= 0, categories[codes], dtype(np.nan))
+
+    return np.asarray(series.to_numpy(), dtype=np.float64).astype(dtype, copy=False)
+
+
+def make_group_arrays(data_df, group_cols, observed_output, intended_output, dtype=np.float64, states=None):
+    """
+    build the compact representation of the ON/OFF values for one grouping.
+    groups are in the same (sorted) order as data_df.groupby(group_cols), and groups without any ON/OFF values are
+    kept with empty segments.
+
+    :param data_df: pandas.DataFrame of the data
+    :param group_cols: list of columns to group by
+    :param observed_output: column name associated with the observed output
+    :param intended_output: dictionary of values associated with the intended output of the on/off states
+    :param dtype: dtype of the values, np.float64 or np.float32 (compact mode, half the memory)
+    :param states: optional list of intended output values to use as the states, instead of [off, on] (e.g. every
+        level of the contrasts, see select_states)
+    :return: GroupArrays
+    """
+
+    if states is None:
+        states = [intended_output['off'], intended_output['on']]
+    nstates = len(states)
+
+    # group code for each row, -1 for rows with missing keys
+    grouped_df = data_df.groupby(group_cols, sort=True, observed=True)
+    codes = grouped_df.ngroup().fillna(-1).to_numpy().astype(np.int64)
+    has_key = codes >= 0
+    uniq_codes, first_pos = np.unique(codes[has_key], return_index=True)
+    codes[has_key] = np.searchsorted(uniq_codes, codes[has_key])
+    ngroups = len(uniq_codes)
+
+    key_rows = np.flatnonzero(has_key)[first_pos]
+    keys = list(data_df[group_cols].iloc[key_rows].itertuples(index=False, name=None))
+    names = [key[0] for key in keys] if len(group_cols) == 1 else keys
+
+    # state index for each row, -1 for rows that are neither ON nor OFF
+    state = np.full(len(data_df), -1, dtype=np.int64)
+    for i, state_val in enumerate(states):
+        state[(data_df[intended_output['col']] == state_val).to_numpy()] = i
+
+    # sort the rows by (group, state), lexsort is stable so row order is kept within a segment
+    rows = np.flatnonzero(has_key & (state >= 0))
+    order = np.lexsort((state[rows], codes[rows]))
+    row_index = rows[order]
+    segments = codes[row_index] * nstates + state[row_index]
+    offsets = np.zeros(ngroups * nstates + 1, dtype=np.int64)
+    np.cumsum(np.bincount(segments, minlength=ngroups * nstates), out=offsets[1:])
+
+    values = to_float_array(data_df[observed_output].iloc[row_index], dtype)
+
+    return GroupArrays(group_cols=list(group_cols), names=names, keys=keys, states=states, values=values,
+                       offsets=offsets, row_index=row_index)
+
+
+def make_group_arrays_dict(data_df, config_json, cache=None):
+    """
+    build the compact representation for every grouping in the config, so it is only done once per run.
+    the values are float32 if the config has "compact": {"float32": true}. with several observed outputs the values are
+    the first one's (see variants.py)
+
+    :param data_df: pandas.DataFrame of the data
+    :param config_json: configuration file
+    :param cache: optional dictionary of GroupArrays already made from the same data_df (e.g. for another config of a
+        sweep), new ones are added to it
+    :return: dictionary of group name (key of group_cols_dict) to GroupArrays
+    """
+
+    compact_config = get_compact_config(config_json)
+    dtype = np.float32 if compact_config is not None and compact_config['float32'] else np.float64
+
+    observed_output = get_observed_outputs(config_json)[0]
+    intended_output = config_json['intended_output']
+    cache = dict() if cache is None else cache
+    group_arrays_dict = dict()
+    for key, group_cols in config_json['group_cols_dict'].items():
+        cache_key = (tuple(group_cols), observed_output, intended_output['col'], intended_output['off'],
+                     intended_output['on'], np.dtype(dtype).name)
+        if cache_key not in cache:
+            cache[cache_key] = make_group_arrays(data_df, group_cols, observed_output, intended_output, dtype)
+        group_arrays_dict[key] = cache[cache_key]
+
+    return group_arrays_dict
+
+
+def get_segment(group_arrays, group_index, state):
+    """
+    get the slice of a (group, state) segment
+
+    :param group_arrays: GroupArrays
+    :param group_index: index of the group
+    :param state: state index (OFF or ON)
+    :return: slice into group_arrays.values and group_arrays.row_index
+    """
+
+    i = group_index * len(group_arrays.states) + state
+    return slice(group_arrays.offsets[i], group_arrays.offsets[i + 1])
+
+
+def get_on_off(group_arrays, group_index):
+    """
+    get the ON and OFF values for a group (views, not copies)
+
+    :param group_arrays: GroupArrays
+    :param group_index: index of the group
+    :return: on, off: numpy arrays of values
+    """
+
+    on = group_arrays.values[get_segment(group_arrays, group_index, ON)]
+    off = group_arrays.values[get_segment(group_arrays, group_index, OFF)]
+
+    return on, off
+
+
+def get_segment_lengths(group_arrays):
+    """
+    number of values (including nan) in each (group, state) segment
+
+    :param group_arrays: GroupArrays
+    :return: numpy.ndarray of shape (ngroups, nstates)
+    """
+
+    return np.diff(group_arrays.offsets).reshape(len(group_arrays.names), len(group_arrays.states))
+
+
+def get_group_labels(group_arrays):
+    """
+    string label for each group, used in the plots
+
+    :param group_arrays: GroupArrays
+    :return: list of str
+    """
+
+    return [', '.join(name) if isinstance(name, (list, tuple)) else name for name in group_arrays.names]
+
+
+def get_segment_ids(offsets):
+    """
+    segment index of each value
+
+    :param offsets: segment offsets
+    :return: numpy.ndarray of int64, same length as the values
+    """
+
+    return np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+
+
+def drop_nan(values, offsets):
+    """
+    remove the nan values, keeping the segments
+
+    :param values: offset indexed values
+    :param offsets: segment offsets
+    :return: values, offsets without nan
+    """
+
+    valid = ~np.isnan(values)
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(np.bincount(get_segment_ids(offsets)[valid], minlength=len(offsets) - 1), out=new_offsets[1:])
+
+    return values[valid], new_offsets
+
+
+def get_segment_counts(group_arrays):
+    """
+    number of non nan values in each (group, state) segment
+
+    :param group_arrays: GroupArrays
+    :return: numpy.ndarray of shape (ngroups, nstates)
+    """
+
+    nsegments = len(group_arrays.offsets) - 1
+    segments = get_segment_ids(group_arrays.offsets)
+    counts = np.bincount(segments[~np.isnan(group_arrays.values)], minlength=nsegments)
+
+    return counts.reshape(len(group_arrays.names), len(group_arrays.states))
+
+
+def get_name_array(group_arrays):
+    """
+    group names as a 1d object array (tuples are kept as tuples), for building columns
+
+    :param group_arrays: GroupArrays
+    :return: numpy.ndarray of objects
+    """
+
+    names = np.empty(len(group_arrays.names), dtype=object)
+    for i, name in enumerate(group_arrays.names):
+        names[i] = name
+
+    return names
+
+
+def get_key_columns(group_arrays):
+    """
+    group column values for each group, for building columns
+
+    :param group_arrays: GroupArrays
+    :return: OrderedDict of group column to numpy.ndarray of objects (one value per group)
+    """
+
+    columns = OrderedDict()
+    for i, col in enumerate(group_arrays.group_cols):
+        col_values = np.empty(len(group_arrays.keys), dtype=object)
+        col_values[:] = [key[i] for key in group_arrays.keys]
+        columns[col] = col_values
+
+    return columns
+
+
+def take_segments(offsets, segments):
+    """
+    index array that concatenates the given segments, in the given order
+
+    :param offsets: segment offsets
+    :param segments: array of segment indices
+    :return: numpy.ndarray of int64 positions
+    """
+
+    starts = offsets[segments]
+    lengths = offsets[segments + 1] - starts
+    out_starts = np.cumsum(lengths) - lengths
+
+    return np.repeat(starts - out_starts, lengths) + np.arange(lengths.sum())
+
+
+def select_states(group_arrays, states):
+    """
+    the segments of some of the states of every group, in the given order (e.g. the OFF and ON levels of a contrast
+    from the GroupArrays of all the levels). this is the same as making the GroupArrays with only those states.
+
+    :param group_arrays: GroupArrays
+    :param states: list of intended output values, each one in group_arrays.states
+    :return: GroupArrays
+    """
+
+    ngroups = len(group_arrays.names)
+    state_index = np.array([group_arrays.states.index(state) for state in states], dtype=np.int64)
+    segments = (np.arange(ngroups)[:, np.newaxis] * len(group_arrays.states) + state_index).ravel()
+    rows = take_segments(group_arrays.offsets, segments)
+    offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+    np.cumsum(group_arrays.offsets[segments + 1] - group_arrays.offsets[segments], out=offsets[1:])
+
+    return group_arrays._replace(states=list(states), values=group_arrays.values[rows], offsets=offsets,
+                                 row_index=group_arrays.row_index[rows])
+
+
+def slice_groups(group_arrays, start, stop):
+    """
+    the groups start to stop as a GroupArrays (the arrays are views, not copies)
+
+    :param group_arrays: GroupArrays
+    :param start: first group
+    :param stop: one past the last group
+    :return: GroupArrays
+    """
+
+    nstates = len(group_arrays.states)
+    first, last = group_arrays.offsets[start * nstates], group_arrays.offsets[stop * nstates]
+
+    return group_arrays._replace(names=group_arrays.names[start:stop], keys=group_arrays.keys[start:stop],
+                                 values=group_arrays.values[first:last],
+                                 offsets=group_arrays.offsets[start * nstates:stop * nstates + 1] - first,
+                                 row_index=group_arrays.row_index[first:last])
+
+
+def iter_group_blocks(group_arrays, block_size):
+    """
+    split the groups into consecutive blocks of about block_size values (a group is never split), so output can be
+    made and written a block at a time
+
+    :param group_arrays: GroupArrays
+    :param block_size: number of values (plus one per group) per block
+    :return: generator of GroupArrays
+    """
+
+    ngroups = len(group_arrays.names)
+    cum_sizes = np.cumsum(get_segment_lengths(group_arrays).sum(axis=1) + 1)
+
+    start = 0
+    while start < ngroups:
+        done = cum_sizes[start - 1] if start > 0 else 0
+        stop = max(int(np.searchsorted(cum_sizes, done + block_size, side='right')), start + 1)
+        yield slice_groups(group_arrays, start, stop)
+        start = stop
+
+
+def concat_group_arrays(group_arrays_list, nrows_list):
+    """
+    join the GroupArrays of several parts of the data (e.g. partitions), as if they were made from the concatenated
+    data. the parts should not share any groups.
+
+    :param group_arrays_list: list of GroupArrays, one for each part
+    :param nrows_list: number of rows of the data of each part, to shift the row index
+    :return: GroupArrays
+    """
+
+    first = group_arrays_list[0]
+    value_starts = np.cumsum([0] + [len(group_arrays.values) for group_arrays in group_arrays_list])
+    row_starts = np.cumsum([0] + list(nrows_list))
+
+    offsets = [group_arrays.offsets[1:] + value_starts[i] for i, group_arrays in enumerate(group_arrays_list)]
+    row_index = [group_arrays.row_index + row_starts[i] for i, group_arrays in enumerate(group_arrays_list)]
+
+    return first._replace(names=[name for group_arrays in group_arrays_list for name in group_arrays.names],
+                          keys=[key for group_arrays in group_arrays_list for key in group_arrays.keys],
+                          values=np.concatenate([group_arrays.values for group_arrays in group_arrays_list]),
+                          offsets=np.concatenate([np.zeros(1, dtype=np.int64)] + offsets),
+                          row_index=np.concatenate(row_index))
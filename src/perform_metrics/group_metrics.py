@@ -9,8 +9,11 @@ code for calculating the group metrics for ON vs OFF states
 import numpy as np
 from collections import OrderedDict
 
+from perform_metrics.grouped_quantiles import grouped_nanpercentile
+from perform_metrics.group_arrays import get_segment_ids, drop_nan, OFF, ON
 
-def compute_metric_percent(on, off):
+
+def compute_metric_percent(on, off, percents=None):
     """
     treat the ON and OFF states as distributions, and compare their percentiles
     for specified grouping of columns (exp, ts, etc)
@@ -18,28 +21,33 @@ def compute_metric_percent(on, off):
     for the OFF, use q to get right hand side of dist; for ON, use 1 - q to get left hand side of dist
     median if q = 50,  minimum if q = 0, maximum if q = 100.
 
+    all percentiles are computed in a single np.nanpercentile call per state, instead of one call per percent.
+
     :param on: data associated with the ON state
     :param off: data associated with the OFF state
+    :param percents: list of percents to use (default [100, 75, 50])
     :return: dictionary of data associated with percentile metric
     """
     # percents to use
     # for the OFF, use q to get right hand side of dist; for ON, use 1 - q to get left hand side of dist
     # median if q = 50,  minimum if q = 0, maximum if q = 100.
-    percents = [100, 75, 50]
-    records = list()
+    if percents is None:
+        percents = [100, 75, 50]
+    percents = list(percents)
 
-    for percent in percents:
-        # compute absolute difference
-        # check to make sure list exists
-        if len(off) > 0:
-            off_agg = np.nanpercentile(off, percent)
-        else:
-            off_agg = np.nan
-        if len(on) > 0:
-            on_agg = np.nanpercentile(on, 100 - percent)
-        else:
-            on_agg = np.nan
+    # check to make sure list exists
+    if len(off) > 0:
+        off_aggs = np.nanpercentile(off, percents)
+    else:
+        off_aggs = np.full(len(percents), np.nan)
+    if len(on) > 0:
+        on_aggs = np.nanpercentile(on, [100 - percent for percent in percents])
+    else:
+        on_aggs = np.full(len(percents), np.nan)
 
+    records = list()
+    for percent, off_agg, on_agg in zip(percents, off_aggs, on_aggs):
+        # compute absolute difference
         diff = on_agg - off_agg
         ratio = on_agg / off_agg  # need to catch zero here
 
@@ -56,27 +64,36 @@ def compute_metric_percent(on, off):
     return records
 
 
-def compute_metric_sd(on, off):
+def compute_metric_sd(on, off, num_std=None):
     """
     computing the difference between mean +/- SD to detect change difference between ON vs OFF states
+
+    the mean and SD are computed once per state and reused for every num_std.
+
     :param on: data associated with the ON state
     :param off: data associated with the OFF state
+    :param num_std: list of number of standard deviations to use (default [0, 1, 2, 3])
     :return: dictionary of values associated with sd metric
     """
 
-    num_std = [0, 1, 2, 3]
+    if num_std is None:
+        num_std = [0, 1, 2, 3]
+
+    if len(off) > 0:
+        off_mean = np.nanmean(off)
+        off_std = np.nanstd(off)
+    else:
+        off_mean = off_std = np.nan
+    if len(on) > 0:
+        on_mean = np.nanmean(on)
+        on_std = np.nanstd(on)
+    else:
+        on_mean = on_std = np.nan
 
-    # group by the exp and ts ids
     records = list()
     for n_std in num_std:
-        if len(off) > 0:
-            off_agg = np.nanmean(off) + (np.nanstd(off) * n_std)
-        else:
-            off_agg = np.nan
-        if len(on) > 0:
-            on_agg = np.nanmean(on) - (np.nanstd(on) * n_std)
-        else:
-            on_agg = np.nan
+        off_agg = off_mean + (off_std * n_std)
+        on_agg = on_mean - (on_std * n_std)
         diff = on_agg - off_agg
         ratio = on_agg / off_agg
 
@@ -93,10 +110,405 @@ def compute_metric_sd(on, off):
     return records
 
 
+def grouped_metric_percent(values, offsets, percents=None):
+    """
+    same as compute_metric_percent, but for all groups at once from the offset indexed ON/OFF values
+    (see group_arrays.py), with one grouped quantile call for all groups and percents.
+
+    :param values: observed values sorted by (group, state), OFF is state 0 and ON is state 1
+    :param offsets: segment offsets, length 2 * ngroups + 1
+    :param percents: list of percents to use (default [100, 75, 50])
+    :return: OrderedDict of column name to numpy.ndarray of shape (ngroups, len(percents))
+    """
+
+    if percents is None:
+        percents = [100, 75, 50]
+    percents = list(percents)
+    npercents = len(percents)
+
+    # OFF uses q, ON uses 100 - q
+    quantiles = grouped_nanpercentile(values, offsets, percents + [100 - percent for percent in percents])
+    off_agg = quantiles[0::2, :npercents]
+    on_agg = quantiles[1::2, npercents:]
+
+    columns = OrderedDict()
+    columns['percentile'] = np.broadcast_to(np.array(percents), off_agg.shape)
+    columns['off_agg'] = off_agg
+    columns['on_agg'] = on_agg
+    columns['diff'] = on_agg - off_agg
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['ratio'] = on_agg / off_agg
+
+    return columns
+
+
+def grouped_metric_sd(values, offsets, num_std=None):
+    """
+    same as compute_metric_sd, but for all groups at once from the offset indexed ON/OFF values
+    (see group_arrays.py). the means and SDs of every segment are computed together with bincount, so they agree with
+    np.nanmean/np.nanstd up to floating point rounding.
+
+    :param values: observed values sorted by (group, state), OFF is state 0 and ON is state 1
+    :param offsets: segment offsets, length 2 * ngroups + 1
+    :param num_std: list of number of standard deviations to use (default [0, 1, 2, 3])
+    :return: OrderedDict of column name to numpy.ndarray of shape (ngroups, len(num_std))
+    """
+
+    if num_std is None:
+        num_std = [0, 1, 2, 3]
+    num_std = np.array(num_std)
+
+    nsegments = len(offsets) - 1
+    valid = ~np.isnan(values)
+    segments = get_segment_ids(offsets)[valid]
+    values = values[valid]
+
+    counts = np.bincount(segments, minlength=nsegments)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.bincount(segments, weights=values, minlength=nsegments) / counts
+        stds = np.sqrt(np.bincount(segments, weights=(values - means[segments]) ** 2, minlength=nsegments) / counts)
+
+    off_agg = means[0::2, np.newaxis] + (stds[0::2, np.newaxis] * num_std)
+    on_agg = means[1::2, np.newaxis] - (stds[1::2, np.newaxis] * num_std)
+
+    columns = OrderedDict()
+    columns['num_std'] = np.broadcast_to(num_std, off_agg.shape)
+    columns['off_agg'] = off_agg
+    columns['on_agg'] = on_agg
+    columns['diff'] = on_agg - off_agg
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['ratio'] = on_agg / off_agg
+
+    return columns
+
+
+def get_separation_record(fold, off_agg, on_agg):
+    """
+    record of a separation metric (auc or ks), the ON and OFF aggregates are the evidence for each direction
+
+    :param fold: fold the OFF values were multiplied by
+    :param off_agg: separation of fold * OFF above ON
+    :param on_agg: separation of ON above fold * OFF
+    :return: OrderedDict
+    """
+
+    record = OrderedDict()
+    record['fold'] = fold
+    record['off_agg'] = off_agg
+    record['on_agg'] = on_agg
+    record['diff'] = on_agg - off_agg
+    with np.errstate(divide='ignore', invalid='ignore'):
+        record['ratio'] = np.float64(on_agg) / off_agg
+
+    return record
+
+
+def compute_metric_auc(on, off, folds=None):
+    """
+    area under the ROC curve of ON vs. fold * OFF: the probability that an ON sample is above fold times an OFF sample
+    (ties count half). on_agg is the AUC and off_agg is 1 - AUC (fold * OFF above ON), so ratio is the odds of ON
+    being higher and is inf when every ON sample is higher (as for the ks metric).
+
+    nan values are ignored, each ON value is placed among the sorted OFF values with a binary search.
+
+    :param on: data associated with the ON state
+    :param off: data associated with the OFF state
+    :param folds: list of folds to multiply the OFF values by (default [1])
+    :return: list of dictionaries of values associated with the auc metric
+    """
+
+    if folds is None:
+        folds = [1]
+    on = np.asarray(on, dtype=np.float64)
+    off = np.asarray(off, dtype=np.float64)
+    on = on[~np.isnan(on)]
+    off = off[~np.isnan(off)]
+
+    records = list()
+    for fold in folds:
+        if len(on) > 0 and len(off) > 0:
+            sorted_off = np.sort(off * fold)
+            below = np.searchsorted(sorted_off, on, side='left')
+            not_above = np.searchsorted(sorted_off, on, side='right')
+            auc = (below.sum() + 0.5 * (not_above - below).sum()) / (len(on) * len(off))
+        else:
+            auc = np.nan
+        records.append(get_separation_record(fold, 1 - auc, auc))
+
+    return records
+
+
+def compute_metric_ks(on, off, folds=None):
+    """
+    one sided Kolmogorov-Smirnov statistics of ON vs. fold * OFF: on_agg is the largest gap of the OFF empirical
+    distribution function above the ON one (ON is higher), off_agg the largest gap the other way. the two sided KS
+    statistic is the larger of the two.
+
+    nan values are ignored, both empirical distribution functions are evaluated at every value with a binary search.
+
+    :param on: data associated with the ON state
+    :param off: data associated with the OFF state
+    :param folds: list of folds to multiply the OFF values by (default [1])
+    :return: list of dictionaries of values associated with the ks metric
+    """
+
+    if folds is None:
+        folds = [1]
+    on = np.sort(np.asarray(on, dtype=np.float64))
+    off = np.asarray(off, dtype=np.float64)
+    on = on[~np.isnan(on)]
+    off = off[~np.isnan(off)]
+
+    records = list()
+    for fold in folds:
+        if len(on) > 0 and len(off) > 0:
+            sorted_off = np.sort(off * fold)
+            points = np.concatenate([sorted_off, on])
+            gaps = (np.searchsorted(sorted_off, points, side='right') / len(off) -
+                    np.searchsorted(on, points, side='right') / len(on))
+            d_on = max(0.0, gaps.max())
+            d_off = max(0.0, -gaps.min())
+        else:
+            d_on = d_off = np.nan
+        records.append(get_separation_record(fold, d_off, d_on))
+
+    return records
+
+
+def grouped_separation(values, offsets, fold):
+    """
+    AUC and one sided KS statistics of ON vs. fold * OFF for all groups at once. the values of all groups are sorted
+    together once by (group, value), then the average ranks of the ON values give the AUC and the running counts of
+    the OFF and ON values give the empirical distribution functions, so there is no comparison of pairs of values.
+
+    :param values: observed values sorted by (group, state), OFF is state 0 and ON is state 1
+    :param offsets: segment offsets, length 2 * ngroups + 1
+    :param fold: fold to multiply the OFF values by
+    :return: auc, ks_on (ON higher) and ks_off (fold * OFF higher), numpy.ndarray of length ngroups, nan for groups
+        without ON or OFF values
+    """
+
+    values, offsets = drop_nan(np.asarray(values, dtype=np.float64), offsets)
+    ngroups = (len(offsets) - 1) // 2
+    counts = np.diff(offsets).reshape(ngroups, 2)
+    segments = get_segment_ids(offsets)
+    groups = segments // 2
+    is_on = segments % 2 == ON
+    scaled = np.where(is_on, values, values * fold)
+
+    # sorting by (group, value) keeps each group where it was: group g is at offsets[2 * g]:offsets[2 * g + 2]
+    order = np.lexsort((scaled, groups))
+    sorted_values = scaled[order]
+    sorted_on = is_on[order]
+    group_starts = offsets[0:-1:2]
+
+    # runs of tied values in a group, each value gets the average rank (1 based) of its run in the group
+    new_run = np.ones(len(values), dtype=bool)
+    new_run[1:] = (groups[1:] != groups[:-1]) | (sorted_values[1:] != sorted_values[:-1])
+    run_starts = np.flatnonzero(new_run)
+    run_ends = np.append(run_starts[1:], len(values)) - 1
+    run_groups = groups[run_starts]
+    run_ranks = run_starts - group_starts[run_groups] + (run_ends - run_starts + 2) / 2
+    value_ranks = run_ranks[np.cumsum(new_run) - 1]
+
+    n_off = counts[:, OFF].astype(np.float64)
+    n_on = counts[:, ON].astype(np.float64)
+    on_rank_sums = np.bincount(groups[sorted_on], weights=value_ranks[sorted_on], minlength=ngroups)
+
+    # empirical distribution functions of the group after each run of ties
+    off_seen = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(~sorted_on, out=off_seen[1:])
+    on_seen = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(sorted_on, out=on_seen[1:])
+    run_group_starts = group_starts[run_groups]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        auc = (on_rank_sums - n_on * (n_on + 1) / 2) / (n_on * n_off)
+        gaps = ((off_seen[run_ends + 1] - off_seen[run_group_starts]) / n_off[run_groups] -
+                (on_seen[run_ends + 1] - on_seen[run_group_starts]) / n_on[run_groups])
+
+    ks_on = np.zeros(ngroups)
+    ks_off = np.zeros(ngroups)
+    with np.errstate(invalid='ignore'):
+        np.maximum.at(ks_on, run_groups, gaps)
+        np.maximum.at(ks_off, run_groups, -gaps)
+    # no negative zeros, so the ratio of groups that do not overlap is inf and not -inf
+    ks_on += 0.0
+    ks_off += 0.0
+    empty = (counts == 0).any(axis=1)
+    auc[empty] = np.nan
+    ks_on[empty] = np.nan
+    ks_off[empty] = np.nan
+
+    return auc, ks_on, ks_off
+
+
+def get_separation_columns(folds, off_agg, on_agg):
+    """
+    columns of a grouped separation metric (auc or ks)
+
+    :param folds: list of folds
+    :param off_agg: numpy.ndarray of shape (ngroups, len(folds))
+    :param on_agg: numpy.ndarray of shape (ngroups, len(folds))
+    :return: OrderedDict of column name to numpy.ndarray of shape (ngroups, len(folds))
+    """
+
+    columns = OrderedDict()
+    columns['fold'] = np.broadcast_to(np.array(folds), off_agg.shape)
+    columns['off_agg'] = off_agg
+    columns['on_agg'] = on_agg
+    columns['diff'] = on_agg - off_agg
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['ratio'] = on_agg / off_agg
+
+    return columns
+
+
+def grouped_metric_auc(values, offsets, folds=None):
+    """
+    same as compute_metric_auc, but for all groups at once from the offset indexed ON/OFF values
+    (see group_arrays.py), with one sort of all the values for each fold (see grouped_separation)
+
+    :param values: observed values sorted by (group, state), OFF is state 0 and ON is state 1
+    :param offsets: segment offsets, length 2 * ngroups + 1
+    :param folds: list of folds to multiply the OFF values by (default [1])
+    :return: OrderedDict of column name to numpy.ndarray of shape (ngroups, len(folds))
+    """
+
+    if folds is None:
+        folds = [1]
+    auc = np.stack([grouped_separation(values, offsets, fold)[0] for fold in folds], axis=1)
+
+    return get_separation_columns(folds, 1 - auc, auc)
+
+
+def grouped_metric_ks(values, offsets, folds=None):
+    """
+    same as compute_metric_ks, but for all groups at once from the offset indexed ON/OFF values
+    (see group_arrays.py), with one sort of all the values for each fold (see grouped_separation)
+
+    :param values: observed values sorted by (group, state), OFF is state 0 and ON is state 1
+    :param offsets: segment offsets, length 2 * ngroups + 1
+    :param folds: list of folds to multiply the OFF values by (default [1])
+    :return: OrderedDict of column name to numpy.ndarray of shape (ngroups, len(folds))
+    """
+
+    if folds is None:
+        folds = [1]
+    ks = [grouped_separation(values, offsets, fold)[1:] for fold in folds]
+
+    return get_separation_columns(folds, np.stack([ks_off for _, ks_off in ks], axis=1),
+                                  np.stack([ks_on for ks_on, _ in ks], axis=1))
+
+
+def sample_separation(values, offsets, fold):
+    """
+    AUC and one sided KS statistics of each sample against the other state of its group, the same as
+    compute_metric_auc and compute_metric_ks of one sample (an ON sample against fold * OFF, fold times an OFF sample
+    against ON). for one sample both only depend on the fractions of the other state's values below it and tied with
+    it, which are read from running counts after one sort of all the values by (group, value).
+
+    :param values: observed values sorted by (group, state), OFF is state 0 and ON is state 1
+    :param offsets: segment offsets, length 2 * ngroups + 1
+    :param fold: fold to multiply the OFF values by
+    :return: auc, ks_on (ON higher) and ks_off (fold * OFF higher), numpy.ndarray with a value for each of the values,
+        nan for nan values and for groups without values of the other state
+    """
+
+    values = np.asarray(values, dtype=np.float64)
+    ngroups = (len(offsets) - 1) // 2
+    segments = get_segment_ids(offsets)
+    groups = segments // 2
+    is_on = segments % 2 == ON
+    scaled = np.where(is_on, values, values * fold)
+    valid = np.flatnonzero(~np.isnan(scaled))
+    counts = np.bincount(segments[valid], minlength=2 * ngroups).reshape(ngroups, 2)
+
+    # the valid values sorted by (group, value), group g starts at group_starts[g]
+    order = valid[np.lexsort((scaled[valid], groups[valid]))]
+    sorted_values = scaled[order]
+    sorted_groups = groups[order]
+    sorted_on = is_on[order]
+    group_starts = np.zeros(ngroups, dtype=np.int64)
+    np.cumsum(counts.sum(axis=1)[:-1], out=group_starts[1:])
+
+    # runs of tied values in a group, with the start and (exclusive) end of the run of each value
+    new_run = np.ones(len(order), dtype=bool)
+    new_run[1:] = (sorted_groups[1:] != sorted_groups[:-1]) | (sorted_values[1:] != sorted_values[:-1])
+    run_starts = np.flatnonzero(new_run)
+    value_run = np.cumsum(new_run) - 1
+    value_starts = run_starts[value_run]
+    value_ends = np.append(run_starts[1:], len(order))[value_run]
+
+    # values of the other state of the group before the run (below) and up to the end of the run (not above)
+    off_seen = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(~sorted_on, out=off_seen[1:])
+    on_seen = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(sorted_on, out=on_seen[1:])
+    other_seen = [np.where(sorted_on, off_seen[index], on_seen[index])
+                  for index in [group_starts[sorted_groups], value_starts, value_ends]]
+    n_other = np.where(sorted_on, counts[sorted_groups, OFF], counts[sorted_groups, ON]).astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        below = (other_seen[1] - other_seen[0]) / n_other
+        above = 1 - (other_seen[2] - other_seen[0]) / n_other
+    tied = 1 - below - above
+
+    auc = np.full(len(values), np.nan)
+    ks_on = np.full(len(values), np.nan)
+    ks_off = np.full(len(values), np.nan)
+    # an ON sample is higher than the OFF values below it, an OFF sample is lower than the ON values above it
+    auc[order] = np.where(sorted_on, below, above) + 0.5 * tied
+    ks_on[order] = np.where(sorted_on, below, above)
+    ks_off[order] = np.where(sorted_on, above, below)
+
+    return auc, ks_on, ks_off
+
+
+def sample_metric_auc(values, offsets, folds=None):
+    """
+    same as compute_metric_auc of each sample against the other state of its group, for all samples at once (see
+    sample_separation)
+
+    :param values: observed values sorted by (group, state), OFF is state 0 and ON is state 1
+    :param offsets: segment offsets, length 2 * ngroups + 1
+    :param folds: list of folds to multiply the OFF values by (default [1])
+    :return: OrderedDict of column name to numpy.ndarray of shape (len(values), len(folds))
+    """
+
+    if folds is None:
+        folds = [1]
+    auc = np.stack([sample_separation(values, offsets, fold)[0] for fold in folds], axis=1)
+
+    return get_separation_columns(folds, 1 - auc, auc)
+
+
+def sample_metric_ks(values, offsets, folds=None):
+    """
+    same as compute_metric_ks of each sample against the other state of its group, for all samples at once (see
+    sample_separation)
+
+    :param values: observed values sorted by (group, state), OFF is state 0 and ON is state 1
+    :param offsets: segment offsets, length 2 * ngroups + 1
+    :param folds: list of folds to multiply the OFF values by (default [1])
+    :return: OrderedDict of column name to numpy.ndarray of shape (len(values), len(folds))
+    """
+
+    if folds is None:
+        folds = [1]
+    ks = [sample_separation(values, offsets, fold)[1:] for fold in folds]
+
+    return get_separation_columns(folds, np.stack([ks_off for _, ks_off in ks], axis=1),
+                                  np.stack([ks_on for ks_on, _ in ks], axis=1))
+
+
 # Dictionary associated with each metric, users can append to the dictionary to add more metrics
+# 'grouped_function' is optional, it computes the metric for all groups at once from the offset indexed values
+# 'sample_function' is optional, it computes the metric of every sample against the other state of its group at once,
+# for metrics where a single value is not its own statistic (the per sample tables otherwise use 'grouped_function')
+# 'opt_in': True metrics are only run when they are in the "metrics" of the config (see config_parsing.get_metrics)
 metrics_info = [
         {'metric': 'perc',
          'function': compute_metric_percent,
+         'grouped_function': grouped_metric_percent,
          'file_name': 'metrics_per_',
          'comments': "# percentiles difference \n"
                      "# OFF, use q to get right hand side of dist; "
@@ -107,10 +519,34 @@ metrics_info = [
 
         {'metric': 'sd',
          'function': compute_metric_sd,
+         'grouped_function': grouped_metric_sd,
          'file_name': 'metrics_sd_',
          'comments': "# mean +/- SD intervals \n"
                      "# off_minus_on = (mean_off + std_off) - (mean_on - std_on)"
                      "on_minus_off = (mean_on + std_on) - (mean_off - std_off)\n"
                      "# grouped by:'",
-         "plot_metric": ('num_std', 0)}
+         "plot_metric": ('num_std', 0)},
+
+        {'metric': 'auc',
+         'function': compute_metric_auc,
+         'grouped_function': grouped_metric_auc,
+         'sample_function': sample_metric_auc,
+         'opt_in': True,
+         'file_name': 'metrics_auc_',
+         'comments': "# area under the ROC curve of ON vs. fold * OFF \n"
+                     "# on_agg = P(ON > fold * OFF) (ties count half), off_agg = 1 - on_agg\n"
+                     "# grouped by:'",
+         "plot_metric": ('fold', 1)},
+
+        {'metric': 'ks',
+         'function': compute_metric_ks,
+         'grouped_function': grouped_metric_ks,
+         'sample_function': sample_metric_ks,
+         'opt_in': True,
+         'file_name': 'metrics_ks_',
+         'comments': "# one sided Kolmogorov-Smirnov statistics of ON vs. fold * OFF \n"
+                     "# on_agg = max(ECDF_OFF - ECDF_ON) (ON higher), off_agg = max(ECDF_ON - ECDF_OFF), "
+                     "KS = max(on_agg, off_agg)\n"
+                     "# grouped by:'",
+         "plot_metric": ('fold', 1)}
     ]
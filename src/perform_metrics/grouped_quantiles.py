@@ -0,0 +1,280 @@
+"""
+nan aware quantiles for many groups at once, over offset indexed arrays (see group_arrays.py).
+
+the results match np.nanpercentile (linear interpolation) for each segment. a numba kernel is used when numba is
+installed, otherwise a vectorized numpy kernel (one sort of all the values) is used. set the environment variable
+PERFORM_METRICS_KERNEL=numpy (or the config entry "quantile_kernel") to always use the numpy kernel.
+
+sliding_window_percentile computes the quantiles of overlapping windows of one sorted run of values (see windows.py)
+by keeping the current window sorted: the values leaving the window are deleted and the values entering it are
+inserted, so each value is moved in and out once instead of every window being sorted again.
+
+:license: see LICENSE for more details
+"""
+
+import os
+from bisect import bisect_left, insort
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+KERNELS = ['numpy', 'numba'] if numba is not None else ['numpy']
+DEFAULT_KERNEL = os.environ.get('PERFORM_METRICS_KERNEL', KERNELS[-1])
+assert DEFAULT_KERNEL in KERNELS, 'PERFORM_METRICS_KERNEL must be one of {}, not {}'.format(KERNELS, DEFAULT_KERNEL)
+
+
+def set_default_kernel(kernel):
+    """
+    set the kernel used when grouped_nanpercentile is not given one
+
+    :param kernel: 'numpy' or 'numba'
+    """
+
+    global DEFAULT_KERNEL
+    assert kernel in KERNELS, 'kernel must be one of {}, not {}'.format(KERNELS, kernel)
+    DEFAULT_KERNEL = kernel
+
+
+def _lerp(a, b, t):
+    """
+    linear interpolation between a and b, written the same way as numpy so the results are identical
+
+    :param a: lower values
+    :param b: upper values
+    :param t: fraction of the way from a to b
+    :return: interpolated values
+    """
+
+    diff_b_a = b - a
+    return np.where(t >= 0.5, b - diff_b_a * (1 - t), a + diff_b_a * t)
+
+
+def _grouped_nanpercentile_numpy(values, offsets, quantiles):
+    """
+    numpy kernel: sort all values once by (segment, isnan, value), then interpolate every segment and quantile
+    with fancy indexing.
+
+    :param values: float64 values, segments are contiguous
+    :param offsets: int64 segment offsets (length nsegments + 1)
+    :param quantiles: float64 quantiles in [0, 1]
+    :return: numpy.ndarray of shape (nsegments, nquantiles)
+    """
+
+    nsegments = len(offsets) - 1
+    seg_lengths = np.diff(offsets)
+    out = np.full((nsegments, len(quantiles)), np.nan)
+    if len(values) == 0:
+        return out
+
+    segments = np.repeat(np.arange(nsegments), seg_lengths)
+    is_nan = np.isnan(values)
+    sorted_values = values[np.lexsort((values, is_nan, segments))]
+    n_valid = np.bincount(segments[~is_nan], minlength=nsegments)
+
+    has_values = n_valid > 0
+    n_valid = n_valid[has_values, np.newaxis]
+    starts = offsets[:-1][has_values, np.newaxis]
+
+    virtual_index = (n_valid - 1) * quantiles[np.newaxis, :]
+    lo = np.floor(virtual_index)
+    hi = np.minimum(lo + 1, n_valid - 1)
+    t = virtual_index - lo
+
+    a = sorted_values[starts + lo.astype(np.int64)]
+    b = sorted_values[starts + hi.astype(np.int64)]
+    out[has_values] = _lerp(a, b, t)
+
+    return out
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _grouped_nanpercentile_numba(values, offsets, quantiles):
+        """
+        numba kernel: sort each segment separately and interpolate. it is single threaded, so it is safe to use
+        in forked worker processes.
+
+        :param values: float64 values, segments are contiguous
+        :param offsets: int64 segment offsets (length nsegments + 1)
+        :param quantiles: float64 quantiles in [0, 1]
+        :return: numpy.ndarray of shape (nsegments, nquantiles)
+        """
+
+        nsegments = len(offsets) - 1
+        out = np.empty((nsegments, len(quantiles)))
+        for i in range(nsegments):
+            seg = values[offsets[i]:offsets[i + 1]]
+            seg = np.sort(seg[~np.isnan(seg)])
+            n = len(seg)
+            for j in range(len(quantiles)):
+                if n == 0:
+                    out[i, j] = np.nan
+                    continue
+                virtual_index = (n - 1) * quantiles[j]
+                lo = np.floor(virtual_index)
+                hi = min(lo + 1, n - 1)
+                t = virtual_index - lo
+                a = seg[int(lo)]
+                b = seg[int(hi)]
+                diff_b_a = b - a
+                if t >= 0.5:
+                    out[i, j] = b - diff_b_a * (1 - t)
+                else:
+                    out[i, j] = a + diff_b_a * t
+        return out
+else:
+    _grouped_nanpercentile_numba = None
+
+
+def grouped_nanpercentile(values, offsets, percents, kernel=None):
+    """
+    compute the percentiles of every segment of an offset indexed array, ignoring nan.
+    segments with no (non nan) values get nan.
+
+    :param values: 1d array of values, segment i is values[offsets[i]:offsets[i + 1]]
+    :param offsets: 1d array of segment offsets (length nsegments + 1)
+    :param percents: list of percents (0 - 100)
+    :param kernel: 'numpy' or 'numba' (default: see set_default_kernel)
+    :return: numpy.ndarray of shape (nsegments, len(percents))
+    """
+
+    if kernel is None:
+        kernel = DEFAULT_KERNEL
+    assert kernel in KERNELS, 'kernel must be one of {}, not {}'.format(KERNELS, kernel)
+
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    offsets = np.ascontiguousarray(offsets, dtype=np.int64)
+    quantiles = np.asarray(percents, dtype=np.float64) / 100
+
+    if kernel == 'numba':
+        return _grouped_nanpercentile_numba(values, offsets, quantiles)
+    return _grouped_nanpercentile_numpy(values, offsets, quantiles)
+
+
+def _sliding_window_percentile_python(values, starts, ends, quantiles):
+    """
+    python kernel: the window is a sorted list updated with bisect
+
+    :param values: float64 values without nan
+    :param starts: int64 first value of each window
+    :param ends: int64 end (exclusive) of each window
+    :param quantiles: float64 quantiles in [0, 1]
+    :return: numpy.ndarray of shape (nwindows, nquantiles)
+    """
+
+    out = np.full((len(starts), len(quantiles)), np.nan)
+    window = list()
+    window_start = window_end = 0
+    for i, (start, end) in enumerate(zip(starts.tolist(), ends.tolist())):
+        if window_start <= start <= window_end <= end:
+            for value in values[window_start:start].tolist():
+                del window[bisect_left(window, value)]
+            for value in values[window_end:end].tolist():
+                insort(window, value)
+        else:
+            window = sorted(values[start:end].tolist())
+        window_start, window_end = start, end
+
+        n = len(window)
+        if n == 0:
+            continue
+        virtual_index = (n - 1) * quantiles
+        lo = np.floor(virtual_index)
+        hi = np.minimum(lo + 1, n - 1)
+        sorted_window = np.array(window)
+        out[i] = _lerp(sorted_window[lo.astype(np.int64)], sorted_window[hi.astype(np.int64)], virtual_index - lo)
+
+    return out
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _sliding_window_percentile_numba(values, starts, ends, quantiles):
+        """
+        numba kernel: the window is kept sorted in a buffer, values are deleted and inserted by shifting the buffer
+
+        :param values: float64 values without nan
+        :param starts: int64 first value of each window
+        :param ends: int64 end (exclusive) of each window
+        :param quantiles: float64 quantiles in [0, 1]
+        :return: numpy.ndarray of shape (nwindows, nquantiles)
+        """
+
+        nwindows = len(starts)
+        out = np.empty((nwindows, len(quantiles)))
+        max_size = 0
+        for i in range(nwindows):
+            max_size = max(max_size, ends[i] - starts[i])
+        window = np.empty(max_size)
+        n = 0
+        window_start = 0
+        window_end = 0
+        for i in range(nwindows):
+            start = starts[i]
+            end = ends[i]
+            if window_start <= start and start <= window_end and window_end <= end:
+                for k in range(window_start, start):
+                    j = np.searchsorted(window[:n], values[k])
+                    window[j:n - 1] = window[j + 1:n].copy()
+                    n -= 1
+                for k in range(window_end, end):
+                    j = np.searchsorted(window[:n], values[k], side='right')
+                    window[j + 1:n + 1] = window[j:n].copy()
+                    window[j] = values[k]
+                    n += 1
+            else:
+                n = end - start
+                window[:n] = np.sort(values[start:end])
+            window_start = start
+            window_end = end
+
+            for j in range(len(quantiles)):
+                if n == 0:
+                    out[i, j] = np.nan
+                    continue
+                virtual_index = (n - 1) * quantiles[j]
+                lo = np.floor(virtual_index)
+                hi = min(lo + 1, n - 1)
+                t = virtual_index - lo
+                a = window[int(lo)]
+                b = window[int(hi)]
+                diff_b_a = b - a
+                if t >= 0.5:
+                    out[i, j] = b - diff_b_a * (1 - t)
+                else:
+                    out[i, j] = a + diff_b_a * t
+        return out
+else:
+    _sliding_window_percentile_numba = None
+
+
+def sliding_window_percentile(values, starts, ends, percents, kernel=None):
+    """
+    compute the percentiles of windows of a run of values, window i is values[starts[i]:ends[i]]. the windows are
+    updated incrementally when a window overlaps the previous one and does not start before it (e.g. windows sliding
+    along sorted time points), otherwise the window is sorted from scratch. empty windows get nan.
+
+    :param values: 1d array of values without nan
+    :param starts: 1d array of the first value of each window
+    :param ends: 1d array of the end (exclusive) of each window
+    :param percents: list of percents (0 - 100)
+    :param kernel: 'numpy' (python with bisect) or 'numba' (default: see set_default_kernel)
+    :return: numpy.ndarray of shape (nwindows, len(percents))
+    """
+
+    if kernel is None:
+        kernel = DEFAULT_KERNEL
+    assert kernel in KERNELS, 'kernel must be one of {}, not {}'.format(KERNELS, kernel)
+
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    starts = np.ascontiguousarray(starts, dtype=np.int64)
+    ends = np.ascontiguousarray(ends, dtype=np.int64)
+    quantiles = np.asarray(percents, dtype=np.float64) / 100
+
+    if kernel == 'numba':
+        return _sliding_window_percentile_numba(values, starts, ends, quantiles)
+    return _sliding_window_percentile_python(values, starts, ends, quantiles)
@@ -0,0 +1,199 @@
+"""
+analysis of input data split over many files (see data_loading.find_partition_files) one partition at a time.
+
+if a partition column is the first column of every grouping, the groups of different partitions never mix, so each
+partition can be analyzed on its own (in parallel processes) and the results joined in partition order. this gives the
+same tables as reading all the data, but only one partition per process is in memory at a time: the per sample tables
+are written as each partition is analyzed, and only the small per group results are kept until the end.
+
+:license: see LICENSE for more details
+"""
+
+import multiprocessing
+import os
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from perform_metrics.compact import make_compact_data
+from perform_metrics.aggregate_metrics import compute_all_metrics, concat_results, make_box_data_dict, \
+    concat_box_data
+from perform_metrics.data_loading import read_partition_files, get_csv_parser
+from perform_metrics.group_arrays import make_group_arrays_dict
+from perform_metrics.diagnostics import get_diagnostics_config, concat_group_costs
+from perform_metrics.pipeline import prefetch
+from perform_metrics.sample_metrics import make_sample_chunks_dict, get_per_sample_files
+from perform_metrics.table_writer import write_tables
+
+
+def get_partition_col(files, config_json):
+    """
+    find a partition column that is the first column of every grouping (and of the transition and window series), so the
+    partitions can be analyzed independently. event level data and runs with several observed outputs or contrasts
+    (see variants.py) are never split.
+
+    :param files: list of (file path, partition) from find_partition_files
+    :param config_json: configuration file
+    :return: column name, or None if there is no such column
+    """
+
+    if 'events' in config_json.keys() or 'contrasts' in config_json.keys() or \
+            isinstance(config_json.get('observed_output'), list):
+        return None
+    first_cols = [group_cols[0] for group_cols in config_json['group_cols_dict'].values()]
+    if 'transitions' in config_json.keys():
+        first_cols.append(config_json['transitions']['series_cols'][0])
+    if 'windows' in config_json.keys():
+        first_cols.append(config_json['windows']['series_cols'][0])
+
+    for col in files[0][1].keys():
+        if all(col in partition for _, partition in files) and all(first_col == col for first_col in first_cols):
+            return col
+
+    return None
+
+
+def group_files_by_partition(files, partition_col):
+    """
+    group the files by the value of the partition column, in sorted order (the same order as the groups)
+
+    :param files: list of (file path, partition) from find_partition_files
+    :param partition_col: partition column
+    :return: list of lists of (file path, partition)
+    """
+
+    partitions = OrderedDict()
+    for file in files:
+        partitions.setdefault(file[1][partition_col], list()).append(file)
+
+    return [partitions[val] for val in sorted(partitions.keys())]
+
+
+def read_partition(files, config_json, merge_files=None):
+    """
+    read one partition, merge it with the metadata, subset it and make it compact (if the config has "compact")
+
+    :param files: list of (file path, partition) in the partition
+    :param config_json: configuration file
+    :param merge_files: optional metadata file to merge with
+    :return: pandas.DataFrame
+    """
+
+    data_df = read_partition_files(files, csv_parser=get_csv_parser(config_json))
+    if merge_files is not None:
+        metadata_df = pd.read_csv(merge_files, dtype=object)
+        data_df = pd.merge(data_df, metadata_df, on=config_json['sample_id'])
+    if "subset_by" in config_json.keys():
+        for col, val in config_json["subset_by"].items():
+            data_df = data_df[data_df[col] == val]
+
+    return make_compact_data(data_df, config_json)
+
+
+def analyze_partition_df(data_df, config_json):
+    """
+    compute the per sample and aggregate metrics of one partition. the per sample chunks are computed as they are
+    taken, and the values of the groups are not kept (only the box data of the on vs. off figure is)
+
+    :param data_df: pandas.DataFrame of the partition
+    :param config_json: configuration file (with the intended output already parsed)
+    :return: dictionary with 'nrows', 'sample_chunks' (dictionary of per sample table name to generator of
+        pandas.DataFrame), 'results' (see aggregate_metrics.compute_all_metrics), 'group_costs' (dictionary of
+        diagnostics.GroupCosts of each grouping, empty without diagnostics) and 'box_data' (see
+        aggregate_metrics.make_box_data_dict)
+    """
+
+    group_arrays_dict = make_group_arrays_dict(data_df, config_json)
+    group_costs = OrderedDict()
+    results = compute_all_metrics(data_df, config_json, group_arrays_dict, group_costs)
+
+    return {'nrows': len(data_df), 'sample_chunks': make_sample_chunks_dict(data_df, config_json, group_arrays_dict),
+            'results': results, 'group_costs': group_costs,
+            'box_data': make_box_data_dict(group_arrays_dict, config_json)}
+
+
+def analyze_partition(files, config_json, merge_files=None):
+    """
+    read one partition and compute its per sample and aggregate metrics (run in the worker processes, the per sample
+    chunks are made here and sent back as lists)
+
+    :param files: list of (file path, partition) in the partition
+    :param config_json: configuration file (with the intended output already parsed)
+    :param merge_files: optional metadata file to merge with
+    :return: see analyze_partition_df
+    """
+
+    part = analyze_partition_df(read_partition(files, config_json, merge_files), config_json)
+    part['sample_chunks'] = {table_key: list(chunks) for table_key, chunks in part['sample_chunks'].items()}
+
+    return part
+
+
+def iter_partitions(partitions, config_json, merge_files=None, n_jobs=1):
+    """
+    analyze each partition independently, in partition order. at most n_jobs + 1 partitions are analyzed or waiting
+    to be taken at any time, so the memory does not grow with the number of partitions
+
+    :param partitions: list of lists of (file path, partition), from group_files_by_partition
+    :param config_json: configuration file (with the intended output already parsed)
+    :param merge_files: optional metadata file to merge with
+    :param n_jobs: number of processes (spawned, see bootstrap.py), with one process the next partition is read on a
+        background thread while the current one is analyzed
+    :return: generator of the result of each partition (see analyze_partition_df)
+    """
+
+    args = [(files, config_json, merge_files) for files in partitions]
+    if n_jobs > 1 and len(partitions) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+            pending = deque()
+            for arg in args:
+                pending.append(executor.submit(analyze_partition, *arg))
+                if len(pending) > n_jobs:
+                    yield pending.popleft().result()
+            while len(pending) > 0:
+                yield pending.popleft().result()
+    else:
+        for data_df in prefetch(read_partition(*arg) for arg in args):
+            yield analyze_partition_df(data_df, config_json)
+
+
+def analyze_partitions(partitions, config_json, output_dir, merge_files=None, n_jobs=1):
+    """
+    analyze each partition independently and join the results in partition order. the per sample tables are written
+    as the partitions are analyzed (the chunks of a partition are written before the next partition is taken), only
+    the aggregate results, box data and costs of each grouping are kept for all the partitions
+
+    :param partitions: list of lists of (file path, partition), from group_files_by_partition
+    :param config_json: configuration file (with the intended output already parsed)
+    :param output_dir: directory to save the per sample tables to
+    :param merge_files: optional metadata file to merge with
+    :param n_jobs: number of processes, see iter_partitions
+    :return: sample_files (list of per sample file names), box_data_dict (see aggregate_metrics.make_box_data_dict),
+        full_results_df_dict, group_costs_dict (dictionary of diagnostics.GroupCosts of each grouping, empty without
+        diagnostics)
+    """
+
+    parts = list()
+
+    def iter_sample_chunks():
+        for part in iter_partitions(partitions, config_json, merge_files, n_jobs):
+            parts.append({key: part[key] for key in ['nrows', 'results', 'group_costs', 'box_data']})
+            yield part.pop('sample_chunks')
+
+    sample_files = get_per_sample_files(config_json)
+    write_tables(iter_sample_chunks(),
+                 OrderedDict((table_key, (comment, os.path.join(output_dir, file_name)))
+                             for table_key, (file_name, comment) in sample_files.items()),
+                 config_json.get('output_compression'))
+
+    box_data_dict = OrderedDict((key, concat_box_data([part['box_data'][key] for part in parts]))
+                                for key in parts[0]['box_data'].keys())
+    full_results_df_dict = concat_results([part['results'] for part in parts])
+    diagnostics_config = get_diagnostics_config(config_json)
+    group_costs_dict = OrderedDict((key, concat_group_costs([part['group_costs'][key] for part in parts],
+                                                            diagnostics_config['top']))
+                                   for key in parts[0]['group_costs'].keys())
+
+    return [file_name for file_name, _ in sample_files.values()], box_data_dict, full_results_df_dict, \
+        group_costs_dict
@@ -0,0 +1,160 @@
+"""
+helpers to overlap the stages of a run: output tables are written (and hashed) on background threads while the next
+tables are computed, and the next chunk/partition of the input is read while the current one is analyzed.
+
+the queues are bounded, so at most a few tables or chunks are waiting at any time and memory does not grow.
+
+:license: see LICENSE for more details
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from perform_metrics.make_record import make_hash
+
+DEFAULT_PIPELINE = {
+    'threads': 1,
+    'max_pending': 4,
+}
+
+
+class OutputWriter(object):
+    """
+    write output files on background threads and hash each file as soon as it is written.
+    submitting blocks while max_pending files are waiting to be written. with threads=0 everything is done when it is
+    submitted (no threads).
+    """
+
+    def __init__(self, output_dir, threads=1, max_pending=4):
+        """
+        :param output_dir: output directory
+        :param threads: number of writer threads (0 to write in the calling thread)
+        :param max_pending: maximum number of files submitted but not written yet
+        """
+        self.output_dir = output_dir
+        self.executor = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        self.slots = threading.BoundedSemaphore(max(max_pending, 1))
+        self.hashes = dict()
+
+    def _write_and_hash(self, file_name, function, args):
+        """
+        call the write function, then hash the file it wrote
+        """
+        try:
+            function(*args)
+            return make_hash(os.path.join(self.output_dir, file_name))
+        finally:
+            if self.executor is not None:
+                self.slots.release()
+
+    def write(self, file_name, function, *args):
+        """
+        write a file in the background
+
+        :param file_name: name of the file (in the output directory) the function writes
+        :param function: function that writes the file
+        :param args: arguments of the function
+        """
+        if self.executor is None:
+            self.hashes[file_name] = self._write_and_hash(file_name, function, args)
+            return
+
+        self.slots.acquire()
+        self.hashes[file_name] = self.executor.submit(self._write_and_hash, file_name, function, args)
+
+    def add_file(self, file_name):
+        """
+        hash a file already written in the calling thread (e.g. tables written while the data is read, see
+        table_writer.write_tables)
+
+        :param file_name: name of the file (in the output directory)
+        """
+        self.write(file_name, lambda: None)
+
+    def get_file_records(self, file_names):
+        """
+        wait for the files to be written (errors in the writer threads are raised here)
+
+        :param file_names: list of file names
+        :return: list of file records [{"name": str, "hash_md5": str}, ...] (see make_record.make_hashes_for_files)
+        """
+        files = list()
+        for file_name in file_names:
+            hash_num = self.hashes[file_name]
+            if self.executor is not None:
+                hash_num = hash_num.result()
+            files.append({'name': file_name, 'hash_md5': hash_num})
+
+        return files
+
+    def close(self):
+        """
+        wait for all the files and stop the threads
+        """
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+
+def make_output_writer(output_dir, config_json):
+    """
+    output writer with the "pipeline" settings of the config
+
+    :param output_dir: output directory
+    :param config_json: configuration file
+    :return: OutputWriter
+    """
+
+    pipeline_config = dict(DEFAULT_PIPELINE)
+    pipeline_config.update(config_json.get('pipeline', dict()))
+
+    return OutputWriter(output_dir, pipeline_config['threads'], pipeline_config['max_pending'])
+
+
+def prefetch(iterable, max_ahead=1):
+    """
+    get the items of an iterable on a background thread, at most max_ahead items ahead of the consumer, e.g. to read
+    the next chunk of a file while the current one is analyzed
+
+    :param iterable: iterable (e.g. a generator of chunks)
+    :param max_ahead: number of items that can be waiting
+    :return: generator of the items, in order
+    """
+
+    items = queue.Queue(maxsize=max_ahead)
+    done = object()
+    stop = threading.Event()
+
+    def put(item, error=None):
+        # give up if the consumer has stopped, so the thread does not wait forever on a full queue
+        while not stop.is_set():
+            try:
+                items.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except BaseException as error:
+            put(done, error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        # the consumer stopped early (or failed), let the producer finish
+        stop.set()
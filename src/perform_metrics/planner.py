@@ -0,0 +1,354 @@
+"""
+dry run planner: estimate the size and cost of a run before running it (run_analysis.py --plan).
+
+only the columns the config needs (group columns, intended output, sample id, subset and merge columns) are read, or
+only the first rows of a csv file, and for each grouping the number of groups, the group sizes and the number of
+output rows are reported. the time and memory of each stage are estimated from these counts with coefficients
+calibrated on this kind of data (python benchmark.py calibrate, see DEFAULT_COEFFICIENTS).
+
+bootstrap, transitions, windows, event pooling and the values of any extra observed outputs or contrasts (see
+variants.py) are not estimated.
+
+:license: see LICENSE for more details
+"""
+
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.config_parsing import resolve_intended_output, resolve_contrasts, get_observed_outputs, \
+    get_metrics
+from perform_metrics.data_loading import read_data, is_partitioned, find_partition_files, get_usecols
+from perform_metrics.columnar_cache import is_column_cache, load_cache
+from perform_metrics.group_metrics import metrics_info
+from perform_metrics.pipeline import DEFAULT_PIPELINE
+from perform_metrics.ranking import get_ranking_config
+from perform_metrics.sample_metrics import DEFAULT_PER_SAMPLE_METRICS
+from perform_metrics.table_writer import DEFAULT_BLOCK_SIZE
+
+# seconds and bytes per unit of work, from python benchmark.py calibrate --nrows 200000 on one core of a linux
+# workstation. calibrate on the machine that runs the analysis and pass the file with --plan_coefficients
+DEFAULT_COEFFICIENTS = {
+    'read_seconds_per_cell': 1.6e-7,
+    'group_seconds_per_row': 1.7e-6,
+    'aggregate_seconds_per_value': 5.7e-7,
+    'aggregate_seconds_per_group': 5.7e-7,
+    'per_sample_seconds_per_row': 1.4e-5,
+    'write_seconds_per_cell': 9.4e-7,
+    'plot_seconds_per_figure': 0.22,
+    'plot_seconds_per_group': 0.021,
+    'table_bytes_per_cell': 31,
+}
+PLAN_FILE_NAME = 'plan.json'
+
+
+def get_plan_columns(config_json):
+    """
+    the columns of the data the config needs, except the observed output
+
+    :param config_json: configuration file
+    :return: list of column names
+    """
+
+    columns = [config_json['intended_output']['col'], config_json['sample_id']]
+    for group_cols in config_json['group_cols_dict'].values():
+        columns.extend(group_cols)
+    columns.extend(config_json.get('subset_by', dict()).keys())
+
+    return list(OrderedDict.fromkeys(columns))
+
+
+def count_data_rows(data_path):
+    """
+    number of data rows of a csv file (without parsing it, lines are counted for uncompressed files)
+
+    :param data_path: path to a csv file
+    :return: int
+    """
+
+    if not data_path.endswith('.csv'):
+        return sum(len(chunk) for chunk in pd.read_csv(data_path, dtype=object, usecols=[0], chunksize=1000000))
+
+    nlines = 0
+    last = b'\n'
+    with open(data_path, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(1 << 20), b''):
+            nlines += block.count(b'\n')
+            last = block[-1:]
+    if last != b'\n':
+        nlines += 1
+
+    return nlines - 1
+
+
+def read_plan_data(data_path, config_json, merge_files=None, nrows=None):
+    """
+    read the columns of the data the config needs, merged with the metadata and subset
+
+    :param data_path: path to the data
+    :param config_json: configuration file
+    :param merge_files: optional metadata file to merge with
+    :param nrows: optional number of rows to read from the start of a csv file
+    :return: data_df, dictionary with 'nrows' (all rows of the data), 'nrows_read', 'nrows_used' (after the merge and
+        subset), 'ncols' (all columns), 'read_mb' (memory of the columns read, scaled to all the columns and rows) and
+        'merge_mb' (memory of the data merged with the metadata, None without merge_files)
+    """
+
+    columns = get_plan_columns(config_json)
+    data_df = read_data(data_path, columns=columns, nrows=nrows)
+    nrows_read = len(data_df)
+
+    # the first rows are only read from a csv file
+    total_rows = nrows_read
+    if is_column_cache(data_path):
+        ncols = len(load_cache(data_path).columns)
+    elif is_partitioned(data_path):
+        path, partition = find_partition_files(data_path)[0]
+        ncols = len(pd.read_csv(path, dtype=object, nrows=0).columns) + len(partition)
+    else:
+        ncols = len(pd.read_csv(data_path, dtype=object, nrows=0).columns)
+        if nrows is not None:
+            total_rows = count_data_rows(data_path)
+
+    read_mb = data_df.memory_usage(deep=True, index=False).sum() / 1e6
+    read_mb *= float(ncols) / max(len(data_df.columns), 1) * total_rows / max(nrows_read, 1)
+
+    # the merged data has the metadata columns too
+    merge_mb = None
+    if merge_files is not None:
+        meta_ncols = len(pd.read_csv(merge_files, dtype=object, nrows=0).columns) - 1
+        merge_mb = read_mb * float(ncols + meta_ncols) / ncols
+        metadata_df = pd.read_csv(merge_files, dtype=object, usecols=get_usecols(columns))
+        data_df = pd.merge(data_df, metadata_df, on=config_json['sample_id'])
+    if "subset_by" in config_json.keys():
+        for col, val in config_json["subset_by"].items():
+            data_df = data_df[data_df[col] == val]
+
+    data_info = OrderedDict([('nrows', total_rows), ('nrows_read', nrows_read), ('nrows_used', len(data_df)),
+                             ('ncols', ncols), ('read_mb', read_mb), ('merge_mb', merge_mb)])
+
+    return data_df, data_info
+
+
+def plan_grouping(data_df, key, group_cols, intended_output, scale, nparams, per_sample_nparams=1):
+    """
+    group counts and sizes of one grouping
+
+    :param data_df: data (columns from get_plan_columns)
+    :param key: grouping name
+    :param group_cols: list of group columns
+    :param intended_output: intended output entry of the config (min/max already resolved)
+    :param scale: number of rows of the data per row read (> 1 if only the first rows were read)
+    :param nparams: number of rows per group of the aggregate tables (all metrics)
+    :param per_sample_nparams: number of rows per sample of the per sample tables (all metrics)
+    :return: OrderedDict
+    """
+
+    is_on_off = data_df[intended_output['col']].isin([intended_output['on'], intended_output['off']])
+    on_off_df = data_df[is_on_off]
+    sizes = on_off_df.groupby(group_cols, observed=True).size().to_numpy()
+    nstates = on_off_df.groupby(group_cols, observed=True)[intended_output['col']].nunique().to_numpy()
+    ngroups = data_df.groupby(group_cols, observed=True).ngroups
+
+    plan = OrderedDict()
+    plan['grouping'] = key
+    plan['group_cols'] = ', '.join(group_cols)
+    plan['ngroups'] = ngroups
+    plan['ngroups_on_off'] = int(np.count_nonzero(nstates == 2))
+    plan['nvalues'] = int(round(len(on_off_df) * scale))
+    plan['size_min'] = int(sizes.min()) if len(sizes) > 0 else 0
+    plan['size_median'] = float(np.median(sizes)) if len(sizes) > 0 else 0
+    plan['size_p90'] = float(np.percentile(sizes, 90)) if len(sizes) > 0 else 0
+    plan['size_max'] = int(sizes.max()) if len(sizes) > 0 else 0
+    plan['aggregate_rows'] = ngroups * nparams
+    plan['per_sample_rows'] = plan['nvalues'] * per_sample_nparams
+
+    return plan
+
+
+def get_nparams(config_json):
+    """
+    number of rows per group in the aggregate table of each metric
+
+    :param config_json: configuration file
+    :return: dictionary of metric name to number of rows
+    """
+
+    metric_params = config_json.get('metric_params', dict())
+    nparams = dict()
+    for metric_dict in get_metrics(config_json, metrics_info):
+        params = metric_params.get(metric_dict['metric'], dict())
+        defaults = [len(val) for val in params.values()]
+        if len(defaults) == 0:
+            # number of rows the metric function makes with its default parameters
+            defaults = [len(metric_dict['function'](np.ones(2), np.ones(2)))]
+        nparams[metric_dict['metric']] = max(defaults)
+
+    return nparams
+
+
+def get_per_sample_nparams(config_json):
+    """
+    number of rows per sample in the per sample tables of all the metrics
+
+    :param config_json: configuration file
+    :return: int
+    """
+
+    functions = {metric_dict['metric']: metric_dict['function'] for metric_dict in metrics_info}
+    per_sample_metrics = config_json.get('per_sample_metrics', DEFAULT_PER_SAMPLE_METRICS)
+
+    return sum(len(functions[metric](np.ones(1), np.ones(2), **params)) for metric, params in per_sample_metrics.items())
+
+
+def estimate_stages(data_info, grouping_plans, config_json, coefficients):
+    """
+    time and memory of each stage of the run
+
+    :param data_info: from read_plan_data, optionally with 'read_working_mb' (memory only used while reading, e.g. a
+        chunk), 'resident_mb' (memory the data holds after it is read, e.g. if it is memory-mapped), 'value_bytes'
+        (bytes the group arrays hold per value, 16 for the values and row index, 0 if they are memory-mapped) and
+        'ncontrasts'
+    :param grouping_plans: list of plan_grouping results
+    :param config_json: configuration file
+    :param coefficients: dictionary of coefficients (see DEFAULT_COEFFICIENTS)
+    :return: list of OrderedDict with 'stage', 'seconds', 'memory_mb' (memory held after the stage) and 'peak_mb'
+    """
+
+    pipeline_config = dict(DEFAULT_PIPELINE)
+    pipeline_config.update(config_json.get('pipeline', dict()))
+    block_size = config_json.get('output_block_size', DEFAULT_BLOCK_SIZE)
+    ranking_config = get_ranking_config(config_json)
+    # every metric, table and plot is made for each observed output and contrast (see variants.py)
+    nchannels = len(get_observed_outputs(config_json)) * data_info.get('ncontrasts', 1)
+    nmetrics = len(get_metrics(config_json, metrics_info))
+    nrows = data_info['nrows']
+    nvalues = sum(plan['nvalues'] for plan in grouping_plans)
+    per_sample_rows = sum(plan['per_sample_rows'] for plan in grouping_plans)
+    ngroups = sum(plan['ngroups'] for plan in grouping_plans)
+    cell_bytes = coefficients['table_bytes_per_cell']
+
+    # cells of a table row: group columns, group_name, counts, parameter and 4 metric columns
+    def row_cells(plan):
+        return len(plan['group_cols'].split(', ')) + 8
+
+    def row_bytes(plan):
+        return cell_bytes * row_cells(plan)
+
+    stages = list()
+    held = 0.0
+
+    def add_stage(stage, seconds, memory_mb, working_mb=0.0):
+        stages.append(OrderedDict([('stage', stage), ('seconds', seconds), ('memory_mb', held + memory_mb),
+                                   ('peak_mb', held + memory_mb + working_mb)]))
+        return memory_mb
+
+    held += add_stage('read', coefficients['read_seconds_per_cell'] * nrows * data_info['ncols'],
+                      data_info['read_mb'], data_info.get('read_working_mb', 0.0))
+    if data_info['merge_mb'] is not None:
+        # the merged data replaces the data read
+        add_stage('merge', 0.0, data_info['merge_mb'])
+        held = data_info['merge_mb']
+    held = data_info.get('resident_mb', held)
+
+    # values, row index and offsets, plus the group keys
+    value_bytes = data_info.get('value_bytes', 16.0)
+    arrays_mb = sum(value_bytes * plan['nvalues'] + 16.0 * plan['ngroups'] + row_bytes(plan) * plan['ngroups']
+                    for plan in grouping_plans) / 1e6
+    held += add_stage('group_arrays', coefficients['group_seconds_per_row'] * nrows * len(grouping_plans),
+                      arrays_mb, 8.0 * nrows * 3 / 1e6)
+
+    # blocks of per sample rows waiting to be written
+    pending = pipeline_config['max_pending'] + pipeline_config['threads'] + 1
+    block_mb = max(row_bytes(plan) * min(block_size, plan['per_sample_rows']) for plan in grouping_plans) / 1e6
+    add_stage('per_sample', coefficients['per_sample_seconds_per_row'] * per_sample_rows * nchannels, 0.0,
+              block_mb * pending)
+
+    tables_mb = nchannels * sum(row_bytes(plan) * plan['aggregate_rows'] for plan in grouping_plans) / 1e6
+    table_cells = nchannels * sum(row_cells(plan) * plan['aggregate_rows'] for plan in grouping_plans)
+    held += add_stage('aggregate', (coefficients['aggregate_seconds_per_value'] * nvalues +
+                                    coefficients['aggregate_seconds_per_group'] * ngroups) * nmetrics * nchannels +
+                      coefficients['write_seconds_per_cell'] * table_cells, tables_mb)
+
+    plot_groups = 0
+    for plan in grouping_plans:
+        if ranking_config is not None and ranking_config['limit_plots']:
+            plot_groups += min(plan['ngroups_on_off'], 2 * ranking_config['k'])
+        else:
+            plot_groups += plan['ngroups_on_off']
+    nfigures = len(grouping_plans) * (1 + nmetrics) * nchannels
+    add_stage('plots', coefficients['plot_seconds_per_figure'] * nfigures +
+              coefficients['plot_seconds_per_group'] * plot_groups * nchannels, 0.0, 16.0 * nvalues / 1e6)
+
+    return stages
+
+
+def plan_run(config_json, data_path, merge_files=None, nrows=None, coefficients=None):
+    """
+    estimate the size and cost of a run without computing any metrics
+
+    :param config_json: configuration (not changed)
+    :param data_path: path to the data (see data_loading.read_data)
+    :param merge_files: optional metadata file to merge with
+    :param nrows: optional number of rows to read from the start of a csv file, the counts are scaled to all the rows
+        (group counts are then only the groups seen in those rows)
+    :param coefficients: optional dictionary of coefficients (see DEFAULT_COEFFICIENTS)
+    :return: OrderedDict with 'data', 'groupings', 'stages', 'seconds' and 'peak_mb'
+    """
+
+    plan_coefficients = dict(DEFAULT_COEFFICIENTS)
+    plan_coefficients.update(coefficients or dict())
+
+    data_df, data_info = read_plan_data(data_path, config_json, merge_files, nrows)
+    intended_output = resolve_intended_output(config_json['intended_output'], data_df)
+    if 'contrasts' in config_json.keys():
+        data_info['ncontrasts'] = len(resolve_contrasts(config_json['contrasts'], intended_output['col'], data_df))
+    scale = float(data_info['nrows']) / max(data_info['nrows_read'], 1)
+    nparams = sum(get_nparams(config_json).values())
+
+    per_sample_nparams = get_per_sample_nparams(config_json)
+
+    grouping_plans = [plan_grouping(data_df, key, group_cols, intended_output, scale, nparams, per_sample_nparams)
+                      for key, group_cols in config_json['group_cols_dict'].items()]
+    stages = estimate_stages(data_info, grouping_plans, config_json, plan_coefficients)
+
+    plan = OrderedDict()
+    plan['data'] = data_info
+    plan['groupings'] = grouping_plans
+    plan['stages'] = stages
+    plan['seconds'] = sum(stage['seconds'] for stage in stages)
+    plan['peak_mb'] = max(stage['peak_mb'] for stage in stages)
+
+    return plan
+
+
+def print_plan(plan):
+    """
+    print a plan as tables
+
+    :param plan: from plan_run
+    """
+
+    print('data: ' + ', '.join('{0:s}={1}'.format(key, val) for key, val in plan['data'].items()))
+    print(pd.DataFrame(plan['groupings']).to_string(index=False))
+    print(pd.DataFrame(plan['stages']).to_string(index=False, float_format='{0:.2f}'.format))
+    print('estimated total: {0:.1f} seconds, peak memory {1:.1f} MB'.format(plan['seconds'], plan['peak_mb']))
+
+
+def save_plan(plan, output_dir):
+    """
+    write a plan to plan.json
+
+    :param plan: from plan_run
+    :param output_dir: directory to save output to
+    :return: path of the file
+    """
+
+    out_path = os.path.join(output_dir, PLAN_FILE_NAME)
+    with open(out_path, 'w') as json_file:
+        json.dump(plan, json_file, indent=2, default=float)
+
+    return out_path
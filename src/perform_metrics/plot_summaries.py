@@ -0,0 +1,236 @@
+"""
+the plots of a run drawn from small summaries instead of the data: the box plot statistics of each group (quartiles,
+whiskers and the values beyond them) and the ratios of the fold change histograms. the summaries of every figure are
+saved to plot_summaries.npz in the output directory, so the figures can be drawn again (e.g. after changing how they
+look) without reading the data or computing the metrics:
+
+    python run_analysis.py --replot output_dir
+
+:license: see LICENSE for more details
+"""
+
+import inspect
+import json
+import os
+import platform
+import time
+from collections import OrderedDict
+
+import matplotlib
+import numpy as np
+
+if platform.system() == "Darwin":
+    matplotlib.use("TkAgg")
+import matplotlib.pyplot as plt
+from matplotlib.patches import Patch
+import seaborn as sns
+
+from perform_metrics.group_arrays import take_segments, drop_nan, get_segment_ids
+from perform_metrics.grouped_quantiles import grouped_nanpercentile
+
+SUMMARY_FILE_NAME = 'plot_summaries.npz'
+# statistics of each box, in the order they are stored
+BOX_STATS = ['whislo', 'q1', 'med', 'q3', 'whishi']
+STATE_NAMES = ['off', 'on']
+# whiskers reach the furthest values within this many IQR of the box (as in matplotlib and seaborn)
+WHISKER_IQR = 1.5
+BOX_WIDTH = 0.4
+HISTOGRAM_BINS = list(range(0, 15, 1))
+
+
+def compute_box_stats(group_arrays, groups):
+    """
+    box plot statistics of the off and on values of some groups, nan values are ignored
+
+    :param group_arrays: GroupArrays (with the off and on states)
+    :param groups: array of group indices, in plot order
+    :return: stats: numpy.ndarray of shape (len(groups), 2, 5) of the BOX_STATS of each group and state
+             fliers: values beyond the whiskers, those of group i and state j are
+                 fliers[flier_offsets[2 * i + j]:flier_offsets[2 * i + j + 1]]
+             flier_offsets: numpy.ndarray of int64
+    """
+
+    segments = (np.asarray(groups, dtype=np.int64)[:, np.newaxis] * len(group_arrays.states)
+                + np.arange(2)).ravel()
+    offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+    np.cumsum(group_arrays.offsets[segments + 1] - group_arrays.offsets[segments], out=offsets[1:])
+    values = group_arrays.values[take_segments(group_arrays.offsets, segments)].astype(np.float64)
+    values, offsets = drop_nan(values, offsets)
+
+    quartiles = grouped_nanpercentile(values, offsets, [25, 50, 75])
+    iqr = quartiles[:, 2] - quartiles[:, 0]
+    segment_ids = get_segment_ids(offsets)
+    inside = ((values >= (quartiles[:, 0] - WHISKER_IQR * iqr)[segment_ids]) &
+              (values <= (quartiles[:, 2] + WHISKER_IQR * iqr)[segment_ids]))
+    whislo = np.full(len(segments), np.nan)
+    whishi = np.full(len(segments), np.nan)
+    np.fmin.at(whislo, segment_ids[inside], values[inside])
+    np.fmax.at(whishi, segment_ids[inside], values[inside])
+    # the whiskers do not end inside the box
+    whislo = np.fmin(whislo, quartiles[:, 0])
+    whishi = np.fmax(whishi, quartiles[:, 2])
+
+    stats = np.stack([whislo, quartiles[:, 0], quartiles[:, 1], quartiles[:, 2], whishi], axis=1)
+    flier_offsets = np.zeros(len(segments) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(segment_ids[~inside], minlength=len(segments)), out=flier_offsets[1:])
+
+    return stats.reshape(len(groups), 2, len(BOX_STATS)), values[~inside], flier_offsets
+
+
+def get_horizontal_kwargs():
+    """
+    keyword argument of Axes.bxp for horizontal boxes (orientation since matplotlib 3.10, vert before)
+
+    :return: dictionary
+    """
+
+    if 'orientation' in inspect.signature(plt.Axes.bxp).parameters:
+        return {'orientation': 'horizontal'}
+    return {'vert': False}
+
+
+def draw_on_vs_off(summary, out_path):
+    """
+    stacked boxplots of the off and on values of each group, from its box statistics
+
+    :param summary: dictionary with 'labels', 'stats', 'fliers', 'flier_offsets' (see compute_box_stats), 'title',
+        'xlabel', 'ylabel', 'legend_title' and 'fig_groups' (number of groups the figure height is made for)
+    :param out_path: path to save the figure to
+    """
+
+    labels = summary['labels']
+    stats = summary['stats']
+    fliers = summary['fliers']
+    flier_offsets = summary['flier_offsets']
+    colors = sns.color_palette()[:len(STATE_NAMES)]
+
+    fig, ax = plt.subplots(figsize=(12, 3 + 0.1 * int(summary['fig_groups'])))
+    for j, color in enumerate(colors):
+        box_stats = list()
+        for i in range(len(labels)):
+            box = dict(zip(BOX_STATS, stats[i, j]))
+            box['fliers'] = fliers[flier_offsets[2 * i + j]:flier_offsets[2 * i + j + 1]]
+            box_stats.append(box)
+        ax.bxp(box_stats, positions=np.arange(len(labels)) + (j - 0.5) * BOX_WIDTH, widths=0.8 * BOX_WIDTH,
+               patch_artist=True, boxprops={'facecolor': color}, medianprops={'color': '0.25'},
+               flierprops={'marker': 'd', 'markersize': 4, 'markerfacecolor': '0.25'}, manage_ticks=False,
+               **get_horizontal_kwargs())
+
+    ax.set_yticks(np.arange(len(labels)))
+    ax.set_yticklabels(labels)
+    ax.set_ylim(len(labels) - 0.5, -0.5)
+    ax.set_xlabel(summary['xlabel'])
+    ax.set_ylabel(summary['ylabel'])
+    ax.legend(handles=[Patch(facecolor=color, label=state) for state, color in zip(STATE_NAMES, colors)],
+              title=summary['legend_title'])
+    ax.set_title(summary['title'])
+    plt.tight_layout()
+    fig.savefig(out_path)
+    plt.close()
+
+
+def draw_fold_change_histogram(summary, out_path):
+    """
+    histogram of the on/off ratios of the groups
+
+    :param summary: dictionary with 'ratios' and 'title'
+    :param out_path: path to save the figure to
+    """
+
+    hist = sns.distplot(summary['ratios'], kde=False, bins=HISTOGRAM_BINS, hist_kws={"rwidth": 0.75})
+    hist.set_title(summary['title'])
+    hist.set(xlabel='ratio on/off', ylabel='Counts')
+    plt.tight_layout()
+
+    fig = hist.get_figure()
+    fig.savefig(out_path)
+    plt.close()
+
+
+# how each kind of figure is drawn from its summary
+DRAW_FUNCTIONS = {
+    'on_vs_off': draw_on_vs_off,
+    'fold_change_histogram': draw_fold_change_histogram,
+}
+
+
+def draw_figure(img_name, summary, output_dir, summaries=None):
+    """
+    draw a figure from its summary, and keep the summary to be saved
+
+    :param img_name: file name of the figure (without extension)
+    :param summary: dictionary with 'kind' (a key of DRAW_FUNCTIONS) and what its draw function needs
+    :param output_dir: directory to save the figure to
+    :param summaries: optional OrderedDict of figure name to summary to add the summary to (see save_plot_summaries)
+    """
+
+    DRAW_FUNCTIONS[summary['kind']](summary, os.path.join(output_dir, img_name))
+    if summaries is not None:
+        summaries[img_name] = summary
+
+
+def save_plot_summaries(summaries, output_dir):
+    """
+    save the summaries of the figures of a run (numpy arrays, with the titles and other fields as json)
+
+    :param summaries: OrderedDict of figure name to summary (see draw_figure)
+    :param output_dir: directory to save output to
+    :return: path of the summary file
+    """
+
+    figures = list()
+    arrays = dict()
+    for i, (img_name, summary) in enumerate(summaries.items()):
+        fields = OrderedDict()
+        array_fields = list()
+        for field, value in summary.items():
+            if isinstance(value, np.ndarray):
+                arrays['{0:d}_{1:s}'.format(i, field)] = value
+                array_fields.append(field)
+            else:
+                fields[field] = value
+        figures.append({'name': img_name, 'fields': fields, 'arrays': array_fields})
+
+    out_path = os.path.join(output_dir, SUMMARY_FILE_NAME)
+    print("saving plot summaries: " + out_path)
+    np.savez(out_path, figures=np.array(json.dumps(figures)), **arrays)
+
+    return out_path
+
+
+def load_plot_summaries(run_dir):
+    """
+    read the figure summaries saved by a run
+
+    :param run_dir: output directory of the run
+    :return: OrderedDict of figure name to summary
+    """
+
+    summaries = OrderedDict()
+    with np.load(os.path.join(run_dir, SUMMARY_FILE_NAME)) as summary_file:
+        for i, figure in enumerate(json.loads(str(summary_file['figures']))):
+            summary = dict(figure['fields'])
+            for field in figure['arrays']:
+                summary[field] = summary_file['{0:d}_{1:s}'.format(i, field)]
+            summaries[figure['name']] = summary
+
+    return summaries
+
+
+def replot(run_dir, output_dir=None):
+    """
+    draw all the figures of a run again from its plot summaries, without the data
+
+    :param run_dir: output directory of the run (with plot_summaries.npz)
+    :param output_dir: directory to save the figures to (default run_dir)
+    :return: list of figure names
+    """
+
+    output_dir = run_dir if output_dir is None else output_dir
+    start = time.perf_counter()
+    summaries = load_plot_summaries(run_dir)
+    for img_name, summary in summaries.items():
+        draw_figure(img_name, summary, output_dir)
+    print("drew {0:d} figures in {1:.1f} s".format(len(summaries), time.perf_counter() - start))
+
+    return list(summaries.keys())
@@ -0,0 +1,158 @@
+"""
+top and bottom ranked groups of every grouping and metric ("ranking" in the config).
+
+the groups are ranked by ratio or diff at the metric's plot parameter (50th percentile, 0 SD). only the k best and
+worst groups are needed, so they are found with a partial selection (np.partition, linear in the number of groups)
+and only those k are sorted. ties are broken by group order, so the report does not depend on the selection.
+
+:license: see LICENSE for more details
+"""
+
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.table_writer import write_table, get_table_file_name
+
+DEFAULT_RANKING = {
+    'k': 10,
+    'by': ['ratio'],
+    'limit_plots': False,
+}
+RANKING_FILE_NAME = 'ranked_groups.tsv'
+RANK_COLUMNS = ['group_name', 'off_count', 'on_count', 'off_agg', 'on_agg', 'diff', 'ratio']
+
+
+def get_ranking_config(config_json):
+    """
+    ranking settings of the config, "ranking": true uses the defaults
+
+    :param config_json: configuration file
+    :return: dictionary of ranking settings (see DEFAULT_RANKING), or None if there is no ranking
+    """
+
+    ranking = config_json.get('ranking', False)
+    if ranking is False or ranking is None:
+        return None
+
+    ranking_config = dict(DEFAULT_RANKING)
+    if isinstance(ranking, dict):
+        ranking_config.update(ranking)
+    if isinstance(ranking_config['by'], str):
+        ranking_config['by'] = [ranking_config['by']]
+
+    return ranking_config
+
+
+def top_k_indices(values, k, largest=True):
+    """
+    positions of the k largest (or smallest) values, best first. nan values are never ranked and ties are ordered by
+    position.
+
+    :param values: 1d numpy array
+    :param k: number of positions
+    :param largest: rank the largest values first (otherwise the smallest)
+    :return: numpy.ndarray of int64 positions, at most k
+    """
+
+    keys = -values if largest else values
+    is_nan = np.isnan(keys)
+    valid = None
+    if is_nan.any():
+        valid = np.flatnonzero(~is_nan)
+        keys = keys[valid]
+    k = min(k, len(keys))
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # every value up to the k-th smallest key (ties included), then sort only those
+    kth = np.partition(keys, k - 1)[k - 1]
+    candidates = np.flatnonzero(keys <= kth)
+    positions = candidates[np.lexsort((candidates, keys[candidates]))[:k]]
+
+    return positions if valid is None else valid[positions]
+
+
+def rank_groups(results_df, by, k, param_col, param_value):
+    """
+    top and bottom k groups of a results table
+
+    :param results_df: results dataframe (see aggregate_metrics.compute_metrics)
+    :param by: column to rank by (e.g. 'ratio' or 'diff')
+    :param k: number of groups at each end
+    :param param_col: metric parameter column (e.g. 'percentile')
+    :param param_value: parameter value of the rows to rank (e.g. 50)
+    :return: pandas.DataFrame with 'rank_type' ('top' or 'bottom'), 'rank' and the RANK_COLUMNS
+    """
+
+    rows = np.flatnonzero(results_df[param_col].to_numpy() == param_value)
+    values = results_df[by].to_numpy(dtype=np.float64)[rows]
+
+    ranked = list()
+    for rank_type, largest in [('top', True), ('bottom', False)]:
+        positions = rows[top_k_indices(values, k, largest)]
+        columns = OrderedDict()
+        columns['rank_type'] = np.full(len(positions), rank_type, dtype=object)
+        columns['rank'] = np.arange(1, len(positions) + 1)
+        # tables of several observed outputs or contrasts have channel and contrast columns (see variants.py)
+        for col in [col for col in ['channel', 'contrast'] if col in results_df.columns] + RANK_COLUMNS:
+            columns[col] = results_df[col].to_numpy()[positions]
+        ranked.append(pd.DataFrame(columns))
+
+    return pd.concat(ranked, ignore_index=True)
+
+
+def make_ranking(full_results_df_dict, ranking_config):
+    """
+    ranked groups for every metric, grouping and ranking column
+
+    :param full_results_df_dict: results from aggregate_metrics.compute_all_metrics
+    :param ranking_config: ranking settings (see get_ranking_config)
+    :return: pandas.DataFrame with 'metric', 'grouping', 'param_name', 'param_value', 'by' and the rank_groups columns
+    """
+
+    ranked = list()
+    for metric_results in full_results_df_dict:
+        param_col, param_value = metric_results['plot_metric']
+        for key, results_df in metric_results['record_df_dict'].items():
+            for by in ranking_config['by']:
+                ranked_df = rank_groups(results_df, by, ranking_config['k'], param_col, param_value)
+                ranked_df.insert(0, 'by', by)
+                ranked_df.insert(0, 'param_value', param_value)
+                ranked_df.insert(0, 'param_name', param_col)
+                ranked_df.insert(0, 'grouping', key)
+                ranked_df.insert(0, 'metric', metric_results['metric'])
+                ranked.append(ranked_df)
+
+    return pd.concat(ranked, ignore_index=True)
+
+
+def save_ranking(full_results_df_dict, config_json, output_dir, writer=None):
+    """
+    write the ranked groups table (if the config has a "ranking" entry)
+
+    :param full_results_df_dict: results from aggregate_metrics.compute_all_metrics
+    :param config_json: configuration file
+    :param output_dir: directory to save output to
+    :param writer: optional pipeline.OutputWriter to write the table on a background thread
+    :return: list of file names (empty without ranking)
+    """
+
+    ranking_config = get_ranking_config(config_json)
+    if ranking_config is None:
+        return list()
+
+    compression = config_json.get('output_compression')
+    ranked_df = make_ranking(full_results_df_dict, ranking_config)
+    comment = "# top and bottom {0:d} groups of each metric and grouping by {1:s}".format(
+        ranking_config['k'], ', '.join(ranking_config['by']))
+    file_name = get_table_file_name(RANKING_FILE_NAME, compression)
+    out_path = os.path.join(output_dir, file_name)
+    if writer is None:
+        write_table([ranked_df], comment, out_path, compression)
+    else:
+        writer.write(file_name, write_table, [ranked_df], comment, out_path, compression)
+
+    return [file_name]
@@ -0,0 +1,213 @@
+"""
+results store: an sqlite file the aggregate metric tables of every run are appended to, so results can be looked up
+across runs without reading the output directories.
+
+    * runs: one row per run (run id, config hash, the evaluated config and the record.json fields)
+    * metrics: one row per table row, with the run id, metric, grouping, a text column for each group column (empty for
+      groupings without it), param_name/param_value (e.g. percentile, 50) and the metric columns
+
+the group columns and (metric, param_value) are indexed.
+
+    python results_store.py results.sqlite --metric perc --param 50 --where strain=UWBF1
+
+:license: see LICENSE for more details
+"""
+
+import argparse
+import hashlib
+import json
+import sqlite3
+import uuid
+
+import pandas as pd
+
+RUN_COLUMNS = ['run_id', 'config_hash', 'date_run', 'data_path', 'output_dir', 'version', 'config']
+METRIC_COLUMNS = ['run_id', 'metric', 'grouping', 'group_name', 'param_name', 'param_value']
+PARAM_COLUMNS = ['percentile', 'num_std', 'fold']
+
+
+def quote(name):
+    """
+    quote a column name for sql
+
+    :param name: column name
+    :return: str
+    """
+
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def get_config_hash(config_json):
+    """
+    hash of a config, the same for configs with the same entries
+
+    :param config_json: configuration
+    :return: hex str
+    """
+
+    return hashlib.sha256(json.dumps(config_json, sort_keys=True).encode()).hexdigest()
+
+
+def open_store(store_path):
+    """
+    open (and create if needed) a results store
+
+    :param store_path: path to the sqlite file
+    :return: sqlite3.Connection
+    """
+
+    connection = sqlite3.connect(store_path)
+    connection.execute('CREATE TABLE IF NOT EXISTS runs ({0:s}, PRIMARY KEY (run_id))'.format(
+        ', '.join(quote(col) + ' TEXT' for col in RUN_COLUMNS)))
+    connection.execute('CREATE TABLE IF NOT EXISTS metrics ({0:s}, {1:s} REAL)'.format(
+        ', '.join(quote(col) + ' TEXT' for col in METRIC_COLUMNS[:-1]), quote(METRIC_COLUMNS[-1])))
+    connection.execute('CREATE INDEX IF NOT EXISTS metrics_run ON metrics (run_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS metrics_param ON metrics (metric, param_value)')
+
+    return connection
+
+
+def get_columns(connection, table):
+    """
+    column names of a table
+
+    :param connection: sqlite3.Connection
+    :param table: table name
+    :return: list of column names
+    """
+
+    return [row[1] for row in connection.execute('PRAGMA table_info({0:s})'.format(quote(table)))]
+
+
+def add_columns(connection, columns, group_cols):
+    """
+    add new columns to the metrics table, group columns are text and indexed, the others are numbers
+
+    :param connection: sqlite3.Connection
+    :param columns: column names the table should have
+    :param group_cols: columns that are group columns
+    """
+
+    existing = set(get_columns(connection, 'metrics'))
+    for col in columns:
+        if col in existing:
+            continue
+        col_type = 'TEXT' if col in group_cols else 'REAL'
+        connection.execute('ALTER TABLE metrics ADD COLUMN {0:s} {1:s}'.format(quote(col), col_type))
+        if col in group_cols:
+            connection.execute('CREATE INDEX IF NOT EXISTS {0:s} ON metrics ({1:s})'.format(
+                quote('metrics_' + col), quote(col)))
+
+
+def make_metric_rows(results_df, run_id, metric, grouping, group_cols):
+    """
+    the rows of a metric table in the layout of the metrics table
+
+    :param results_df: results dataframe (see aggregate_metrics.compute_metrics)
+    :param run_id: run id
+    :param metric: metric name (e.g. 'perc')
+    :param grouping: grouping name (key of group_cols_dict)
+    :param group_cols: list of group columns of the table
+    :return: pandas.DataFrame
+    """
+
+    param_col = [col for col in PARAM_COLUMNS if col in results_df.columns][0]
+
+    rows_df = pd.DataFrame({'run_id': run_id, 'metric': metric, 'grouping': grouping,
+                            'group_name': results_df['group_name'].astype(str),
+                            'param_name': param_col,
+                            'param_value': results_df[param_col].astype(float)}, index=results_df.index)
+    for col in group_cols:
+        rows_df[col] = results_df[col].astype(str)
+    for col in results_df.columns:
+        if col not in rows_df.columns and col not in group_cols and col != param_col:
+            rows_df[col] = results_df[col].astype(float)
+
+    return rows_df
+
+
+def store_run(store_path, record, config_json, full_results_df_dict):
+    """
+    append the aggregate metric tables of a run to the results store
+
+    :param store_path: path to the sqlite file
+    :param record: run record (see make_record.make_product_record)
+    :param config_json: evaluated configuration
+    :param full_results_df_dict: results from aggregate_metrics.compute_all_metrics
+    :return: run id
+    """
+
+    run_id = uuid.uuid4().hex
+    run = [run_id, get_config_hash(config_json), record['date_run'], record['data_path'], record['output_dir'],
+           record['perform_metrics version'], json.dumps(config_json, sort_keys=True)]
+
+    connection = open_store(store_path)
+    with connection:
+        connection.execute('INSERT INTO runs VALUES ({0:s})'.format(', '.join('?' * len(run))), run)
+        for metric_results in full_results_df_dict:
+            for grouping, results_df in metric_results['record_df_dict'].items():
+                group_cols = metric_results['group_cols_dict'][grouping]
+                rows_df = make_metric_rows(results_df, run_id, metric_results['metric'], grouping, group_cols)
+                add_columns(connection, rows_df.columns, group_cols)
+                connection.executemany('INSERT INTO metrics ({0:s}) VALUES ({1:s})'.format(
+                    ', '.join(quote(col) for col in rows_df.columns), ', '.join('?' * len(rows_df.columns))),
+                    rows_df.astype(object).where(rows_df.notna(), None).itertuples(index=False, name=None))
+    connection.close()
+
+    return run_id
+
+
+def query_metrics(store_path, metric=None, param_value=None, where=None, run_id=None):
+    """
+    look up metric rows across runs, joined with the run information
+
+    :param store_path: path to the sqlite file
+    :param metric: optional metric name (e.g. 'perc')
+    :param param_value: optional parameter value (e.g. 50 for the median)
+    :param where: optional dictionary of group column to value
+    :param run_id: optional run id
+    :return: pandas.DataFrame
+    """
+
+    conditions = list()
+    params = list()
+    for col, val in [('metric', metric), ('param_value', param_value), ('run_id', run_id)]:
+        if val is not None:
+            conditions.append('metrics.{0:s} = ?'.format(quote(col)))
+            params.append(val)
+    for col, val in (where or dict()).items():
+        conditions.append('metrics.{0:s} = ?'.format(quote(col)))
+        params.append(str(val))
+
+    query = 'SELECT runs.date_run, runs.config_hash, runs.data_path, metrics.* FROM metrics ' \
+            'JOIN runs ON metrics.run_id = runs.run_id'
+    if len(conditions) > 0:
+        query += ' WHERE ' + ' AND '.join(conditions)
+
+    connection = open_store(store_path)
+    results_df = pd.read_sql_query(query, connection, params=params)
+    connection.close()
+
+    return results_df
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("store_path", help="results store (sqlite file)")
+    parser.add_argument("--metric", help="metric name, e.g. perc or sd")
+    parser.add_argument("--param", type=float, help="metric parameter value, e.g. 50 for the median")
+    parser.add_argument("--where", nargs='*', default=[], help="group column values, e.g. strain=UWBF1")
+    parser.add_argument("--run_id", help="only this run")
+    parser.add_argument("--runs", action="store_true", help="list the runs instead of the metrics")
+
+    args = parser.parse_args()
+
+    if args.runs:
+        connection_loc = open_store(args.store_path)
+        print(pd.read_sql_query('SELECT run_id, date_run, config_hash, data_path, output_dir FROM runs',
+                                connection_loc).to_string(index=False))
+        connection_loc.close()
+    else:
+        where_loc = dict(condition.split('=', 1) for condition in args.where)
+        print(query_metrics(args.store_path, args.metric, args.param, where_loc, args.run_id).to_string(index=False))
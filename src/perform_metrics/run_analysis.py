@@ -11,12 +11,29 @@ Runner to run the following analysis:
 import argparse
 import json
 import os
+from collections import OrderedDict
 from datetime import datetime
 import shutil
 import pandas as pd
 from perform_metrics.config_parsing import parse_intended_output
+from perform_metrics.data_loading import read_data, is_partitioned, find_partition_files, get_data_name, \
+    get_csv_parser
+from perform_metrics.partitioned_data import get_partition_col, group_files_by_partition, analyze_partitions
 from perform_metrics.sample_metrics import run_functions as run_per_sample
-from perform_metrics.aggregate_metrics import run_analysis as run_aggregate
+from perform_metrics.aggregate_metrics import run_analysis as run_aggregate, compute_all_metrics
+from perform_metrics.results_store import store_run
+from perform_metrics.pipeline import make_output_writer
+from perform_metrics.group_arrays import make_group_arrays_dict
+from perform_metrics.compact import read_compact_csv
+from perform_metrics.columnar_cache import is_column_cache
+from perform_metrics.governor import choose_strategy, get_strategy_config, spill_data, spill_group_arrays_dict, \
+    remove_spill, get_peak_memory_mb, SPILL_DIR_NAME, CHUNK_ROWS
+from perform_metrics.grouped_quantiles import set_default_kernel
+from perform_metrics.planner import plan_run, print_plan, save_plan
+from perform_metrics.plot_summaries import replot
+from perform_metrics.variants import run_variants, is_variant_run, make_level_group_arrays_dict
+from perform_metrics.api import prepare_data
+from perform_metrics.event_summaries import read_events, get_events_config, make_pooled_group_arrays_dict
 import perform_metrics.make_record as rec
 
 
@@ -39,72 +56,342 @@ def make_sub_directory(out_dir, input_file_name):
     return out_dir
 
 
-def main(config_file, data_path, output_dir, input_file_name, merge_files):
+def run_all(config_json, config_file, data_path, output_dir, input_file_name, merge_files, n_jobs=1, writer=None,
+            strategy='in_memory', data_df=None, group_arrays_cache=None, read_profile=None):
     """
-    Main function to run all of the analysis - both aggregate and per sample. This run will also hash the files and
-    make a records json.
+    run the per sample and aggregate analysis on all the data at once
 
-    :param config_file: Configuration file
+    :param config_json: configuration
+    :param config_file: Configuration file name
     :param data_path: Path to data
     :param output_dir: Output directory
     :param input_file_name: experimental reference (or data file name)
     :param merge_files: Metadata file to merge with (optional).
+    :param n_jobs: number of threads for reading a directory of files
+    :param writer: optional pipeline.OutputWriter to compute the per sample tables and write all the tables on
+        background threads
+    :param strategy: 'in_memory', or 'chunked' / 'spill' to read a csv file a chunk at a time (and memory-map it and
+        the values of the group arrays), see governor.py
+    :param data_df: optional data already read, merged and prepared (see prepare_data), e.g. shared by the configs
+        of a sweep (see run_sweep), data_path is then not read
+    :param group_arrays_cache: optional dictionary of GroupArrays already made from data_df (see
+        group_arrays.make_group_arrays_dict)
+    :param read_profile: optional dictionary to put the read throughput in (see data_loading.get_read_profile)
+    :return: saved_files: list of output file names
+             full_results_df_dict: aggregate results (see aggregate_metrics.compute_all_metrics)
     """
 
-    with open(config_file) as json_file:
-        config_json = json.load(json_file)
-
-    data_df = pd.read_csv(data_path, dtype=object)
+    events = None
+    prepared = data_df is not None
+    if prepared:
+        print("using data already read: " + data_path)
+    elif "events" in config_json.keys():
+        data_df, events = read_events(data_path, config_json)
+    elif strategy != 'in_memory' and not is_partitioned(data_path) and not is_column_cache(data_path):
+        print("reading data in chunks: " + data_path)
+        data_df = read_compact_csv(data_path, config_json, merge_files, CHUNK_ROWS)
+        # already merged a chunk at a time
+        merge_files = None
+    else:
+        data_df = read_data(data_path, n_jobs, csv_parser=get_csv_parser(config_json), profile=read_profile)
 
     if merge_files is not None:
         metadata_df = pd.read_csv(merge_files, dtype=object)
         data_df = pd.merge(data_df, metadata_df, on=config_json['sample_id'])
-
-    if "subset_by" in config_json.keys():
-        for col, val in config_json["subset_by"].items():
-            data_df = data_df[data_df[col] == val]
+    if not prepared:
+        data_df = prepare_data(data_df, config_json)
+    spill_dir = os.path.join(output_dir, SPILL_DIR_NAME)
+    if strategy == 'spill':
+        data_df = spill_data(data_df, config_json, spill_dir)
 
     config_json = parse_intended_output(config_json, data_df, output_dir, config_file)
 
     saved_files = list()
+    pooled = events is not None and get_events_config(config_json)['pooled']
+
+    # several observed outputs or contrasts share the groups
+    if is_variant_run(config_json):
+        if pooled:
+            raise ValueError("events: pooled event metrics only support one contrast")
+        level_arrays_dict = None
+        if strategy == 'spill':
+            level_arrays_dict = spill_group_arrays_dict(make_level_group_arrays_dict(data_df, config_json), spill_dir)
+        return run_variants(data_df, config_json, output_dir, input_file_name, writer, level_arrays_dict)
+
+    # the ON/OFF values of each grouping are shared by the per sample and aggregate analysis
+    group_arrays_dict = make_group_arrays_dict(data_df, config_json, group_arrays_cache)
+    if pooled:
+        group_arrays_dict.update(make_pooled_group_arrays_dict(group_arrays_dict, data_df, config_json, events))
+    if strategy == 'spill':
+        group_arrays_dict = spill_group_arrays_dict(group_arrays_dict, spill_dir)
 
     print('running per sample analysis...')
-    _, sample_files = run_per_sample(data_df=data_df, config_json=config_json, output_dir=output_dir)
+    _, sample_files = run_per_sample(data_df=data_df, config_json=config_json, output_dir=output_dir,
+                                     group_arrays_dict=group_arrays_dict, writer=writer)
     saved_files.extend(sample_files)
 
     print('running aggregate analysis...')
-    agg_files = run_aggregate(data_df, config_json, output_dir, input_file_name)
+    group_costs_dict = OrderedDict()
+    full_results_df_dict = compute_all_metrics(data_df, config_json, group_arrays_dict, group_costs_dict)
+    agg_files = run_aggregate(data_df, config_json, output_dir, input_file_name, group_arrays_dict,
+                              full_results_df_dict, writer, group_costs_dict)
     saved_files.extend(agg_files)
 
-    # get files together for summarizing and hashing
-    files = [{'name': x} for x in saved_files]
+    return saved_files, full_results_df_dict
+
+
+def run_partitioned(config_json, config_file, files, partition_col, output_dir, input_file_name, merge_files,
+                    n_jobs=1, writer=None):
+    """
+    run the per sample and aggregate analysis on each partition of the data on its own (see partitioned_data.py),
+    and save the joined results
+
+    :param config_json: configuration
+    :param config_file: Configuration file name
+    :param files: list of (file path, partition) from find_partition_files
+    :param partition_col: partition column, the first column of every grouping
+    :param output_dir: Output directory
+    :param input_file_name: experimental reference (or data file name)
+    :param merge_files: Metadata file to merge with (optional).
+    :param n_jobs: number of processes
+    :param writer: optional pipeline.OutputWriter to write the tables on background threads
+    :return: saved_files: list of output file names
+             full_results_df_dict: aggregate results (see aggregate_metrics.compute_all_metrics)
+    """
+
+    # min/max intended outputs are found over all the data, only the intended output column is read for them
+    intended_col = config_json['intended_output']['col']
+    if any(config_json['intended_output'][state] in ['max', 'min'] for state in ['on', 'off']):
+        intended_df = pd.concat([pd.read_csv(path, dtype=object, usecols=[intended_col]) for path, _ in files])
+    else:
+        intended_df = pd.DataFrame(columns=[intended_col])
+    config_json = parse_intended_output(config_json, intended_df, output_dir, config_file)
+
+    partitions = group_files_by_partition(files, partition_col)
+    print('running analysis on {0:d} partitions by {1:s}...'.format(len(partitions), partition_col))
+    # the per sample tables are written as the partitions are analyzed
+    saved_files, box_data_dict, full_results_df_dict, group_costs_dict = analyze_partitions(
+        partitions, config_json, output_dir, merge_files, n_jobs)
+    if writer is not None:
+        for file_name in saved_files:
+            writer.add_file(file_name)
+    saved_files.extend(run_aggregate(None, config_json, output_dir, input_file_name, None, full_results_df_dict,
+                                     writer, group_costs_dict, box_data_dict))
+
+    return saved_files, full_results_df_dict
+
+
+def main(config_file, data_path, output_dir, input_file_name, merge_files, max_memory_mb=None, data_df=None,
+         group_arrays_cache=None):
+    """
+    Main function to run all of the analysis - both aggregate and per sample. This run will also hash the files and
+    make a records json.
+
+    :param config_file: Configuration file
+    :param data_path: Path to data (csv file, column cache directory made by columnar_cache.py, directory or glob
+        pattern of csv files, or event level csv if the config has an "events" entry)
+    :param output_dir: Output directory
+    :param input_file_name: experimental reference (or data file name)
+    :param merge_files: Metadata file to merge with (optional).
+    :param max_memory_mb: optional memory budget in MB (or "max_memory_mb" in the config), the way the data is read
+        and stored is chosen to stay under it (see governor.py)
+    :param data_df: optional data already read, merged and prepared for this config (see run_sweep), there is no
+        memory budget or partitioning then
+    :param group_arrays_cache: optional dictionary of GroupArrays already made from data_df
+    """
+
+    with open(config_file) as json_file:
+        config_json = json.load(json_file)
+
+    execution = None
+    strategy = 'in_memory'
+    max_memory_mb = max_memory_mb if max_memory_mb is not None else config_json.get("max_memory_mb")
+    if max_memory_mb is not None and data_df is None:
+        execution = choose_strategy(config_json, data_path, max_memory_mb, merge_files)
+        strategy = execution['strategy']
+        config_json = get_strategy_config(config_json, strategy)
+
+    if "quantile_kernel" in config_json.keys():
+        set_default_kernel(config_json["quantile_kernel"])
+
+    n_jobs = config_json.get("n_jobs", 1)
+
+    # the tables are written and hashed on background threads while the analysis goes on
+    writer = make_output_writer(output_dir, config_json)
+    read_profile = OrderedDict()
+    partition_col = None
+    if data_df is None and is_partitioned(data_path):
+        partition_files = find_partition_files(data_path)
+        partition_col = get_partition_col(partition_files, config_json)
+
+    if partition_col is not None:
+        saved_files, full_results_df_dict = run_partitioned(config_json, config_file, partition_files, partition_col,
+                                                            output_dir, input_file_name, merge_files, n_jobs,
+                                                            writer)
+    else:
+        saved_files, full_results_df_dict = run_all(config_json, config_file, data_path, output_dir, input_file_name,
+                                                    merge_files, n_jobs, writer, strategy, data_df, group_arrays_cache,
+                                                    read_profile)
 
-    # make hash for data sets
-    print("hashing output...")
-    files = rec.make_hashes_for_files(output_dir, files)
+    # wait for the files to be written and get their hashes
+    print("waiting for output to be written and hashed...")
+    files = writer.get_file_records(saved_files)
+    writer.close()
+    if strategy == 'spill':
+        remove_spill(os.path.join(output_dir, SPILL_DIR_NAME))
 
     # make data record
     print("making product record...")
     record = rec.make_product_record(output_dir, files,  data_path)
+    if execution is not None:
+        execution['peak_mb'] = get_peak_memory_mb()
+        record['execution'] = execution
+    if len(read_profile) > 0:
+        record['read'] = read_profile
 
     record_path = os.path.join(output_dir, "record.json")
     with open(record_path, 'w') as json_file:
         json.dump(record, json_file, indent=2)
 
+    if "results_store" in config_json.keys():
+        print("adding results to store: " + config_json["results_store"])
+        store_run(config_json["results_store"], record, config_json, full_results_df_dict)
+
     print("finished!")
 
 
+def get_sweep_directories(config_files, output_dir):
+    """
+    output directory of each config of a sweep, named after the config file (with a number if two have the same name)
+
+    :param config_files: list of configuration files
+    :param output_dir: output directory of the sweep
+    :return: list of directories (not made)
+    """
+
+    sub_dirs = list()
+    for config_file in config_files:
+        name = os.path.splitext(os.path.basename(config_file))[0]
+        sub_dir = os.path.join(output_dir, name)
+        i = 2
+        while sub_dir in sub_dirs:
+            sub_dir = os.path.join(output_dir, '{0:s}_{1:d}'.format(name, i))
+            i += 1
+        sub_dirs.append(sub_dir)
+
+    return sub_dirs
+
+
+def run_sweep(config_files, data_path, output_dir, input_file_name, merge_files):
+    """
+    run the analysis of several configs on the same data: the data is read (and merged) once, prepared once for each
+    different "subset_by" and "compact", and the group arrays of a grouping are shared by the configs that have it
+    (with the same observed and intended output). each config's output (and record.json) is in its own subdirectory
+    (see get_sweep_directories), with a copy of the config
+
+    :param config_files: list of configuration files
+    :param data_path: Path to data (csv file, column cache directory, or directory or glob pattern of csv files)
+    :param output_dir: Output directory
+    :param input_file_name: experimental reference (or data file name)
+    :param merge_files: Metadata file to merge with (optional), every config must have the same "sample_id"
+    :return: list of output directories, one for each config
+    """
+
+    config_jsons = list()
+    for config_file in config_files:
+        with open(config_file) as json_file:
+            config_jsons.append(json.load(json_file))
+    if any("events" in config_json.keys() for config_json in config_jsons):
+        raise ValueError("event level data can not be used in a sweep, run each config on its own")
+    sample_ids = set(config_json['sample_id'] for config_json in config_jsons)
+    if merge_files is not None and len(sample_ids) > 1:
+        raise ValueError("every config of a sweep with merge files must have the same sample_id, not {}".format(
+            sorted(sample_ids)))
+
+    data_df = read_data(data_path, max(config_json.get("n_jobs", 1) for config_json in config_jsons),
+                        csv_parser=get_csv_parser(config_jsons[0]))
+    if merge_files is not None:
+        metadata_df = pd.read_csv(merge_files, dtype=object)
+        data_df = pd.merge(data_df, metadata_df, on=config_jsons[0]['sample_id'])
+
+    # data prepared for each subset and compact setting, dropped after the last config that uses it
+    data_keys = [json.dumps([config_json.get("subset_by"), config_json.get("compact")], sort_keys=True)
+                 for config_json in config_jsons]
+    prepared = dict()
+    sub_dirs = get_sweep_directories(config_files, output_dir)
+    for i, (config_file, config_json, data_key, sub_dir) in enumerate(zip(config_files, config_jsons, data_keys,
+                                                                            sub_dirs)):
+        print("running config {0:d} of {1:d}: {2:s}".format(i + 1, len(config_files), config_file))
+        if data_key not in prepared:
+            prepared[data_key] = (prepare_data(data_df, config_json), dict())
+        os.makedirs(sub_dir, exist_ok=True)
+        shutil.copy(config_file, sub_dir)
+        main(config_file, data_path, sub_dir, input_file_name, None, data_df=prepared[data_key][0],
+             group_arrays_cache=prepared[data_key][1])
+        if data_key not in data_keys[i + 1:]:
+            del prepared[data_key]
+
+    return sub_dirs
+
+
+def run_plan(config_file, data_path, output_dir, merge_files, nrows=None, coefficients_file=None):
+    """
+    dry run: estimate the groups, output rows, time and memory of a run (see planner.py) without computing anything,
+    print the estimates and save them to plan.json
+
+    :param config_file: Configuration file
+    :param data_path: Path to data
+    :param output_dir: Output directory
+    :param merge_files: Metadata file to merge with (optional).
+    :param nrows: optional number of rows to read from the start of a csv file
+    :param coefficients_file: optional json file of coefficients from benchmark.py calibrate
+    :return: plan dictionary
+    """
+
+    with open(config_file) as json_file:
+        config_json = json.load(json_file)
+    coefficients = None
+    if coefficients_file is not None:
+        with open(coefficients_file) as json_file:
+            coefficients = json.load(json_file)
+
+    print("planning run...")
+    plan = plan_run(config_json, data_path, merge_files, nrows, coefficients)
+    print_plan(plan)
+    print("saving plan: " + save_plan(plan, output_dir))
+
+    return plan
+
+
 if __name__ == '__main__':
 
+    # --replot only needs the output directory of a run
+    replot_parser = argparse.ArgumentParser(add_help=False)
+    replot_parser.add_argument("--replot")
+    replot_args, _ = replot_parser.parse_known_args()
+    if replot_args.replot is not None:
+        replot(replot_args.replot)
+        raise SystemExit(0)
+
     # Load the config file from user input file location
     parser = argparse.ArgumentParser()
 
-    parser.add_argument("config_file", help="config file")
-    parser.add_argument("data_path", help="input file with data")
+    parser.add_argument("config_file", nargs='+', help="config file, or several to run them all on the data read "
+                                                        "once (sweep, each in its own subdirectory)")
+    parser.add_argument("data_path", help="input file with data, a column cache directory made by columnar_cache.py, or "
+                                          "a directory or glob pattern of csv files")
     parser.add_argument("output_dir", help="directory for output")
     parser.add_argument("-n", "--no_sub_dir", help="do not make a subdirectory (not recommended except for reactor)",
                         action="store_true")
     parser.add_argument('-m', "--merge_files", help='if there is a seperate metadata file, specify its location here')
+    parser.add_argument("--max_memory", type=float, help="memory budget in MB, the data is read in chunks and/or "
+                                                          "memory-mapped if needed to stay under it")
+    parser.add_argument("--plan", help="only estimate the size, time and memory of the run (dry run)",
+                        action="store_true")
+    parser.add_argument("--plan_rows", type=int, help="with --plan, only read this many rows of a csv file")
+    parser.add_argument("--plan_coefficients", help="with --plan, json file from benchmark.py calibrate")
+    parser.add_argument("--replot", metavar="RUN_DIR", help="only draw the figures of a run again from its "
+                                                            "plot_summaries.npz (no other arguments are needed)")
 
     args = parser.parse_args()
 
@@ -114,7 +401,16 @@ if __name__ == '__main__':
     merge_files_loc = args.merge_files
     arg_no_sub_dir = args.no_sub_dir
 
-    input_file_name_loc, input_file_ext = os.path.splitext(os.path.basename(data_path_loc))
+    input_file_name_loc = get_data_name(data_path_loc)
+
+    if args.plan:
+        os.makedirs(output_dir_loc, exist_ok=True)
+        plan_dirs = [output_dir_loc] if len(config_file_loc) == 1 else get_sweep_directories(config_file_loc,
+                                                                                             output_dir_loc)
+        for config, plan_dir in zip(config_file_loc, plan_dirs):
+            os.makedirs(plan_dir, exist_ok=True)
+            run_plan(config, data_path_loc, plan_dir, merge_files_loc, args.plan_rows, args.plan_coefficients)
+        raise SystemExit(0)
 
     if not arg_no_sub_dir:
         output_dir_loc = make_sub_directory(output_dir_loc, input_file_name_loc)
@@ -122,6 +418,10 @@ if __name__ == '__main__':
         if not os.path.exists(output_dir_loc):
             os.makedirs(output_dir_loc, exist_ok=True)
 
-    shutil.copy(config_file_loc, output_dir_loc)
+    if len(config_file_loc) > 1:
+        run_sweep(config_file_loc, data_path_loc, output_dir_loc, input_file_name_loc, merge_files_loc)
+        raise SystemExit(0)
+
+    shutil.copy(config_file_loc[0], output_dir_loc)
 
-    main(config_file_loc, data_path_loc, output_dir_loc, input_file_name_loc, merge_files_loc)
+    main(config_file_loc[0], data_path_loc, output_dir_loc, input_file_name_loc, merge_files_loc, args.max_memory)
@@ -1,6 +1,12 @@
 """
 Functions to compute a circuit performance metric on a per sample basis
 
+each sample is compared to the values of the other state of its group: an ON sample to the OFF values and an OFF
+sample to the ON values. by default this is the median (percentile 50), "per_sample_metrics" in the config selects the
+metrics of metrics_info and their parameters, e.g. {"perc": {"percents": [50, 75]}, "sd": {"num_std": [0, 2]}}. the
+group statistics of each metric are computed once for all groups and broadcast to the samples. the percentile table is
+per_sample_metric_{grouping}.tsv, the other metrics are per_sample_metric_{metric}_{grouping}.tsv.
+
 :author: Tessa Johnson (tessa.johnson@geomdata.com)
 :copyright: (c) 2020, Geometric Data Analytics, Inc.
 :license: see LICENSE for more details
@@ -9,16 +15,27 @@ Functions to compute a circuit performance metric on a per sample basis
 import argparse
 import json
 import os
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import shutil
 from collections import OrderedDict
 
-from perform_metrics.group_metrics import compute_metric_percent
-from perform_metrics.config_parsing import parse_intended_output
+from perform_metrics.group_metrics import compute_metric_percent, grouped_metric_percent, metrics_info
+from perform_metrics.config_parsing import parse_intended_output, get_compact_config, check_metric_params
+from perform_metrics.compact import get_key_categoricals, get_small_int_array
+from perform_metrics.data_loading import read_data, get_csv_parser
+from perform_metrics.table_writer import write_table, get_table_file_name, DEFAULT_BLOCK_SIZE
+from perform_metrics.group_arrays import make_group_arrays, make_group_arrays_dict, get_on_off, get_segment, \
+    get_segment_lengths, get_name_array, get_key_columns, take_segments, iter_group_blocks, ON, OFF
+
+DEFAULT_PER_SAMPLE_METRICS = {'perc': {'percents': [50]}}
+# the per sample table of this metric keeps the file name it had when it was the only one
+PERCENTILE_METRIC = 'perc'
 
 
-def compute_metrics(data_df, group_cols, observed_output, intended_output, function, sample_id):
+def compute_metrics(data_df, group_cols, observed_output, intended_output, function, sample_id, group_arrays=None,
+                    grouped_function=None, function_params=None, compact=False, sample_function=None):
     """
     function to compute all the different intervals for analyzing fold change
 
@@ -28,24 +45,41 @@ def compute_metrics(data_df, group_cols, observed_output, intended_output, funct
     :param data_df: pandas.DataFrame
     :param group_cols: list of columns to group by
     :param sample_id: sample id
+    :param group_arrays: optional GroupArrays for this grouping (made from data_df if not given)
+    :param grouped_function: optional grouped version of function (see metrics_info), the statistics of each group
+        are then computed once and compared to every sample instead of calling function for each sample
+    :param function_params: optional dictionary of keyword arguments for the function, each sample has a row for each
+        record it returns (without it, only the first record is kept for each sample, {'percents': [50]} for
+        compute_metric_percent, i.e. the median)
+    :param compact: build the table with small column types (see compute_grouped_metrics), only with a grouped function
+    :param sample_function: optional function computing the metric of every sample against the other state of its
+        group at once (see metrics_info), used with grouped_function for metrics where a single value is not its own
+        statistic
     :return: pandas.DataFrame
     """
 
-    # group by the exp and ts ids
-    records = list()
-    grouped_df = data_df.groupby(group_cols)
-    for name, group in grouped_df:
-        # compute max of OFF and min of ON
-        off = group[(group[intended_output['col']] == intended_output['off'])][observed_output].astype(
-            'float')
-        on = group[(group[intended_output['col']] == intended_output['on'])][observed_output].astype(
-            'float')
+    nrecords = None
+    if function_params is None:
+        function_params = {'percents': [50]} if function is compute_metric_percent else dict()
+        nrecords = 1
+
+    if group_arrays is None:
+        group_arrays = make_group_arrays(data_df, group_cols, observed_output, intended_output)
+    sample_ids = data_df[sample_id].take(group_arrays.row_index).to_numpy()
 
-        on_ids = group[(group[intended_output['col']] == intended_output['on'])][sample_id]
-        off_ids = group[(group[intended_output['col']] == intended_output['off'])][sample_id]
+    if grouped_function is not None:
+        return compute_grouped_metrics(group_arrays, grouped_function, sample_ids, compact, function_params,
+                                       sample_function)
+
+    # groups are already in sorted order
+    records = list()
+    for i, name in enumerate(group_arrays.names):
+        on, off = get_on_off(group_arrays, i)
+        on_ids = sample_ids[get_segment(group_arrays, i, ON)]
+        off_ids = sample_ids[get_segment(group_arrays, i, OFF)]
 
         # identifier part of record
-        name_list = [name] if isinstance(name, str) else name
+        name_list = group_arrays.keys[i]
 
         # get metric for on samples
         for samp_on, on_id in zip(on, on_ids):
@@ -54,9 +88,9 @@ def compute_metrics(data_df, group_cols, observed_output, intended_output, funct
             record['off_count'] = len(off)
             record['on_count'] = 1
             record['sample_id'] = on_id
-            metric_records = function([samp_on], off)[2]
-            rec_merge = OrderedDict(**record, **metric_records)
-            records.append(rec_merge)
+            for metric_records in function([samp_on], off, **function_params)[:nrecords]:
+                rec_merge = OrderedDict(**record, **metric_records)
+                records.append(rec_merge)
 
         for samp_off, off_id in zip(off, off_ids):
             record = OrderedDict(zip(group_cols, name_list))
@@ -64,65 +98,239 @@ def compute_metrics(data_df, group_cols, observed_output, intended_output, funct
             record['on_count'] = len(on)
             record['off_count'] = 1
             record['sample_id'] = off_id
-            metric_records = function(on, [samp_off])[2]
-            rec_merge = OrderedDict(record, **metric_records)
-            records.append(rec_merge)
+            for metric_records in function(on, [samp_off], **function_params)[:nrecords]:
+                rec_merge = OrderedDict(record, **metric_records)
+                records.append(rec_merge)
 
     records_df = pd.DataFrame(records)
-    records_df.sort_values(by=group_cols,
-                           inplace=True)
     return records_df
 
 
-def save_df(results_df, comments, out_path):
+def compute_grouped_metrics(group_arrays, grouped_function, sample_ids, compact=False, function_params=None,
+                            sample_function=None):
+    """
+    per sample metrics for all groups at once: the statistics of each group's ON and OFF values are computed with the
+    grouped function (e.g. the median), then each ON sample is compared to its group's OFF statistic and each OFF
+    sample to the ON statistic. a single value is its own percentile, mean and mean -/+ n SD, so this is the same as
+    the metric function of one sample against the other state. that does not hold for metrics of the whole
+    distributions (e.g. auc and ks), their sample function gives the off_agg and on_agg of every sample instead. the
+    rows are in the same order as compute_metrics (for each group, the ON samples then the OFF samples, each with a
+    row for every parameter).
+
+    :param group_arrays: GroupArrays for the grouping
+    :param grouped_function: grouped metric function (see metrics_info)
+    :param sample_ids: sample id of each value in group_arrays.values
+    :param compact: group columns and group_name as categoricals, counts and integer parameters (e.g. percentile) as
+        small integers (see compact.py)
+    :param function_params: optional dictionary of keyword arguments for the grouped function (default
+        {'percents': [50]} for grouped_metric_percent)
+    :param sample_function: optional sample function of the metric (see metrics_info), used instead of the grouped
+        function when given
+    :return: pandas.DataFrame
+    """
+
+    if function_params is None:
+        function_params = {'percents': [50]} if grouped_function is grouped_metric_percent else dict()
+
+    ngroups = len(group_arrays.names)
+    nstates = len(group_arrays.states)
+    seg_lengths = get_segment_lengths(group_arrays)
+
+    if sample_function is not None:
+        group_columns = sample_function(group_arrays.values, group_arrays.offsets, **function_params)
+    else:
+        group_columns = grouped_function(group_arrays.values, group_arrays.offsets, **function_params)
+    # the first column is the parameter (e.g. percentile or num_std)
+    param_col = next(iter(group_columns.keys()))
+    nparams = group_columns['off_agg'].shape[1]
+
+    # for each group, the ON segment then the OFF segment, and each sample once for each parameter
+    segments = (np.arange(ngroups)[:, np.newaxis] * nstates + np.array([ON, OFF])).ravel()
+    rows = np.repeat(take_segments(group_arrays.offsets, segments), nparams)
+    row_group = np.repeat(np.arange(ngroups), seg_lengths.sum(axis=1) * nparams)
+    is_on = np.repeat(np.tile([True, False], ngroups), seg_lengths[:, [ON, OFF]].ravel() * nparams)
+    row_param = np.tile(np.arange(nparams), len(rows) // max(nparams, 1))
+    values = group_arrays.values[rows]
+
+    columns = OrderedDict()
+    if compact:
+        columns.update(get_key_categoricals(group_arrays, row_group))
+        seg_lengths = get_small_int_array(seg_lengths)
+    else:
+        for col, col_values in get_key_columns(group_arrays).items():
+            columns[col] = col_values[row_group]
+        columns['group_name'] = get_name_array(group_arrays)[row_group]
+    columns['off_count'] = np.where(is_on, seg_lengths[row_group, OFF], 1).astype(seg_lengths.dtype)
+    columns['on_count'] = np.where(is_on, 1, seg_lengths[row_group, ON]).astype(seg_lengths.dtype)
+    columns['sample_id'] = sample_ids[rows]
+    # the sample function has a row for each value, the grouped function one for each group
+    params = group_columns[param_col][rows if sample_function is not None else row_group, row_param]
+    columns[param_col] = get_small_int_array(params) if compact else params
+    if sample_function is not None:
+        columns['off_agg'] = group_columns['off_agg'][rows, row_param]
+        columns['on_agg'] = group_columns['on_agg'][rows, row_param]
+    else:
+        columns['off_agg'] = np.where(is_on, group_columns['off_agg'][row_group, row_param], values)
+        columns['on_agg'] = np.where(is_on, values, group_columns['on_agg'][row_group, row_param])
+    columns['diff'] = columns['on_agg'] - columns['off_agg']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['ratio'] = columns['on_agg'] / columns['off_agg']
+
+    return pd.DataFrame(columns)
+
+
+def save_df(results_df, comments, out_path, compression=None):
+    """
+    Function to save the results dataframe to file
+
+    :param results_df: results dataframe
+    :param comments: any comments the user wishes to be added to the output file
+    :param out_path: path to save output to
+    :param compression: None, 'gzip' or 'zstd'
+    """
+    write_table([results_df], comments, out_path, compression)
+
+
+def get_per_sample_tables(config_json):
+    """
+    the per sample tables of a run: one for each grouping and metric of "per_sample_metrics" in the config (default
+    DEFAULT_PER_SAMPLE_METRICS)
+
+    :param config_json: configuration file
+    :return: OrderedDict of table name (the grouping name for the percentile metric, {metric}_{grouping} for the
+        others) to (grouping name, metric dictionary of metrics_info, dictionary of keyword arguments)
+    """
+
+    per_sample_metrics = config_json.get('per_sample_metrics', DEFAULT_PER_SAMPLE_METRICS)
+    check_metric_params(per_sample_metrics, metrics_info)
+    metric_dicts = {metric_dict['metric']: metric_dict for metric_dict in metrics_info}
+
+    tables = OrderedDict()
+    for key in config_json['group_cols_dict'].keys():
+        for metric, function_params in per_sample_metrics.items():
+            table_key = key if metric == PERCENTILE_METRIC else metric + '_' + key
+            tables[table_key] = (key, metric_dicts[metric], function_params)
+
+    return tables
+
+
+def iter_sample_chunks(data_df, config_json, group_cols, group_arrays, metric_dict=None, function_params=None):
+    """
+    compute the per sample metrics for one grouping a block of groups at a time (config 'output_block_size' values per
+    block)
+
+    :param data_df: pandas.DataFrame
+    :param config_json: configuration file
+    :param group_cols: list of columns the group arrays were grouped by
+    :param group_arrays: GroupArrays for the grouping
+    :param metric_dict: optional entry of metrics_info (default the percentile metric)
+    :param function_params: optional dictionary of keyword arguments for the metric (default the median for the
+        percentile metric)
+    :return: generator of pandas.DataFrame
+    """
+
+    if metric_dict is None:
+        metric_dict = {'function': compute_metric_percent, 'grouped_function': grouped_metric_percent}
+
+    block_size = config_json.get('output_block_size', DEFAULT_BLOCK_SIZE)
+    for block in iter_group_blocks(group_arrays, block_size):
+        yield compute_metrics(data_df=data_df,
+                              group_cols=group_cols,
+                              observed_output=config_json['observed_output'],
+                              intended_output=config_json['intended_output'], function=metric_dict['function'],
+                              sample_id=config_json['sample_id'], group_arrays=block,
+                              grouped_function=metric_dict.get('grouped_function'),
+                              sample_function=metric_dict.get('sample_function'),
+                              function_params=function_params,
+                              compact=get_compact_config(config_json) is not None)
+
+
+def make_sample_chunks_dict(data_df, config_json, group_arrays_dict):
+    """
+    the chunks of every per sample table, computed as they are written
+
+    :param data_df: pandas.DataFrame
+    :param config_json: configuration file
+    :param group_arrays_dict: dictionary of GroupArrays for each grouping
+    :return: OrderedDict of table name (see get_per_sample_tables) to generator of pandas.DataFrame
+    """
+
+    return OrderedDict((table_key, iter_sample_chunks(data_df, config_json, config_json['group_cols_dict'][key],
+                                                      group_arrays_dict[key], metric_dict, function_params))
+                       for table_key, (key, metric_dict, function_params) in get_per_sample_tables(config_json).items())
+
+
+def get_per_sample_files(config_json):
+    """
+    file name and comments of the per sample table of each grouping (and metric)
+
+    :param config_json: configuration file
+    :return: OrderedDict of table name (see get_per_sample_tables) to (file name, comments)
+    """
+
+    compression = config_json.get('output_compression')
+
+    files = OrderedDict()
+    for table_key, (key, metric_dict, _) in get_per_sample_tables(config_json).items():
+        group_cols = config_json['group_cols_dict'][key]
+        comment = "# metrics on a per sample basis grouped by:" + "{0:s}".format(', '.join(group_cols))
+        if metric_dict['metric'] != PERCENTILE_METRIC:
+            comment = "# {0:s}".format(metric_dict['metric']) + comment[1:]
+        files[table_key] = (get_table_file_name("per_sample_metric" + "_{0:s}.tsv".format(table_key), compression),
+                            comment)
+
+    return files
+
+
+def save_per_sample(chunks_dict, config_json, output_dir, writer=None):
+    """
+    write the per sample table of each grouping (and metric) from its chunks
+
+    :param chunks_dict: dictionary of table name (see get_per_sample_tables) to an iterable of pandas.DataFrame chunks
+    :param config_json: configuration file
+    :param output_dir: directory to save output to
+    :param writer: optional pipeline.OutputWriter, the chunks are then computed and written on its threads
+    :return: files: list of file names which contain the output
     """
-   Function to save the results dataframe to file
 
-   :param results_df: results dataframe
-   :param comments: any comments the user wishes to be added to the output file
-   :param out_path: path to save output to
-   """
+    compression = config_json.get('output_compression')
+
+    files = []
+    for table_key, (file_name, comment) in get_per_sample_files(config_json).items():
+        out_path = os.path.join(output_dir, file_name)
+        if writer is None:
+            write_table(chunks_dict[table_key], comment, out_path, compression)
+        else:
+            writer.write(file_name, write_table, chunks_dict[table_key], comment, out_path, compression)
+        files.append(file_name)
 
-    print("saving to: " + out_path)
-    with open(out_path, 'w') as out_file:
-        out_file.write(comments)
-        out_file.write("# \n")
-        results_df.to_csv(out_file, sep='\t', header=True, index=False)
+    return files
 
 
-def run_functions(data_df, config_json, output_dir):
+def run_functions(data_df, config_json, output_dir, group_arrays_dict=None, writer=None):
     """
     measure fold and absolute change between
     percentiles,
     for each experiment, strain; combine all time series, replicates, and time points
     so group by experiment, strain
 
+    the tables are made and written a block of groups at a time (config 'output_block_size' values per block), so the
+    memory used does not depend on the size of the output.
+
     :param output_dir: directory to save output to
     :param config_json: configuration file
     :param data_df: pandas.DataFrame
+    :param group_arrays_dict: optional dictionary of GroupArrays for each grouping (made from data_df if not given)
+    :param writer: optional pipeline.OutputWriter to write the tables on background threads
     :return: pandas.DataFrame
     """
 
-    observed_output = config_json['observed_output']
-    intended_output = config_json['intended_output']
-    group_cols_dict = config_json['group_cols_dict']
-    sample_id = config_json['sample_id']
+    if group_arrays_dict is None:
+        group_arrays_dict = make_group_arrays_dict(data_df, config_json)
 
-    files = []
+    chunks_dict = make_sample_chunks_dict(data_df, config_json, group_arrays_dict)
+    files = save_per_sample(chunks_dict, config_json, output_dir, writer)
     full_results_df_dict = []
-    results_df_dict = dict()
-    for key, group_cols in group_cols_dict.items():
-        results_df = compute_metrics(data_df=data_df,
-                                     group_cols=group_cols,
-                                     observed_output=observed_output,
-                                     intended_output=intended_output, function=compute_metric_percent,
-                                     sample_id=sample_id)
-        results_df_dict[key] = results_df
-        comment = "# metrics on a per sample basis grouped by:" + "{0:s}".format(', '.join(group_cols))
-        file_name = "per_sample_metric" + "_{0:s}.tsv".format(key)
-        out_path = os.path.join(output_dir, file_name)
-        save_df(results_df, comment, out_path)
-        files.append(file_name)
 
     return full_results_df_dict, files
 
@@ -157,7 +365,7 @@ if __name__ == '__main__':
         os.makedirs(output_dir_loc, exist_ok=True)
     shutil.copy(config_file, output_dir_loc)
 
-    data_df_loc = pd.read_csv(data_path, dtype=object)
+    data_df_loc = read_data(data_path, csv_parser=get_csv_parser(config_json))
 
     config_json_loc = parse_intended_output(config_json_loc, data_df_loc, output_dir_loc, config_file)
 
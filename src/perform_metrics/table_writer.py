@@ -0,0 +1,138 @@
+"""
+code for writing the metric tables (commented tsv files), optionally compressed and a block of rows at a time
+
+:license: see LICENSE for more details
+"""
+
+import gzip
+import io
+from collections import OrderedDict
+from contextlib import ExitStack
+
+import pandas as pd
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# number of values per block when tables are made and written a block of groups at a time
+DEFAULT_BLOCK_SIZE = 100000
+
+# file extension added for each compression
+COMPRESSION_EXTENSIONS = {None: '', 'gzip': '.gz', 'zstd': '.zst'}
+
+
+def get_table_file_name(file_name, compression=None):
+    """
+    file name of a table with the extension for the compression
+
+    :param file_name: file name (e.g. metrics_per__exp_str.tsv)
+    :param compression: None, 'gzip' or 'zstd'
+    :return: file name
+    """
+
+    assert compression in COMPRESSION_EXTENSIONS, \
+        'compression must be one of {}, not {}'.format(list(COMPRESSION_EXTENSIONS.keys()), compression)
+
+    return file_name + COMPRESSION_EXTENSIONS[compression]
+
+
+def open_table(out_path, compression=None):
+    """
+    open a table file for writing text
+
+    :param out_path: path to save output to
+    :param compression: None, 'gzip' or 'zstd' (needs the zstandard package)
+    :return: file object
+    """
+
+    if compression is None:
+        return open(out_path, 'w')
+    if compression == 'gzip':
+        # no timestamp in the header, so the same table always has the same hash
+        return io.TextIOWrapper(gzip.GzipFile(out_path, 'wb', mtime=0))
+    if compression == 'zstd':
+        assert zstandard is not None, 'the zstandard package is needed for zstd compression'
+        return zstandard.open(out_path, 'wt')
+
+    raise ValueError('unknown compression: {}'.format(compression))
+
+
+def write_table(chunks, comments, out_path, compression=None):
+    """
+    write a table from an iterable of dataframes (in output order), each one is written as soon as it is made,
+    so only one chunk has to be in memory. the header and column order are taken from the first chunk.
+
+    :param chunks: iterable of pandas.DataFrame
+    :param comments: any comments the user wishes to be added to the output file
+    :param out_path: path to save output to
+    :param compression: None, 'gzip' or 'zstd'
+    :return: number of rows written
+    """
+
+    return write_tables([{None: chunks}], {None: (comments, out_path)}, compression)[None]
+
+
+def write_chunks(out_file, chunks, columns=None):
+    """
+    write chunks of a table to an open file, the header is written with the first chunk with rows
+
+    :param out_file: file object (see open_table)
+    :param chunks: iterable of pandas.DataFrame
+    :param columns: columns of the table if some chunks are already written, None otherwise
+    :return: columns (None if every chunk is empty), number of rows written, an empty chunk (None if there was none)
+    """
+
+    nrows = 0
+    empty_chunk = None
+    for chunk in chunks:
+        if len(chunk) == 0:
+            # no rows, but kept for the header of an empty table (copied so the chunk itself is released)
+            empty_chunk = chunk.iloc[:0].copy()
+            continue
+        chunk.to_csv(out_file, sep='\t', header=columns is None, index=False, columns=columns)
+        columns = list(chunk.columns)
+        nrows += len(chunk)
+
+    return columns, nrows, empty_chunk
+
+
+def write_tables(parts, tables, compression=None):
+    """
+    write several tables at once from an iterable of parts (e.g. the partitions of the data, in output order), each
+    part has some chunks of every table. the chunks of a part are written and released before the next part is taken,
+    so only one part has to be in memory. the tables are the same as writing the chunks of all the parts with
+    write_table.
+
+    :param parts: iterable of dictionaries of table name to iterable of pandas.DataFrame (the chunks are taken out of
+        the dictionaries)
+    :param tables: OrderedDict of table name to (comments, out_path)
+    :param compression: None, 'gzip' or 'zstd'
+    :return: dictionary of table name to number of rows written
+    """
+
+    out_files = OrderedDict()
+    nrows = dict((key, 0) for key in tables.keys())
+    columns = dict((key, None) for key in tables.keys())
+    empty_chunks = dict((key, pd.DataFrame()) for key in tables.keys())
+    with ExitStack() as stack:
+        for key, (comments, out_path) in tables.items():
+            print("saving to: " + out_path)
+            out_files[key] = stack.enter_context(open_table(out_path, compression))
+            out_files[key].write(comments)
+            out_files[key].write("# \n")
+
+        for part in parts:
+            for key in list(part.keys()):
+                columns[key], part_rows, empty_chunk = write_chunks(out_files[key], part.pop(key), columns[key])
+                nrows[key] += part_rows
+                if empty_chunk is not None:
+                    empty_chunks[key] = empty_chunk
+
+        # no rows, still write the header
+        for key, out_file in out_files.items():
+            if columns[key] is None:
+                empty_chunks[key].to_csv(out_file, sep='\t', header=True, index=False)
+
+    return nrows
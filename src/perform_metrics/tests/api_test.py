@@ -0,0 +1,116 @@
+"""
+Tests for the api.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import copy
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import pytest
+from perform_metrics.api import *
+from perform_metrics.run_analysis import main
+
+
+class TestApi(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+        with open('./src/perform_metrics/example/example_general_config.json') as json_file:
+            self.config_json = json.load(json_file)
+        self.configs = [self.config_json,
+                        dict(self.config_json, ranking={"k": 2}, per_sample_metrics={"sd": {"num_std": [1]}}),
+                        dict(self.config_json, compact=True, subset_by={"strain": "UWBF1"}),
+                        dict(self.config_json, contrasts="pairwise")]
+
+    @staticmethod
+    def read_outputs(output_dir):
+        """
+        :return: dictionary of table file name to table contents, and the sorted figure file names
+        """
+        tables = dict()
+        for file_name in sorted(os.listdir(output_dir)):
+            if file_name.endswith('.tsv'):
+                with open(os.path.join(output_dir, file_name)) as table_file:
+                    tables[file_name] = table_file.read()
+        return tables, sorted(file_name for file_name in os.listdir(output_dir) if file_name.endswith('.png'))
+
+    def test_analyze_matches_run(self):
+        """
+        Tests for the `analyze()` and `save_results()` functions:
+            1. Check the saved tables and figures are the same as those of run_analysis.py for each config
+            2. Check the intended output of the returned config is resolved
+        """
+
+        for i, config in enumerate(self.configs):
+            config_file = str(self.tmp_path / 'config_{0:d}.json'.format(i))
+            with open(config_file, 'w') as json_file:
+                json.dump(config, json_file)
+            run_dir = str(self.tmp_path / 'run_{0:d}'.format(i))
+            api_dir = str(self.tmp_path / 'api_{0:d}'.format(i))
+            os.makedirs(run_dir)
+            os.makedirs(api_dir)
+
+            main(config_file, self.data_path, run_dir, 'synthetic', None)
+            results = analyze(self.data, config, 'synthetic')
+            files = save_results(results, api_dir)
+
+            assert results.config['intended_output'] == {"col": "intended_output", "off": "0", "on": "1"}
+            assert (results.ranking is not None) == ('ranking' in config.keys())
+            tables, figures = self.read_outputs(api_dir)
+            assert sorted(files) == sorted(tables.keys())
+            assert (tables, figures) == self.read_outputs(run_dir)
+
+    def test_analyze_in_threads(self):
+        """
+        Tests that analyze does not change its inputs or write anything, and gives the same results when it is called
+        from several threads at once
+        """
+
+        data = self.data.copy()
+        configs = copy.deepcopy(self.configs)
+        files_before = sorted(os.listdir('.'))
+
+        serial = [analyze(self.data, config) for config in self.configs]
+        with ThreadPoolExecutor(4) as executor:
+            threaded = list(executor.map(lambda config: analyze(self.data, config), self.configs * 2))
+
+        pd.testing.assert_frame_equal(self.data, data)
+        assert self.configs == configs
+        assert sorted(os.listdir('.')) == files_before
+        for expected, results in zip(serial * 2, threaded):
+            assert results.config == expected.config
+            assert list(results.figures.keys()) == list(expected.figures.keys())
+            for table_key, table_df in expected.per_sample.items():
+                pd.testing.assert_frame_equal(results.per_sample[table_key], table_df)
+            for expected_metric, metric_results in zip(expected.aggregate, results.aggregate):
+                for key, results_df in expected_metric['record_df_dict'].items():
+                    pd.testing.assert_frame_equal(metric_results['record_df_dict'][key], results_df)
+
+    def test_analyze_silent(self, capsys):
+        """
+        Tests that analyze prints nothing, also while it bootstraps (of a single and of several variants)
+        """
+
+        bootstrap = {"n_resamples": 20}
+        for config in self.configs + [dict(self.config_json, bootstrap=bootstrap),
+                                      dict(self.config_json, contrasts="pairwise", bootstrap=bootstrap)]:
+            analyze(self.data, config)
+
+        assert capsys.readouterr() == ('', '')
+
+    def test_events(self):
+        """
+        Tests that event level configs are refused
+        """
+
+        with pytest.raises(ValueError):
+            analyze(self.data, dict(self.config_json, events={"method": "exact"}))
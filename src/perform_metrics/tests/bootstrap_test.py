@@ -0,0 +1,87 @@
+"""
+Tests for the bootstrap.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.bootstrap import *
+from perform_metrics.group_arrays import make_group_arrays, get_segment_ids
+from perform_metrics.group_metrics import metrics_info
+from perform_metrics.grouped_quantiles import KERNELS, DEFAULT_KERNEL, set_default_kernel
+
+
+class TestBootstrap(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for tests
+        """
+        data = pd.read_csv('./src/perform_metrics/example/synthetic_data.csv', dtype=object)
+        self.group_arrays = make_group_arrays(data, ["experiment_id", "strain", "output_id"], "observed_fluor",
+                                              {"col": "intended_output", "off": "0", "on": "1"})
+        self.config = {'n_resamples': 200, 'seed': 1, 'ci': 90}
+
+    def test_resample_offsets(self):
+        """
+        Tests that every resampled value comes from the same segment
+        """
+
+        offsets = self.group_arrays.offsets
+        resample_index, boot_offsets = resample_offsets(offsets, 5, np.random.default_rng(0))
+
+        assert resample_index.shape == (5, offsets[-1])
+        assert np.array_equal(boot_offsets[:len(offsets)], offsets)
+        segments = get_segment_ids(offsets)
+        for row in resample_index:
+            assert np.array_equal(segments[row], segments)
+
+    def test_bootstrap_metric(self):
+        """
+        Tests for the `bootstrap_metric()` function:
+            1. Check the CI columns have one value per group and parameter, with low <= point estimate <= high
+            2. Check the same seed gives the same CIs, whether or not the work is split across processes
+        """
+
+        for metric_dict in metrics_info:
+            point = metric_dict['grouped_function'](self.group_arrays.values, self.group_arrays.offsets)
+            ci_columns = bootstrap_metric(self.group_arrays, metric_dict['grouped_function'],
+                                          bootstrap_config=self.config)
+
+            assert list(ci_columns.keys()) == ['diff_ci_low', 'diff_ci_high', 'ratio_ci_low', 'ratio_ci_high']
+            for col in CI_COLUMNS:
+                assert ci_columns[col + '_ci_low'].shape == point[col].shape
+                # the on/off distributions do not overlap, so the auc and ks ratios are inf and have no CI
+                finite = np.isfinite(point[col])
+                assert finite.all() or metric_dict['metric'] in ['auc', 'ks']
+                assert np.all(ci_columns[col + '_ci_low'][finite] <= ci_columns[col + '_ci_high'][finite])
+                assert np.all(ci_columns[col + '_ci_low'][finite] <= point[col][finite] + 1e-9)
+                assert np.all(point[col][finite] <= ci_columns[col + '_ci_high'][finite] + 1e-9)
+
+        grouped_function = metrics_info[0]['grouped_function']
+        again = bootstrap_metric(self.group_arrays, grouped_function, bootstrap_config=self.config)
+        ci_columns = bootstrap_metric(self.group_arrays, grouped_function, bootstrap_config=self.config)
+        for col in ci_columns.keys():
+            assert np.array_equal(ci_columns[col], again[col])
+
+    @pytest.mark.parametrize('kernel', KERNELS)
+    def test_process_pool(self, kernel):
+        """
+        Tests that splitting the work across processes gives the same CIs as one process, for every quantile kernel
+        (the numba kernel is compiled in the parent before the pool starts)
+        """
+
+        grouped_function = metrics_info[0]['grouped_function']
+        self.config['max_values'] = 200 * 40
+        set_default_kernel(kernel)
+        try:
+            one_job = bootstrap_metric(self.group_arrays, grouped_function, bootstrap_config=self.config)
+            self.config['n_jobs'] = 2
+            two_jobs = bootstrap_metric(self.group_arrays, grouped_function, bootstrap_config=self.config)
+        finally:
+            set_default_kernel(DEFAULT_KERNEL)
+
+        for col in one_job.keys():
+            assert np.array_equal(one_job[col], two_jobs[col])
@@ -0,0 +1,67 @@
+"""
+Tests for the columnar_cache.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.columnar_cache import *
+from perform_metrics.data_loading import read_data
+from perform_metrics.aggregate_metrics import compute_metrics
+from perform_metrics.group_metrics import metrics_info
+
+
+class TestColumnarCache(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+        self.cache_dir = str(tmp_path / 'cache')
+        self.config = {"observed_output": "observed_fluor", "sample_id": "sample_id"}
+
+    def test_round_trip(self):
+        """
+        Tests for `convert_csv()` and `load_cache()`:
+            1. Check the cache is recognized by read_data
+            2. Check the string columns come back with the same values and the observed output as floats
+            3. Check the arrays are memory-mapped
+        """
+
+        convert_csv(self.data_path, self.cache_dir, self.config)
+        assert is_column_cache(self.cache_dir)
+        assert not is_column_cache(self.data_path)
+
+        cached = read_data(self.cache_dir)
+        assert list(cached.columns) == list(self.data.columns)
+        for col in self.data.columns:
+            if col == 'observed_fluor':
+                assert cached[col].dtype == np.float64
+                assert np.array_equal(cached[col].to_numpy(), self.data[col].astype(float).to_numpy())
+            else:
+                assert list(cached[col].astype(object)) == list(self.data[col])
+
+        # walk back to the memory map
+        base = cached['observed_fluor'].to_numpy()
+        while base is not None and not isinstance(base, np.memmap):
+            base = base.base
+        assert isinstance(base, np.memmap), 'the observed output should be memory-mapped, not copied'
+
+    def test_same_metrics(self):
+        """
+        Tests that the metrics computed from the cache are the same as from the csv
+        """
+
+        convert_csv(self.data_path, self.cache_dir, self.config)
+        cached = load_cache(self.cache_dir)
+        args = (["experiment_id", "strain", "output_id"], "observed_fluor",
+                {"col": "intended_output", "off": "0", "on": "1"}, metrics_info[1]['function'])
+
+        csv_df = compute_metrics(self.data, *args)
+        cached_df = compute_metrics(cached, *args)
+
+        pd.testing.assert_frame_equal(csv_df, cached_df)
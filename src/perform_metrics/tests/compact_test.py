@@ -0,0 +1,103 @@
+"""
+Tests for the compact.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.compact import *
+from perform_metrics.aggregate_metrics import compute_all_metrics
+from perform_metrics.group_arrays import make_group_arrays_dict
+from perform_metrics.run_analysis import main
+
+
+class TestCompact(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+        with open('./src/perform_metrics/example/example_config.json') as json_file:
+            self.config_json = json.load(json_file)
+
+    def run_main(self, name, compact):
+        """
+        run the whole analysis into a new output directory
+
+        :return: dictionary of table file name to table contents
+        """
+        config_json = dict(self.config_json, compact=compact)
+        config_file = str(self.tmp_path / (name + '.json'))
+        with open(config_file, 'w') as json_file:
+            json.dump(config_json, json_file)
+
+        output_dir = str(self.tmp_path / name)
+        os.makedirs(output_dir)
+        main(config_file, self.data_path, output_dir, name, None)
+
+        tables = dict()
+        for file_name in sorted(os.listdir(output_dir)):
+            if file_name.endswith('.tsv'):
+                with open(os.path.join(output_dir, file_name)) as table_file:
+                    tables[file_name] = table_file.read()
+        return tables
+
+    def test_compact_data(self):
+        """
+        Tests for the `make_compact_data()` function:
+            1. Check the string columns are categoricals with the same values
+            2. Check the observed output is float32 with the float32 setting
+            3. Check the compact data uses less memory and the data is not changed without "compact"
+        """
+
+        assert make_compact_data(self.data, self.config_json) is self.data
+
+        config_json = dict(self.config_json, compact={'float32': True})
+        compact_df = make_compact_data(self.data, config_json)
+        assert isinstance(compact_df['strain'].dtype, pd.CategoricalDtype)
+        assert list(compact_df['strain'].astype(object)) == list(self.data['strain'])
+        assert compact_df['observed_fluor'].dtype == np.float32
+        assert compact_df.memory_usage(deep=True).sum() < self.data.memory_usage(deep=True).sum()
+
+        group_arrays_dict = make_group_arrays_dict(compact_df, config_json)
+        assert all(group_arrays.values.dtype == np.float32 for group_arrays in group_arrays_dict.values())
+
+        with pytest.raises(ValueError):
+            make_compact_data(self.data, dict(self.config_json, compact={'float16': True}))
+
+    def test_compact_results(self):
+        """
+        Tests that the compact result tables have small column types and use less memory, but have the same values
+        """
+
+        config_json = dict(self.config_json, compact=True)
+        full_results = compute_all_metrics(self.data, self.config_json)
+        compact_results = compute_all_metrics(make_compact_data(self.data, config_json), config_json)
+
+        for metric_results, compact_metric_results in zip(full_results, compact_results):
+            for key, results_df in metric_results['record_df_dict'].items():
+                compact_df = compact_metric_results['record_df_dict'][key]
+                assert isinstance(compact_df['group_name'].dtype, pd.CategoricalDtype)
+                assert compact_df['off_count'].dtype == np.int8
+                assert compact_df.memory_usage(deep=True).sum() < results_df.memory_usage(deep=True).sum()
+                pd.testing.assert_frame_equal(compact_df.astype(object), results_df.astype(object))
+
+    def test_compact_tables(self):
+        """
+        Tests that a compact run writes the same tables as a standard run
+        """
+
+        standard_tables = self.run_main('standard', False)
+        compact_tables = self.run_main('compact', True)
+
+        assert standard_tables.keys() == compact_tables.keys()
+        for file_name in standard_tables.keys():
+            assert standard_tables[file_name] == compact_tables[file_name], file_name
@@ -0,0 +1,90 @@
+"""
+Tests for the data_loading.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import bz2
+import gzip
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.data_loading import *
+from perform_metrics.run_analysis import main
+
+
+class TestDataLoading(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests: the synthetic data compressed with gzip and bz2
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.config_file = './src/perform_metrics/example/example_config.json'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+
+        self.compressed_paths = list()
+        for extension, open_file in [('.gz', gzip.open), ('.bz2', bz2.open)]:
+            path = str(tmp_path / ('synthetic_data.csv' + extension))
+            with open(self.data_path, 'rb') as in_file, open_file(path, 'wb') as out_file:
+                shutil.copyfileobj(in_file, out_file)
+            self.compressed_paths.append(path)
+
+    def test_read_compressed(self):
+        """
+        Tests for reading compressed csv files:
+            1. Check the compression is found from the extension
+            2. Check the rows are the same as the uncompressed csv
+            3. Check the read throughput is put in the profile
+        """
+
+        assert [get_compression(path) for path in self.compressed_paths] == ['gzip', 'bz2']
+        assert get_compression(self.data_path) is None
+        assert get_compression('data.csv.zst') == 'zstd'
+
+        for path in self.compressed_paths:
+            profile = dict()
+            pd.testing.assert_frame_equal(read_data(path, profile=profile), self.data)
+            assert profile['csv_parser'] == 'pandas'
+            assert profile['files'] == 1
+            assert profile['mb'] == os.path.getsize(path) / 1e6
+            assert profile['seconds'] > 0
+
+        pd.testing.assert_frame_equal(read_data(self.compressed_paths[0], columns=['sample_id', 'strain'], nrows=10),
+                                      self.data[['sample_id', 'strain']].head(10))
+
+    def test_csv_parser(self):
+        """
+        Tests for the `get_csv_parser()` function and the pyarrow parser (if pyarrow is installed)
+        """
+
+        assert get_csv_parser({}) == 'pandas'
+        with pytest.raises(AssertionError):
+            get_csv_parser({'csv_parser': 'polars'})
+
+        pytest.importorskip('pyarrow')
+        data = self.data.copy()
+        data.loc[3, 'observed_fluor'] = np.nan
+        data_path = str(self.tmp_path / 'missing.csv.gz')
+        data.to_csv(data_path, index=False)
+        for columns in [None, ['sample_id', 'observed_fluor']]:
+            expected = data if columns is None else data[columns]
+            pd.testing.assert_frame_equal(read_data(data_path, columns=columns, csv_parser='pyarrow'), expected)
+
+    def test_read_record(self):
+        """
+        Tests that the read throughput of a gzip file is saved in record.json
+        """
+
+        output_dir = str(self.tmp_path / 'output')
+        os.makedirs(output_dir)
+        main(self.config_file, self.compressed_paths[0], output_dir, 'gzip', None)
+        with open(os.path.join(output_dir, 'record.json')) as json_file:
+            record = json.load(json_file)
+        assert record['read']['csv_parser'] == 'pandas'
+        assert record['read']['mb_per_s'] > 0
@@ -0,0 +1,139 @@
+"""
+Tests for the diagnostics.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.diagnostics import *
+from perform_metrics.group_arrays import make_group_arrays_dict, slice_groups
+from perform_metrics.aggregate_metrics import compute_all_metrics
+from perform_metrics.run_analysis import main
+
+
+class TestDiagnostics(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+        with open('./src/perform_metrics/example/example_config.json') as json_file:
+            self.config_json = json.load(json_file)
+
+    def test_size_histogram(self):
+        """
+        Tests for the `make_size_histogram()` function:
+            1. Check each group is counted in its power of 2 bin
+            2. Check the groups and rows add up
+        """
+
+        sizes = np.array([1, 2, 3, 4, 100, 1000])
+        sizes_df = make_size_histogram(sizes)
+
+        assert list(sizes_df['min_rows']) == [1, 2, 4, 64, 512]
+        assert list(sizes_df['groups']) == [1, 2, 1, 1, 1]
+        assert list(sizes_df['rows']) == [1, 5, 4, 100, 1000]
+        assert sizes_df['row_share'].sum() == pytest.approx(1.0)
+
+    @pytest.mark.parametrize('profile', [False, True])
+    def test_group_diagnostics(self, profile):
+        """
+        Tests for the `make_group_diagnostics()` function:
+            1. Check the heaviest groups are the largest groups, for every metric (and the per sample table when the
+               metrics are timed again)
+            2. Check the skew summary and the histogram cover all the rows
+            3. Check recording the costs does not change the results
+        """
+
+        config_json = dict(self.config_json, diagnostics={'top': 3, 'profile': profile})
+        group_arrays_dict = make_group_arrays_dict(self.data, config_json)
+        group_costs_dict = OrderedDict()
+        results = compute_all_metrics(self.data, config_json, group_arrays_dict, group_costs_dict)
+        expected = compute_all_metrics(self.data, config_json, group_arrays_dict)
+        for metric_results, expected_results in zip(results, expected):
+            for key, results_df in expected_results['record_df_dict'].items():
+                pd.testing.assert_frame_equal(metric_results['record_df_dict'][key], results_df)
+
+        assert list(group_costs_dict.keys()) == list(config_json['group_cols_dict'].keys())
+        for key, group_cols in config_json['group_cols_dict'].items():
+            skew_df, sizes_df, heavy_df = make_group_diagnostics(key, group_costs_dict[key])
+            group_sizes = self.data.groupby(group_cols).size()
+
+            assert skew_df['nrows'][0] == len(self.data) == sizes_df['rows'].sum()
+            assert skew_df['ngroups'][0] == len(group_sizes) == sizes_df['groups'].sum()
+            assert skew_df['max_rows'][0] == group_sizes.max()
+            assert skew_df['skew_ratio'][0] == pytest.approx(group_sizes.max() / group_sizes.median())
+            assert set(heavy_df['metric']) == {'perc', 'sd'} | ({PER_SAMPLE_METRIC} if profile else set())
+            for metric, metric_df in heavy_df.groupby('metric'):
+                assert list(metric_df['rows']) == list(group_sizes.sort_values(ascending=False, kind='stable')[:3])
+                assert (metric_df['seconds'] >= 0).all()
+                if not profile:
+                    # the heavy groups are part of the timed run
+                    assert metric_df['seconds'].sum() <= skew_df[metric + '_seconds'][0]
+
+        with pytest.raises(ValueError):
+            get_diagnostics_config({'diagnostics': {'bottom': 3}})
+
+    def test_group_costs(self):
+        """
+        Tests for the `time_grouped_metric()` and `concat_group_costs()` functions:
+            1. Check splitting out the heavy groups gives the same columns as one call
+            2. Check joining the costs of two halves gives the same sizes and heaviest groups as the whole
+        """
+
+        group_arrays = make_group_arrays_dict(self.data, self.config_json)['exp_str_ts']
+        heavy = get_heavy_groups(group_arrays, 3)
+        for metric_dict in metrics_info:
+            columns, seconds, heavy_seconds = time_grouped_metric(group_arrays, metric_dict['grouped_function'], {},
+                                                                  heavy)
+            expected = metric_dict['grouped_function'](group_arrays.values, group_arrays.offsets)
+            assert list(columns.keys()) == list(expected.keys())
+            for col in expected.keys():
+                assert np.array_equal(columns[col], expected[col], equal_nan=True)
+            assert len(heavy_seconds) == 3 and heavy_seconds.sum() <= seconds
+
+        whole = make_group_costs(group_arrays, heavy, OrderedDict())
+        half = len(group_arrays.names) // 2
+        part_costs = list()
+        for start, stop in [(0, half), (half, len(group_arrays.names))]:
+            part = slice_groups(group_arrays, start, stop)
+            part_heavy = get_heavy_groups(part, 3)
+            # the seconds of each heavy group are its position in the whole grouping
+            part_seconds = OrderedDict([('perc', (0.5, (part_heavy + start).astype(np.float64)))])
+            part_costs.append(make_group_costs(part, part_heavy, part_seconds))
+        joined = concat_group_costs(part_costs, 3)
+
+        assert np.array_equal(joined.sizes, whole.sizes)
+        assert np.array_equal(joined.heavy, whole.heavy)
+        assert list(joined.labels) == list(whole.labels)
+        assert np.array_equal(joined.counts, whole.counts)
+        assert np.array_equal(joined.seconds['perc'][1], whole.heavy)
+        assert joined.seconds['perc'][0] == 1.0
+
+    def test_diagnostics_output(self):
+        """
+        Tests that a run with "diagnostics" writes the diagnostics tables
+        """
+
+        config_json = dict(self.config_json, diagnostics={'top': 2})
+        config_file = str(self.tmp_path / 'config.json')
+        with open(config_file, 'w') as json_file:
+            json.dump(config_json, json_file)
+
+        output_dir = str(self.tmp_path / 'output')
+        os.makedirs(output_dir)
+        main(config_file, self.data_path, output_dir, 'diagnostics', None)
+
+        heavy_df = pd.read_csv(os.path.join(output_dir, HEAVY_FILE_NAME), sep='\t', comment='#')
+        assert (heavy_df.groupby(['grouping', 'metric']).size() == 2).all()
+        with open(os.path.join(output_dir, 'record.json')) as json_file:
+            file_names = [file['name'] for file in json.load(json_file)['files']]
+        assert all(file_name in file_names for file_name in [SKEW_FILE_NAME, SIZES_FILE_NAME, HEAVY_FILE_NAME])
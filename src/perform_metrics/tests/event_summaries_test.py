@@ -0,0 +1,131 @@
+"""
+Tests for the event_summaries.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.event_summaries import *
+from perform_metrics.group_arrays import make_group_arrays, get_on_off
+
+
+class TestEventSummaries(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests: an event level csv made from the synthetic data, 50 - 150 events per sample in shuffled order
+        """
+        rng = np.random.default_rng(0)
+        samples = pd.read_csv('./src/perform_metrics/example/synthetic_data.csv', dtype=object)
+        nevents = rng.integers(50, 150, len(samples))
+        events = samples.loc[samples.index.repeat(nevents)].reset_index(drop=True)
+        events['observed_fluor'] = rng.lognormal(np.log(events['observed_fluor'].astype(float)), 0.3)
+        self.events = events.sample(frac=1, random_state=0).reset_index(drop=True)
+        self.data_path = str(tmp_path / 'events.csv')
+        self.events.to_csv(self.data_path, index=False)
+
+        self.config = {"observed_output": "observed_fluor", "sample_id": "sample_id",
+                       "events": {"quantiles": [25, 50, 75], "chunksize": 997}}
+        self.expected = self.events.groupby('sample_id')['observed_fluor'].describe()
+
+    def test_exact(self):
+        """
+        Tests for the exact method:
+            1. Check the counts, means and quantiles match pandas for every sample
+            2. Check the observed output is the median and the other columns come from the samples
+        """
+
+        summary_df, events = read_events(self.data_path, self.config)
+        expected = self.expected.loc[summary_df['sample_id']].reset_index(drop=True)
+
+        assert len(summary_df) == len(self.expected)
+        assert np.array_equal(summary_df['event_count'], expected['count'])
+        assert np.allclose(summary_df['event_mean'], expected['mean'])
+        assert np.allclose(summary_df['event_p25'], expected['25%'])
+        assert np.allclose(summary_df['event_p75'], expected['75%'])
+        assert np.array_equal(summary_df['observed_fluor'], summary_df['event_p50'])
+        assert np.array_equal(np.diff(events.offsets), summary_df['event_count'])
+
+        strains = self.events.groupby('sample_id')['strain'].first().loc[summary_df['sample_id']]
+        assert list(summary_df['strain']) == list(strains)
+
+    def test_exact_streamed(self):
+        """
+        Tests for the exact method when the events of each sample are together:
+            1. Check each sample is summarized as its events end (no events kept), with the same summaries as keeping
+               every event
+            2. Check shuffled events raise SamplesNotContiguous without keeping the events
+        """
+
+        sorted_path = self.data_path.replace('events.csv', 'sorted_events.csv')
+        self.events.sort_values('sample_id', kind='stable').to_csv(sorted_path, index=False)
+        events_config = get_events_config(self.config)
+
+        summary_df, events = read_events(sorted_path, self.config)
+        chunks = pd.read_csv(sorted_path, dtype=object, chunksize=997)
+        kept_df, kept_events = summarize_events(chunks, 'sample_id', 'observed_fluor', events_config, keep_events=True)
+        assert events is None and kept_events is not None
+        pd.testing.assert_frame_equal(summary_df, kept_df)
+        expected = self.expected.loc[summary_df['sample_id']].reset_index(drop=True)
+        assert np.array_equal(summary_df['event_count'], expected['count'])
+        assert np.allclose(summary_df['event_p25'], expected['25%'])
+
+        with pytest.raises(SamplesNotContiguous):
+            summarize_events(pd.read_csv(self.data_path, dtype=object, chunksize=997), 'sample_id', 'observed_fluor',
+                             events_config)
+
+    def test_sketch_range(self):
+        """
+        Tests that sketch values below sketch_range[0] (zero, negative and small events) are counted at the lowest
+        edge and values above sketch_range[1] at the highest edge, while the mean uses the actual values
+        """
+
+        chunk = pd.DataFrame({'sample_id': ['a'] * 3 + ['b'] * 3 + ['c'] * 3,
+                              'observed_fluor': ['0', '-5', '0.5', '-1', '2e6', '3e6', '3e6', '4e6', '5e6']})
+        self.config['events']['method'] = 'sketch'
+        summary_df, _ = summarize_events([chunk], 'sample_id', 'observed_fluor', get_events_config(self.config))
+
+        assert np.array_equal(summary_df['event_count'], [3, 3, 3])
+        assert np.allclose(summary_df['event_mean'], [-1.5, (5e6 - 1) / 3, 4e6])
+        assert np.allclose(summary_df.loc[0, ['event_p25', 'event_p50', 'event_p75']].astype(float), 1)
+        assert np.isclose(summary_df.loc[1, 'event_p25'], 1) and np.isclose(summary_df.loc[1, 'event_p75'], 1e6)
+        assert np.allclose(summary_df.loc[2, ['event_p25', 'event_p50', 'event_p75']].astype(float), 1e6)
+
+    def test_sketch(self):
+        """
+        Tests that the mean is exact, and each sketch quantile is between the two events on either side of the
+        exact quantile (give or take a bin width)
+        """
+
+        self.config['events']['method'] = 'sketch'
+        summary_df, events = read_events(self.data_path, self.config)
+        expected = self.expected.loc[summary_df['sample_id']].reset_index(drop=True)
+
+        assert events is None
+        assert np.allclose(summary_df['event_mean'], expected['mean'])
+
+        bin_width = (1e6 ** (1 / 2000)) - 1
+        grouped = self.events.groupby('sample_id')['observed_fluor']
+        for percent in [25, 50, 75]:
+            lower = grouped.quantile(percent / 100, interpolation='lower').loc[summary_df['sample_id']].to_numpy()
+            higher = grouped.quantile(percent / 100, interpolation='higher').loc[summary_df['sample_id']].to_numpy()
+            sketch = summary_df['event_p{}'.format(percent)].to_numpy()
+            assert (sketch >= lower * (1 - bin_width)).all() and (sketch <= higher * (1 + bin_width)).all()
+
+    def test_pooled(self):
+        """
+        Tests that the pooled group arrays hold all the events of the samples in each group and state
+        """
+
+        summary_df, events = read_events(self.data_path, self.config)
+        intended_output = {"col": "intended_output", "off": "0", "on": "1"}
+        group_arrays = make_group_arrays(summary_df, ["strain"], "observed_fluor", intended_output)
+        pooled = make_pooled_group_arrays(group_arrays, summary_df, "sample_id", events)
+
+        for i, strain in enumerate(pooled.names):
+            on, off = get_on_off(pooled, i)
+            strain_df = self.events[self.events['strain'] == strain]
+            assert np.allclose(np.sort(on), np.sort(strain_df[strain_df['intended_output'] == '1']['observed_fluor']))
+            assert np.allclose(np.sort(off), np.sort(strain_df[strain_df['intended_output'] == '0']['observed_fluor']))
@@ -0,0 +1,147 @@
+"""
+Tests for the governor.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.governor import *
+from perform_metrics.compact import read_compact_csv, make_compact_data
+from perform_metrics.config_parsing import resolve_intended_output
+from perform_metrics.group_arrays import make_group_arrays_dict
+from perform_metrics.run_analysis import main
+
+
+class TestGovernor(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.config_file = './src/perform_metrics/example/example_config.json'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+        with open(self.config_file) as json_file:
+            self.config_json = json.load(json_file)
+
+    def run_main(self, name, max_memory_mb, config_file=None):
+        """
+        run the whole analysis into a new output directory
+
+        :return: output directory, dictionary of table file name to table contents
+        """
+        output_dir = str(self.tmp_path / name)
+        os.makedirs(output_dir)
+        main(config_file or self.config_file, self.data_path, output_dir, name, None, max_memory_mb)
+
+        tables = dict()
+        for file_name in sorted(os.listdir(output_dir)):
+            if file_name.endswith('.tsv'):
+                with open(os.path.join(output_dir, file_name)) as table_file:
+                    tables[file_name] = table_file.read()
+        return output_dir, tables
+
+    def test_choose_strategy(self):
+        """
+        Tests for the `choose_strategy()` function:
+            1. Check a large budget runs in memory
+            2. Check a budget under every estimate spills
+            3. Check chunked and spill are estimated to use less memory than in memory
+        """
+
+        execution = choose_strategy(self.config_json, self.data_path, 1e9)
+        assert execution['strategy'] == 'in_memory'
+        estimates = execution['estimated_peak_mb']
+        assert list(estimates.keys()) == STRATEGIES
+        assert estimates['chunked'] <= estimates['in_memory']
+        assert estimates['spill'] <= estimates['chunked']
+
+        assert choose_strategy(self.config_json, self.data_path, 0)['strategy'] == 'spill'
+
+    def test_strategy_config(self):
+        """
+        Tests that the strategy config is compact and the input config is not changed
+        """
+
+        config_json = json.loads(json.dumps(self.config_json))
+        assert get_strategy_config(config_json, 'in_memory') == self.config_json
+        chunked_config = get_strategy_config(config_json, 'chunked')
+        assert chunked_config['compact'] is True
+        assert chunked_config['output_block_size'] <= SMALL_BLOCK_SIZE
+        assert config_json == self.config_json
+
+        with pytest.raises(AssertionError):
+            get_strategy_config(config_json, 'disk')
+
+    def test_read_compact_csv(self):
+        """
+        Tests that reading a csv file in chunks gives the same data as reading it all and making it compact
+        """
+
+        config_json = dict(self.config_json, compact=True)
+        compact_df = read_compact_csv(self.data_path, config_json, chunksize=7)
+        expected_df = make_compact_data(self.data, config_json)
+
+        assert list(compact_df.columns) == list(expected_df.columns)
+        for col in compact_df.columns:
+            assert list(compact_df[col].astype(object)) == list(expected_df[col].astype(object)), col
+
+    def test_strategy_tables(self):
+        """
+        Tests that a spill run (read in chunks and memory-mapped) writes the same tables as an in memory run, records
+        the execution and removes the spill directory
+        """
+
+        _, in_memory_tables = self.run_main('in_memory', None)
+        output_dir, spill_tables = self.run_main('spill', 0)
+        assert spill_tables == in_memory_tables
+        assert not os.path.exists(os.path.join(output_dir, SPILL_DIR_NAME))
+        with open(os.path.join(output_dir, 'record.json')) as json_file:
+            execution = json.load(json_file)['execution']
+        assert execution['strategy'] == 'spill'
+        assert execution['max_memory_mb'] == 0
+
+        # several contrasts spill the group arrays of every level
+        config_file = str(self.tmp_path / 'contrasts.json')
+        with open(config_file, 'w') as json_file:
+            json.dump(dict(self.config_json, contrasts="pairwise"), json_file)
+        _, in_memory_tables = self.run_main('contrasts_in_memory', None, config_file)
+        _, spill_tables = self.run_main('contrasts_spill', 0, config_file)
+        assert spill_tables == in_memory_tables
+
+    def test_spill_group_arrays(self):
+        """
+        Tests that the values and row index of spilled group arrays are memory-mapped with the same contents, and that
+        the spill estimate does not hold them
+        """
+
+        intended_output = resolve_intended_output(self.config_json['intended_output'], self.data)
+        config_json = dict(self.config_json, intended_output=intended_output)
+        group_arrays_dict = make_group_arrays_dict(self.data, config_json)
+        spill_dir = str(self.tmp_path / SPILL_DIR_NAME)
+        spilled = spill_group_arrays_dict(group_arrays_dict, spill_dir)
+
+        assert list(spilled.keys()) == list(group_arrays_dict.keys())
+        for key, group_arrays in group_arrays_dict.items():
+            for field in group_arrays._fields:
+                if field in ['values', 'row_index']:
+                    assert isinstance(getattr(spilled[key], field), np.memmap)
+                    np.testing.assert_array_equal(getattr(spilled[key], field), getattr(group_arrays, field))
+                else:
+                    assert getattr(spilled[key], field) is getattr(group_arrays, field)
+        remove_spill(spill_dir)
+        assert not os.path.exists(spill_dir)
+
+        plan = plan_run(self.config_json, self.data_path)
+        arrays_mb = list()
+        for value_bytes in [16.0, 0.0]:
+            stages = estimate_stages(dict(plan['data'], value_bytes=value_bytes), plan['groupings'], self.config_json,
+                                     DEFAULT_COEFFICIENTS)
+            arrays_mb.extend(stage['memory_mb'] for stage in stages if stage['stage'] == 'group_arrays')
+        assert arrays_mb[1] < arrays_mb[0]
@@ -0,0 +1,103 @@
+"""
+Tests for the group_arrays.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.group_arrays import *
+
+
+class TestGroupArrays(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for tests
+        """
+        self.data = pd.read_csv('./src/perform_metrics/example/synthetic_data.csv', dtype=object)
+        self.intended_output = {"col": "intended_output", "off": "0", "on": "1"}
+
+    def test_make_group_arrays(self):
+        """
+        Tests for the `make_group_arrays()` function:
+            1. Check the groups are in the same order as a pandas groupby
+            2. Check the offsets cover every value
+            3. Check the on/off slices match selecting from the DataFrame
+        """
+
+        group_cols = ["experiment_id", "strain"]
+        group_arrays = make_group_arrays(self.data, group_cols, "observed_fluor", self.intended_output)
+
+        grouped_df = self.data.groupby(group_cols)
+        assert group_arrays.keys == list(grouped_df.groups.keys())
+        assert group_arrays.offsets[-1] == len(group_arrays.values) == self.data.shape[0]
+        assert get_segment_lengths(group_arrays).shape == (grouped_df.ngroups, 2)
+
+        for i, (name, group) in enumerate(grouped_df):
+            on, off = get_on_off(group_arrays, i)
+            off_df = group[group['intended_output'] == '0']['observed_fluor'].astype('float')
+            on_df = group[group['intended_output'] == '1']['observed_fluor'].astype('float')
+            assert np.array_equal(off, off_df.to_numpy())
+            assert np.array_equal(on, on_df.to_numpy())
+
+            # the row index points back to the same rows of the data
+            on_rows = group_arrays.row_index[get_segment(group_arrays, i, ON)]
+            assert np.array_equal(self.data.index[on_rows], on_df.index)
+
+    def test_missing_states(self):
+        """
+        Tests that rows which are neither on nor off are dropped, but their groups are kept with empty segments
+        """
+
+        data = self.data.copy()
+        data.loc[data['strain'] == 'UWBF2', 'intended_output'] = '2'
+        group_arrays = make_group_arrays(data, ["strain"], "observed_fluor", self.intended_output)
+
+        assert group_arrays.names == ['UWBF1', 'UWBF2']
+        assert list(get_segment_lengths(group_arrays)[1]) == [0, 0]
+        assert len(group_arrays.values) == (data['strain'] == 'UWBF1').sum()
+
+    def test_select_states(self):
+        """
+        Tests that selecting the states of a contrast from the group arrays of all the levels is the same as making
+        the group arrays with only those states
+        """
+
+        data = self.data.copy()
+        data.loc[data['sample_id'].astype(int) % 3 == 0, 'intended_output'] = '2'
+        group_cols = ["experiment_id", "strain", "output_id"]
+        level_arrays = make_group_arrays(data, group_cols, "observed_fluor", self.intended_output,
+                                         states=['0', '1', '2'])
+        assert get_segment_lengths(level_arrays).shape == (len(level_arrays.names), 3)
+
+        for off, on in [('0', '1'), ('0', '2'), ('2', '1')]:
+            expected = make_group_arrays(data, group_cols, "observed_fluor", dict(self.intended_output, off=off, on=on))
+            selected = select_states(level_arrays, [off, on])
+            assert selected.states == expected.states
+            assert np.array_equal(selected.values, expected.values)
+            assert np.array_equal(selected.offsets, expected.offsets)
+            assert np.array_equal(selected.row_index, expected.row_index)
+
+    def test_group_arrays_cache(self):
+        """
+        Tests that configs with the same grouping share its group arrays through the cache, and a different observed
+        output does not
+        """
+
+        config_json = {"observed_output": "observed_fluor", "intended_output": self.intended_output,
+                       "group_cols_dict": {"exp_str": ["experiment_id", "strain"]}}
+        other_config = dict(config_json, group_cols_dict={"by_strain": ["experiment_id", "strain"],
+                                                          "exp_str_ts": ["experiment_id", "strain", "output_id"]})
+        cache = dict()
+        group_arrays_dict = make_group_arrays_dict(self.data, config_json, cache)
+        other_dict = make_group_arrays_dict(self.data, other_config, cache)
+        assert len(cache) == 2
+        assert other_dict['by_strain'] is group_arrays_dict['exp_str']
+        assert np.array_equal(other_dict['exp_str_ts'].values,
+                              make_group_arrays_dict(self.data, other_config)['exp_str_ts'].values)
+
+        data = self.data.assign(other_fluor=self.data['observed_fluor'])
+        make_group_arrays_dict(data, dict(config_json, observed_output="other_fluor"), cache)
+        assert len(cache) == 3
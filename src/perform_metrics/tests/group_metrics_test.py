@@ -137,3 +137,107 @@ class TestGroupMetric(object):
         records_w_na = compute_metric_sd(on_w_na, off_w_na)
 
         assert records_w_na == records, 'Your function appears to not be ignoring NA values'
+
+    def test_custom_grids(self):
+        """
+        Tests for user supplied percent and num_std grids:
+            1. Check a record is returned for each value in the grid, in the given order
+            2. Check the values match the default grid for shared parameters
+        """
+
+        default_perc = compute_metric_percent(self.on, self.off)
+        records = compute_metric_percent(self.on, self.off, percents=[50, 90, 100])
+
+        assert [item['percentile'] for item in records] == [50, 90, 100]
+        assert records[0] == default_perc[2], 'The median record should not depend on the grid'
+        assert records[2] == default_perc[0], 'The max record should not depend on the grid'
+
+        default_sd = compute_metric_sd(self.on, self.off)
+        records = compute_metric_sd(self.on, self.off, num_std=[0.5, 3])
+
+        assert [item['num_std'] for item in records] == [0.5, 3]
+        assert records[1] == default_sd[3], 'The 3 SD record should not depend on the grid'
+        assert records[0]['off_agg'] == np.mean(self.off) + 0.5 * np.std(self.off)
+
+        # empty states return nan for every parameter
+        records = compute_metric_percent([], self.off, percents=[75, 50])
+        assert len(records) == 2
+        assert all(np.isnan(item['on_agg']) for item in records)
+
+    def test_compute_metric_auc_ks(self):
+        """
+        Tests for the `compute_metric_auc()` and `compute_metric_ks()` functions:
+            1. Check the records have the fold and the usual metric columns
+            2. Check the values for ON above OFF with one tie (ON 100 - 200, OFF 0 - 100)
+            3. Check nan values are ignored and empty states give nan
+        """
+
+        auc_records = compute_metric_auc(self.on, self.off)
+        ks_records = compute_metric_ks(self.on, self.off)
+
+        for records in [auc_records, ks_records]:
+            assert len(records) == 1
+            assert list(records[0].keys()) == ['fold', 'off_agg', 'on_agg', 'diff', 'ratio']
+        assert auc_records[0]['on_agg'] == (101 * 101 - 0.5) / (101 * 101)
+        assert auc_records[0]['off_agg'] == pytest.approx(0.5 / (101 * 101))
+        assert ks_records[0]['on_agg'] == 100 / 101
+        assert ks_records[0]['off_agg'] == 0
+        assert ks_records[0]['ratio'] == np.inf
+
+        # with OFF doubled, ON is no longer always higher
+        records = compute_metric_auc(self.on, self.off, folds=[1, 2])
+        assert [item['fold'] for item in records] == [1, 2]
+        assert records[0] == auc_records[0]
+        assert 0.5 < records[1]['on_agg'] < records[0]['on_agg']
+
+        assert compute_metric_ks(np.r_[self.on, np.nan], np.r_[np.nan, self.off]) == ks_records
+        assert np.isnan(compute_metric_auc([], self.off)[0]['on_agg'])
+        assert np.isnan(compute_metric_ks(self.on, [np.nan])[0]['off_agg'])
+
+    def test_grouped_separation(self):
+        """
+        Tests that the grouped AUC and KS statistics match the per group functions and scipy, with ties, nan values and
+        empty states
+        """
+
+        stats = pytest.importorskip('scipy.stats')
+        rng = np.random.default_rng(0)
+        offsets = np.r_[0, np.cumsum(rng.integers(0, 30, 300))]
+        values = np.round(rng.normal(10, 3, offsets[-1]))
+        values[rng.random(offsets[-1]) < 0.1] = np.nan
+
+        for fold in [1, 1.5]:
+            auc_columns = grouped_metric_auc(values, offsets, [fold])
+            ks_columns = grouped_metric_ks(values, offsets, [fold])
+            for i in range(150):
+                off = values[offsets[2 * i]:offsets[2 * i + 1]]
+                on = values[offsets[2 * i + 1]:offsets[2 * i + 2]]
+                for columns, records in [(auc_columns, compute_metric_auc(on, off, [fold])),
+                                         (ks_columns, compute_metric_ks(on, off, [fold]))]:
+                    for col in columns.keys():
+                        assert np.allclose(columns[col][i], records[0][col], equal_nan=True)
+
+                on = on[~np.isnan(on)]
+                off = off[~np.isnan(off)] * fold
+                if len(on) > 0 and len(off) > 0:
+                    assert np.isclose(auc_columns['on_agg'][i, 0],
+                                      stats.mannwhitneyu(on, off).statistic / (len(on) * len(off)))
+                    assert np.isclose(max(ks_columns['on_agg'][i, 0], ks_columns['off_agg'][i, 0]),
+                                      stats.ks_2samp(on, off).statistic)
+
+    def test_get_metrics(self):
+        """
+        Tests for the `config_parsing.get_metrics()` function:
+            1. Check the opt in metrics (auc, ks) are not run by default
+            2. Check the "metrics" of the config select the metrics, in the order of metrics_info
+            3. Check an unknown metric is an error
+        """
+
+        from perform_metrics.config_parsing import get_metrics
+
+        assert [metric_dict['metric'] for metric_dict in get_metrics(dict(), metrics_info)] == ['perc', 'sd']
+        metric_dicts = get_metrics({'metrics': ['ks', 'perc', 'auc']}, metrics_info)
+        assert [metric_dict['metric'] for metric_dict in metric_dicts] == ['perc', 'auc', 'ks']
+
+        with pytest.raises(ValueError):
+            get_metrics({'metrics': ['median']}, metrics_info)
@@ -0,0 +1,79 @@
+"""
+Tests for the grouped_quantiles.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.grouped_quantiles import *
+from perform_metrics.aggregate_metrics import compute_metrics
+from perform_metrics.group_metrics import metrics_info
+
+
+class TestGroupedQuantiles(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for tests
+        """
+        rng = np.random.default_rng(0)
+        sizes = rng.integers(0, 20, 200)
+        self.offsets = np.r_[0, np.cumsum(sizes)]
+        self.values = rng.normal(100, 25, self.offsets[-1])
+        self.values[rng.random(self.offsets[-1]) < 0.1] = np.nan
+        self.percents = [0, 12.5, 25, 50, 66.6, 75, 99, 100]
+
+    @pytest.mark.parametrize('kernel', KERNELS)
+    def test_matches_nanpercentile(self, kernel):
+        """
+        Tests that every kernel returns exactly what np.nanpercentile returns for each segment, including nan for
+        empty or all nan segments
+        """
+
+        results = grouped_nanpercentile(self.values, self.offsets, self.percents, kernel=kernel)
+
+        assert results.shape == (len(self.offsets) - 1, len(self.percents))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for i in range(len(self.offsets) - 1):
+                segment = self.values[self.offsets[i]:self.offsets[i + 1]]
+                correct = np.nanpercentile(segment, self.percents) if len(segment) > 0 else np.nan
+                assert np.array_equal(results[i], np.broadcast_to(correct, results[i].shape), equal_nan=True), \
+                    'segment {} does not match np.nanpercentile'.format(i)
+
+    def test_grouped_metric(self):
+        """
+        Tests that the grouped percentile metric gives the same table as calling compute_metric_percent per group
+        """
+
+        data = pd.read_csv('./src/perform_metrics/example/synthetic_data.csv', dtype=object)
+        args = (data, ["experiment_id", "strain", "output_id"], "observed_fluor",
+                {"col": "intended_output", "off": "0", "on": "1"}, metrics_info[0]['function'])
+
+        per_group_df = compute_metrics(*args)
+        grouped_df = compute_metrics(*args, grouped_function=metrics_info[0]['grouped_function'])
+
+        pd.testing.assert_frame_equal(per_group_df, grouped_df)
+
+    @pytest.mark.parametrize('kernel', KERNELS)
+    def test_sliding_window_percentile(self, kernel):
+        """
+        Tests that every kernel returns what np.percentile returns for each window, for windows sliding forward,
+        windows that do not overlap the previous one, windows going back and empty windows
+        """
+
+        values = self.values[~np.isnan(self.values)]
+        starts = np.array([0, 0, 2, 5, 5, 30, 31, 3, 10, 10, 12], dtype=np.int64)
+        ends = np.array([0, 4, 9, 9, 20, 40, 45, 8, 10, 15, 25], dtype=np.int64)
+
+        results = sliding_window_percentile(values, starts, ends, self.percents, kernel=kernel)
+
+        assert results.shape == (len(starts), len(self.percents))
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            correct = np.percentile(values[start:end], self.percents) if end > start else np.nan
+            assert np.array_equal(results[i], np.broadcast_to(correct, results[i].shape), equal_nan=True), \
+                'window {} does not match np.percentile'.format(i)
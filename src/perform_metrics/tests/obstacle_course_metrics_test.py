@@ -44,3 +44,16 @@ class TestObstacleCourse(object):
         # check the column names are being properly created
         assert list(records_df.columns) == ['experiment_id', 'strain', 'group_name', 'off_count', 'on_count',
                                             'percentile', 'off_agg', 'on_agg', 'diff', 'ratio']
+
+    def test_bad_metric_params(self):
+        """
+        Tests that a metric_params entry with the wrong parameter name gives a clear error
+        """
+
+        config = {"observed_output": "observed_fluor",
+                  "intended_output": {"col": "intended_output", "off": "0", "on": "1"},
+                  "group_cols_dict": {"exp_str": ["experiment_id", "strain"]},
+                  "metric_params": {"perc": {"num_std": [1, 2]}}}
+
+        with pytest.raises(ValueError, match="not a parameter of the 'perc' metric"):
+            run_functions(self.data, config, '.')
@@ -0,0 +1,136 @@
+"""
+Tests for the partitioned_data.py script (and reading partitioned data with data_loading.py)
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import gc
+import json
+import os
+import weakref
+
+import numpy as np
+import pandas as pd
+import pytest
+import perform_metrics.partitioned_data as partitioned_data
+from perform_metrics.partitioned_data import *
+from perform_metrics.data_loading import find_partition_files, read_data
+from perform_metrics.plot_summaries import load_plot_summaries
+from perform_metrics.run_analysis import main
+
+
+class TestPartitionedData(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests: the synthetic data split into experiment_id=.../strain.csv files
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.config_file = './src/perform_metrics/example/example_config.json'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+        self.output_dirs = dict()
+
+        self.partition_dir = str(tmp_path / 'partitions')
+        for (experiment, strain), group in self.data.groupby(['experiment_id', 'strain']):
+            out_dir = os.path.join(self.partition_dir, 'experiment_id=' + experiment)
+            os.makedirs(out_dir, exist_ok=True)
+            group.drop(columns='experiment_id').to_csv(os.path.join(out_dir, strain + '.csv'), index=False)
+
+    def run_main(self, data_path, name, n_jobs=1):
+        """
+        run the whole analysis into a new output directory
+
+        :return: dictionary of table file name to table contents
+        """
+        with open(self.config_file) as json_file:
+            config_json = json.load(json_file)
+        config_json['n_jobs'] = n_jobs
+        config_file = str(self.tmp_path / (name + '.json'))
+        with open(config_file, 'w') as json_file:
+            json.dump(config_json, json_file)
+
+        output_dir = str(self.tmp_path / ('output_' + name))
+        os.makedirs(output_dir)
+        main(config_file, data_path, output_dir, name, None)
+
+        tables = dict()
+        for file_name in sorted(os.listdir(output_dir)):
+            if file_name.endswith('.tsv'):
+                with open(os.path.join(output_dir, file_name)) as table_file:
+                    tables[file_name] = table_file.read()
+        self.output_dirs[name] = output_dir
+        return tables
+
+    def test_read_partitions(self):
+        """
+        Tests for reading a directory and a glob pattern:
+            1. Check the hive partition values are found for every file
+            2. Check the rows are the same as the csv, with experiment_id from the directory names
+        """
+
+        files = find_partition_files(self.partition_dir)
+        assert [partition['experiment_id'] for _, partition in files] == ['exp1', 'exp1', 'exp2', 'exp2']
+        assert get_partition_col(files, {'group_cols_dict': {'a': ['experiment_id'], 'b': ['experiment_id', 'strain']}}) \
+            == 'experiment_id'
+        assert get_partition_col(files, {'group_cols_dict': {'a': ['strain', 'experiment_id']}}) is None
+
+        for data_path in [self.partition_dir, os.path.join(self.partition_dir, '*', '*.csv')]:
+            data_df = read_data(data_path, n_jobs=2)[self.data.columns]
+            pd.testing.assert_frame_equal(data_df.sort_values('sample_id', key=lambda x: x.astype(int))
+                                          .reset_index(drop=True), self.data)
+
+    @pytest.mark.parametrize('n_jobs', [1, 2])
+    def test_partitioned_analysis(self, n_jobs):
+        """
+        Tests that analyzing each experiment on its own gives the same tables (and box plot statistics) as analyzing
+        the whole csv
+        """
+
+        whole_tables = self.run_main(self.data_path, 'whole')
+        partition_tables = self.run_main(self.partition_dir, 'partitions', n_jobs)
+
+        assert whole_tables.keys() == partition_tables.keys()
+        for file_name in whole_tables.keys():
+            assert whole_tables[file_name] == partition_tables[file_name], file_name
+
+        whole_summaries = load_plot_summaries(self.output_dirs['whole'])
+        partition_summaries = load_plot_summaries(self.output_dirs['partitions'])
+        assert list(whole_summaries.keys()) == list(partition_summaries.keys())
+        for img_name, summary in whole_summaries.items():
+            # the titles have the name of the run
+            for key, value in [(key, value) for key, value in summary.items() if key != 'title']:
+                if isinstance(value, np.ndarray):
+                    np.testing.assert_array_equal(value, partition_summaries[img_name][key])
+                else:
+                    assert value == partition_summaries[img_name][key], (img_name, key)
+
+    def test_partitions_streamed(self, monkeypatch):
+        """
+        Tests that the per sample chunks of a partition are written and released before the next partition is
+        analyzed, so they are never all in memory
+        """
+
+        chunk_refs = list()
+        analyzed = list()
+
+        def track(chunks):
+            for chunk in chunks:
+                chunk_refs.append(weakref.ref(chunk))
+                yield chunk
+
+        def analyze(data_df, config_json):
+            gc.collect()
+            assert len(chunk_refs) > 0 or len(analyzed) == 0
+            assert all(ref() is None for ref in chunk_refs)
+            part = analyze_partition_df(data_df, config_json)
+            part['sample_chunks'] = {table_key: track(chunks) for table_key, chunks in part['sample_chunks'].items()}
+            analyzed.append(len(data_df))
+            return part
+
+        monkeypatch.setattr(partitioned_data, 'analyze_partition_df', analyze)
+        partition_tables = self.run_main(self.partition_dir, 'partitions')
+        whole_tables = self.run_main(self.data_path, 'whole')
+
+        assert len(analyzed) == 2
+        assert partition_tables == whole_tables
@@ -0,0 +1,103 @@
+"""
+Tests for the pipeline.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import json
+import os
+import threading
+import time
+
+import pytest
+from perform_metrics.pipeline import *
+from perform_metrics.make_record import make_hash
+from perform_metrics.run_analysis import main
+
+
+class TestPipeline(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+
+    def test_prefetch(self):
+        """
+        Tests for the `prefetch()` function:
+            1. Check the items come out in order
+            2. Check the producer is at most max_ahead items ahead of the consumer
+            3. Check errors in the producer are raised in the consumer
+        """
+
+        produced = list()
+
+        def items():
+            for i in range(10):
+                produced.append(i)
+                yield i
+
+        for i in prefetch(items(), max_ahead=2):
+            time.sleep(0.01)
+            # the item being used, up to 2 waiting in the queue, and 1 waiting to be put
+            assert len(produced) <= i + 4
+        assert produced == list(range(10))
+
+        def failing():
+            yield 1
+            raise ValueError('bad chunk')
+
+        with pytest.raises(ValueError, match='bad chunk'):
+            list(prefetch(failing()))
+
+    @pytest.mark.parametrize('threads', [0, 2])
+    def test_output_writer(self, threads):
+        """
+        Tests that the writer writes every file, hashes it, and never has more than max_pending files waiting
+        """
+
+        writer = OutputWriter(str(self.tmp_path), threads=threads, max_pending=2)
+        written = list()
+        lock = threading.Lock()
+
+        def write(file_name, text):
+            time.sleep(0.01)
+            with open(os.path.join(str(self.tmp_path), file_name), 'w') as out_file:
+                out_file.write(text)
+            with lock:
+                written.append(file_name)
+
+        file_names = ['file_{}.txt'.format(i) for i in range(6)]
+        for i, file_name in enumerate(file_names):
+            writer.write(file_name, write, file_name, file_name * 1000)
+            with lock:
+                assert i + 1 - len(written) <= 2
+        files = writer.get_file_records(file_names)
+        writer.close()
+
+        assert [file['name'] for file in files] == file_names
+        for file in files:
+            assert file['hash_md5'] == make_hash(os.path.join(str(self.tmp_path), file['name']))
+
+    def test_pipelined_run(self):
+        """
+        Tests that a run with background writer threads gives the same files and hashes as a sequential run
+        """
+
+        with open('./src/perform_metrics/example/example_config.json') as json_file:
+            config_json = json.load(json_file)
+
+        records = dict()
+        for threads in [0, 2]:
+            config_json['pipeline'] = {'threads': threads, 'max_pending': 1}
+            config_file = str(self.tmp_path / 'config_{}.json'.format(threads))
+            with open(config_file, 'w') as json_file:
+                json.dump(config_json, json_file)
+            output_dir = str(self.tmp_path / 'output_{}'.format(threads))
+            os.makedirs(output_dir)
+            main(config_file, './src/perform_metrics/example/synthetic_data.csv', output_dir, 'synthetic', None)
+            with open(os.path.join(output_dir, 'record.json')) as json_file:
+                records[threads] = json.load(json_file)['files']
+
+        assert records[0] == records[2]
@@ -0,0 +1,82 @@
+"""
+Tests for the planner.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import json
+import os
+
+import pandas as pd
+import pytest
+from perform_metrics.planner import *
+from perform_metrics.aggregate_metrics import compute_all_metrics
+from perform_metrics.run_analysis import run_plan
+
+
+class TestPlanner(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.config_file = './src/perform_metrics/example/example_config.json'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+        with open(self.config_file) as json_file:
+            self.config_json = json.load(json_file)
+
+    def test_plan_counts(self):
+        """
+        Tests for the `plan_run()` function:
+            1. Check the group counts and output rows are the same as the tables of a real run
+            2. Check the config is not changed
+            3. Check the stages are estimated
+        """
+
+        config_json = json.loads(json.dumps(self.config_json))
+        plan = plan_run(config_json, self.data_path)
+        assert config_json == self.config_json
+
+        full_results = compute_all_metrics(self.data, self.config_json)
+        for grouping_plan in plan['groupings']:
+            key = grouping_plan['grouping']
+            assert grouping_plan['ngroups'] == self.data.groupby(self.config_json['group_cols_dict'][key]).ngroups
+            assert grouping_plan['aggregate_rows'] == sum(len(metric_results['record_df_dict'][key])
+                                                          for metric_results in full_results)
+            assert grouping_plan['per_sample_rows'] == len(self.data)
+
+        assert plan['data']['nrows'] == len(self.data)
+        assert [stage['stage'] for stage in plan['stages']] == ['read', 'group_arrays', 'per_sample', 'aggregate',
+                                                                 'plots']
+        assert plan['seconds'] > 0 and plan['peak_mb'] > 0
+
+    def test_plan_first_rows(self):
+        """
+        Tests that reading only the first rows scales the counts to all the rows
+        """
+
+        plan = plan_run(self.config_json, self.data_path, nrows=30)
+
+        assert count_data_rows(self.data_path) == len(self.data)
+        assert plan['data']['nrows'] == len(self.data)
+        assert plan['data']['nrows_read'] == 30
+        assert all(grouping_plan['nvalues'] == len(self.data) for grouping_plan in plan['groupings'])
+
+    def test_run_plan(self):
+        """
+        Tests that the dry run only writes plan.json
+        """
+
+        output_dir = str(self.tmp_path / 'plan')
+        os.makedirs(output_dir)
+        coefficients_file = str(self.tmp_path / 'coefficients.json')
+        with open(coefficients_file, 'w') as json_file:
+            json.dump({'plot_seconds_per_group': 0}, json_file)
+
+        plan = run_plan(self.config_file, self.data_path, output_dir, None, coefficients_file=coefficients_file)
+
+        assert os.listdir(output_dir) == [PLAN_FILE_NAME]
+        with open(os.path.join(output_dir, PLAN_FILE_NAME)) as json_file:
+            assert json.load(json_file)['groupings'][0]['ngroups'] == plan['groupings'][0]['ngroups']
@@ -0,0 +1,81 @@
+"""
+Tests for the plot_summaries.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from matplotlib import cbook
+from perform_metrics.plot_summaries import *
+from perform_metrics.group_arrays import make_group_arrays, get_on_off
+from perform_metrics.run_analysis import main
+
+
+class TestPlotSummaries(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.config_file = './src/perform_metrics/example/example_config.json'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+
+    def test_compute_box_stats(self):
+        """
+        Tests that the box statistics and fliers of each group are the same as matplotlib's (with nan values)
+        """
+
+        group_arrays = make_group_arrays(self.data, ["experiment_id", "strain", "output_id"], "observed_fluor",
+                                         {"col": "intended_output", "off": "0", "on": "1"})
+        values = group_arrays.values.copy()
+        values[::7] = np.nan
+        group_arrays = group_arrays._replace(values=values)
+        groups = np.array([3, 0, 2, 7])
+
+        stats, fliers, flier_offsets = compute_box_stats(group_arrays, groups)
+        assert stats.shape == (len(groups), 2, len(BOX_STATS))
+        for i, group in enumerate(groups):
+            on, off = get_on_off(group_arrays, group)
+            for j, state_values in enumerate([off, on]):
+                expected = cbook.boxplot_stats(state_values[~np.isnan(state_values)])[0]
+                assert np.allclose(stats[i, j], [expected[stat] for stat in BOX_STATS])
+                assert np.allclose(np.sort(fliers[flier_offsets[2 * i + j]:flier_offsets[2 * i + j + 1]]),
+                                   np.sort(expected['fliers']))
+
+    def test_replot(self):
+        """
+        Tests for the `replot()` function:
+            1. Check the summaries of every figure of a run are saved and read back the same
+            2. Check every figure is drawn again from the summaries alone
+        """
+
+        output_dir = str(self.tmp_path / 'output')
+        os.makedirs(output_dir)
+        main(self.config_file, self.data_path, output_dir, 'replot', None)
+        figures = sorted(file_name[:-len('.png')] for file_name in os.listdir(output_dir)
+                         if file_name.endswith('.png'))
+        assert len(figures) == 9
+
+        summaries = load_plot_summaries(output_dir)
+        assert sorted(summaries.keys()) == figures
+        summary = summaries['on_vs_off_exp_str']
+        assert summary['kind'] == 'on_vs_off'
+        assert sorted(summary['labels']) == ['exp1, UWBF1', 'exp1, UWBF2', 'exp2, UWBF1', 'exp2, UWBF2']
+        save_plot_summaries(summaries, str(self.tmp_path))
+        for img_name, summary in load_plot_summaries(str(self.tmp_path)).items():
+            for field, value in summary.items():
+                if isinstance(value, np.ndarray):
+                    assert np.array_equal(value, summaries[img_name][field], equal_nan=value.dtype.kind == 'f')
+                else:
+                    assert value == summaries[img_name][field]
+
+        replot_dir = str(self.tmp_path / 'replot')
+        os.makedirs(replot_dir)
+        assert sorted(replot(output_dir, replot_dir)) == figures
+        assert sorted(file_name[:-len('.png')] for file_name in os.listdir(replot_dir)) == figures
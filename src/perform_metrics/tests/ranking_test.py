@@ -0,0 +1,91 @@
+"""
+Tests for the ranking.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.ranking import *
+from perform_metrics.aggregate_metrics import compute_all_metrics
+from perform_metrics.run_analysis import main
+
+
+class TestRanking(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.data = pd.read_csv(self.data_path, dtype=object)
+        with open('./src/perform_metrics/example/example_config.json') as json_file:
+            self.config_json = json.load(json_file)
+
+    def test_top_k_indices(self):
+        """
+        Tests for the `top_k_indices()` function:
+            1. Check the positions are the same as a full stable sort, with ties and nan values
+            2. Check k larger than the number of values returns every non nan value
+        """
+
+        rng = np.random.default_rng(0)
+        values = rng.integers(0, 20, 1000).astype(np.float64)
+        values[rng.random(1000) < 0.1] = np.nan
+        valid = np.flatnonzero(~np.isnan(values))
+
+        for k in [1, 5, 50]:
+            top = valid[np.argsort(-values[valid], kind='stable')][:k]
+            bottom = valid[np.argsort(values[valid], kind='stable')][:k]
+            assert np.array_equal(top_k_indices(values, k), top)
+            assert np.array_equal(top_k_indices(values, k, largest=False), bottom)
+
+        assert len(top_k_indices(values, 5000)) == len(valid)
+        assert len(top_k_indices(np.full(3, np.nan), 2)) == 0
+
+    def test_make_ranking(self):
+        """
+        Tests that the ranked groups are the best and worst rows of the metric tables at the plot parameter
+        """
+
+        full_results = compute_all_metrics(self.data, self.config_json)
+        ranked_df = make_ranking(full_results, {'k': 3, 'by': ['ratio', 'diff']})
+
+        for metric_results in full_results:
+            param_col, param_value = metric_results['plot_metric']
+            for key, results_df in metric_results['record_df_dict'].items():
+                rows_df = results_df[results_df[param_col] == param_value]
+                for by in ['ratio', 'diff']:
+                    selected = ranked_df[(ranked_df['metric'] == metric_results['metric']) &
+                                         (ranked_df['grouping'] == key) & (ranked_df['by'] == by)]
+                    top = selected[selected['rank_type'] == 'top']
+                    assert list(top['rank']) == list(range(1, len(top) + 1))
+                    assert np.array_equal(top[by], rows_df[by].nlargest(3))
+                    bottom = selected[selected['rank_type'] == 'bottom']
+                    assert np.array_equal(bottom[by], rows_df[by].nsmallest(3))
+
+    def test_ranking_output(self):
+        """
+        Tests that a run with "ranking" writes the ranked groups table and can limit the plots
+        """
+
+        config_json = dict(self.config_json, ranking={'k': 2, 'by': 'ratio', 'limit_plots': True})
+        config_file = str(self.tmp_path / 'config.json')
+        with open(config_file, 'w') as json_file:
+            json.dump(config_json, json_file)
+
+        output_dir = str(self.tmp_path / 'output')
+        os.makedirs(output_dir)
+        main(config_file, self.data_path, output_dir, 'ranking', None)
+
+        ranked_df = pd.read_csv(os.path.join(output_dir, RANKING_FILE_NAME), sep='\t', comment='#')
+        assert set(ranked_df['grouping']) == set(self.config_json['group_cols_dict'].keys())
+        assert (ranked_df.groupby(['metric', 'grouping', 'rank_type']).size() <= 2).all()
+        assert os.path.exists(os.path.join(output_dir, 'on_vs_off_exp_str.png'))
+        with open(os.path.join(output_dir, 'record.json')) as json_file:
+            assert RANKING_FILE_NAME in [file['name'] for file in json.load(json_file)['files']]
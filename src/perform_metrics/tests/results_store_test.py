@@ -0,0 +1,70 @@
+"""
+Tests for the results_store.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.results_store import *
+from perform_metrics.run_analysis import main
+
+
+class TestResultsStore(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests: a config that adds the results to a store in tmp_path
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        self.store_path = str(tmp_path / 'results.sqlite')
+        with open('./src/perform_metrics/example/example_config.json') as json_file:
+            self.config_json = json.load(json_file)
+        self.config_json['results_store'] = self.store_path
+
+    def run_main(self, name):
+        """
+        run the whole analysis into a new output directory
+        """
+        config_file = str(self.tmp_path / (name + '.json'))
+        with open(config_file, 'w') as json_file:
+            json.dump(self.config_json, json_file)
+        output_dir = str(self.tmp_path / name)
+        os.makedirs(output_dir)
+        main(config_file, self.data_path, output_dir, name, None)
+
+        return output_dir
+
+    def test_store_runs(self):
+        """
+        Tests for storing and querying runs:
+            1. Check every row of every aggregate table is stored once per run
+            2. Check a query by group column and metric parameter matches the table in the output directory
+            3. Check the config hash is the same for the same config
+        """
+
+        output_dir = self.run_main('run1')
+        self.run_main('run2')
+
+        all_df = query_metrics(self.store_path)
+        table_rows = 0
+        for file_name in os.listdir(output_dir):
+            if file_name.startswith('metrics_'):
+                table_rows += len(pd.read_csv(os.path.join(output_dir, file_name), sep='\t', comment='#'))
+        assert len(all_df) == 2 * table_rows
+        assert all_df['run_id'].nunique() == 2
+        assert all_df['config_hash'].nunique() == 1
+
+        query_df = query_metrics(self.store_path, metric='perc', param_value=50, where={'strain': 'UWBF1'})
+        table_df = pd.read_csv(os.path.join(output_dir, 'metrics_per__exp_str.tsv'), sep='\t', comment='#')
+        table_df = table_df[(table_df['strain'] == 'UWBF1') & (table_df['percentile'] == 50)]
+
+        exp_str_df = query_df[query_df['grouping'] == 'exp_str']
+        assert len(exp_str_df) == 2 * len(table_df)
+        assert np.allclose(sorted(exp_str_df['ratio']), sorted(list(table_df['ratio']) * 2))
+        assert (query_df['strain'] == 'UWBF1').all()
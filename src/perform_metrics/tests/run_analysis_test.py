@@ -0,0 +1,82 @@
+"""
+Tests for the run_analysis.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import json
+import os
+
+import pytest
+from perform_metrics.run_analysis import *
+
+
+class TestRunAnalysis(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+        self.data_path = './src/perform_metrics/example/synthetic_data.csv'
+        with open('./src/perform_metrics/example/example_config.json') as json_file:
+            config_json = json.load(json_file)
+        self.config_files = list()
+        for name, config in [('full', config_json),
+                             ('compact', dict(config_json, compact=True,
+                                              group_cols_dict={"exp_str": ["experiment_id", "strain"]},
+                                              per_sample_metrics={"perc": {"percents": [50]},
+                                                                  "sd": {"num_std": [0, 1]}})),
+                             ('subset', dict(config_json, subset_by={"strain": "UWBF1"})),
+                             ('shared', dict(config_json, group_cols_dict={
+                                 "by_strain": ["experiment_id", "strain"], "by_rep": ["experiment_id", "replicate"]}))]:
+            config_file = str(tmp_path / (name + '.json'))
+            with open(config_file, 'w') as json_file:
+                json.dump(config, json_file)
+            self.config_files.append(config_file)
+
+    @staticmethod
+    def read_tables(output_dir):
+        """
+        :return: dictionary of table file name to table contents
+        """
+        tables = dict()
+        for file_name in sorted(os.listdir(output_dir)):
+            if file_name.endswith('.tsv'):
+                with open(os.path.join(output_dir, file_name)) as table_file:
+                    tables[file_name] = table_file.read()
+        return tables
+
+    def test_run_sweep(self):
+        """
+        Tests for the `run_sweep()` function:
+            1. Check each config has its own directory with the config and record.json
+            2. Check the tables are the same as running each config on its own (the last config shares a grouping
+               with the first)
+        """
+
+        sweep_dir = str(self.tmp_path / 'sweep')
+        sub_dirs = run_sweep(self.config_files, self.data_path, sweep_dir, 'sweep', None)
+        assert [os.path.basename(sub_dir) for sub_dir in sub_dirs] == ['full', 'compact', 'subset', 'shared']
+
+        for config_file, sub_dir in zip(self.config_files, sub_dirs):
+            assert os.path.exists(os.path.join(sub_dir, os.path.basename(config_file)))
+            with open(os.path.join(sub_dir, 'record.json')) as json_file:
+                record = json.load(json_file)
+            assert len(record['files']) > 0
+
+            output_dir = str(self.tmp_path / ('single_' + os.path.basename(sub_dir)))
+            os.makedirs(output_dir)
+            main(config_file, self.data_path, output_dir, 'sweep', None)
+            sweep_tables = self.read_tables(sub_dir)
+            assert len(sweep_tables) > 0
+            assert sweep_tables == self.read_tables(output_dir)
+        assert 'per_sample_metric_sd_exp_str.tsv' in os.listdir(sub_dirs[1])
+
+    def test_sweep_directories(self):
+        """
+        Tests that configs with the same file name get different directories
+        """
+
+        assert get_sweep_directories(['a/config.json', 'b/config.json', 'other.json'], 'out') == \
+            [os.path.join('out', 'config'), os.path.join('out', 'config_2'), os.path.join('out', 'other')]
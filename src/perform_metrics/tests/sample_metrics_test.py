@@ -11,7 +11,7 @@ Tests for the sample_metrics.py script
 import numpy as np
 import pytest
 from perform_metrics.sample_metrics import *
-from perform_metrics.group_metrics import compute_metric_percent
+from perform_metrics.group_metrics import compute_metric_percent, compute_metric_sd, metrics_info
 
 
 class TestSampleMetric(object):
@@ -66,3 +66,73 @@ class TestSampleMetric(object):
         assert (off_vals['on_agg'] - off_vals['off_agg']) == off_vals['diff']
         assert (off_vals['on_agg'] / off_vals['off_agg']) == off_vals['ratio']
 
+
+    def test_other_metric(self):
+        """
+        Tests that compute_metrics works with a metric function other than the percentile one
+        """
+
+        records_df = compute_metrics(self.data, ["experiment_id", "strain"], "observed_fluor",
+                                     {"col": "intended_output", "off": "0", "on": "1"}, compute_metric_sd,
+                                     sample_id="sample_id")
+
+        assert len(records_df) == self.data.shape[0]
+        assert 'num_std' in records_df.columns
+        assert np.unique(records_df['num_std']) == 0
+
+    @pytest.mark.parametrize('metric_dict', metrics_info, ids=[metric_dict['metric'] for metric_dict in metrics_info])
+    @pytest.mark.parametrize('overlap', [False, True])
+    def test_grouped_metric(self, metric_dict, overlap):
+        """
+        Tests that the grouped (and sample) functions of every metric give the same per sample rows as computing the
+        metric for each sample, with a row for each parameter, on the example data and on values where ON and OFF
+        overlap, with ties and nan values
+        """
+
+        data = self.data
+        if overlap:
+            rng = np.random.default_rng(7)
+            values = np.round(rng.uniform(0, 3, len(data)), 1)
+            values[rng.choice(len(data), 20, replace=False)] = np.nan
+            data = data.assign(observed_fluor=values)
+        # the default parameters and a grid of several values (the parameter name comes from the function)
+        function_params = {'perc': {'percents': [50, 75, 100]}, 'sd': {'num_std': [0, 1, 2]}}.get(
+            metric_dict['metric'], {'folds': [0.5, 1, 2]})
+        args = (data, ["experiment_id", "strain", "output_id"], "observed_fluor",
+                {"col": "intended_output", "off": "0", "on": "1"}, metric_dict['function'])
+
+        for params in [dict(), function_params]:
+            expected = compute_metrics(*args, sample_id="sample_id", function_params=params)
+            grouped = compute_metrics(*args, sample_id="sample_id", function_params=params,
+                                      grouped_function=metric_dict['grouped_function'],
+                                      sample_function=metric_dict.get('sample_function'))
+
+            nparams = len(metric_dict['function']([1.0], [1.0], **params))
+            assert len(grouped) == data.shape[0] * nparams
+            assert list(grouped.columns) == list(expected.columns)
+            for col in grouped.columns:
+                if grouped[col].dtype.kind == 'f':
+                    assert np.allclose(grouped[col], expected[col], equal_nan=True)
+                else:
+                    assert list(grouped[col]) == list(expected[col])
+
+    def test_per_sample_tables(self):
+        """
+        Tests for the `get_per_sample_tables()` function:
+            1. Check the default is the percentile table of each grouping, with its original name
+            2. Check other metrics get their own tables, and an unknown metric or parameter is an error
+        """
+
+        config_json = {"group_cols_dict": {"exp_str": ["experiment_id", "strain"], "exp": ["experiment_id"]}}
+        tables = get_per_sample_tables(config_json)
+        assert list(tables.keys()) == ['exp_str', 'exp']
+        assert tables['exp'][1]['metric'] == 'perc' and tables['exp'][2] == {'percents': [50]}
+
+        config_json['per_sample_metrics'] = {"perc": {"percents": [50, 75]}, "sd": {"num_std": [0, 2]}}
+        tables = get_per_sample_tables(config_json)
+        assert list(tables.keys()) == ['exp_str', 'sd_exp_str', 'exp', 'sd_exp']
+        assert tables['sd_exp'] == ('exp', metrics_info[1], {"num_std": [0, 2]})
+
+        for per_sample_metrics in [{"median": {}}, {"sd": {"percents": [50]}}]:
+            with pytest.raises(ValueError):
+                get_per_sample_tables(dict(config_json, per_sample_metrics=per_sample_metrics))
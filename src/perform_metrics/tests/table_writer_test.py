@@ -0,0 +1,67 @@
+"""
+Tests for the table_writer.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import gzip
+import os
+
+import pandas as pd
+import pytest
+from perform_metrics.table_writer import *
+from perform_metrics.sample_metrics import run_functions
+
+
+class TestTableWriter(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.data = pd.read_csv('./src/perform_metrics/example/synthetic_data.csv', dtype=object)
+        self.config = {"observed_output": "observed_fluor",
+                       "intended_output": {"col": "intended_output", "off": "0", "on": "1"},
+                       "group_cols_dict": {"exp_str_ts": ["experiment_id", "strain", "output_id"]},
+                       "sample_id": "sample_id"}
+        self.out_dir = str(tmp_path)
+
+    def test_write_table(self):
+        """
+        Tests for the `write_table()` function:
+            1. Check writing in chunks gives the same file as writing the whole table
+            2. Check the gzip file has the same contents
+        """
+
+        table = pd.DataFrame({'a': range(10), 'b': [x / 3 for x in range(10)]})
+        whole_path = os.path.join(self.out_dir, 'whole.tsv')
+        chunk_path = os.path.join(self.out_dir, 'chunks.tsv')
+
+        assert write_table([table], '# comment\n', whole_path) == 10
+        assert write_table([table[:3], table[3:3], table[3:]], '# comment\n', chunk_path) == 10
+        with open(whole_path) as whole_file, open(chunk_path) as chunk_file:
+            whole = whole_file.read()
+            assert whole == chunk_file.read()
+        assert whole.startswith('# comment\n# \na\tb\n')
+
+        gzip_path = os.path.join(self.out_dir, get_table_file_name('chunks.tsv', 'gzip'))
+        write_table([table[:3], table[3:]], '# comment\n', gzip_path, compression='gzip')
+        assert gzip_path.endswith('.tsv.gz')
+        with gzip.open(gzip_path, 'rt') as gzip_file:
+            assert gzip_file.read() == whole
+
+    def test_block_size(self):
+        """
+        Tests that the per sample tables do not depend on the block size
+        """
+
+        _, files = run_functions(self.data, self.config, self.out_dir)
+        with open(os.path.join(self.out_dir, files[0])) as out_file:
+            whole = out_file.read()
+
+        self.config['output_block_size'] = 7
+        self.config['output_compression'] = 'gzip'
+        _, files = run_functions(self.data, self.config, self.out_dir)
+        assert files == ['per_sample_metric_exp_str_ts.tsv.gz']
+        with gzip.open(os.path.join(self.out_dir, files[0]), 'rt') as out_file:
+            assert out_file.read() == whole
@@ -0,0 +1,74 @@
+"""
+Tests for the transitions.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.transitions import *
+from perform_metrics.group_arrays import get_on_off, get_segment_lengths
+from perform_metrics.aggregate_metrics import compute_metrics
+from perform_metrics.group_metrics import metrics_info
+
+
+class TestTransitions(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for tests
+        """
+        self.data = pd.read_csv('./src/perform_metrics/example/synthetic_data.csv', dtype=object)
+        self.series_cols = ["experiment_id", "strain", "output_id"]
+        self.intended_output = {"col": "intended_output", "off": "0", "on": "1"}
+
+    def test_make_transition_arrays(self):
+        """
+        Tests for the `make_transition_arrays()` function on the synthetic data:
+            1. Check there is one transition per time series (ts1 is OFF->ON, ts2 is ON->OFF, both from time 1 to 2)
+            2. Check the on/off values are the samples of the time points before/after the transition
+        """
+
+        arrays = make_transition_arrays(self.data, self.series_cols, "time", "observed_fluor", self.intended_output)
+
+        assert arrays.group_cols == self.series_cols + TRANSITION_COLS
+        assert len(arrays.keys) == self.data.groupby(self.series_cols).ngroups
+        for i, key in enumerate(arrays.keys):
+            assert key[3:5] == ('1', '2')
+            assert key[5] == ('OFF->ON' if key[2] == 'ts1' else 'ON->OFF')
+
+            series_df = self.data[(self.data[self.series_cols] == key[:3]).all(axis=1)]
+            on_time, off_time = ('2', '1') if key[5] == 'OFF->ON' else ('1', '2')
+            on, off = get_on_off(arrays, i)
+            assert np.array_equal(on, series_df[series_df['time'] == on_time]['observed_fluor'].astype(float))
+            assert np.array_equal(off, series_df[series_df['time'] == off_time]['observed_fluor'].astype(float))
+
+    def test_time_order(self):
+        """
+        Tests that times are sorted as numbers, a series can switch back and forth, and mixed time points are skipped
+        """
+
+        data = pd.DataFrame({'series': ['a'] * 6 + ['b'] * 2,
+                             'time': ['10', '9', '2', '2', '11', '12', '1', '2'],
+                             'state': ['1', '0', '0', '1', '0', '1', '0', '0'],
+                             'value': np.arange(8, dtype=float)})
+        arrays = make_transition_arrays(data, ['series'], 'time', 'value', {"col": "state", "off": "0", "on": "1"})
+
+        # a: 2 (mixed) -> 9 (off) -> 10 (on) -> 11 (off) -> 12 (on), b never changes
+        assert arrays.keys == [('a', '9', '10', 'OFF->ON'), ('a', '10', '11', 'ON->OFF'), ('a', '11', '12', 'OFF->ON')]
+        assert get_segment_lengths(arrays).tolist() == [[1, 1], [1, 1], [1, 1]]
+        assert list(arrays.values) == [1, 0, 4, 0, 4, 5]
+
+    def test_transition_metrics(self):
+        """
+        Tests that the grouped metrics give the same table as the per group functions on the transitions
+        """
+
+        arrays = make_transition_arrays(self.data, self.series_cols, "time", "observed_fluor", self.intended_output)
+        for metric_dict in metrics_info:
+            args = (self.data, arrays.group_cols, "observed_fluor", self.intended_output, metric_dict['function'])
+            per_group_df = compute_metrics(*args, group_arrays=arrays)
+            grouped_df = compute_metrics(*args, group_arrays=arrays, grouped_function=metric_dict['grouped_function'])
+
+            pd.testing.assert_frame_equal(per_group_df, grouped_df)
@@ -0,0 +1,192 @@
+"""
+Tests for the variants.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+import perform_metrics.variants as variants_module
+from perform_metrics.variants import *
+from perform_metrics.config_parsing import resolve_contrasts
+from perform_metrics.group_metrics import metrics_info
+from perform_metrics.run_analysis import main
+
+CHANNELS = ['observed_fluor', 'observed_rfp']
+TABLE_FILES = ['metrics_per__{}.tsv', 'metrics_sd__{}.tsv', 'per_sample_metric_{}.tsv']
+
+
+class TestVariants(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, tmp_path):
+        """
+        setup for tests
+        """
+        self.tmp_path = tmp_path
+        data = pd.read_csv('./src/perform_metrics/example/synthetic_data.csv', dtype=object)
+        rng = np.random.default_rng(0)
+        rfp = data['observed_fluor'].astype(float) * 2 + rng.random(len(data))
+        rfp[rng.random(len(data)) < 0.1] = np.nan
+        data['observed_rfp'] = rfp
+        # a third intended output level
+        data.loc[data['sample_id'].astype(int) % 3 == 0, 'intended_output'] = '2'
+        self.data = data
+        self.data_path = str(tmp_path / 'variants.csv')
+        data.to_csv(self.data_path, index=False)
+        with open('./src/perform_metrics/example/example_config.json') as json_file:
+            self.config_json = json.load(json_file)
+
+    def run_main(self, name, **config):
+        """
+        run the whole analysis into a new output directory
+
+        :return: output directory
+        """
+        config_json = dict(self.config_json, **config)
+        config_file = str(self.tmp_path / (name + '.json'))
+        with open(config_file, 'w') as json_file:
+            json.dump(config_json, json_file)
+
+        output_dir = str(self.tmp_path / name)
+        os.makedirs(output_dir)
+        main(config_file, self.data_path, output_dir, name, None)
+        return output_dir
+
+    def read_table(self, output_dir, file_name):
+        """
+        read an output table
+        """
+        return pd.read_csv(os.path.join(output_dir, file_name), sep='\t', comment='#', dtype={'intended_output': str})
+
+    def check_variant_tables(self, output_dir, col, single_dirs):
+        """
+        check the rows of each variant of the tables are the tables of a run with only that variant
+        """
+        for key in self.config_json['group_cols_dict'].keys():
+            for file_name in TABLE_FILES:
+                table_df = self.read_table(output_dir, file_name.format(key))
+                assert list(table_df[col].unique()) == list(single_dirs.keys())
+                for label, single_dir in single_dirs.items():
+                    variant_df = table_df[table_df[col] == label].drop(columns=col)
+                    expected_df = self.read_table(single_dir, file_name.format(key))
+                    pd.testing.assert_frame_equal(variant_df.reset_index(drop=True), expected_df)
+                assert os.path.exists(os.path.join(output_dir, 'on_vs_off_{}_{}.png'.format(key, label)))
+
+    def test_channel_column(self):
+        """
+        Tests that the tables of a run with several observed outputs have a channel column, and the rows of each channel
+        are the tables of a run with that observed output
+        """
+
+        output_dir = self.run_main('column', observed_output=CHANNELS, ranking=True)
+        single_dirs = {channel: self.run_main(channel, observed_output=channel) for channel in CHANNELS}
+        self.check_variant_tables(output_dir, CHANNEL_COL, single_dirs)
+
+        ranked_df = self.read_table(output_dir, 'ranked_groups.tsv')
+        assert set(ranked_df[CHANNEL_COL]) <= set(CHANNELS)
+
+    def test_contrast_column(self):
+        """
+        Tests that the tables of a run with pairwise contrasts have a contrast column, and the rows of each contrast
+        are the tables of a run with that off and on
+        """
+
+        output_dir = self.run_main('contrasts', contrasts='pairwise')
+        single_dirs = dict()
+        for off, on in [('0', '1'), ('0', '2'), ('1', '2')]:
+            intended_output = dict(self.config_json['intended_output'], off=off, on=on)
+            single_dirs['{}_vs_{}'.format(on, off)] = self.run_main(on + off, intended_output=intended_output)
+        self.check_variant_tables(output_dir, CONTRAST_COL, single_dirs)
+
+    def test_variant_files(self):
+        """
+        Tests that with "channel_output": "files" each variant's tables are written to their own files
+        """
+
+        output_dir = self.run_main('files', observed_output=CHANNELS, contrasts=[{'off': '0', 'on': 'max'}],
+                                   channel_output='files')
+        single_dir = self.run_main('single', observed_output=CHANNELS[1],
+                                   intended_output=dict(self.config_json['intended_output'], on='2'))
+
+        for key in self.config_json['group_cols_dict'].keys():
+            for file_name in TABLE_FILES:
+                variant_key = '{}_{}_2_vs_0'.format(key, CHANNELS[1])
+                with open(os.path.join(output_dir, file_name.format(variant_key))) as table_file:
+                    variant_table = table_file.read()
+                with open(os.path.join(single_dir, file_name.format(key))) as table_file:
+                    assert variant_table == table_file.read()
+                assert not os.path.exists(os.path.join(output_dir, file_name.format(key)))
+
+    def test_variant_config(self):
+        """
+        Tests for the `get_variants()` and `get_variant_config()` functions, and the contrast and observed output
+        checks
+        """
+
+        contrasts = resolve_contrasts('pairwise', 'intended_output', self.data)
+        assert contrasts == [{'off': '0', 'on': '1'}, {'off': '0', 'on': '2'}, {'off': '1', 'on': '2'}]
+        config_json = dict(self.config_json, observed_output=CHANNELS, contrasts=contrasts)
+        variants = get_variants(config_json)
+        assert len(variants) == 6
+        assert list(variants[1]['labels'].items()) == [(CHANNEL_COL, CHANNELS[0]), (CONTRAST_COL, '2_vs_0')]
+
+        variant_config = get_variant_config(config_json, variants[1])
+        assert variant_config['observed_output'] == CHANNELS[0]
+        assert variant_config['intended_output'] == {'col': 'intended_output', 'off': '0', 'on': '2'}
+        assert list(variant_config['group_cols_dict'].keys()) == [get_variant_key(key, variants[1]) for key in
+                                                                  self.config_json['group_cols_dict'].keys()]
+        assert 'contrasts' not in variant_config
+        assert config_json['observed_output'] == CHANNELS
+
+        with pytest.raises(AssertionError):
+            get_channel_output(dict(config_json, channel_output='rows'))
+        with pytest.raises(ValueError):
+            get_observed_outputs(dict(config_json, observed_output=[]))
+        with pytest.raises(ValueError):
+            resolve_contrasts('all', 'intended_output', self.data)
+
+    def test_channel_columns(self, monkeypatch):
+        """
+        Tests for the `compute_channel_columns()` function:
+            1. Check each grouped metric is called once per grouping and contrast, on the segments of every channel
+            2. Check the columns of each variant are those of the grouped metric on that variant's group arrays
+        """
+
+        calls = list()
+
+        def count_calls(grouped_function):
+            def counted(values, offsets, **params):
+                calls.append(len(offsets) - 1)
+                return grouped_function(values, offsets, **params)
+            return counted
+
+        monkeypatch.setattr(variants_module, 'metrics_info', [
+            dict(metric_dict, grouped_function=count_calls(metric_dict['grouped_function'])) for metric_dict in
+            metrics_info if metric_dict.get('grouped_function') is not None])
+        contrasts = resolve_contrasts('pairwise', 'intended_output', self.data)
+        config_json = dict(self.config_json, observed_output=CHANNELS, contrasts=contrasts)
+        level_arrays_dict = make_level_group_arrays_dict(self.data, config_json)
+        variant_columns = compute_channel_columns(level_arrays_dict, self.data, config_json)
+
+        ngroups = {key: len(group_arrays.names) for key, group_arrays in level_arrays_dict.items()}
+        nmetrics = len([metric_dict for metric_dict in variants_module.metrics_info
+                        if not metric_dict.get('opt_in', False)])
+        assert sorted(calls) == sorted([len(CHANNELS) * ngroups[key] * 2 for key in ngroups.keys()
+                                        for _ in contrasts for _ in range(nmetrics)])
+
+        for variant, columns_dict in zip(get_variants(config_json), variant_columns):
+            variant_arrays_dict = make_variant_group_arrays_dict(level_arrays_dict, self.data, config_json, variant)
+            assert len(columns_dict) == nmetrics * len(ngroups)
+            for metric_dict in metrics_info:
+                for key in ngroups.keys():
+                    variant_key = get_variant_key(key, variant)
+                    if (metric_dict['metric'], variant_key) not in columns_dict:
+                        continue
+                    group_arrays = variant_arrays_dict[variant_key]
+                    expected = metric_dict['grouped_function'](group_arrays.values, group_arrays.offsets)
+                    for col, col_values in columns_dict[(metric_dict['metric'], variant_key)]['columns'].items():
+                        np.testing.assert_array_equal(col_values, expected[col])
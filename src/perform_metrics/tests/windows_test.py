@@ -0,0 +1,151 @@
+"""
+Tests for the windows.py script
+
+:license: All Rights Reserved, see LICENSE for more details
+"""
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+from perform_metrics.windows import *
+from perform_metrics.aggregate_metrics import compute_all_metrics
+from perform_metrics.group_metrics import compute_metric_percent, compute_metric_sd
+from perform_metrics.grouped_quantiles import KERNELS
+
+
+class TestWindows(object):
+    @pytest.fixture(autouse=True)
+    def setup(self):
+        """
+        setup for tests
+        """
+        rng = np.random.default_rng(0)
+        nrows = 3000
+        self.data = pd.DataFrame({'experiment_id': rng.choice(['exp1', 'exp2'], nrows),
+                                  'strain': rng.choice(['a', 'b', 'c'], nrows),
+                                  'time': rng.integers(0, 12, nrows).astype(str),
+                                  'intended_output': rng.choice(['0', '1'], nrows),
+                                  'observed_fluor': rng.normal(100, 25, nrows)})
+        self.data.loc[rng.random(nrows) < 0.05, 'observed_fluor'] = np.nan
+        # a short series with fewer time points than the window size
+        self.data.loc[self.data['strain'] == 'c', 'time'] = self.data['time'].where(
+            self.data['time'].isin(['0', '1']), '0')
+        self.series_cols = ['experiment_id', 'strain']
+        self.intended_output = {"col": "intended_output", "off": "0", "on": "1"}
+        self.config = {'observed_output': 'observed_fluor', 'intended_output': self.intended_output,
+                       'group_cols_dict': {'str': ['strain']},
+                       'windows': {'series_cols': self.series_cols, 'size': 4}}
+
+    def get_window_on_off(self, key, size):
+        """
+        on and off values of a window by brute force
+
+        :param key: key of the window (series columns, time_start, time_end)
+        :param size: window size
+        :return: on, off
+        """
+
+        series_df = self.data[(self.data[self.series_cols] == key[:2]).all(axis=1)]
+        times = np.sort(series_df['time'].astype(int).unique())
+        start = int(np.flatnonzero(times == int(key[2]))[0])
+        window_df = series_df[series_df['time'].astype(int).isin(times[start:start + size])]
+        assert str(times[min(start + size, len(times)) - 1]) == key[3]
+        values = window_df['observed_fluor'].to_numpy()
+        on = values[(window_df['intended_output'] == '1').to_numpy()]
+        off = values[(window_df['intended_output'] == '0').to_numpy()]
+
+        return on, off
+
+    def test_make_window_arrays(self):
+        """
+        Tests for the `make_window_arrays()` function:
+            1. Check each series of n time points has n - size + 1 windows, and a short series has one
+            2. Check the values of each window are those of its time points
+        """
+
+        arrays = make_window_arrays(self.data, self.series_cols, 'time', 4, 'observed_fluor', self.intended_output)
+
+        assert arrays.group_cols == self.series_cols + WINDOW_COLS
+        assert len(arrays.keys) == 2 * (2 * (12 - 4 + 1) + 1)
+        for i, key in enumerate(arrays.keys):
+            on, off = self.get_window_on_off(key, 4)
+            assert np.array_equal(np.sort(arrays.values[ON][arrays.starts[i, ON]:arrays.ends[i, ON]]),
+                                  np.sort(on[~np.isnan(on)]))
+            assert np.array_equal(np.sort(arrays.values[OFF][arrays.starts[i, OFF]:arrays.ends[i, OFF]]),
+                                  np.sort(off[~np.isnan(off)]))
+
+    @pytest.mark.parametrize('kernel', KERNELS)
+    def test_window_metrics(self, kernel):
+        """
+        Tests that the incremental window metrics match the per group functions on each window
+        """
+
+        arrays = make_window_arrays(self.data, self.series_cols, 'time', 4, 'observed_fluor', self.intended_output)
+        percent_columns = window_metric_percent(arrays, [0, 25, 50, 90, 100], kernel=kernel)
+        sd_columns = window_metric_sd(arrays, [0, 1, 2])
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            for i, key in enumerate(arrays.keys):
+                on, off = self.get_window_on_off(key, 4)
+                for columns, records in [(percent_columns, compute_metric_percent(on, off, [0, 25, 50, 90, 100])),
+                                         (sd_columns, compute_metric_sd(on, off, [0, 1, 2]))]:
+                    for col in columns.keys():
+                        assert np.allclose(columns[col][i], [record[col] for record in records], equal_nan=True), \
+                            'window {} column {} does not match'.format(key, col)
+
+    def test_window_sd_offset(self):
+        """
+        Tests that the window sd matches np.std when the series have large and different offsets, and is 0 (not nan)
+        for a constant series
+        """
+
+        offsets = {'a': 1e9, 'b': -3e8, 'c': 0.0}
+        data = self.data.copy()
+        data['observed_fluor'] = data['observed_fluor'] / 100 + data['strain'].map(offsets)
+        data.loc[data['strain'] == 'c', 'observed_fluor'] = 7.1
+        arrays = make_window_arrays(data, self.series_cols, 'time', 4, 'observed_fluor', self.intended_output)
+        sd_columns = window_metric_sd(arrays, [0, 1])
+
+        self.data = data
+        for i, key in enumerate(arrays.keys):
+            on, off = self.get_window_on_off(key, 4)
+            on = on[~np.isnan(on)]
+            off = off[~np.isnan(off)]
+            assert np.allclose(sd_columns['off_agg'][i, 1] - sd_columns['off_agg'][i, 0], np.std(off),
+                               rtol=1e-6, atol=1e-6), key
+            assert np.allclose(sd_columns['on_agg'][i, 0] - sd_columns['on_agg'][i, 1], np.std(on),
+                               rtol=1e-6, atol=1e-6), key
+            assert np.allclose(sd_columns['on_agg'][i, 0], np.mean(on), rtol=1e-12), key
+            if key[1] == 'c':
+                assert np.array_equal(sd_columns['on_agg'][i], [7.1, 7.1]), key
+
+        empty = make_window_arrays(data.iloc[:0], self.series_cols, 'time', 4, 'observed_fluor', self.intended_output)
+        assert window_metric_sd(empty)['off_agg'].shape == (0, 4)
+
+    def test_compute_all_metrics(self):
+        """
+        Tests that the windows are a grouping of the aggregate metrics with a window function, with the window
+        columns and the metric parameters of the config, and that other metrics are refused
+        """
+
+        config = dict(self.config, metric_params={'perc': {'percents': [50]}})
+        results = compute_all_metrics(self.data, config)
+
+        for metric_results in results:
+            if metric_results['metric'] not in WINDOW_FUNCTIONS:
+                assert list(metric_results['record_df_dict'].keys()) == ['str']
+                continue
+            assert list(metric_results['record_df_dict'].keys()) == ['str', 'windows']
+            assert metric_results['group_cols_dict']['windows'] == self.series_cols + WINDOW_COLS
+            windows_df = metric_results['record_df_dict']['windows']
+            assert list(windows_df.columns[:6]) == self.series_cols + WINDOW_COLS + ['group_name', 'off_count']
+        assert len(results[0]['record_df_dict']['windows']) == 2 * (2 * (12 - 4 + 1) + 1)
+
+        arrays = make_window_arrays_from_config(self.data, config)
+        with pytest.raises(ValueError):
+            compute_window_metrics(arrays, ['perc', 'other'])
+        with pytest.raises(ValueError):
+            get_windows_config({'windows': {'series_cols': self.series_cols, 'size': 0}})
@@ -0,0 +1,121 @@
+"""
+grouping by transitions: for each time series, every pair of consecutive time points where the intended output
+changes (OFF -> ON or ON -> OFF) is a group, with the samples of the OFF time point as its OFF values and the samples
+of the ON time point as its ON values. the result is a GroupArrays, so all the metrics run on it unchanged.
+
+the rows are sorted once by (series, time), and the time points and transitions are found by comparing shifted
+arrays, so there is no python loop over the series or time points.
+
+:license: see LICENSE for more details
+"""
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.group_arrays import GroupArrays, OFF, ON, to_float_array, take_segments
+
+TRANSITION_COLS = ['time_before', 'time_after', 'transition']
+
+
+def get_time_order(time_series):
+    """
+    sort key for the time column, numeric if every time is a number, otherwise the sorted order of the strings
+
+    :param time_series: pandas.Series of times
+    :return: numpy.ndarray of float64 (nan for missing times)
+    """
+
+    try:
+        return to_float_array(time_series)
+    except (TypeError, ValueError):
+        codes, _ = pd.factorize(time_series, sort=True)
+        return np.where(codes >= 0, codes, np.nan)
+
+
+def make_transition_arrays(data_df, series_cols, time_col, observed_output, intended_output):
+    """
+    build the GroupArrays of the transitions of every time series. only consecutive time points are compared, a time
+    point with a mix of ON and OFF samples (or neither) does not start or end a transition.
+
+    :param data_df: pandas.DataFrame of the data
+    :param series_cols: list of columns identifying a time series (e.g. ["experiment_id", "strain", "output_id"])
+    :param time_col: column with the time of each sample
+    :param observed_output: column name associated with the observed output
+    :param intended_output: dictionary of values associated with the intended output of the on/off states
+    :return: GroupArrays, grouped by series_cols + ['time_before', 'time_after', 'transition']
+    """
+
+    states = [intended_output['off'], intended_output['on']]
+
+    # series code and time for each row, rows with a missing series or time are dropped
+    series = data_df.groupby(series_cols, sort=True, observed=True).ngroup().fillna(-1).to_numpy().astype(np.int64)
+    time = get_time_order(data_df[time_col])
+    state = np.full(len(data_df), -1, dtype=np.int64)
+    for i, state_val in enumerate(states):
+        state[(data_df[intended_output['col']] == state_val).to_numpy()] = i
+
+    rows = np.flatnonzero((series >= 0) & ~np.isnan(time))
+    rows = rows[np.lexsort((time[rows], series[rows]))]
+    row_series = series[rows]
+    row_time = time[rows]
+    row_state = state[rows]
+
+    # time points: runs of rows with the same (series, time)
+    new_point = np.ones(len(rows), dtype=bool)
+    new_point[1:] = (row_series[1:] != row_series[:-1]) | (row_time[1:] != row_time[:-1])
+    point_starts = np.flatnonzero(new_point)
+    point_offsets = np.append(point_starts, len(rows)).astype(np.int64)
+    point_series = row_series[point_starts]
+
+    # a time point only has a state if all its samples agree
+    if len(rows) > 0:
+        min_state = np.minimum.reduceat(row_state, point_starts)
+        max_state = np.maximum.reduceat(row_state, point_starts)
+        point_state = np.where(min_state == max_state, min_state, -1)
+    else:
+        point_state = np.zeros(0, dtype=np.int64)
+
+    # transitions: consecutive time points of the same series with different (known) states
+    before = np.flatnonzero((point_series[1:] == point_series[:-1]) & (point_state[1:] != point_state[:-1]) &
+                            (point_state[1:] >= 0) & (point_state[:-1] >= 0))
+    after = before + 1
+    off_to_on = point_state[before] == OFF
+    off_point = np.where(off_to_on, before, after)
+    on_point = np.where(off_to_on, after, before)
+
+    # segments in (transition, state) order, a time point can be in two transitions
+    segment_points = np.empty(2 * len(before), dtype=np.int64)
+    segment_points[OFF::2] = off_point
+    segment_points[ON::2] = on_point
+    row_index = rows[take_segments(point_offsets, segment_points)]
+    offsets = np.zeros(len(segment_points) + 1, dtype=np.int64)
+    np.cumsum(np.diff(point_offsets)[segment_points], out=offsets[1:])
+
+    values = to_float_array(data_df[observed_output].iloc[row_index])
+
+    # keys: the series columns of the first row of each transition, then the two times and the direction
+    first_rows = rows[point_offsets[before]]
+    series_keys = data_df[series_cols].iloc[first_rows].itertuples(index=False, name=None)
+    time_before = data_df[time_col].iloc[first_rows].to_numpy()
+    time_after = data_df[time_col].iloc[rows[point_offsets[after]]].to_numpy()
+    labels = np.where(off_to_on, 'OFF->ON', 'ON->OFF')
+    keys = [key + (t_before, t_after, label) for key, t_before, t_after, label in
+            zip(series_keys, time_before, time_after, labels)]
+
+    return GroupArrays(group_cols=list(series_cols) + TRANSITION_COLS, names=keys, keys=keys, states=states,
+                       values=values, offsets=offsets, row_index=row_index)
+
+
+def make_transition_arrays_from_config(data_df, config_json):
+    """
+    build the transition GroupArrays from the "transitions" entry of the config
+
+    :param data_df: pandas.DataFrame of the data
+    :param config_json: configuration file, with "transitions": {"series_cols": [...], "time_col": "time"}
+    :return: GroupArrays
+    """
+
+    transitions = config_json['transitions']
+
+    return make_transition_arrays(data_df, transitions['series_cols'], transitions.get('time_col', 'time'),
+                                  config_json['observed_output'], config_json['intended_output'])
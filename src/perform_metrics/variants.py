@@ -0,0 +1,442 @@
+"""
+several observed outputs (channels, e.g. GFP, RFP and OD normalized) and/or several intended output contrasts in one
+run: "observed_output" can be a list of columns, and "contrasts" a list of {"off": level, "on": level} (or "pairwise"
+for every pair of levels of the intended output column) used instead of the on/off of "intended_output".
+
+each (channel, contrast) is a variant of the run. the groups only depend on the group columns, so the group arrays are
+made once with every level of the contrasts as a state (see group_arrays.make_group_arrays), and each variant takes
+its channel's values with the same row index and the segments of its OFF and ON levels (group_arrays.select_states),
+without grouping the data again. each grouped metric is computed for all the channels of a contrast in one call, with
+the (channel, group, state) segments of the channels stacked in one array (see compute_channel_columns), and the tables
+of each variant are made from their part of the columns. the tables either get 'channel' and/or 'contrast' columns
+("channel_output": "column", the default) or are written to one file per variant ("channel_output": "files", the
+grouping names get a _{channel}_{contrast} suffix). the plots are always made for each variant.
+
+:license: see LICENSE for more details
+"""
+
+import itertools
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.config_parsing import get_observed_outputs, get_compact_config, get_contrast_levels, get_metrics
+from perform_metrics.group_arrays import make_group_arrays, select_states, to_float_array, concat_group_arrays
+from perform_metrics.group_metrics import metrics_info
+from perform_metrics.transitions import make_transition_arrays_from_config
+from perform_metrics.aggregate_metrics import compute_all_metrics, save_all_metrics, plot_on_vs_off, \
+    plot_histogram_of_fold_changes, make_on_vs_off_summaries, make_fold_change_summaries
+from perform_metrics.sample_metrics import make_sample_chunks_dict, save_per_sample, get_per_sample_tables
+from perform_metrics.ranking import save_ranking
+from perform_metrics.diagnostics import save_diagnostics, get_diagnostics_config, get_heavy_groups, \
+    time_grouped_metric
+from perform_metrics.plot_summaries import save_plot_summaries
+
+CHANNEL_OUTPUTS = ['column', 'files']
+CHANNEL_COL = 'channel'
+CONTRAST_COL = 'contrast'
+
+
+def is_variant_run(config_json):
+    """
+    whether the config has several observed outputs or contrasts
+
+    :param config_json: configuration file
+    :return: bool
+    """
+
+    return not isinstance(config_json['observed_output'], str) or 'contrasts' in config_json.keys()
+
+
+def get_channel_output(config_json):
+    """
+    how the tables of several variants are written
+
+    :param config_json: configuration file
+    :return: one of CHANNEL_OUTPUTS
+    """
+
+    channel_output = config_json.get('channel_output', CHANNEL_OUTPUTS[0])
+    assert channel_output in CHANNEL_OUTPUTS, \
+        'channel_output must be one of {}, not {}'.format(CHANNEL_OUTPUTS, channel_output)
+
+    return channel_output
+
+
+def get_contrast_label(contrast):
+    """
+    label of a contrast in the tables and file names
+
+    :param contrast: {"off": level, "on": level}
+    :return: str, e.g. '2_vs_0'
+    """
+
+    return '{0}_vs_{1}'.format(contrast['on'], contrast['off'])
+
+
+def get_variants(config_json):
+    """
+    every (channel, contrast) of a run, the contrasts should be resolved (see config_parsing.parse_intended_output)
+
+    :param config_json: configuration file
+    :return: list of dictionaries with 'labels' (OrderedDict of variant column to label, only for the columns that vary),
+        'observed_output' and 'intended_output'
+    """
+
+    channels = get_observed_outputs(config_json)
+    intended_col = config_json['intended_output']['col']
+    contrasts = config_json.get('contrasts', [config_json['intended_output']])
+
+    variants = list()
+    for channel, contrast in itertools.product(channels, contrasts):
+        labels = OrderedDict()
+        if not isinstance(config_json['observed_output'], str):
+            labels[CHANNEL_COL] = channel
+        if 'contrasts' in config_json.keys():
+            labels[CONTRAST_COL] = get_contrast_label(contrast)
+        variants.append({'labels': labels, 'observed_output': channel,
+                         'intended_output': {'col': intended_col, 'off': contrast['off'], 'on': contrast['on']}})
+
+    return variants
+
+
+def get_variant_key(key, variant):
+    """
+    grouping name of a variant (used for its file names)
+
+    :param key: grouping name (key of group_cols_dict)
+    :param variant: variant (see get_variants)
+    :return: str
+    """
+
+    return '_'.join([key] + list(variant['labels'].values()))
+
+
+def get_variant_config(config_json, variant):
+    """
+    config of a single variant: its observed output and on/off, and the grouping names have the variant suffix
+
+    :param config_json: configuration file
+    :param variant: variant (see get_variants)
+    :return: configuration (a new dictionary, the input is not changed)
+    """
+
+    variant_config = dict(config_json)
+    variant_config['observed_output'] = variant['observed_output']
+    variant_config['intended_output'] = variant['intended_output']
+    variant_config['group_cols_dict'] = OrderedDict((get_variant_key(key, variant), group_cols)
+                                                    for key, group_cols in config_json['group_cols_dict'].items())
+    variant_config.pop('contrasts', None)
+    # the transitions are made with the group arrays, under their variant name
+    variant_config.pop('transitions', None)
+
+    return variant_config
+
+
+def get_values_dtype(config_json):
+    """
+    dtype of the group array values (float32 with "compact": {"float32": true})
+
+    :param config_json: configuration file
+    :return: np.float64 or np.float32
+    """
+
+    compact_config = get_compact_config(config_json)
+    return np.float32 if compact_config is not None and compact_config['float32'] else np.float64
+
+
+def make_level_group_arrays_dict(data_df, config_json):
+    """
+    group arrays of every grouping with the first observed output, with every level of the contrasts as a state (or
+    the intended output off and on without contrasts)
+
+    :param data_df: pandas.DataFrame of the data
+    :param config_json: configuration file
+    :return: dictionary of group name (key of group_cols_dict) to GroupArrays
+    """
+
+    states = get_contrast_levels(config_json['contrasts']) if 'contrasts' in config_json.keys() else None
+    observed_output = get_observed_outputs(config_json)[0]
+
+    return {key: make_group_arrays(data_df, group_cols, observed_output, config_json['intended_output'],
+                                   get_values_dtype(config_json), states)
+            for key, group_cols in config_json['group_cols_dict'].items()}
+
+
+def make_variant_group_arrays_dict(level_arrays_dict, data_df, config_json, variant, channel_values=None):
+    """
+    group arrays of a variant from the group arrays of all the levels, only the values and the segments are new
+
+    :param level_arrays_dict: dictionary of GroupArrays for each grouping (see make_level_group_arrays_dict)
+    :param data_df: pandas.DataFrame of the data
+    :param config_json: configuration file
+    :param variant: variant (see get_variants)
+    :param channel_values: optional dictionary to keep the float values of each channel in, so each column is only
+        converted once
+    :return: dictionary of variant grouping name (see get_variant_key) to GroupArrays
+    """
+
+    channel = variant['observed_output']
+    channel_values = dict() if channel_values is None else channel_values
+    if channel not in channel_values:
+        channel_values[channel] = to_float_array(data_df[channel], get_values_dtype(config_json))
+    states = [variant['intended_output']['off'], variant['intended_output']['on']]
+
+    variant_arrays_dict = OrderedDict()
+    for key, group_arrays in level_arrays_dict.items():
+        group_arrays = group_arrays._replace(values=channel_values[channel][group_arrays.row_index])
+        variant_arrays_dict[get_variant_key(key, variant)] = select_states(group_arrays, states)
+    if 'transitions' in config_json.keys():
+        variant_arrays_dict[get_variant_key('transitions', variant)] = make_transition_arrays_from_config(
+            data_df, dict(config_json, observed_output=channel, intended_output=variant['intended_output']))
+
+    return variant_arrays_dict
+
+
+def with_variant_columns(results_df, variant):
+    """
+    a table with the variant columns first (the input table is not changed, it may still be being written)
+
+    :param results_df: pandas.DataFrame
+    :param variant: variant (see get_variants)
+    :return: pandas.DataFrame
+    """
+
+    results_df = results_df.copy(deep=False)
+    for i, (col, label) in enumerate(variant['labels'].items()):
+        results_df.insert(i, col, label)
+
+    return results_df
+
+
+def add_variant_columns(chunks, variant):
+    """
+    put the variant columns first in each table
+
+    :param chunks: iterable of pandas.DataFrame
+    :param variant: variant (see get_variants)
+    :return: generator of pandas.DataFrame
+    """
+
+    for chunk in chunks:
+        yield with_variant_columns(chunk, variant)
+
+
+def combine_variant_results(variant_results, variants, config_json):
+    """
+    join the results of every variant into the results of one run, with the variant columns in every table
+
+    :param variant_results: list of full_results_df_dict (see aggregate_metrics.compute_all_metrics), one for each
+        variant, in the order of variants
+    :param variants: list of variants (see get_variants)
+    :param config_json: configuration file
+    :return: full_results_df_dict, with the grouping names of the config and the variant columns as the first group
+        columns
+    """
+
+    keys = list(config_json['group_cols_dict'].keys())
+    if 'transitions' in config_json.keys():
+        keys.append('transitions')
+
+    full_results_df_dict = list()
+    for i, metric_results in enumerate(variant_results[0]):
+        results_df_dict = OrderedDict()
+        group_cols_dict = OrderedDict()
+        for key in keys:
+            results_df_dict[key] = pd.concat([with_variant_columns(results[i]['record_df_dict'][
+                get_variant_key(key, variant)], variant) for results, variant in zip(variant_results, variants)],
+                ignore_index=True)
+            group_cols_dict[key] = list(variants[0]['labels'].keys()) + list(
+                metric_results['group_cols_dict'][get_variant_key(key, variants[0])])
+        full_results_df_dict.append(dict(metric_results, record_df_dict=results_df_dict,
+                                         group_cols_dict=group_cols_dict))
+
+    return full_results_df_dict
+
+
+def compute_channel_columns(level_arrays_dict, data_df, config_json, channel_values=None, heavy_dict=None):
+    """
+    the grouped metric columns of every variant, each metric of a grouping and contrast is computed for all the
+    channels at once (channels x groups): the GroupArrays of the channels are stacked, so each (channel, group, state)
+    is a segment of one offset indexed array (as the resamples of bootstrap.py), the grouped function is called once
+    and its columns are split back by channel. metrics without a grouped function are computed for each variant.
+
+    :param level_arrays_dict: dictionary of GroupArrays for each grouping (see make_level_group_arrays_dict)
+    :param data_df: pandas.DataFrame of the data
+    :param config_json: configuration file, with a list of observed outputs and/or contrasts (resolved)
+    :param channel_values: optional dictionary to keep the float values of each channel in
+    :param heavy_dict: optional dictionary of grouping name to the positions of its heaviest groups (see
+        diagnostics.get_heavy_groups), the calls of the first contrast are then timed (the seconds are those of every
+        channel)
+    :return: list (one for each variant, see get_variants) of dictionaries of (metric, variant grouping name) to a
+        dictionary with 'columns', 'seconds' and 'heavy_seconds' (see aggregate_metrics.compute_all_metrics)
+    """
+
+    variants = get_variants(config_json)
+    channel_values = dict() if channel_values is None else channel_values
+    for channel in get_observed_outputs(config_json):
+        if channel not in channel_values:
+            channel_values[channel] = to_float_array(data_df[channel], get_values_dtype(config_json))
+    metric_params = config_json.get('metric_params', dict())
+    grouped_metrics = [metric_dict for metric_dict in get_metrics(config_json, metrics_info)
+                       if metric_dict.get('grouped_function') is not None]
+
+    variant_columns = [OrderedDict() for _ in variants]
+    contrasts = OrderedDict()
+    for i, variant in enumerate(variants):
+        contrasts.setdefault((variant['intended_output']['off'], variant['intended_output']['on']), list()).append(i)
+    for key, level_arrays in level_arrays_dict.items():
+        for states, positions in contrasts.items():
+            contrast_arrays = select_states(level_arrays, list(states))
+            ngroups = len(contrast_arrays.names)
+            stacked = concat_group_arrays([contrast_arrays._replace(
+                values=channel_values[variants[i]['observed_output']][contrast_arrays.row_index]) for i in positions],
+                [0] * len(positions))
+            timed = heavy_dict is not None and positions[0] == 0
+            for metric_dict in grouped_metrics:
+                function_params = metric_params.get(metric_dict['metric'], dict())
+                seconds = heavy_seconds = None
+                if timed:
+                    columns, seconds, heavy_seconds = time_grouped_metric(
+                        stacked, metric_dict['grouped_function'], function_params, heavy_dict[key])
+                else:
+                    columns = metric_dict['grouped_function'](stacked.values, stacked.offsets, **function_params)
+                for block, i in enumerate(positions):
+                    variant_columns[i][(metric_dict['metric'], get_variant_key(key, variants[i]))] = {
+                        'columns': OrderedDict((col, col_values[block * ngroups:(block + 1) * ngroups])
+                                               for col, col_values in columns.items()),
+                        'seconds': seconds, 'heavy_seconds': heavy_seconds}
+
+    return variant_columns
+
+
+def iter_variant_results(data_df, config_json, level_arrays_dict, channel_values=None, group_costs_dict=None,
+                         verbose=True):
+    """
+    compute the per sample table chunks and the aggregate metrics of each variant in turn
+
+    :param data_df: pandas.DataFrame of the data
+    :param config_json: configuration file, with a list of observed outputs and/or contrasts (resolved)
+    :param level_arrays_dict: dictionary of GroupArrays for each grouping (see make_level_group_arrays_dict)
+    :param channel_values: optional dictionary to keep the float values of each channel in
+    :param group_costs_dict: optional dictionary to add the costs of each grouping of the first variant to (see
+        aggregate_metrics.compute_all_metrics), the groups are the same for every variant
+    :param verbose: print the progress of the aggregate metrics (see aggregate_metrics.compute_all_metrics)
+    :return: generator of (variant, variant_config, variant_arrays_dict, variant_chunks_dict, results), the chunks
+        are computed as they are read
+    """
+
+    if 'windows' in config_json.keys():
+        raise ValueError('windows can not be used with several observed outputs or contrasts')
+    channel_values = dict() if channel_values is None else channel_values
+    variants = get_variants(config_json)
+
+    # the grouped metrics of the config groupings are computed for every channel at once, timed on the first variant
+    heavy_dict = None
+    diagnostics_config = get_diagnostics_config(config_json) if group_costs_dict is not None else None
+    if diagnostics_config is not None and not diagnostics_config['profile']:
+        states = [variants[0]['intended_output']['off'], variants[0]['intended_output']['on']]
+        heavy_dict = {key: get_heavy_groups(select_states(level_arrays, states), diagnostics_config['top'])
+                      for key, level_arrays in level_arrays_dict.items()}
+    variant_columns = compute_channel_columns(level_arrays_dict, data_df, config_json, channel_values, heavy_dict)
+
+    for i, variant in enumerate(variants):
+        variant_config = get_variant_config(config_json, variant)
+        variant_arrays_dict = make_variant_group_arrays_dict(level_arrays_dict, data_df, config_json, variant,
+                                                             channel_values)
+        variant_chunks_dict = make_sample_chunks_dict(data_df, variant_config, variant_arrays_dict)
+        results = compute_all_metrics(data_df, variant_config, variant_arrays_dict,
+                                      group_costs_dict if i == 0 else None, variant_columns[i], verbose)
+        yield variant, variant_config, variant_arrays_dict, variant_chunks_dict, results
+
+
+def compute_variants(data_df, config_json, input_file_name, verbose=True):
+    """
+    every variant of a run in memory, the tables have the variant columns (as with "channel_output": "column") and
+    nothing is drawn or written
+
+    :param data_df: pandas.DataFrame of the data
+    :param config_json: configuration file, with a list of observed outputs and/or contrasts (resolved)
+    :param input_file_name: experiment reference (or data file name) to put in the title of the plots
+    :param verbose: print the progress of the aggregate metrics (see aggregate_metrics.compute_all_metrics)
+    :return: sample_chunks_dict: OrderedDict of per sample table name to a list of pandas.DataFrame chunks
+             full_results_df_dict: aggregate results of all variants (see combine_variant_results)
+             summaries: OrderedDict of figure name to summary of every variant (see plot_summaries.py)
+    """
+
+    level_arrays_dict = make_level_group_arrays_dict(data_df, config_json)
+
+    variants = list()
+    variant_results = list()
+    summaries = OrderedDict()
+    sample_chunks_dict = OrderedDict((table_key, list()) for table_key in get_per_sample_tables(config_json).keys())
+    for variant, variant_config, variant_arrays_dict, variant_chunks_dict, results in iter_variant_results(
+            data_df, config_json, level_arrays_dict, verbose=verbose):
+        for table_key, chunks in zip(sample_chunks_dict.keys(), variant_chunks_dict.values()):
+            sample_chunks_dict[table_key].extend(add_variant_columns(chunks, variant))
+        variants.append(variant)
+        variant_results.append(results)
+        summaries.update(make_on_vs_off_summaries(variant_config, input_file_name, variant_arrays_dict))
+        summaries.update(make_fold_change_summaries(results, variant_config, input_file_name))
+
+    return sample_chunks_dict, combine_variant_results(variant_results, variants, config_json), summaries
+
+
+def run_variants(data_df, config_json, output_dir, input_file_name, writer=None, level_arrays_dict=None):
+    """
+    run the per sample and aggregate analysis for every variant, on the group arrays made once
+
+    :param data_df: pandas.DataFrame of the data
+    :param config_json: configuration file, with a list of observed outputs and/or contrasts (resolved)
+    :param output_dir: directory to save output to
+    :param input_file_name: experiment reference (or data file name) to put in the title of the plots
+    :param writer: optional pipeline.OutputWriter to compute the per sample tables and write all the tables on
+        background threads
+    :param level_arrays_dict: optional dictionary of GroupArrays for each grouping already made (see
+        make_level_group_arrays_dict), e.g. memory-mapped (see governor.spill_group_arrays_dict)
+    :return: saved_files: list of output file names
+             full_results_df_dict: aggregate results of all variants (see combine_variant_results)
+    """
+
+    variants = get_variants(config_json)
+    by_file = get_channel_output(config_json) == 'files'
+    if level_arrays_dict is None:
+        level_arrays_dict = make_level_group_arrays_dict(data_df, config_json)
+
+    files = list()
+    variant_results = list()
+    channel_values = dict()
+    group_costs_dict = OrderedDict()
+    summaries = OrderedDict()
+    sample_chunks_dict = OrderedDict((table_key, list()) for table_key in get_per_sample_tables(config_json).keys())
+    for variant, variant_config, variant_arrays_dict, variant_chunks_dict, results in iter_variant_results(
+            data_df, config_json, level_arrays_dict, channel_values, group_costs_dict):
+        print('ran analysis of {0:s}'.format(', '.join(variant['labels'].values())))
+
+        # the per sample tables of the variant are in the same order as those of the config
+        for table_key, chunks in zip(sample_chunks_dict.keys(), variant_chunks_dict.values()):
+            sample_chunks_dict[table_key].append(add_variant_columns(chunks, variant))
+
+        if by_file:
+            files.extend(save_per_sample(variant_chunks_dict, variant_config, output_dir, writer))
+            files.extend(save_all_metrics(results, variant_config, output_dir, writer))
+        variant_results.append(results)
+
+        plot_on_vs_off(data_df, variant_config, input_file_name, output_dir, variant_arrays_dict, summaries)
+        plot_histogram_of_fold_changes(results, variant_config, input_file_name, output_dir, summaries)
+    save_plot_summaries(summaries, output_dir)
+
+    full_results_df_dict = combine_variant_results(variant_results, variants, config_json)
+    if not by_file:
+        sample_chunks_dict = {key: itertools.chain.from_iterable(chunks) for key, chunks in sample_chunks_dict.items()}
+        files.extend(save_per_sample(sample_chunks_dict, config_json, output_dir, writer))
+        files.extend(save_all_metrics(full_results_df_dict, config_json, output_dir, writer))
+    files.extend(save_ranking(full_results_df_dict, config_json, output_dir, writer))
+    if get_diagnostics_config(config_json) is not None:
+        # the groups are the same for every variant, the metrics are timed on the first one
+        files.extend(save_diagnostics({key: group_costs_dict[get_variant_key(key, variants[0])]
+                                       for key in config_json['group_cols_dict'].keys()}, config_json, output_dir,
+                                      writer))
+
+    return files, full_results_df_dict
@@ -0,0 +1,315 @@
+"""
+rolling time windows ("windows" in the config): for each time series (e.g. experiment and strain), the OFF and ON
+samples of `size` consecutive time points are compared, and the window slides along the series one time point at a
+time. a series with fewer time points than the window size has a single window with all its time points.
+
+    "windows": {"series_cols": ["experiment_id", "strain"], "time_col": "time", "size": 3}
+
+the windows overlap, so they are not made into group arrays (each sample would be copied into `size` windows).
+instead the valid values of each state are sorted once by (series, time), each window is a range of them, and the
+statistics are updated as time points enter and leave the window: running sums of the values (shifted by the mean of
+their series) and their squares for the sd metric, and a sorted window with deletes and inserts for the percentiles (see
+grouped_quantiles.sliding_window_percentile). the cost grows with the number of samples, not with the number of
+windows times the window size. only the metrics in WINDOW_FUNCTIONS can be computed on windows.
+
+:license: see LICENSE for more details
+"""
+
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+import pandas as pd
+
+from perform_metrics.group_arrays import OFF, ON, to_float_array, get_key_columns, get_name_array
+from perform_metrics.grouped_quantiles import sliding_window_percentile
+from perform_metrics.transitions import get_time_order
+from perform_metrics.compact import get_key_categoricals, get_small_int_array
+
+DEFAULT_WINDOWS = {
+    'time_col': 'time',
+    'size': 3,
+}
+WINDOW_COLS = ['time_start', 'time_end']
+
+# group_cols: series columns + WINDOW_COLS
+# names, keys: list of key tuples, one for each window (in (series, time) order)
+# states: [off value, on value] of the intended output
+# values: list with the float64 values of each state (nan dropped), sorted by (series, time)
+# starts, ends: int64 arrays of shape (nwindows, 2), the values of window i and state s are
+#     values[s][starts[i, s]:ends[i, s]]
+# series: int64 array of the series index of each window (0, 1, ... in window order), the values of a series are the
+#     range from the start of its first window to the end of its last window
+WindowArrays = namedtuple('WindowArrays', ['group_cols', 'names', 'keys', 'states', 'values', 'starts', 'ends',
+                                           'series'])
+
+
+def get_windows_config(config_json):
+    """
+    windows settings of the config with the defaults filled in
+
+    :param config_json: configuration file
+    :return: dictionary with 'series_cols', 'time_col' and 'size', or None if there are no windows
+    """
+
+    windows = config_json.get('windows')
+    if windows is None:
+        return None
+
+    unknown = set(windows.keys()) - set(DEFAULT_WINDOWS.keys()) - {'series_cols'}
+    if len(unknown) > 0:
+        raise ValueError('unknown windows settings: {}'.format(sorted(unknown)))
+    if 'series_cols' not in windows.keys():
+        raise ValueError('windows needs "series_cols"')
+    windows_config = dict(DEFAULT_WINDOWS)
+    windows_config.update(windows)
+    if not isinstance(windows_config['size'], int) or windows_config['size'] < 1:
+        raise ValueError('windows size must be a positive integer, not {}'.format(windows_config['size']))
+
+    return windows_config
+
+
+def make_window_arrays(data_df, series_cols, time_col, size, observed_output, intended_output):
+    """
+    build the WindowArrays of the sliding windows of every time series
+
+    :param data_df: pandas.DataFrame of the data
+    :param series_cols: list of columns identifying a time series (e.g. ["experiment_id", "strain"])
+    :param time_col: column with the time of each sample
+    :param size: number of consecutive time points in a window
+    :param observed_output: column name associated with the observed output
+    :param intended_output: dictionary of values associated with the intended output of the on/off states
+    :return: WindowArrays, grouped by series_cols + ['time_start', 'time_end']
+    """
+
+    states = [intended_output['off'], intended_output['on']]
+
+    # series code and time for each row, rows with a missing series or time are dropped
+    series = data_df.groupby(series_cols, sort=True, observed=True).ngroup().fillna(-1).to_numpy().astype(np.int64)
+    time = get_time_order(data_df[time_col])
+    state = np.full(len(data_df), -1, dtype=np.int64)
+    for i, state_val in enumerate(states):
+        state[(data_df[intended_output['col']] == state_val).to_numpy()] = i
+
+    rows = np.flatnonzero((series >= 0) & ~np.isnan(time))
+    rows = rows[np.lexsort((time[rows], series[rows]))]
+    row_series = series[rows]
+    row_time = time[rows]
+
+    # time points: runs of rows with the same (series, time)
+    new_point = np.ones(len(rows), dtype=bool)
+    new_point[1:] = (row_series[1:] != row_series[:-1]) | (row_time[1:] != row_time[:-1])
+    point_starts = np.flatnonzero(new_point)
+    npoints = len(point_starts)
+    row_point = np.cumsum(new_point) - 1
+
+    # windows: `size` consecutive time points of a series, or all of them for a short series
+    point_series = row_series[point_starts]
+    series_starts = np.flatnonzero(np.r_[True, point_series[1:] != point_series[:-1]]) if npoints > 0 else \
+        np.zeros(0, dtype=np.int64)
+    series_ends = np.append(series_starts[1:], npoints).astype(np.int64)
+    nwindows = np.maximum(series_ends - series_starts - size + 1, 1)
+    window_series = np.repeat(np.arange(len(series_starts)), nwindows)
+    first_point = series_starts[window_series] + np.arange(nwindows.sum()) - np.repeat(
+        np.cumsum(nwindows) - nwindows, nwindows)
+    end_point = np.minimum(first_point + size, series_ends[window_series])
+
+    # the values of each state in (series, time) order, a window is the range of its time points
+    row_values = to_float_array(data_df[observed_output].iloc[rows])
+    row_state = state[rows]
+    values = list()
+    starts = np.empty((len(first_point), len(states)), dtype=np.int64)
+    ends = np.empty((len(first_point), len(states)), dtype=np.int64)
+    for i in [OFF, ON]:
+        keep = (row_state == i) & ~np.isnan(row_values)
+        values.append(row_values[keep])
+        point_offsets = np.zeros(npoints + 1, dtype=np.int64)
+        np.cumsum(np.bincount(row_point[keep], minlength=npoints), out=point_offsets[1:])
+        starts[:, i] = point_offsets[first_point]
+        ends[:, i] = point_offsets[end_point]
+
+    # keys: the series columns of the first row of each window, then its first and last time
+    first_rows = rows[point_starts[first_point]]
+    series_keys = data_df[series_cols].iloc[first_rows].itertuples(index=False, name=None)
+    time_start = data_df[time_col].iloc[first_rows].to_numpy()
+    time_end = data_df[time_col].iloc[rows[point_starts[end_point - 1]]].to_numpy()
+    keys = [key + (t_start, t_end) for key, t_start, t_end in zip(series_keys, time_start, time_end)]
+
+    return WindowArrays(group_cols=list(series_cols) + WINDOW_COLS, names=keys, keys=keys, states=states,
+                        values=values, starts=starts, ends=ends, series=window_series)
+
+
+def make_window_arrays_from_config(data_df, config_json):
+    """
+    build the WindowArrays from the "windows" entry of the config
+
+    :param data_df: pandas.DataFrame of the data
+    :param config_json: configuration file
+    :return: WindowArrays
+    """
+
+    windows_config = get_windows_config(config_json)
+
+    return make_window_arrays(data_df, windows_config['series_cols'], windows_config['time_col'],
+                              windows_config['size'], config_json['observed_output'], config_json['intended_output'])
+
+
+def get_window_counts(window_arrays):
+    """
+    number of (non nan) values of each window and state
+
+    :param window_arrays: WindowArrays
+    :return: numpy.ndarray of shape (nwindows, 2)
+    """
+
+    return window_arrays.ends - window_arrays.starts
+
+
+def window_metric_percent(window_arrays, percents=None, kernel=None):
+    """
+    same as group_metrics.grouped_metric_percent, for every window, with the sorted window updated as time points
+    enter and leave it
+
+    :param window_arrays: WindowArrays
+    :param percents: list of percents to use (default [100, 75, 50])
+    :param kernel: optional quantile kernel (see grouped_quantiles.sliding_window_percentile)
+    :return: OrderedDict of column name to numpy.ndarray of shape (nwindows, len(percents))
+    """
+
+    if percents is None:
+        percents = [100, 75, 50]
+    percents = list(percents)
+
+    # OFF uses q, ON uses 100 - q
+    off_agg = sliding_window_percentile(window_arrays.values[OFF], window_arrays.starts[:, OFF],
+                                        window_arrays.ends[:, OFF], percents, kernel)
+    on_agg = sliding_window_percentile(window_arrays.values[ON], window_arrays.starts[:, ON],
+                                       window_arrays.ends[:, ON], [100 - percent for percent in percents], kernel)
+
+    columns = OrderedDict()
+    columns['percentile'] = np.broadcast_to(np.array(percents), off_agg.shape)
+    columns['off_agg'] = off_agg
+    columns['on_agg'] = on_agg
+    columns['diff'] = on_agg - off_agg
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['ratio'] = on_agg / off_agg
+
+    return columns
+
+
+def window_metric_sd(window_arrays, num_std=None):
+    """
+    same as group_metrics.grouped_metric_sd, for every window, from running sums of the values and their squares.
+    the values are shifted by the mean of their series and state first, so the sums of squares do not lose precision
+    when the series have large (or different) offsets, and rounding that makes a variance negative is clamped to 0.
+
+    :param window_arrays: WindowArrays
+    :param num_std: list of number of standard deviations to use (default [0, 1, 2, 3])
+    :return: OrderedDict of column name to numpy.ndarray of shape (nwindows, len(num_std))
+    """
+
+    if num_std is None:
+        num_std = [0, 1, 2, 3]
+    num_std = np.array(num_std)
+
+    counts = get_window_counts(window_arrays)
+    means = np.full(counts.shape, np.nan)
+    stds = np.full(counts.shape, np.nan)
+    # first and last window of each series
+    series = window_arrays.series
+    new_series = np.flatnonzero(np.diff(series)) + 1
+    nseries = len(new_series) + 1 if len(series) > 0 else 0
+    first_window = np.r_[0, new_series][:nseries]
+    last_window = np.r_[new_series - 1, len(series) - 1][:nseries]
+    for i in [OFF, ON]:
+        values = window_arrays.values[i]
+        series_counts = window_arrays.ends[last_window, i] - window_arrays.starts[first_window, i]
+        value_series = np.repeat(np.arange(nseries), series_counts)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            series_means = np.bincount(value_series, weights=values, minlength=nseries) / series_counts
+        series_means[series_counts == 0] = 0.0
+        shifted = values - series_means[value_series]
+        sums = np.zeros(len(values) + 1)
+        np.cumsum(shifted, out=sums[1:])
+        squares = np.zeros(len(values) + 1)
+        np.cumsum(shifted ** 2, out=squares[1:])
+        starts = window_arrays.starts[:, i]
+        ends = window_arrays.ends[:, i]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            window_mean = (sums[ends] - sums[starts]) / counts[:, i]
+            variance = (squares[ends] - squares[starts]) / counts[:, i] - window_mean ** 2
+        means[:, i] = series_means[series] + window_mean
+        stds[:, i] = np.sqrt(np.maximum(variance, 0))
+
+    off_agg = means[:, OFF, np.newaxis] + (stds[:, OFF, np.newaxis] * num_std)
+    on_agg = means[:, ON, np.newaxis] - (stds[:, ON, np.newaxis] * num_std)
+
+    columns = OrderedDict()
+    columns['num_std'] = np.broadcast_to(num_std, off_agg.shape)
+    columns['off_agg'] = off_agg
+    columns['on_agg'] = on_agg
+    columns['diff'] = on_agg - off_agg
+    with np.errstate(divide='ignore', invalid='ignore'):
+        columns['ratio'] = on_agg / off_agg
+
+    return columns
+
+
+# incremental function of each metric that can be computed on windows
+WINDOW_FUNCTIONS = {
+    'perc': window_metric_percent,
+    'sd': window_metric_sd,
+}
+
+
+def make_window_records_df(window_arrays, metric_columns, compact=False):
+    """
+    build the results dataframe of a window metric, same columns as aggregate_metrics.make_records_df
+
+    :param window_arrays: WindowArrays the metric was computed on
+    :param metric_columns: OrderedDict of column name to numpy.ndarray of shape (nwindows, nparams)
+    :param compact: group columns and group_name as categoricals, counts and integer parameters as small integers
+    :return: pandas.DataFrame
+    """
+
+    nparams = next(iter(metric_columns.values())).shape[1]
+    counts = get_window_counts(window_arrays)
+
+    columns = OrderedDict()
+    if compact:
+        columns.update(get_key_categoricals(window_arrays, np.repeat(np.arange(len(window_arrays.names)), nparams)))
+        counts = get_small_int_array(counts)
+    else:
+        for col, col_values in get_key_columns(window_arrays).items():
+            columns[col] = np.repeat(col_values, nparams)
+        columns['group_name'] = np.repeat(get_name_array(window_arrays), nparams)
+    columns['off_count'] = np.repeat(counts[:, OFF], nparams)
+    columns['on_count'] = np.repeat(counts[:, ON], nparams)
+    for i, (col, col_values) in enumerate(metric_columns.items()):
+        columns[col] = get_small_int_array(np.ravel(col_values)) if compact and i == 0 else np.ravel(col_values)
+
+    return pd.DataFrame(columns)
+
+
+def compute_window_metrics(window_arrays, metrics, metric_params=None, compact=False):
+    """
+    compute metrics on the windows
+
+    :param window_arrays: WindowArrays
+    :param metrics: list of metric names (keys of WINDOW_FUNCTIONS)
+    :param metric_params: optional dictionary of metric name to keyword arguments of the metric function
+    :param compact: build the tables with small column types (see make_window_records_df)
+    :return: OrderedDict of metric name to pandas.DataFrame
+    """
+
+    metric_params = metric_params or dict()
+    missing = [metric for metric in metrics if metric not in WINDOW_FUNCTIONS]
+    if len(missing) > 0:
+        raise ValueError('metrics {} can not be computed on windows, only {}'.format(
+            missing, sorted(WINDOW_FUNCTIONS.keys())))
+
+    results = OrderedDict()
+    for metric in metrics:
+        metric_columns = WINDOW_FUNCTIONS[metric](window_arrays, **(metric_params.get(metric) or dict()))
+        results[metric] = make_window_records_df(window_arrays, metric_columns, compact)
+
+    return results